@@ -0,0 +1,478 @@
+"""
+A local stand-in for ServiceNow instances, serving just enough of the
+Table and Aggregate APIs, the JSONv2/CSV export processors, the Batch API
+and the OAuth token endpoint for snset to run against it. Latency, URL length limits
+and rate limiting can be configured to reproduce production behaviour
+"""
+
+import base64
+import csv
+import io
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List
+from urllib.parse import parse_qs, urlsplit, urlunsplit
+
+UPDATE_SET_FIELDS = [
+    "sys_id",
+    "name",
+    "state",
+    "description",
+    "installed_from",
+    "install_date",
+    "sys_created_on",
+    "sys_updated_by",
+    "sys_updated_on",
+]
+REMOTE_UPDATE_SET_FIELDS = [
+    "sys_id",
+    "name",
+    "state",
+    "update_source",
+    "description",
+    "sys_created_on",
+    "commit_date",
+    "sys_updated_by",
+    "sys_updated_on",
+    "collisions",
+]
+
+# how often a generated set also updates a shared record, and how many
+# shared records there are
+SHARED_EVERY = 10
+SHARED_RECORDS = 17
+# rows an export processor returns at most, glide.json.return_limit and
+# glide.csv.export.limit on an instance
+EXPORT_LIMIT = 10000
+
+
+def generate_tables(
+    rows: int, updates_per_set: int = 0
+) -> Dict[str, List[Dict[str, str]]]:
+    """
+    Builds `rows` complete update sets, every other one of which
+    was retrieved (and committed) from another instance. Instances built
+    with fewer rows hold a prefix of the same sets, so a small target
+    compared against a large source yields a predictable difference.
+    With updates_per_set, each set gets that many sys_update_xml rows for
+    records of its own, and every SHARED_EVERY-th set also updates one of
+    SHARED_RECORDS records shared between sets
+    """
+    start = datetime(2021, 1, 1)
+    update_sets, remote_sets, updates = [], [], []
+    for idx in range(rows):
+        created = start + timedelta(minutes=idx * 7)
+        name = f"STRY{idx:07d} - update set {idx}"
+        stamp = created.strftime("%Y-%m-%d %H:%M:%S")
+        retrieved = idx % 2 == 0
+        update_sets.append(
+            {
+                "sys_id": f"{idx:032x}",
+                "name": name,
+                "state": "complete",
+                "description": f"Changes for story {idx}",
+                "installed_from": "dev" if retrieved else "",
+                "install_date": stamp if retrieved else "",
+                "sys_created_on": stamp,
+                "sys_updated_by": "admin",
+                "sys_updated_on": stamp,
+            }
+        )
+        if retrieved:
+            remote_sets.append(
+                {
+                    "sys_id": f"{idx + rows:032x}",
+                    "name": name,
+                    "state": "committed",
+                    "update_source": "dev",
+                    "description": f"Changes for story {idx}",
+                    "sys_created_on": stamp,
+                    "commit_date": stamp,
+                    "sys_updated_by": "admin",
+                    "sys_updated_on": stamp,
+                    "collisions": "false",
+                }
+            )
+        records = [f"sys_script_include_{idx:07d}_{j}" for j in range(updates_per_set)]
+        if updates_per_set and idx % SHARED_EVERY == 0:
+            records.append(f"sys_properties_{idx % SHARED_RECORDS:03d}")
+        for record in records:
+            updates.append(
+                {
+                    "sys_id": f"{len(updates) + 2 * rows:032x}",
+                    "name": record,
+                    # the dot walked field is stored as it is returned
+                    "update_set.name": name,
+                    "sys_updated_on": stamp,
+                }
+            )
+    return {
+        "sys_update_set": update_sets,
+        "sys_remote_update_set": remote_sets,
+        "sys_update_xml": updates,
+    }
+
+
+def compile_term(term: str) -> Callable[[Dict[str, str]], bool]:
+    """
+    Parses a single encoded query term once, so large IN lists aren't
+    split again for every record
+    """
+    for op in ("ISNOTEMPTY", "ISEMPTY", "!=", ">=", "<=", "IN", ">", "="):
+        field, sep, value = term.partition(op)
+        if not sep or not field:
+            continue
+        if op == "ISNOTEMPTY":
+            return lambda r: r.get(field, "") != ""
+        if op == "ISEMPTY":
+            return lambda r: r.get(field, "") == ""
+        if op == "IN":
+            values = frozenset(value.split(","))
+            return lambda r: r.get(field, "") in values
+        if op == "!=":
+            return lambda r: r.get(field, "") != value
+        if op == ">=":
+            return lambda r: r.get(field, "") >= value
+        if op == "<=":
+            return lambda r: r.get(field, "") <= value
+        if op == ">":
+            return lambda r: r.get(field, "") > value
+        expected = "" if value == "NULL" else value
+        return lambda r: r.get(field, "") == expected
+    return lambda r: True
+
+
+def query_records(records: List[Dict[str, str]], query: str) -> List[Dict[str, str]]:
+    """
+    Evaluates the subset of encoded queries snset uses: =, !=, >=, >, IN,
+    ISEMPTY, ISNOTEMPTY, ^OR and ORDERBY/ORDERBYDESC
+    """
+    groups, order_by = [], []
+    for term in filter(None, (query or "").split("^")):
+        if term.startswith("ORDERBYDESC"):
+            order_by.append((term[11:], True))
+        elif term.startswith("ORDERBY"):
+            order_by.append((term[7:], False))
+        elif term.startswith("OR") and groups:
+            groups[-1].append(term[2:])
+        else:
+            groups.append([term])
+
+    predicates = [[compile_term(t) for t in group] for group in groups]
+    result = [r for r in records if all(any(p(r) for p in g) for g in predicates)]
+    for field, desc in reversed(order_by):
+        result.sort(key=lambda r: r.get(field, ""), reverse=desc)
+    return result
+
+
+class FakeInstance:
+    """
+    Serves generated ServiceNow data sets on 127.0.0.1 from a background thread.
+    Each instance lives under its own path prefix, so point snset at
+    `url_template`, i.e. http://127.0.0.1:{port}/{instance}
+
+    Parameters:
+    instances: Dict[str, int] - instance name mapped to its number of update sets
+    latency: float - seconds added to every response
+    max_url_length: int - longer request lines are rejected with
+        `url_too_long_status`, like an instance's 400/414 responses
+    rate_limit_every: int - every Nth request is answered with a 429
+    retry_after: int - Retry-After seconds sent with injected 429s
+    slow_every: int - every Nth request is served by a "slow node",
+        taking slow_latency seconds longer
+    updates_per_set: int - sys_update_xml rows generated per update set
+    oauth: bool - require a bearer token from /oauth_token.do
+
+    Usage:
+    with FakeInstance({"nyudev": 5000, "nyuqa": 4000}) as fake:
+        requests_lib.options["instance_url"] = fake.url_template
+    """
+
+    def __init__(
+        self,
+        instances: Dict[str, int] = None,
+        latency: float = 0.0,
+        max_url_length: int = 0,
+        url_too_long_status: int = 414,
+        rate_limit_every: int = 0,
+        retry_after: int = 1,
+        slow_every: int = 0,
+        slow_latency: float = 0.0,
+        updates_per_set: int = 0,
+        oauth: bool = False,
+        port: int = 0,
+    ):
+        self.instances = {
+            name: generate_tables(rows, updates_per_set)
+            for name, rows in (instances or {"nyudev": 1000}).items()
+        }
+        self.latency = latency
+        self.max_url_length = max_url_length
+        self.url_too_long_status = url_too_long_status
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.slow_every = slow_every
+        self.slow_latency = slow_latency
+        self._arrivals = 0
+        self.oauth = oauth
+        self.tokens: set = set()
+        self._lock = threading.Lock()
+        self.reset_counters()
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def url_template(self) -> str:
+        return self.base_url + "/{instance}"
+
+    def start(self) -> "FakeInstance":
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset_counters(self):
+        with self._lock:
+            self.requests = 0
+            self.connections = 0
+            self.bytes_sent = 0
+            self.statuses: Dict[int, int] = {}
+
+    def counters(self) -> Dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "connections": self.connections,
+                "bytes": self.bytes_sent,
+                "statuses": {str(k): v for k, v in sorted(self.statuses.items())},
+            }
+
+    def __enter__(self) -> "FakeInstance":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _count(self, status: int, sent: int) -> int:
+        with self._lock:
+            self.requests += 1
+            self.bytes_sent += sent
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            return self.requests
+
+    def connected(self):
+        with self._lock:
+            self.connections += 1
+
+    def _next_is_slow(self) -> bool:
+        with self._lock:
+            self._arrivals += 1
+            return bool(self.slow_every and self._arrivals % self.slow_every == 0)
+
+    def _next_is_limited(self) -> bool:
+        with self._lock:
+            return bool(
+                self.rate_limit_every
+                and (self.requests + 1) % self.rate_limit_every == 0
+            )
+
+    def serve(self, method: str, path: str, body: bytes = b"", headers=None):
+        """
+        Answers a request the way the instance's front end would: after the
+        configured latency, rejecting long urls and injecting 429s, and
+        counts it. Shared by the HTTP/1.1 and HTTP/2 servers
+        """
+        if self.latency:
+            time.sleep(self.latency)
+        if self._next_is_slow():
+            time.sleep(self.slow_latency)
+
+        if self.max_url_length and len(path) > self.max_url_length:
+            status, headers, payload = _json(
+                self.url_too_long_status,
+                {"error": {"message": "Request URI Too Long"}},
+            )
+        elif self._next_is_limited():
+            status, headers, payload = _json(
+                429,
+                {"error": {"message": "Too Many Requests"}},
+                {"Retry-After": str(self.retry_after)},
+            )
+        else:
+            status, headers, payload = self.respond(method, path, body, headers)
+        if "Link" in headers:
+            headers = {**headers, "Link": _absolute_link(path, headers["Link"])}
+        self._count(status, len(payload))
+        return status, headers, payload
+
+    def respond(self, method: str, path: str, body: bytes = b"", headers=None):
+        """
+        Computes the (status, headers, body) for a request, shared by the
+        http handler and the Batch API sub requests
+        """
+        parts = urlsplit(path)
+        params = {k: v[0] for k, v in parse_qs(parts.query, True).items() if v}
+        name, _, rest = parts.path.lstrip("/").partition("/")
+        if name not in self.instances:
+            return _json(404, {"error": {"message": f"No instance {name}"}})
+        tables = self.instances[name]
+        rest = "/" + rest
+
+        if rest == "/oauth_token.do" and method == "POST":
+            token = base64.b16encode(str(len(self.tokens)).encode()).decode()
+            self.tokens.add(token)
+            return _json(
+                200,
+                {"access_token": token, "token_type": "Bearer", "expires_in": 1800},
+            )
+        if self.oauth and not _bearer_ok(headers or {}, self.tokens):
+            return _json(401, {"error": {"message": "User Not Authenticated"}})
+        if rest == "/api/now/v1/batch" and method == "POST":
+            return self.batch(json.loads(body or b"{}"), headers)
+        if rest.startswith("/api/now/table/") and method == "GET":
+            return self.table_api(tables, rest.rsplit("/", 1)[-1], params)
+        if rest.startswith("/api/now/stats/") and method == "GET":
+            return self.aggregate_api(tables, rest.rsplit("/", 1)[-1], params)
+        if rest.endswith(".do") and method == "GET":
+            return self.export(tables, rest[1:-3], parts.query, params)
+        return _json(404, {"error": {"message": "Not found"}})
+
+    def table_api(self, tables, table: str, params: Dict[str, str]):
+        if table not in tables:
+            return _json(404, {"error": {"message": "Invalid table"}})
+        records = query_records(tables[table], params.get("sysparm_query", ""))
+        total = len(records)
+        offset = int(params.get("sysparm_offset") or 0)
+        limit = int(params.get("sysparm_limit") or 0)
+        records = records[offset : offset + limit] if limit else records[offset:]
+        fields = [f for f in params.get("sysparm_fields", "").split(",") if f]
+        if fields:
+            records = [{f: r.get(f, "") for f in fields} for r in records]
+        headers = {"X-Total-Count": str(total)}
+        if limit and offset + limit < total:
+            headers["Link"] = f'<?sysparm_offset={offset + limit}>;rel="next"'
+        return _json(200, {"result": records}, headers)
+
+    def aggregate_api(self, tables, table: str, params: Dict[str, str]):
+        if table not in tables:
+            return _json(404, {"error": {"message": "Invalid table"}})
+        records = query_records(tables[table], params.get("sysparm_query", ""))
+        return _json(200, {"result": {"stats": {"count": str(len(records))}}})
+
+    def export(self, tables, table: str, raw_query: str, params: Dict[str, str]):
+        if table not in tables:
+            return _json(404, {"error": {"message": "Invalid table"}})
+        records = query_records(tables[table], params.get("sysparm_query", ""))
+        # like an instance, rows past the processor's limit are silently dropped
+        limit = min(
+            int(params.get("sysparm_record_count") or EXPORT_LIMIT), EXPORT_LIMIT
+        )
+        records = records[:limit]
+        fields = [f for f in params.get("sysparm_fields", "").split(",") if f]
+        if fields:
+            records = [{f: r.get(f, "") for f in fields} for r in records]
+        if raw_query.startswith("JSONv2"):
+            return _json(200, {"records": records})
+        if raw_query.startswith("CSV"):
+            out = io.StringIO()
+            fieldnames = list(records[0].keys()) if records else ["sys_id"]
+            writer = csv.DictWriter(out, fieldnames, quoting=csv.QUOTE_ALL)
+            writer.writeheader()
+            writer.writerows(records)
+            return 200, {"Content-Type": "text/csv"}, out.getvalue().encode("utf-8-sig")
+        return 200, {"Content-Type": "text/html"}, b"<html>Unsupported</html>"
+
+    def batch(self, payload: Dict, headers):
+        serviced = []
+        for sub in payload.get("rest_requests", []):
+            status, _, body = self.respond(
+                sub.get("method", "GET"), sub["url"], b"", headers
+            )
+            serviced.append(
+                {
+                    "id": sub["id"],
+                    "status_code": status,
+                    "status_text": HTTPStatus(status).phrase,
+                    "body": base64.b64encode(body).decode(),
+                }
+            )
+        return _json(
+            200,
+            {
+                "batch_request_id": payload.get("batch_request_id"),
+                "serviced_requests": serviced,
+                "unserviced_requests": [],
+            },
+        )
+
+    def _handler(self):
+        instance = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def setup(self):
+                super().setup()
+                instance.connected()
+
+            def handle_request(self, method: str):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                status, headers, payload = instance.serve(
+                    method, self.path, body, self.headers
+                )
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                self.handle_request("GET")
+
+            def do_POST(self):
+                self.handle_request("POST")
+
+        return Handler
+
+
+def _json(status: int, payload: Dict, headers: Dict[str, str] = None):
+    return (
+        status,
+        {"Content-Type": "application/json", **(headers or {})},
+        json.dumps(payload).encode(),
+    )
+
+
+def _bearer_ok(headers, tokens: set) -> bool:
+    auth = headers.get("Authorization") or ""
+    return auth.startswith("Bearer ") and auth[7:] in tokens
+
+
+def _absolute_link(path: str, link: str) -> str:
+    """
+    Rewrites the relative next link to keep the rest of the original query
+    """
+    parts = urlsplit(path)
+    params = parse_qs(parts.query, True)
+    offset = link[link.index("=") + 1 : link.index(">")]
+    params["sysparm_offset"] = [offset]
+    query = "&".join(f"{k}={v[0]}" for k, v in params.items())
+    return f'<{urlunsplit(("", "", parts.path, query, ""))}>;rel="next"'
@@ -0,0 +1,155 @@
+"""
+Serves a FakeInstance over cleartext HTTP/2 with prior knowledge, the way
+httpx talks to it with http1=False. The streams of a connection are
+answered concurrently, each after the instance's latency, so many requests
+can be in flight over a single connection. Requires the h2 package, which
+is installed with snset[httpx]
+"""
+
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import h2.config
+import h2.connection
+import h2.events
+from requests.structures import CaseInsensitiveDict
+
+from benchmarks.fake_instance import FakeInstance
+
+
+class Http2Server:
+    """
+    Parameters:
+    instance: FakeInstance - the data, latency and limits to serve
+    max_streams: int - streams answered at once per connection
+
+    Usage:
+    with FakeInstance({"nyudev": 5000}) as fake, Http2Server(fake) as h2:
+        requests_lib.options["instance_url"] = h2.url_template
+    """
+
+    def __init__(self, instance: FakeInstance, max_streams: int = 100, port: int = 0):
+        self.instance = instance
+        self.max_streams = max_streams
+        self.sock = socket.create_server(("127.0.0.1", port))
+        self._stopped = threading.Event()
+        self._sockets: List[socket.socket] = []
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.sock.getsockname()[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def url_template(self) -> str:
+        return self.base_url + "/{instance}"
+
+    def start(self) -> "Http2Server":
+        threading.Thread(target=self._accept, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self.sock.close()
+        for sock in self._sockets:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def __enter__(self) -> "Http2Server":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _accept(self):
+        while not self._stopped.is_set():
+            try:
+                sock, _ = self.sock.accept()
+            except OSError:
+                return
+            self.instance.connected()
+            self._sockets.append(sock)
+            threading.Thread(target=self._connection, args=(sock,), daemon=True).start()
+
+    def _connection(self, sock: socket.socket):
+        conn = h2.connection.H2Connection(
+            h2.config.H2Configuration(client_side=False, header_encoding="utf-8")
+        )
+        # the condition guards conn and the socket, and is notified when
+        # the client opens up its flow control window
+        lock = threading.Condition()
+        closed = threading.Event()
+        streams: Dict[int, list] = {}
+        with ThreadPoolExecutor(max_workers=self.max_streams) as executor:
+            with lock:
+                conn.initiate_connection()
+                sock.sendall(conn.data_to_send())
+            while True:
+                try:
+                    data = sock.recv(65536)
+                except OSError:
+                    data = b""
+                with lock:
+                    if not data:
+                        closed.set()
+                        lock.notify_all()
+                        break
+                    for event in conn.receive_data(data):
+                        if isinstance(event, h2.events.RequestReceived):
+                            streams[event.stream_id] = [dict(event.headers), b""]
+                        elif isinstance(event, h2.events.DataReceived):
+                            streams[event.stream_id][1] += event.data
+                            conn.acknowledge_received_data(
+                                event.flow_controlled_length, event.stream_id
+                            )
+                        elif isinstance(event, h2.events.StreamEnded):
+                            headers, body = streams.pop(event.stream_id)
+                            executor.submit(
+                                self._respond,
+                                (sock, conn, lock, closed),
+                                event.stream_id,
+                                headers,
+                                body,
+                            )
+                        elif isinstance(event, h2.events.WindowUpdated):
+                            lock.notify_all()
+                    sock.sendall(conn.data_to_send())
+        sock.close()
+
+    def _respond(self, connection, stream_id: int, headers: Dict, body: bytes):
+        sock, conn, lock, closed = connection
+        status, response_headers, payload = self.instance.serve(
+            headers[":method"], headers[":path"], body, CaseInsensitiveDict(headers)
+        )
+        sent = 0
+        with lock:
+            if closed.is_set():
+                return
+            conn.send_headers(
+                stream_id,
+                [(":status", str(status))]
+                + [(k.lower(), v) for k, v in response_headers.items()]
+                + [("content-length", str(len(payload)))],
+            )
+            while True:
+                window = min(
+                    conn.local_flow_control_window(stream_id),
+                    conn.max_outbound_frame_size,
+                )
+                if window < 1 and sent < len(payload):
+                    sock.sendall(conn.data_to_send())
+                    lock.wait()
+                    if closed.is_set():
+                        return
+                    continue
+                size = min(window, len(payload) - sent)
+                end = sent + size == len(payload)
+                conn.send_data(stream_id, payload[sent : sent + size], end_stream=end)
+                sent += size
+                if end:
+                    break
+            sock.sendall(conn.data_to_send())
@@ -0,0 +1,1028 @@
+"""
+Benchmarks for snset against a local stand-in instance.
+
+Without a benchmark name, the end to end scenarios are run. Each runs in its
+own process so peak RSS is measured per scenario, while the fake instances
+run in this process and count the requests and bytes they serve. Results
+are written as JSON so runs can be compared. The named benchmarks time a
+single part of snset and print a table.
+
+Usage:
+python -m benchmarks.run --source-rows 20000 --target-rows 18000 --latency 0.02
+python -m benchmarks.run --scenario cli --oauth --label oauth
+python -m benchmarks.run --compare benchmarks/results/a.json benchmarks/results/b.json
+python -m benchmarks.run export --rows 20000
+python -m benchmarks.run --help
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterator, List
+
+from benchmarks.fake_instance import FakeInstance
+
+SOURCE = "nyudev"
+TARGET = "nyuqa"
+
+# scenario name -> (fake instance overrides, snset request options)
+SCENARIOS: Dict[str, tuple] = {
+    "inventory": ({}, {}),
+    "install_order": ({}, {}),
+    "install_order_fallback": ({"max_url_length": 2048}, {}),
+    "install_order_batch": ({"max_url_length": 2048}, {"batch_size": 50}),
+    "install_order_slow_node": (
+        {"max_url_length": 2048, "slow_every": 20, "slow_latency": 0.25},
+        {},
+    ),
+    "install_order_hedged": (
+        {"max_url_length": 2048, "slow_every": 20, "slow_latency": 0.25},
+        {"hedge_percentile": 90},
+    ),
+    "cli": ({}, {}),
+    "cli_fallback": ({"max_url_length": 2048}, {}),
+}
+
+# name -> (benchmark, its arguments and their defaults), filled by @benchmark
+BENCHMARKS: Dict[str, tuple] = {}
+
+
+def credentials(oauth: bool = False) -> Dict[str, str]:
+    """
+    The environment snset needs to connect to the stand-in instances
+    """
+    return {
+        "SN_USER_NAME": "bench",
+        "SN_PASSWORD": "bench",
+        "SN_SET_USE_OAUTH": "true" if oauth else "false",
+        "SN_SET_CLIENT_ID": "bench",
+        "SN_SET_CLIENT_SECRET": "bench",
+    }
+
+
+@contextmanager
+def stand_in(tables: Dict[str, int], **kwargs) -> Iterator[FakeInstance]:
+    """
+    Serves tables from a fake instance that snset connects to, and resets
+    snset's options and clients when done
+    """
+    from sn_set import requests_lib
+
+    os.environ.update(credentials(kwargs.get("oauth", False)))
+    with FakeInstance(tables, **kwargs) as fake:
+        requests_lib.options["instance_url"] = fake.url_template
+        try:
+            yield fake
+        finally:
+            requests_lib.options.clear()
+            requests_lib.context.clear()
+
+
+def measure(run: Callable, repeat: int = 1, memory: bool = False) -> Dict:
+    """
+    Times run, keeping the best of repeat runs. With memory, the last run
+    is traced for the peak and the memory still held by its result, which
+    slows it down
+    """
+    timings = []
+    peak = held = None
+    for n in range(repeat):
+        gc.collect()
+        traced = memory and n == repeat - 1
+        if traced:
+            tracemalloc.start()
+        start = time.perf_counter()
+        result = run()
+        timings.append(time.perf_counter() - start)
+        if traced:
+            gc.collect()
+            held, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+    return {
+        "best_s": min(timings),
+        "mean_s": sum(timings) / len(timings),
+        "peak_mib": peak / 2**20 if memory else None,
+        "held_mib": held / 2**20 if memory else None,
+        "result": result,
+    }
+
+
+def benchmark(**defaults):
+    """
+    Registers a benchmark, its docstring is the help and each default adds
+    an option of its type, a list one taking several values
+    """
+
+    def register(func: Callable) -> Callable:
+        name = func.__name__[len("bench_") :].replace("_", "-")
+        BENCHMARKS[name] = (func, defaults)
+        return func
+
+    return register
+
+
+def peak_rss_kb() -> int | None:
+    try:
+        import resource
+    except ImportError:  # pragma: no cover - not available on windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports kilobytes, macos bytes
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def run_child(scenario: str, options: Dict, workdir: str) -> Dict:
+    """
+    Runs a single scenario in this (child) process
+    """
+    # sn_set is imported here and in each benchmark, so a scenario's peak RSS
+    # only counts what it uses
+    from sn_set import cli, requests_lib
+    from sn_set.hedging import HedgingPolicy
+
+    hedge_percentile = options.pop("hedge_percentile", None)
+    requests_lib.options.update(options)
+    if hedge_percentile:
+        requests_lib.options["hedging"] = HedgingPolicy(
+            pct=hedge_percentile, max_ratio=0.2
+        )
+    start = time.perf_counter()
+    error = None
+    try:
+        if scenario == "inventory":
+            requests_lib.get_update_sets(SOURCE)
+            requests_lib.get_update_sets(TARGET)
+        elif scenario.startswith("install_order"):
+            source = [r["name"] for r in requests_lib.get_update_sets(SOURCE)]
+            target = [r["name"] for r in requests_lib.get_update_sets(TARGET)]
+            diff = cli.get_set_diff(source, target)
+            ordered = requests_lib.get_install_order(SOURCE, diff)
+            found = [r["name"] for r in ordered]
+            new = cli.get_set_diff(diff, found) if found else diff
+            if new:
+                requests_lib.get_install_order_new(SOURCE, new)
+        elif scenario.startswith("cli"):
+            from click.testing import CliRunner
+
+            result = CliRunner().invoke(
+                cli.main,
+                ["-s", SOURCE, "-t", TARGET, "-f", os.path.join(workdir, "out")],
+            )
+            if result.exit_code != 0:
+                error = f"exit code {result.exit_code}: {result.output[-500:]}"
+        else:
+            raise ValueError(f"Unknown scenario {scenario}")
+    except Exception as ex:
+        error = f"{type(ex).__name__}: {ex}"
+    result = {
+        "wall_s": round(time.perf_counter() - start, 4),
+        "peak_rss_kb": peak_rss_kb(),
+        "ok": error is None,
+        "error": error,
+    }
+    if requests_lib.options.get("hedging"):
+        result["hedging"] = requests_lib.options["hedging"].summary()
+    return result
+
+
+def run_scenario(fake: FakeInstance, scenario: str, args) -> Dict:
+    overrides, options = SCENARIOS[scenario]
+    defaults = {
+        "max_url_length": args.max_url_length,
+        "rate_limit_every": args.rate_limit_every,
+        "slow_every": 0,
+        "slow_latency": 0.0,
+    }
+    for key, value in {**defaults, **overrides}.items():
+        setattr(fake, key, value)
+
+    env = dict(os.environ, **credentials(args.oauth))
+    options = {"instance_url": fake.url_template, **options}
+    fake.reset_counters()
+    with tempfile.TemporaryDirectory() as workdir:
+        proc = subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "benchmarks.run",
+                "--child",
+                scenario,
+                "--child-options",
+                json.dumps(options),
+                "--workdir",
+                workdir,
+            ],
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+    if proc.returncode != 0:
+        result = {"ok": False, "error": proc.stderr[-1000:]}
+    else:
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result.update(fake.counters())
+    return result
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(paths: List[str]):
+    runs = []
+    for path in paths:
+        with open(path) as f:
+            runs.append(json.load(f))
+    baseline = runs[0]
+    metrics = ["wall_s", "requests", "bytes", "peak_rss_kb"]
+    for name in baseline["scenarios"]:
+        print(f"\n{name}")
+        for metric in metrics:
+            base = baseline["scenarios"][name].get(metric)
+            cells = [f"{metric:<12}", f"{base!s:>12}"]
+            for run in runs[1:]:
+                value = run["scenarios"].get(name, {}).get(metric)
+                change = (
+                    f" ({(value - base) / base:+.1%})"
+                    if base and value is not None
+                    else ""
+                )
+                cells.append(f"{value!s:>12}{change}")
+            print(" ".join(cells))
+
+
+def run_scenarios(args):
+    config = {
+        "source_rows": args.source_rows,
+        "target_rows": args.target_rows,
+        "latency": args.latency,
+        "max_url_length": args.max_url_length,
+        "rate_limit_every": args.rate_limit_every,
+        "oauth": args.oauth,
+    }
+    fake = FakeInstance(
+        {SOURCE: args.source_rows, TARGET: args.target_rows},
+        latency=args.latency,
+        oauth=args.oauth,
+    )
+    results = {}
+    with fake:
+        for scenario in args.scenario or list(SCENARIOS):
+            results[scenario] = result = run_scenario(fake, scenario, args)
+            status = "ok" if result["ok"] else f"FAILED {result['error']}"
+            print(
+                f"{scenario:<24} {result.get('wall_s', '-')!s:>8}s "
+                f"{result['requests']:>6} req {result['bytes']:>10} B "
+                f"{result.get('peak_rss_kb')!s:>8} KB  {status}"
+            )
+
+    created = datetime.now(timezone.utc)
+    report = {
+        "label": args.label,
+        "created": created.isoformat(),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": config,
+        "scenarios": results,
+    }
+    os.makedirs(args.output_dir, exist_ok=True)
+    name = args.label or created.strftime("%Y%m%dT%H%M%S")
+    path = os.path.join(args.output_dir, f"{name}.json")
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {path}")
+
+
+@benchmark(rows=20000, repeat=5)
+def bench_export(args):
+    """
+    Compares the Table API with the JSONv2 and CSV export backends
+    """
+    from sn_set import requests_lib
+
+    def fetch():
+        sets = requests_lib.get_update_sets(SOURCE)
+        requests_lib.get_install_order(SOURCE, names)
+        return len(sets)
+
+    with stand_in({SOURCE: args.rows}) as fake:
+        names = [r["name"] for r in fake.instances[SOURCE]["sys_update_set"][:200]]
+        print(f"{'backend':<8} {'rows':>7} {'best s':>8} {'mean s':>8} {'bytes':>10}")
+        for backend in ["table", "jsonv2", "csv"]:
+            requests_lib.options["backend"] = backend
+            fake.reset_counters()
+            result = measure(fetch, args.repeat)
+            print(
+                f"{backend:<8} {result['result']:>7} {result['best_s']:>8.3f} "
+                f"{result['mean_s']:>8.3f} "
+                f"{fake.counters()['bytes'] // args.repeat:>10}"
+            )
+
+
+@benchmark(rows=100000)
+def bench_records(args):
+    """
+    Compares the memory held by decoded Table API rows as plain dicts and as
+    UpdateSetRecords, for the update set inventory and for install order
+    rows with display values ("all", so each field is a nested dict)
+    """
+    from benchmarks.fake_instance import generate_tables
+    from sn_set.records import UpdateSetRecord
+    from sn_set.requests_lib import INSTALL_ORDER_FIELDS
+
+    tables = generate_tables(args.rows)
+    payloads = {
+        "inventory": [{"name": r["name"]} for r in tables["sys_update_set"]],
+        "install order": [
+            {
+                field: {"display_value": r.get(field, ""), "value": r.get(field, "")}
+                for field in INSTALL_ORDER_FIELDS
+            }
+            for r in tables["sys_remote_update_set"]
+        ],
+    }
+    print(f"{'payload':<14} {'type':<8} {'held MiB':>9} {'peak MiB':>9} {'s':>7}")
+    for name, rows in payloads.items():
+        body = json.dumps({"result": rows})
+        baseline = None
+        for kind, hook in [("dict", dict), ("record", UpdateSetRecord.from_pairs)]:
+            result = measure(
+                lambda: json.loads(body, object_pairs_hook=hook), memory=True
+            )
+            baseline = baseline or result["held_mib"]
+            change = result["held_mib"] / baseline - 1
+            print(
+                f"{name:<14} {kind:<8} {result['held_mib']:>9.1f} "
+                f"{result['peak_mib']:>9.1f} {result['best_s']:>7.3f}"
+                + (f"  ({change:+.0%})" if kind != "dict" else "")
+            )
+
+
+@benchmark(rows=50000, repeat=5, cassette="")
+def bench_decoding(args):
+    """
+    Compares the json decoders on recorded responses. Pass a cassette made
+    with `snset --record DIR`, or leave it out to record the inventory and
+    a display value install order query from a stand-in instance
+    """
+    import gzip
+
+    from sn_set import decoding, requests_lib
+    from sn_set.cassette import INDEX_FILE, Cassette
+
+    def load_bodies(path: str) -> List[tuple]:
+        # the successful json responses, with the fields each query asked for
+        bodies = []
+        with open(os.path.join(path, INDEX_FILE)) as f:
+            for line in f:
+                entry = json.loads(line)
+                content_type = entry["headers"].get("Content-Type", "")
+                if entry["status"] != 200 or "json" not in content_type:
+                    continue
+                with gzip.open(os.path.join(path, entry["body"]), "rb") as body:
+                    content = body.read()
+                fields = (entry.get("params") or {}).get("sysparm_fields")
+                bodies.append((content, fields.split(",") if fields else None))
+        return bodies
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if not args.cassette:
+            with stand_in({SOURCE: args.rows}):
+                requests_lib.options["cassette"] = Cassette(tmp, mode="record")
+                # fall back to nameIN chunks rather than a request per name
+                requests_lib.options["max_url_length"] = 8192
+                names = [r["name"] for r in requests_lib.get_update_sets(SOURCE)]
+                requests_lib.get_install_order(SOURCE, names[::2])
+        bodies = load_bodies(args.cassette or tmp)
+    size = sum(len(content) for content, _ in bodies) / 2**20
+    print(f"{len(bodies)} responses, {size:.1f} MiB")
+    print(f"{'decoder':<8} {'best s':>8} {'MiB/s':>8} {'speedup':>8}")
+    baseline = None
+    for name in ["json", "orjson", "msgspec"]:
+        try:
+            decoder = decoding.get_decoder(name)
+        except ImportError:
+            print(f"{name:<8} not installed")
+            continue
+        best = measure(
+            lambda: [decoder.decode_result(*body) for body in bodies], args.repeat
+        )["best_s"]
+        baseline = baseline or best
+        print(f"{name:<8} {best:>8.3f} {size / best:>8.1f} {baseline / best:>7.2f}x")
+
+
+@benchmark(names=200000, overlap=0.9, repeat=5)
+def bench_diff(args):
+    """
+    Compares the set difference snset used to compute (validate both lists,
+    then list(set(left) - set(right))) with sn_set.diff, for lists and
+    iterators, in arbitrary and stable order. --overlap is the share of the
+    source names in the target
+    """
+    from sn_set import diff
+
+    def baseline(left: List[str], right: List[str]) -> List[str]:
+        if not left or not isinstance(left, list):
+            raise ValueError("Left must be a list")
+        if not right or not isinstance(right, list):
+            raise ValueError("Right must be a list")
+        for item in left + right:
+            if not item or not isinstance(item, str):
+                raise ValueError("The lists must be composed of strings")
+        return list(set(left) - set(right))
+
+    source = [
+        f"update set {i:07d} for story STRY{i * 7:07d}" for i in range(args.names)
+    ]
+    target = source[: int(args.names * args.overlap)]
+    cases = {
+        "baseline": lambda: baseline(source, target),
+        "diff": lambda: diff.difference(source, target),
+        "diff stable": lambda: diff.difference(source, target, stable=True),
+        "diff iter": lambda: diff.difference(iter(source), iter(target)),
+        "diff swapped": lambda: diff.difference(target, source),
+        "baseline swapped": lambda: baseline(target, source),
+    }
+    print(f"{len(source)} source names, {len(target)} target names")
+    print(f"{'case':<18} {'best s':>8} {'peak MiB':>9} {'result':>8}")
+    for name, run in cases.items():
+        result = measure(run, args.repeat, memory=True)
+        print(
+            f"{name:<18} {result['best_s']:>8.4f} {result['peak_mib']:>9.1f} "
+            f"{len(result['result']):>8}"
+        )
+
+
+@benchmark(sets=500, updates_per_set=400, latency=0.0)
+def bench_waves(args):
+    """
+    Times the install wave planner: fetching the sys_update_xml rows of the
+    difference (keyset paged, nameIN chunked) and layering the sets into
+    waves
+    """
+    from sn_set import requests_lib
+    from sn_set.waves import fetch_updates, format_waves, plan_waves
+
+    with stand_in(
+        {SOURCE: args.sets},
+        latency=args.latency,
+        updates_per_set=args.updates_per_set,
+    ) as fake:
+        names = [r["name"] for r in requests_lib.get_update_sets(SOURCE)]
+        fake.reset_counters()
+        fetched = measure(lambda: list(fetch_updates(SOURCE, names)))
+        counters = fake.counters()
+    planned = measure(lambda: plan_waves(names, fetched["result"]), memory=True)
+
+    print(format_waves(planned["result"]).splitlines()[0])
+    print(
+        f"fetch: {fetched['best_s']:.2f}s, {counters['requests']} requests, "
+        f"{counters['bytes'] / 2**20:.1f} MiB"
+    )
+    print(f"plan:  {planned['best_s']:.3f}s, {planned['peak_mib']:.1f} MiB peak")
+
+
+@benchmark(sets=500, updates_per_set=400, target_rows=2000000)
+def bench_collisions(args):
+    """
+    Times the local collision join on generated sys_update_xml rows and
+    shows its memory is bounded by the source index: the target rows are
+    streamed past it, so reading millions of them costs no more memory than
+    thousands
+    """
+    from sn_set.collisions import index_updates, join_updates
+
+    per_set = args.updates_per_set
+    source_rows = (
+        {
+            "name": f"sys_script_include_{idx:07d}_{j}",
+            "update_set.name": f"STRY{idx:07d} - update set {idx}",
+            "sys_updated_on": f"2021-01-{1 + idx % 28:02d} 00:00:00",
+        }
+        for idx in range(args.sets)
+        for j in range(per_set)
+    )
+
+    def target_rows(rows: int):
+        # the records are updated round robin, one in 50 of the updates made
+        # after the source's
+        for n in range(rows):
+            idx, j = divmod(n % (args.sets * per_set), per_set)
+            yield {
+                "name": f"sys_script_include_{idx:07d}_{j}",
+                "update_set.name": "Default",
+                "sys_updated_on": (
+                    "2021-02-01 00:00:00" if n % 50 == 0 else "2020-12-01"
+                ),
+            }
+
+    indexed = measure(lambda: index_updates(source_rows), memory=True)
+    index, source_count = indexed["result"]
+    print(
+        f"index: {source_count} source rows in {indexed['best_s']:.2f}s, "
+        f"{indexed['peak_mib']:.1f} MiB peak"
+    )
+    for rows in sorted({args.target_rows // 10, args.target_rows}):
+        joined = measure(lambda: join_updates(index, target_rows(rows)), memory=True)
+        collisions, count = joined["result"]
+        found = sum(len(records) for records in collisions.values())
+        print(
+            f"join:  {count} target rows in {joined['best_s']:.2f}s "
+            f"({count / joined['best_s']:,.0f} rows/s), {found} collisions in "
+            f"{len(collisions)} sets, {joined['peak_mib']:.1f} MiB peak"
+        )
+
+
+@benchmark(rows=1000000, sets=2000, buffer=[50000, 200000])
+def bench_content_diff(args):
+    """
+    Compares the memory and time of the content diff's external merge join
+    with an in-memory hash index of the target fingerprints, on generated
+    (record, fingerprint) rows
+    """
+    from sn_set.content_diff import ExternalSorter, fingerprint, merge_join
+
+    def source_rows():
+        # updates arrive by set, not by record, so the input isn't sorted
+        for n in range(args.rows):
+            record = (n * 7919) % args.rows
+            yield (
+                f"sys_script_include_{record:032x}",
+                fingerprint(f"<payload {record}/>"),
+                f"STRY{n % args.sets:07d}",
+            )
+
+    def target_rows():
+        # one record in 20 changed since it was promoted
+        for n in range(args.rows):
+            record = (n * 104729) % args.rows
+            version = " v2" if record % 20 == 0 else ""
+            yield (
+                f"sys_script_include_{record:032x}",
+                fingerprint(f"<payload {record}{version}/>"),
+            )
+
+    def hash_index():
+        present = set(target_rows())
+        tally: Dict[str, list] = {}
+        for record, digest, set_name in source_rows():
+            counts = tally.setdefault(set_name, [0, 0])
+            counts[0] += 1
+            counts[1] += (record, digest) not in present
+        return {name: tuple(counts) for name, counts in tally.items()}
+
+    def external(buffer_rows: int):
+        with tempfile.TemporaryDirectory() as tmp:
+            source = ExternalSorter(tmp, buffer_rows)
+            for row in source_rows():
+                source.add(row)
+            target = ExternalSorter(tmp, buffer_rows)
+            for row in target_rows():
+                target.add(row)
+            return merge_join(source.sorted(), target.sorted())
+
+    print(f"{args.rows} source and target rows, {args.sets} sets")
+    print(f"{'method':<24} {'s':>7} {'peak MiB':>9} {'missing sets':>13}")
+    cases = [("hash index", hash_index)] + [
+        (f"external, {b} rows", lambda b=b: external(b)) for b in args.buffer
+    ]
+    expected = None
+    for name, run in cases:
+        result = measure(run, memory=True)
+        expected = expected or result["result"]
+        assert result["result"] == expected, f"{name} disagrees with the hash index"
+        missing = sum(1 for _, m in expected.values() if m)
+        print(
+            f"{name:<24} {result['best_s']:>7.2f} {result['peak_mib']:>9.1f} "
+            f"{missing:>13}"
+        )
+
+
+@benchmark(source_rows=20000, target_rows=18000, latency=0.02, queries=200)
+def bench_serve(args):
+    """
+    Compares a cold diff, which downloads both inventories, with an
+    incremental refresh and with warm /diff queries answered by `snset
+    serve` from memory
+    """
+    import statistics
+    import threading
+    import urllib.request
+
+    from sn_set import requests_lib
+    from sn_set.server import SnsetService, make_server
+
+    def query(url: str) -> int:
+        with urllib.request.urlopen(url) as response:
+            return json.load(response)["count"]
+
+    with stand_in(
+        {SOURCE: args.source_rows, TARGET: args.target_rows}, latency=args.latency
+    ):
+        requests_lib.options["keep_alive"] = True
+        service = SnsetService()
+        cold = measure(lambda: service.diff(SOURCE, TARGET)["count"])
+        count = cold["result"]
+        print(f"cold diff:    {cold['best_s'] * 1000:9.1f} ms, {count} sets")
+        refreshed = measure(service.refresh_all)["best_s"]
+        print(f"refresh:      {refreshed * 1000:9.1f} ms, both inventories")
+
+        server = make_server(service, "127.0.0.1", 0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = (
+            f"http://127.0.0.1:{server.server_address[1]}"
+            f"/diff?source={SOURCE}&target={TARGET}"
+        )
+        timings = []
+        try:
+            for _ in range(args.queries):
+                result = measure(lambda: query(url))
+                assert result["result"] == count
+                timings.append(result["best_s"])
+        finally:
+            server.shutdown()
+            server.server_close()
+    print(
+        f"warm query:   {statistics.median(timings) * 1000:9.1f} ms median, "
+        f"{max(timings) * 1000:.1f} ms max over {args.queries} queries"
+    )
+
+
+@benchmark(sets=2000, requests=400, concurrency=50, latency=0.05)
+def bench_transport(args):
+    """
+    Sends concurrent Table API lookups through make_request with each
+    transport: requests without and with a pooled session, against the
+    HTTP/1.1 stand-in instance, and httpx over a single multiplexed HTTP/2
+    connection, against the same instance served over cleartext HTTP/2.
+    Requires snset[httpx]
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    from benchmarks.h2_server import Http2Server
+    from sn_set import requests_lib
+    from sn_set.transport import HttpxClient
+
+    def lookups(url_template: str, client) -> List:
+        base_url = url_template.format(instance=SOURCE)
+        requests_lib.options["instance_url"] = url_template
+        requests_lib.context.clear()
+        if client is not None:
+            requests_lib.context[base_url] = {"client": client}
+        uri = f"{base_url}/api/now/table/sys_update_set"
+        params = [
+            {
+                "sysparm_query": f"name=STRY{n:07d} - update set {n}",
+                "sysparm_fields": "name,state,sys_updated_on",
+            }
+            for n in (i % args.sets for i in range(args.requests))
+        ]
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            return list(
+                executor.map(
+                    lambda p: requests_lib.make_request(uri, p, base_url=base_url),
+                    params,
+                )
+            )
+
+    auth = ("bench", "bench")
+    print(
+        f"{args.requests} lookups, {args.concurrency} at a time, "
+        f"{args.latency * 1000:g} ms latency"
+    )
+    print(f"{'transport':<28} {'s':>7} {'req/s':>8} {'connections':>12}")
+    with stand_in({SOURCE: args.sets}, latency=args.latency) as fake, Http2Server(
+        fake, max_streams=args.concurrency
+    ) as h2:
+        pool = args.concurrency
+        cases = [
+            ("requests", fake.url_template, lambda: None),
+            (
+                "requests, keep alive",
+                fake.url_template,
+                lambda: requests_lib.options.update(keep_alive=True),
+            ),
+            (
+                "httpx, HTTP/1.1",
+                fake.url_template,
+                lambda: HttpxClient(auth=auth, http2=False, max_connections=pool),
+            ),
+            (
+                "httpx, HTTP/2",
+                h2.url_template,
+                lambda: HttpxClient(auth=auth, http1=False, max_connections=pool),
+            ),
+        ]
+        for name, url_template, setup in cases:
+            requests_lib.options.clear()
+            client = setup()
+            fake.reset_counters()
+            result = measure(lambda: lookups(url_template, client))
+            assert all(len(rows) == 1 for rows in result["result"])
+            if client is not None:
+                client.close()
+            print(
+                f"{name:<28} {result['best_s']:>7.2f} "
+                f"{args.requests / result['best_s']:>8.0f} "
+                f"{fake.counters()['connections']:>12}"
+            )
+
+
+@benchmark(instances=4, sets=1000, latency=0.1)
+def bench_prewarm(args):
+    """
+    Times fetching the update sets of several instances one after the
+    other, as a run does, from cold clients and after prewarming them in
+    parallel. The stand-in instances require OAuth2, so a cold client pays
+    for its token request before its first fetch
+    """
+    from sn_set import requests_lib
+    from sn_set.registry import InstanceConfig, Registry
+
+    names = [f"instance{n}" for n in range(args.instances)]
+    print(
+        f"{args.instances} instances, {args.sets} sets each, "
+        f"{args.latency * 1000:g} ms latency"
+    )
+    with stand_in(
+        {name: args.sets for name in names}, latency=args.latency, oauth=True
+    ) as fake:
+        requests_lib.options.update(
+            keep_alive=True,
+            registry=Registry(
+                [
+                    InstanceConfig(name, base_url=f"{fake.base_url}/{name}")
+                    for name in names
+                ]
+            ),
+        )
+        for label, warm in [("cold", False), ("prewarmed", True)]:
+            requests_lib.context.clear()
+            fake.reset_counters()
+            warmed = measure(lambda: warm and requests_lib.prewarm(names))
+            assert not any((warmed["result"] or {}).values()), warmed["result"]
+            fetched = measure(lambda: [requests_lib.get_update_sets(n) for n in names])
+            print(
+                f"{label:<10} prewarm {warmed['best_s']:6.2f}s, "
+                f"fetches {fetched['best_s']:6.2f}s, "
+                f"total {warmed['best_s'] + fetched['best_s']:6.2f}s, "
+                f"{fake.counters()['requests']} requests"
+            )
+
+
+def cache_worker(url_template: str, cache_dir: str) -> None:
+    # a spawned process of bench_cache, like a CI job on the same host
+    from sn_set import requests_lib
+    from sn_set.cache import DiskCache
+
+    os.environ.update(credentials())
+    requests_lib.options["instance_url"] = url_template
+    if cache_dir:
+        requests_lib.options["cache"] = DiskCache(cache_dir)
+    for instance in (SOURCE, TARGET):
+        requests_lib.get_update_sets(instance)
+
+
+@benchmark(processes=8, source_rows=20000, target_rows=18000, latency=0.05)
+def bench_cache(args):
+    """
+    Starts several snset processes at once, each fetching the same source
+    and target inventories, like CI runners sharing a host. Without a cache
+    every process downloads both, with a shared disk cache one process
+    fills each entry while the others wait for it and read it from disk
+    """
+    import multiprocessing
+
+    def run_workers(url_template: str, cache_dir: str):
+        context = multiprocessing.get_context("spawn")
+        workers = [
+            context.Process(target=cache_worker, args=(url_template, cache_dir))
+            for _ in range(args.processes)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+            assert worker.exitcode == 0
+
+    print(
+        f"{args.processes} processes, {args.source_rows}/{args.target_rows} sets, "
+        f"{args.latency * 1000:g} ms latency"
+    )
+    print(f"{'cache':<12} {'s':>7} {'requests':>9} {'MiB served':>11}")
+    with stand_in(
+        {SOURCE: args.source_rows, TARGET: args.target_rows}, latency=args.latency
+    ) as fake, tempfile.TemporaryDirectory() as cache_dir:
+        for label, directory in [
+            ("none", ""),
+            ("cold", cache_dir),
+            ("warm", cache_dir),
+        ]:
+            fake.reset_counters()
+            elapsed = measure(lambda: run_workers(fake.url_template, directory))
+            counters = fake.counters()
+            print(
+                f"{label:<12} {elapsed['best_s']:>7.2f} {counters['requests']:>9} "
+                f"{counters['bytes'] / 2**20:>11.1f}"
+            )
+
+
+@benchmark(targets=3, rounds=3, source_rows=5000, latency=0.02)
+def bench_comparator(args):
+    """
+    Compares one source against several targets a few times over, as an
+    orchestrator importing sn_set does, once with a fresh Comparator per
+    comparison (what a snset run costs) and once with a single warm one
+    """
+    from sn_set.comparator import Comparator
+    from sn_set.registry import DEFAULT_INSTANCES
+
+    def compare_all(comparator=None) -> int:
+        found = 0
+        for _ in range(args.rounds):
+            for target in targets:
+                if comparator:
+                    found += len(list(comparator.compare(SOURCE, target)))
+                    continue
+                with Comparator(max_age=0) as cold:
+                    found += len(list(cold.compare(SOURCE, target)))
+        return found
+
+    targets = [name for name in DEFAULT_INSTANCES if name != SOURCE][: args.targets]
+    tables = {SOURCE: args.source_rows}
+    # each target is missing a different number of the source's sets
+    tables.update({t: args.source_rows - 50 * (n + 1) for n, t in enumerate(targets)})
+    print(
+        f"{args.targets} targets x {args.rounds} rounds, {args.source_rows} sets, "
+        f"{args.latency * 1000:g} ms latency"
+    )
+    with stand_in(tables, latency=args.latency) as fake:
+        for label, warm in [("per run", False), ("warm", True)]:
+            fake.reset_counters()
+            comparator = Comparator() if warm else None
+            result = measure(lambda: compare_all(comparator))
+            if comparator:
+                comparator.close()
+            counters = fake.counters()
+            print(
+                f"{label:<8} {result['best_s']:6.2f}s, {counters['requests']:4} "
+                f"requests, {counters['connections']:4} connections, "
+                f"{result['result']} sets ordered"
+            )
+
+
+@benchmark(source_rows=50000, missing=200, window=500, latency=0.02, url_limit=16000)
+def bench_since(args):
+    """
+    Compares a full diff, which downloads both inventories, with a --since
+    diff of the sets updated in the last window, which only downloads the
+    window of the source and looks its sets up on the target
+    """
+    from sn_set import requests_lib
+    from sn_set.comparator import Comparator
+
+    def diff(since) -> List[str]:
+        with Comparator(max_age=0) as comparator:
+            return list(comparator.diff(SOURCE, TARGET, since=since))
+
+    print(
+        f"{args.source_rows} sets, {args.missing} missing on the target, "
+        f"the last {args.window} in the window, {args.latency * 1000:g} ms latency"
+    )
+    with stand_in(
+        {SOURCE: args.source_rows, TARGET: args.source_rows - args.missing},
+        latency=args.latency,
+        max_url_length=args.url_limit,
+    ) as fake:
+        source_sets = fake.instances[SOURCE]["sys_update_set"]
+        since = source_sets[-args.window]["sys_updated_on"]
+        for label, window in [("full", None), ("--since", since)]:
+            requests_lib.options.update(
+                instance_url=fake.url_template, max_url_length=args.url_limit - 500
+            )
+            fake.reset_counters()
+            result = measure(lambda: diff(window))
+            counters = fake.counters()
+            print(
+                f"{label:<8} {result['best_s'] * 1000:8.1f} ms, "
+                f"{counters['requests']:3} requests, "
+                f"{counters['bytes'] / 2**20:6.2f} MiB, "
+                f"{len(result['result'])} sets missing"
+            )
+
+
+@benchmark(
+    reports=8,
+    rows=20000,
+    fetch_seconds=0.5,
+    format="xlsx",
+    workers=[0, 1, 2, 4, os.cpu_count() or 1],
+)
+def bench_reports(args):
+    """
+    Times writing one report per pair, as snset batch does, in turn on the
+    main thread and with pools of report writing processes. Each pair's
+    comparison is stood in for by --fetch-seconds of waiting, which the
+    pools overlap with the writes of the previous pairs
+    """
+    from sn_set.reports import ReportWriter
+
+    records = [
+        {
+            "name": f"STRY{idx:07d} - update set {idx}",
+            "state": "committed",
+            "update_source": {"display_value": "dev", "value": "1"},
+            "description": f"Changes for story {idx}",
+            "sys_created_on": "2021-05-01 00:00:00",
+            "commit_date": "2021-05-02 00:00:00",
+            "sys_updated_by": "admin",
+            "sys_updated_on": "2021-05-02 00:00:00",
+            "collisions": "false",
+        }
+        for idx in range(args.rows)
+    ]
+
+    def write(workers: int, directory: str):
+        with ReportWriter(workers, args.format) as writer:
+            for idx in range(args.reports):
+                time.sleep(args.fetch_seconds)
+                writer.submit(os.path.join(directory, f"report{idx}"), records)
+            errors = [error for _, error in writer.wait() if error]
+        assert not errors, errors
+
+    print(
+        f"{args.reports} {args.format} reports of {args.rows} rows, "
+        f"{args.fetch_seconds:g}s per comparison, {os.cpu_count()} CPUs"
+    )
+    baseline = None
+    for workers in sorted(set(args.workers)):
+        with tempfile.TemporaryDirectory() as directory:
+            elapsed = measure(lambda: write(workers, directory))["best_s"]
+        baseline = baseline or elapsed
+        print(
+            f"{workers:>2} workers {elapsed:7.2f}s  {baseline / elapsed:5.2f}x"
+            + ("  (in turn)" if not workers else "")
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--scenario", action="append", choices=list(SCENARIOS))
+    parser.add_argument("--source-rows", type=int, default=5000)
+    parser.add_argument("--target-rows", type=int, default=4500)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--max-url-length", type=int, default=0)
+    parser.add_argument("--rate-limit-every", type=int, default=0)
+    parser.add_argument("--oauth", action="store_true")
+    parser.add_argument("--label")
+    parser.add_argument("--output-dir", default=os.path.join("benchmarks", "results"))
+    parser.add_argument("--compare", nargs="+", metavar="RESULT")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--child-options", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    subparsers = parser.add_subparsers(dest="benchmark", title="benchmarks")
+    for name, (func, defaults) in BENCHMARKS.items():
+        sub = subparsers.add_parser(name, description=func.__doc__)
+        for option, default in defaults.items():
+            flag = "--" + option.replace("_", "-")
+            if isinstance(default, list):
+                sub.add_argument(
+                    flag, type=type(default[0]), nargs="+", default=default
+                )
+            else:
+                sub.add_argument(flag, type=type(default), default=default)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        return BENCHMARKS[args.benchmark][0](args)
+    if args.compare:
+        return compare(args.compare)
+    if args.child:
+        result = run_child(args.child, json.loads(args.child_options), args.workdir)
+        print(json.dumps(result))
+        return
+    run_scenarios(args)
+
+
+if __name__ == "__main__":
+    main()
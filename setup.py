@@ -18,14 +18,23 @@ test_dependencies = [
     "coverage==7.13.5",
 ]
 
+extra_dependencies = {
+    "otel": ["opentelemetry-api>=1.20"],
+    "orjson": ["orjson>=3.9"],
+    "msgspec": ["msgspec>=0.18"],
+    "httpx": ["httpx[http2]>=0.24"],
+    "rich": ["rich>=13"],
+}
+
 setup(
     name="snset",
-    packages=find_packages(exclude=["tests"]),
+    packages=find_packages(exclude=["tests", "benchmarks"]),
     version="0.2.0",
     description="CLI tool to retrieve and compare update sets from ServiceNow",
     author="Alex Biehl",
     license="BSD",
     install_requires=dependecies,
+    extras_require=extra_dependencies,
     include_package_data=True,
     entry_points={"console_scripts": ["snset = sn_set.cli:main"]},
     tests_require=test_dependencies,
@@ -0,0 +1,203 @@
+import base64
+import json
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urlencode, urlsplit
+
+BATCH_PATH = "/api/now/v1/batch"
+
+# ServiceNow caps the number of sub requests it will service per batch,
+# these defaults stay comfortably under the out of the box limits
+DEFAULT_MAX_REQUESTS = 50
+DEFAULT_MAX_BYTES = 512 * 1024
+
+
+class BatchResponse:
+    """
+    A single serviced (or unserviced) sub request from a Batch API call
+    """
+
+    def __init__(
+        self,
+        request_id: str,
+        url: str,
+        status_code: int,
+        status_text: str = "",
+        body: bytes = b"",
+        batch_id: str = "",
+    ):
+        self.request_id = request_id
+        self.batch_id = batch_id
+        self.url = url
+        self.status_code = status_code
+        self.status_text = status_text
+        self.body = body
+
+    @property
+    def ok(self) -> bool:
+        return 200 <= self.status_code < 300
+
+    def json(self) -> Dict:
+        return json.loads(self.body) if self.body else {}
+
+    def __repr__(self) -> str:
+        return f"BatchResponse({self.request_id}, {self.status_code}, {self.url})"
+
+
+class BatchError(Exception):
+    """
+    Raised when one or more sub requests of a batch were not successful.
+    Each failing sub request is kept on `failures` so callers can report on them
+    """
+
+    def __init__(self, failures: List[BatchResponse]):
+        self.failures = failures
+        details = "\n".join(
+            f"  {f.request_id}: {f.status_code} {f.status_text} {f.url}"
+            for f in failures
+        )
+        super().__init__(f"{len(failures)} batch sub request(s) failed:\n{details}")
+
+
+def relative_url(uri: str, params: Optional[Dict[str, str]] = None) -> str:
+    """
+    The Batch API expects instance relative urls, i.e. /api/now/table/...?query
+    """
+    path = urlsplit(uri).path
+    return f"{path}?{urlencode(params)}" if params else path
+
+
+def pack(
+    urls: List[str],
+    max_requests: int = DEFAULT_MAX_REQUESTS,
+    max_bytes: int = DEFAULT_MAX_BYTES,
+) -> List[List[int]]:
+    """
+    Splits the queued urls into groups of indexes, each group fitting
+    within max_requests sub requests and roughly max_bytes of request body
+
+    Parameters:
+    urls: List[str] - relative urls of the queued GET requests
+    max_requests: int - maximum number of sub requests per batch
+    max_bytes: int - maximum (approximate) encoded size of a batch body
+
+    returns: List[List[int]] - the indexes into urls for each batch
+    """
+    if max_requests < 1:
+        raise ValueError("max_requests must be at least 1")
+    groups: List[List[int]] = []
+    current: List[int] = []
+    size = 0
+    for idx, url in enumerate(urls):
+        # the per request json envelope adds roughly 150 bytes to the url
+        cost = len(url) + 150
+        if current and (len(current) >= max_requests or size + cost > max_bytes):
+            groups.append(current)
+            current, size = [], 0
+        current.append(idx)
+        size += cost
+    if current:
+        groups.append(current)
+    return groups
+
+
+def build_payload(batch_id: str, urls: List[str], ids: List[str]) -> Dict:
+    return {
+        "batch_request_id": batch_id,
+        "rest_requests": [
+            {
+                "id": request_id,
+                "url": url,
+                "method": "GET",
+                "headers": [{"name": "Accept", "value": "application/json"}],
+                "exclude_response_headers": True,
+            }
+            for request_id, url in zip(ids, urls)
+        ],
+    }
+
+
+def parse_payload(payload: Dict, urls: Dict[str, str]) -> Dict[str, BatchResponse]:
+    """
+    Decodes the base64 encoded bodies of a Batch API response
+
+    Parameters:
+    payload: Dict - the decoded json body of the batch call
+    urls: Dict[str, str] - the sub request ids mapped to their relative urls
+
+    returns: Dict[str, BatchResponse] - responses indexed by sub request id
+    """
+    responses: Dict[str, BatchResponse] = {}
+    batch_id = str(payload.get("batch_request_id", ""))
+    for serviced in payload.get("serviced_requests") or []:
+        request_id = str(serviced.get("id"))
+        body = serviced.get("body") or ""
+        responses[request_id] = BatchResponse(
+            request_id,
+            urls.get(request_id, ""),
+            int(serviced.get("status_code", 0)),
+            serviced.get("status_text", ""),
+            base64.b64decode(body) if body else b"",
+            batch_id,
+        )
+    for request_id in payload.get("unserviced_requests") or []:
+        request_id = str(request_id)
+        responses[request_id] = BatchResponse(
+            request_id, urls.get(request_id, ""), 0, "unserviced", batch_id=batch_id
+        )
+    # anything the instance didn't mention at all is treated as unserviced too
+    for request_id, url in urls.items():
+        if request_id not in responses:
+            responses[request_id] = BatchResponse(
+                request_id, url, 0, "missing", batch_id=batch_id
+            )
+    return responses
+
+
+class BatchTransport:
+    """
+    Queues GET requests and sends them to the ServiceNow Batch API
+    in as few round trips as the configured limits allow
+
+    Parameters:
+    send: Callable[[Dict], Dict] - posts a batch payload to the instance and
+        returns the decoded json response
+    max_requests: int - maximum number of sub requests per batch
+    max_bytes: int - maximum (approximate) encoded size of a batch body
+    """
+
+    def __init__(
+        self,
+        send: Callable[[Dict], Dict],
+        max_requests: int = DEFAULT_MAX_REQUESTS,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+    ):
+        self.send = send
+        self.max_requests = max_requests
+        self.max_bytes = max_bytes
+        self.queue: List[str] = []
+        self.batches_sent = 0
+
+    def add(self, uri: str, params: Optional[Dict[str, str]] = None) -> int:
+        """
+        Queues a GET request, returns its position in the eventual results
+        """
+        self.queue.append(relative_url(uri, params))
+        return len(self.queue) - 1
+
+    def flush(self) -> List[BatchResponse]:
+        """
+        Sends every queued request and returns the responses in queue order
+        """
+        urls, self.queue = self.queue, []
+        results: List[Optional[BatchResponse]] = [None] * len(urls)
+        for group in pack(urls, self.max_requests, self.max_bytes):
+            ids = [str(idx) for idx in group]
+            group_urls = [urls[idx] for idx in group]
+            batch_id = str(self.batches_sent)
+            payload = self.send(build_payload(batch_id, group_urls, ids))
+            payload.setdefault("batch_request_id", batch_id)
+            self.batches_sent += 1
+            responses = parse_payload(payload, dict(zip(ids, group_urls)))
+            for idx in group:
+                results[idx] = responses[str(idx)]
+        return results
@@ -0,0 +1,257 @@
+import gzip
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - windows, fills aren't shared there
+    fcntl = None
+
+DEFAULT_TTL = 900.0
+DEFAULT_MAX_BYTES = 512 * 2**20
+ENTRY_SUFFIX = ".gz"
+LOCK_SUFFIX = ".lock"
+# the cache is pruned again once this share of max_bytes has been written
+PRUNE_EVERY = 0.1
+
+
+class DiskCache:
+    """
+    Response bodies of make_request calls, kept on disk and shared by every
+    snset process using the same directory. An entry is written to a
+    temporary file and renamed into place, so readers never see a partial
+    one. A missing entry is filled under an exclusive lock on its lock file:
+    the first process to ask fetches it, the others wait for the lock and
+    then read what it wrote
+
+    Parameters:
+    directory: str - where the entries are kept
+    ttl: float - seconds an entry is served for, 0 keeps them until pruned
+    max_bytes: int - entries are evicted, oldest first, above this size
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        ttl: float = DEFAULT_TTL,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self._written = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str, suffix: str = ENTRY_SUFFIX) -> str:
+        return os.path.join(self.directory, key[:2], key + suffix)
+
+    def _fresh(self, mtime: float) -> bool:
+        return not self.ttl or self.clock() - mtime < self.ttl
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        The body stored under key, unless it is missing or expired
+        """
+        path = self._path(key)
+        try:
+            if not self._fresh(os.path.getmtime(path)):
+                return None
+            with gzip.open(path, "rb") as f:
+                return f.read()
+        except (OSError, EOFError):
+            # missing, or pruned while it was being read
+            return None
+
+    def put(self, key: str, content: bytes) -> None:
+        path = self._path(key)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=ENTRY_SUFFIX)
+        try:
+            with os.fdopen(fd, "wb") as raw, gzip.GzipFile(
+                fileobj=raw, mode="wb", compresslevel=1
+            ) as f:
+                f.write(content)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        with self._lock:
+            self._written += os.path.getsize(path)
+            due = self._written >= self.max_bytes * PRUNE_EVERY
+            if due:
+                self._written = 0
+        if due:
+            self.prune()
+
+    @contextmanager
+    def locked(self, key: str) -> Iterator[bool]:
+        """
+        Holds the fill lock of key, yields whether another process held it
+        """
+        path = self._path(key, LOCK_SUFFIX)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "a") as f:
+            waited = False
+            if fcntl:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    waited = True
+                    fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield waited
+            finally:
+                if fcntl:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def get_or_fill(self, key: str, fill: Callable[[], bytes]) -> Tuple[bytes, bool]:
+        """
+        The body stored under key, fetched with fill (once across every
+        process) when it isn't cached. Nothing is stored when fill raises
+
+        returns: Tuple - the body, and whether it came from the cache
+        """
+        content = self.get(key)
+        if content is not None:
+            with self._lock:
+                self.hits += 1
+            return content, True
+        with self.locked(key) as waited:
+            # filled between the get above and taking the lock, or while waiting
+            content = self.get(key)
+            with self._lock:
+                self.waits += waited
+                if content is not None:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+            if content is not None:
+                return content, True
+            content = fill()
+            self.put(key, content)
+            return content, False
+
+    def entries(self) -> List[Tuple[str, float, int]]:
+        """
+        The (path, mtime, size) of every entry, oldest first
+        """
+        found = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(ENTRY_SUFFIX) or name.startswith(".tmp-"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                found.append((path, stat.st_mtime, stat.st_size))
+        found.sort(key=lambda entry: entry[1])
+        return found
+
+    def stats(self) -> Dict:
+        entries = self.entries()
+        now = self.clock()
+        return {
+            "directory": self.directory,
+            "entries": len(entries),
+            "bytes": sum(size for _, _, size in entries),
+            "max_bytes": self.max_bytes,
+            "expired": sum(1 for _, mtime, _ in entries if not self._fresh(mtime)),
+            "oldest_age": round(now - entries[0][1], 1) if entries else None,
+            "newest_age": round(now - entries[-1][1], 1) if entries else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "waits": self.waits,
+        }
+
+    def prune(
+        self, max_bytes: Optional[int] = None, older_than: Optional[float] = None
+    ) -> Dict:
+        """
+        Removes the expired entries, or those older than older_than seconds,
+        then the oldest until the cache fits in max_bytes
+
+        returns: Dict - the entries and bytes removed and kept
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        older_than = self.ttl if older_than is None else older_than
+        now = self.clock()
+        entries = self.entries()
+        total = sum(size for _, _, size in entries)
+        removed = freed = 0
+        for path, mtime, size in entries:
+            expired = bool(older_than) and now - mtime >= older_than
+            if not expired and total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            removed += 1
+            freed += size
+            total -= size
+        self._remove_stale_files()
+        return {
+            "removed": removed,
+            "freed_bytes": freed,
+            "entries": len(entries) - removed,
+            "bytes": total,
+        }
+
+    def _remove_stale_files(self) -> None:
+        # lock files of removed entries, and temporary files of dead writers
+        cutoff = self.clock() - 3600
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                stale = name.startswith(".tmp-") or (
+                    name.endswith(LOCK_SUFFIX)
+                    and not os.path.exists(path[: -len(LOCK_SUFFIX)] + ENTRY_SUFFIX)
+                )
+                try:
+                    if stale and os.path.getmtime(path) < cutoff:
+                        self._remove_unlocked(path)
+                except OSError:
+                    pass
+
+    def _remove_unlocked(self, path: str) -> None:
+        # a fill can still hold an old lock file, removing it would let the
+        # next process lock a new file and fetch the entry a second time
+        if not fcntl or not path.endswith(LOCK_SUFFIX):
+            os.remove(path)
+            return
+        with open(path, "a") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+            try:
+                os.remove(path)
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def format_stats(stats: Dict) -> str:
+    lines = [
+        f"{stats['directory']}: {stats['entries']} entries, "
+        f"{stats['bytes'] / 2**20:.1f} of {stats['max_bytes'] / 2**20:.0f} MiB, "
+        f"{stats['expired']} expired"
+    ]
+    if stats["entries"]:
+        lines.append(
+            f"oldest {stats['oldest_age']:.0f}s, newest {stats['newest_age']:.0f}s ago"
+        )
+    return "\n".join(lines)
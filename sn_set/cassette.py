@@ -0,0 +1,159 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+from urllib.parse import urlencode
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+INDEX_FILE = "index.jsonl"
+BODY_DIR = "bodies"
+
+# response headers that are never written to a cassette
+SKIPPED_HEADERS = {"set-cookie", "authorization", "content-encoding", "content-length"}
+
+
+class CassetteMiss(LookupError):
+    """
+    Raised in replay mode when a request was never recorded
+    """
+
+
+def request_key(
+    method: str,
+    uri: str,
+    params: Dict = None,
+    body: Optional[Dict] = None,
+    scope: str = "",
+) -> str:
+    """
+    Identifies a request independent of param ordering
+
+    Parameters:
+    scope: str - tells apart the same request made by different callers,
+        i.e. the credentials it is sent with
+    """
+    query = urlencode(sorted((params or {}).items()))
+    payload = json.dumps(body, sort_keys=True) if body is not None else ""
+    raw = f"{method.upper()} {uri}?{query}\n{payload}"
+    if scope:
+        raw += f"\n{scope}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class Cassette:
+    """
+    An indexed, compressed store of HTTP exchanges. Each exchange is a line
+    in index.jsonl, response bodies are gzipped under bodies/ and stored once
+    per distinct content
+
+    Parameters:
+    path: str - the cassette directory
+    mode: str - "record" or "replay"
+    latency_factor: float - in replay mode, sleep for the recorded latency
+        multiplied by this factor, 0 disables the simulated latency
+    """
+
+    def __init__(self, path: str, mode: str = "replay", latency_factor: float = 0.0):
+        if mode not in ("record", "replay"):
+            raise ValueError("mode must be one of record or replay")
+        self.path = path
+        self.mode = mode
+        self.latency_factor = latency_factor
+        self._lock = threading.Lock()
+        # replay position for each request key, repeated requests are
+        # served in the order they were recorded
+        self._served: Dict[str, int] = {}
+        self.entries: Dict[str, List[Dict]] = {}
+
+        if mode == "record":
+            os.makedirs(os.path.join(path, BODY_DIR), exist_ok=True)
+            # recording again replaces the exchanges of an earlier recording,
+            # whose bodies are kept in case they are recorded again
+            open(os.path.join(path, INDEX_FILE), "w").close()
+        else:
+            index = os.path.join(path, INDEX_FILE)
+            if not os.path.exists(index):
+                raise ValueError(f"No cassette found at {path}")
+            with open(index) as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.entries.setdefault(entry["key"], []).append(entry)
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    def record(
+        self,
+        method: str,
+        uri: str,
+        params: Dict,
+        body: Optional[Dict],
+        response: requests.Response,
+        elapsed: float,
+    ):
+        """
+        Writes a single exchange to the cassette
+        """
+        content = response.content or b""
+        digest = hashlib.sha256(content).hexdigest()
+        body_file = f"{BODY_DIR}/{digest}.gz"
+        entry = {
+            "key": request_key(method, uri, params, body),
+            "method": method.upper(),
+            "uri": uri,
+            "params": params,
+            "status": response.status_code,
+            "reason": response.reason,
+            "headers": {
+                k: v
+                for k, v in response.headers.items()
+                if k.lower() not in SKIPPED_HEADERS
+            },
+            "elapsed": round(elapsed, 6),
+            "body": body_file,
+        }
+        with self._lock:
+            full_path = os.path.join(self.path, body_file)
+            if not os.path.exists(full_path):
+                tmp = f"{full_path}.{os.getpid()}.tmp"
+                with gzip.open(tmp, "wb") as f:
+                    f.write(content)
+                os.replace(tmp, full_path)
+            with open(os.path.join(self.path, INDEX_FILE), "a") as f:
+                f.write(json.dumps(entry) + "\n")
+
+    def replay(
+        self, method: str, uri: str, params: Dict = None, body: Optional[Dict] = None
+    ) -> requests.Response:
+        """
+        Serves a recorded response without touching the network
+        """
+        key = request_key(method, uri, params, body)
+        with self._lock:
+            recorded = self.entries.get(key)
+            if not recorded:
+                raise CassetteMiss(f"No recorded response for {method} {uri} {params}")
+            position = self._served.get(key, 0)
+            self._served[key] = position + 1
+        entry = recorded[min(position, len(recorded) - 1)]
+
+        if self.latency_factor:
+            time.sleep(entry.get("elapsed", 0) * self.latency_factor)
+
+        with gzip.open(os.path.join(self.path, entry["body"]), "rb") as f:
+            content = f.read()
+        response = requests.Response()
+        response.status_code = entry["status"]
+        response.reason = entry.get("reason")
+        response.headers = CaseInsensitiveDict(entry.get("headers") or {})
+        response._content = content
+        response.encoding = "utf-8"
+        response.url = requests.Request(method, uri, params=params).prepare().url
+        return response
@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+from .records import json_default
+
+MANIFEST = "manifest.json"
+CHUNKS = "chunks.jsonl"
+
+
+def chunk_key(uri: str, params: Optional[Dict[str, str]]) -> str:
+    """
+    Identifies a single fallback lookup by its uri and query params
+    """
+    raw = json.dumps([uri, params or {}], sort_keys=True)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def write_json(path: str, data: Any) -> None:
+    """
+    Writes json to path atomically, readers see either the old or the new file
+    """
+    directory = os.path.dirname(path) or "."
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".json")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, default=json_default)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+class Checkpoint:
+    """
+    Persists the completed units of a comparison run, so an interrupted run
+    can resume from where it stopped. Stages are written to a json file each,
+    fallback lookups are appended to chunks.jsonl as they complete
+
+    Parameters:
+    directory: str - where the checkpoint is kept
+    run: Dict - identifies the run, i.e. its source and target. Resuming a
+        checkpoint made for a different run is refused
+    resume: bool - keep the units already in the directory, otherwise the
+        directory is cleared
+
+    raises: ValueError when resuming a checkpoint of a different run
+    """
+
+    def __init__(self, directory: str, run: Dict, resume: bool = False):
+        self.directory = directory
+        self.run = run
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        manifest = self._read(MANIFEST) if resume else None
+        if manifest is not None and manifest.get("run") != run:
+            raise ValueError(
+                f"The checkpoint in {directory} is for {manifest.get('run')}, "
+                f"not {run}"
+            )
+        if manifest is None:
+            self.clear()
+            write_json(self._path(MANIFEST), {"run": run})
+        self.chunks: Dict[str, Any] = self._read_chunks() if manifest else {}
+        self.resumed = manifest is not None
+        if self.resumed:
+            self._drop_torn_line()
+        self._chunk_file = open(self._path(CHUNKS), "a")
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _read(self, name: str) -> Optional[Any]:
+        try:
+            with open(self._path(name)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _read_chunks(self) -> Dict[str, Any]:
+        chunks = {}
+        try:
+            with open(self._path(CHUNKS)) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # the run died while writing this line
+                        continue
+                    chunks[entry["key"]] = entry["result"]
+        except OSError:
+            pass
+        return chunks
+
+    def _drop_torn_line(self) -> None:
+        # a run that died mid-write leaves a last line without its newline,
+        # the next chunk appended would be glued onto it and lost with it
+        try:
+            with open(self._path(CHUNKS), "rb+") as f:
+                content = f.read()
+                if content and not content.endswith(b"\n"):
+                    f.truncate(content.rfind(b"\n") + 1)
+        except FileNotFoundError:
+            pass
+
+    def clear(self) -> None:
+        """
+        Removes the checkpoint files, leaving anything else in the directory
+        """
+        for name in os.listdir(self.directory):
+            if name in (MANIFEST, CHUNKS) or name.startswith("stage-"):
+                os.remove(self._path(name))
+
+    def has(self, stage: str) -> bool:
+        return os.path.exists(self._path(f"stage-{stage}.json"))
+
+    def load(self, stage: str) -> Any:
+        with open(self._path(f"stage-{stage}.json")) as f:
+            return json.load(f)
+
+    def save(self, stage: str, data: Any) -> None:
+        write_json(self._path(f"stage-{stage}.json"), data)
+
+    def chunk(self, uri: str, params: Dict[str, str]) -> Tuple[bool, Any]:
+        """
+        The saved result of a fallback lookup
+
+        returns: Tuple - whether the lookup was saved, and its result
+        """
+        key = chunk_key(uri, params)
+        with self._lock:
+            if key in self.chunks:
+                return True, self.chunks[key]
+        return False, None
+
+    def save_chunk(self, uri: str, params: Dict[str, str], result: Any) -> None:
+        key = chunk_key(uri, params)
+        line = json.dumps({"key": key, "result": result}, default=json_default)
+        with self._lock:
+            self.chunks[key] = result
+            self._chunk_file.write(line + "\n")
+            self._chunk_file.flush()
+            os.fsync(self._chunk_file.fileno())
+
+    def close(self) -> None:
+        with self._lock:
+            if not self._chunk_file.closed:
+                self._chunk_file.close()
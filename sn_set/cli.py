@@ -1,16 +1,53 @@
-from typing import Dict, List
+import functools
+import json
+import os
+import sys
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
 import click
-import xlsxwriter
+import requests
 
-from sn_set.requests_lib import (
-    get_install_order,
-    get_install_order_new,
-    get_update_sets,
+from sn_set import tracing
+from sn_set.cache import DEFAULT_MAX_BYTES, DEFAULT_TTL, DiskCache, format_stats
+from sn_set.cassette import Cassette
+from sn_set.checkpoint import Checkpoint
+from sn_set.collisions import annotate_collisions, format_collisions
+from sn_set.comparator import Comparator
+from sn_set.content_diff import DEFAULT_BUFFER_ROWS, PAYLOAD_FIELD, format_content_diff
+from sn_set.decoding import DECODERS
+from sn_set.diff import difference
+from sn_set.export import BACKENDS
+from sn_set.hedging import HedgingPolicy
+from sn_set.planner import DEFAULT_URL_LIMIT, build_plan, format_plan
+from sn_set.profiling import profile_run
+from sn_set.progress import ProgressDisplay
+from sn_set.registry import load_registry
+from sn_set.reports import REPORT_FORMATS, ReportWriter, pack, write_xlsx
+from sn_set.requests_lib import first_per_name, options
+from sn_set.resilience import (
+    DEFAULT_CONNECT_TIMEOUT,
+    DEFAULT_READ_TIMEOUT,
+    DeadlineExceeded,
+    ResiliencePolicy,
 )
+from sn_set.server import SnsetService, make_server
+from sn_set.stats import StatsCollector
+from sn_set.tracing import JsonTraceExporter
+from sn_set.transport import TRANSPORTS
+from sn_set.watermarks import (
+    DEFAULT_WATERMARK_FILE,
+    LAST_RUN,
+    WatermarkStore,
+    parse_since,
+)
+from sn_set.waves import assign_waves, format_waves
+
+# exit status when the deadline stopped the run before it finished
+PARTIAL_EXIT_CODE = 3
 
 
-@click.command()
+@click.group(invoke_without_command=True)
 @click.option(
     "--short",
     is_flag=True,
@@ -18,14 +55,315 @@ from sn_set.requests_lib import (
     help="Short circut - don't create excel file",
 )
 @click.option("--debug", is_flag=True, flag_value=True)
-@click.option("--file-name", "-f", help="Specify the output file name if desired")
 @click.option(
-    "--target", "-t", required=True, help="The instance you want to compare to"
+    "--content-diff",
+    is_flag=True,
+    flag_value=True,
+    help="Compare sets by the payloads of their updates rather than by name, "
+    "finding renamed and changed sets",
+)
+@click.option(
+    "--content-field",
+    default=PAYLOAD_FIELD,
+    show_default=True,
+    help="The sys_update_xml field fingerprinted by --content-diff",
+)
+@click.option(
+    "--content-buffer",
+    type=click.IntRange(min=1),
+    default=DEFAULT_BUFFER_ROWS,
+    show_default=True,
+    help="Rows --content-diff sorts in memory before spilling to disk",
+)
+@click.option(
+    "--predict-collisions",
+    is_flag=True,
+    flag_value=True,
+    help="Report the sets likely to collide on the target before previewing, "
+    "from both instances' sys_update_xml",
+)
+@click.option(
+    "--waves",
+    is_flag=True,
+    flag_value=True,
+    help="Group the install order into waves of sets that update no record in "
+    "common, from the source's sys_update_xml",
+)
+@click.option(
+    "--stable-order",
+    is_flag=True,
+    flag_value=True,
+    help="Keep the source's order when diffing names, so runs are reproducible",
+)
+@click.option(
+    "--backend",
+    type=click.Choice(BACKENDS),
+    default="table",
+    show_default=True,
+    help="Fetch records with the Table API or the JSONv2/CSV export processors",
+)
+@click.option(
+    "--json-decoder",
+    type=click.Choice(DECODERS),
+    default="auto",
+    show_default=True,
+    help="How responses are decoded, auto uses msgspec or orjson when installed",
+)
+@click.option(
+    "--transport",
+    type=click.Choice(TRANSPORTS),
+    default="requests",
+    show_default=True,
+    help="The HTTP client, httpx multiplexes requests over one HTTP/2 connection",
+)
+@click.option(
+    "--registry",
+    type=click.Path(exists=True, dir_okay=False),
+    envvar="SN_SET_REGISTRY",
+    help="A json file of the instances, their urls, credentials profiles, "
+    "pool sizes and rate limits",
+)
+@click.option(
+    "--prewarm",
+    is_flag=True,
+    flag_value=True,
+    help="Connect and authenticate to both instances in parallel before fetching",
+)
+@click.option(
+    "--batch-size",
+    type=click.IntRange(min=0),
+    default=0,
+    help="Send fallback lookups through the Batch API, N requests per call",
+)
+@click.option(
+    "--batch-max-bytes",
+    type=click.IntRange(min=1),
+    help="Maximum size of a single Batch API call in bytes",
+)
+@click.option(
+    "--max-url-length",
+    type=click.IntRange(min=1),
+    help="When a nameIN query is too long, fall back to nameIN queries of "
+    "at most this many characters instead of one request per name",
+)
+@click.option(
+    "--connect-timeout",
+    type=click.FloatRange(min=0, min_open=True),
+    default=DEFAULT_CONNECT_TIMEOUT,
+    show_default=True,
+    help="Seconds to wait for a connection to an instance",
+)
+@click.option(
+    "--read-timeout",
+    type=click.FloatRange(min=0, min_open=True),
+    default=DEFAULT_READ_TIMEOUT,
+    show_default=True,
+    help="Seconds to wait for an instance to send data",
+)
+@click.option(
+    "--deadline",
+    type=click.FloatRange(min=0, min_open=True),
+    help="Seconds the whole run may take, after which outstanding work is "
+    f"cancelled and snset exits with status {PARTIAL_EXIT_CODE}",
+)
+@click.option(
+    "--retries",
+    type=click.IntRange(min=0),
+    default=2,
+    show_default=True,
+    help="Retries of rate limited (429) and unavailable (502-504) responses",
+)
+@click.option(
+    "--breaker-threshold",
+    type=click.IntRange(min=0),
+    default=5,
+    show_default=True,
+    help="Consecutive failures before requests to an instance fail fast, "
+    "0 disables the circuit breaker",
+)
+@click.option(
+    "--breaker-reset",
+    type=click.FloatRange(min=0),
+    default=30.0,
+    show_default=True,
+    help="Seconds before an instance's open circuit breaker lets a request through",
+)
+@click.option(
+    "--hedge-percentile",
+    type=click.FloatRange(min=1, max=100, max_open=True),
+    help="Send a duplicate GET when a response takes longer than this "
+    "percentile of the instance's observed latency, i.e. 95",
+)
+@click.option(
+    "--hedge-max-ratio",
+    type=click.FloatRange(min=0, max=1),
+    default=0.1,
+    show_default=True,
+    help="Most duplicate GETs sent to an instance, as a share of its requests",
+)
+@click.option(
+    "--since",
+    "--changed-after",
+    "since",
+    metavar="TIMESTAMP|last-run",
+    help="Only compare the source sets updated since this date or timestamp, "
+    "or since the last --since run of the pair, looking them up on the target",
+)
+@click.option(
+    "--watermark-file",
+    type=click.Path(dir_okay=False),
+    envvar="SN_SET_WATERMARKS",
+    default=DEFAULT_WATERMARK_FILE,
+    show_default=True,
+    help="Where the latest update of each pair's last --since run is kept",
 )
 @click.option(
-    "--source", "-s", required=True, help="The instance you want update sets from"
+    "--checkpoint-dir",
+    type=click.Path(file_okay=False),
+    help="Save each completed stage and fallback lookup to this directory",
 )
-def main(source, target, file_name, debug, short):
+@click.option(
+    "--resume",
+    is_flag=True,
+    flag_value=True,
+    help="Carry on from the last complete unit of work in --checkpoint-dir",
+)
+@click.option(
+    "--cache-dir",
+    type=click.Path(file_okay=False),
+    envvar="SN_SET_CACHE_DIR",
+    help="Share responses through a disk cache in this directory, with every "
+    "snset process using it",
+)
+@click.option(
+    "--cache-ttl",
+    type=click.FloatRange(min=0),
+    default=DEFAULT_TTL,
+    show_default=True,
+    help="Seconds a cached response is served for, 0 until pruned",
+)
+@click.option(
+    "--cache-size",
+    type=click.IntRange(min=1),
+    default=DEFAULT_MAX_BYTES // 2**20,
+    show_default=True,
+    help="MiB the disk cache may hold before the oldest responses are evicted",
+)
+@click.option(
+    "--record",
+    type=click.Path(file_okay=False),
+    help="Record every request and response to a cassette directory",
+)
+@click.option(
+    "--replay",
+    type=click.Path(exists=True, file_okay=False),
+    help="Serve responses from a recorded cassette instead of the network",
+)
+@click.option(
+    "--replay-latency",
+    type=click.FloatRange(min=0),
+    default=0.0,
+    help="Sleep for the recorded latency multiplied by this factor when replaying",
+)
+@click.option(
+    "--stats",
+    is_flag=True,
+    flag_value=True,
+    help="Print a per stage summary of the requests made",
+)
+@click.option(
+    "--stats-json",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Write the per request metrics and stage summary to a json file",
+)
+@click.option(
+    "--trace",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Write a json line per traced span (requests, stages) to a file",
+)
+@click.option(
+    "--otel",
+    is_flag=True,
+    flag_value=True,
+    help="Send spans to OpenTelemetry (requires the otel extra)",
+)
+@click.option(
+    "--profile",
+    is_flag=True,
+    flag_value=True,
+    help="Profile the run with cProfile, writes snset.pstats and a text report",
+)
+@click.option(
+    "--profile-memory",
+    is_flag=True,
+    flag_value=True,
+    help="Trace memory allocations with tracemalloc and add them to the report",
+)
+@click.option(
+    "--profile-dir",
+    type=click.Path(file_okay=False),
+    default=".",
+    show_default=True,
+    help="Where to write the profile output",
+)
+@click.option(
+    "--progress/--no-progress",
+    default=None,
+    help="Show per stage throughput and ETA, a live table on a terminal "
+    "and plain lines otherwise. On by default when output is a terminal",
+)
+@click.option("--file-name", "-f", help="Specify the output file name if desired")
+@click.option("--target", "-t", help="The instance you want to compare to")
+@click.option("--source", "-s", help="The instance you want update sets from")
+@click.pass_context
+def main(
+    ctx,
+    source,
+    target,
+    file_name,
+    stats,
+    stats_json,
+    trace,
+    otel,
+    profile,
+    profile_memory,
+    profile_dir,
+    progress,
+    record,
+    replay,
+    replay_latency,
+    debug,
+    short,
+    backend,
+    batch_size,
+    batch_max_bytes,
+    max_url_length,
+    connect_timeout,
+    read_timeout,
+    deadline,
+    retries,
+    breaker_threshold,
+    breaker_reset,
+    hedge_percentile,
+    hedge_max_ratio,
+    since,
+    watermark_file,
+    checkpoint_dir,
+    resume,
+    json_decoder,
+    transport,
+    registry,
+    prewarm,
+    cache_dir,
+    cache_ttl,
+    cache_size,
+    stable_order,
+    waves,
+    predict_collisions,
+    content_diff,
+    content_field,
+    content_buffer,
+):
     """
     snset is a python cli tool for retrieving the list of installed
     update sets in two ServiceNow instances, comparing them, and
@@ -39,84 +377,735 @@ def main(source, target, file_name, debug, short):
 
     Will output to an excel file in the current directory, unless another
     is specified.
+
+    snset plan -s {source instance} -t {target instance}
+    prints the requests a comparison would make without running it.
+    """
+    # what the run and its subcommands set is undone when they end, so a
+    # second run in the same process starts from the same options
+    ctx.call_on_close(functools.partial(restore_options, dict(options)))
+    # the instances, backend and connections of the run are those plan,
+    # serve and batch use as well
+    use_registry(registry)
+    options["backend"] = backend
+    ctx.obj = dict(transport=transport, retries=retries)
+    if ctx.invoked_subcommand is not None:
+        return
+    if not source:
+        raise click.UsageError("Missing option '--source' / '-s'.", ctx)
+    if not target:
+        raise click.UsageError("Missing option '--target' / '-t'.", ctx)
+    if record and replay:
+        raise click.UsageError("--record and --replay can't be used together")
+    if resume and not checkpoint_dir:
+        raise click.UsageError("--resume requires --checkpoint-dir")
+    if cache_dir and (record or replay):
+        # a cached response would be missing from the cassette
+        raise click.UsageError("--cache-dir can't be used with --record or --replay")
+    # the stages the run goes through
+    options.update(
+        # a replayed run has nothing to connect to
+        prewarm=prewarm and not replay,
+        stable_order=stable_order,
+        waves=waves,
+        predict_collisions=predict_collisions,
+        content_diff=content_diff,
+    )
+    # how the comparator's requests are made
+    settings = dict(
+        backend=backend,
+        batch_size=batch_size,
+        batch_max_bytes=batch_max_bytes,
+        max_url_length=max_url_length,
+        json_decoder=json_decoder,
+        transport=transport,
+        keep_alive=prewarm,
+        content_field=content_field,
+        content_buffer=content_buffer,
+        resilience=ResiliencePolicy(
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            retries=retries,
+            deadline=deadline,
+            failure_threshold=breaker_threshold,
+            reset_timeout=breaker_reset,
+        ),
+    )
+    # a run fetches each result once, nothing needs to expire
+    comparator = Comparator(
+        settings, max_age=0, difference=functools.partial(get_set_diff, debug=debug)
+    )
+    hedging = None
+    if hedge_percentile:
+        hedging = options["hedging"] = HedgingPolicy(
+            pct=hedge_percentile, max_ratio=hedge_max_ratio
+        )
+    if since:
+        use_window(source, target, since, watermark_file)
+    checkpoint = None
+    if checkpoint_dir:
+        # the chunks of a name diff or of another window don't fit this run
+        checkpoint_run = {
+            "source": source,
+            "target": target,
+            "since": options.get("since"),
+            "content_diff": content_diff,
+            "content_field": content_field if content_diff else None,
+        }
+        try:
+            checkpoint = options["checkpoint"] = Checkpoint(
+                checkpoint_dir, checkpoint_run, resume=resume
+            )
+        except ValueError as ex:
+            raise click.UsageError(str(ex))
+        if resume and not checkpoint.resumed:
+            click.echo(f"No checkpoint in {checkpoint_dir}, starting from scratch")
+    if cache_dir:
+        options["cache"] = DiskCache(
+            cache_dir, ttl=cache_ttl, max_bytes=cache_size * 2**20
+        )
+    if record:
+        options["cassette"] = Cassette(record, mode="record")
+    elif replay:
+        options["cassette"] = Cassette(
+            replay, mode="replay", latency_factor=replay_latency
+        )
+
+    collector = options["stats"] = StatsCollector()
+    # what run has worked out so far, kept when the deadline cuts it short
+    partial: Dict = {}
+    trace_hooks = []
+    # every hook added makes each span do work, so piped runs that didn't
+    # ask for progress keep tracing a no-op
+    if progress is None:
+        progress = sys.stdout.isatty()
+    if progress:
+        display = ProgressDisplay(
+            collector, live=sys.stdout.isatty(), write=click.echo
+        ).start()
+        trace_hooks.append(tracing.add_hook(display))
+    if trace:
+        trace_hooks.append(tracing.add_hook(JsonTraceExporter(trace)))
+    if otel:
+        from sn_set.otel import OpenTelemetryHook
+
+        trace_hooks.append(tracing.add_hook(OpenTelemetryHook()))
+    try:
+        profiler = (
+            profile_run(profile_dir, cpu=profile, memory=profile_memory)
+            if profile or profile_memory
+            else nullcontext()
+        )
+        with profiler, tracing.span("snset", source=source, target=target):
+            run(
+                source,
+                target,
+                file_name,
+                debug,
+                short,
+                collector,
+                partial,
+                comparator=comparator,
+            )
+    except DeadlineExceeded as ex:
+        stopped_in = next(reversed(collector.stages), None)
+        click.echo(f"\n{ex} during {stopped_in}, stopping with partial results")
+        partial_sets = partial_install_order(partial)
+        if partial_sets and not short:
+            partial_file = f"{file_name or 'output'}-partial"
+            if to_excel(partial_sets, partial_file):
+                click.echo(f"Wrote the install order found so far to {partial_file}")
+        exit(PARTIAL_EXIT_CODE)
+    finally:
+        comparator.close()
+        for hook in trace_hooks:
+            tracing.remove_hook(hook)
+        if hedging:
+            hedging.close()
+        if checkpoint:
+            checkpoint.close()
+        if stats:
+            click.echo("\n" + collector.format_table())
+            if hedging:
+                click.echo("\n" + hedging.format_summary())
+            if options.get("cache"):
+                disk_cache = options["cache"]
+                click.echo(
+                    f"\nDisk cache: {disk_cache.hits} hits, {disk_cache.misses} "
+                    f"misses, {disk_cache.waits} waited for another process"
+                )
+        if stats_json:
+            with open(stats_json, "w") as f:
+                f.write(
+                    collector.to_json(
+                        extra={"hedging": hedging.summary()} if hedging else None
+                    )
+                )
+
+
+@main.command()
+@click.option(
+    "--json", "as_json", is_flag=True, flag_value=True, help="Print the plan as json"
+)
+@click.option(
+    "--url-limit",
+    type=click.IntRange(min=1),
+    default=DEFAULT_URL_LIMIT,
+    show_default=True,
+    help="The longest url the instances accept before a lookup falls back",
+)
+@click.option(
+    "--max-url-length",
+    type=click.IntRange(min=1),
+    help="Plan the fallback as nameIN queries of at most this many characters",
+)
+@click.option(
+    "--batch-size",
+    type=click.IntRange(min=0),
+    default=0,
+    help="Plan the fallback lookups through the Batch API, N requests per call",
+)
+@click.option("--target", "-t", required=True, help="The instance to compare to")
+@click.option("--source", "-s", required=True, help="The instance to get sets from")
+def plan(source, target, batch_size, max_url_length, url_limit, as_json):
     """
+    Shows the HTTP work comparing source to target would do: the requests
+    per stage, the nameIN chunk sizes, the estimated bytes and the expected
+    concurrency. Only record counts and a small sample are retrieved. The
+    instances and backend are those of snset's --registry and --backend.
+    """
+    options.update(batch_size=batch_size, max_url_length=max_url_length)
+    the_plan = build_plan(source, target, url_limit=url_limit)
+    if as_json:
+        click.echo(json.dumps(the_plan, indent=2))
+    else:
+        click.echo(format_plan(the_plan))
+
+
+@main.command()
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option("--port", type=click.IntRange(min=0), default=8765, show_default=True)
+@click.option(
+    "--interval",
+    type=click.FloatRange(min=1),
+    default=300.0,
+    show_default=True,
+    help="Seconds between incremental refreshes of the inventories",
+)
+@click.option(
+    "--full-every",
+    type=click.IntRange(min=0),
+    default=12,
+    show_default=True,
+    help="Reload the inventories in full every N refreshes, to notice deleted sets",
+)
+@click.option(
+    "--warm",
+    multiple=True,
+    metavar="SOURCE:TARGET",
+    help="Instance pairs to load before serving, can be repeated",
+)
+@click.pass_obj
+def serve(connection, host, port, interval, full_every, warm):
+    """
+    Keeps the update set inventories of the instances it is asked about in
+    memory, refreshing them incrementally, and answers diff and install
+    order queries over a local HTTP/JSON endpoint. The instances and
+    connections are those of snset's --registry, --transport and --retries:
+
+    \b
+    GET  /diff?source=nyudev&target=nyuqa[&since=2021-05-01 00:00:00]
+    GET  /install-order?source=nyudev&target=nyuqa[&fields=name,commit_date]
+    GET  /status
+    POST /refresh[?instance=nyudev&full=true]
+    """
+    service = SnsetService(
+        interval=interval,
+        full_every=full_every,
+        settings=connection_settings(connection),
+    )
+    pairs = parse_pairs(warm, "--warm")
+    warmed = service.comparator.prewarm([i for p in pairs for i in p])
+    for instance, error in warmed.items():
+        if error:
+            click.echo(f"Could not prewarm {instance}: {error}")
+    for source, target in pairs:
+        click.echo(f"Loading {source} and {target}")
+        service.diff(source, target)
+    server = make_server(service, host, port)
+    service.start()
+    click.echo(f"Serving on http://{host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
+
+
+@main.command()
+@click.option(
+    "--pair",
+    "pair_values",
+    multiple=True,
+    metavar="SOURCE:TARGET",
+    help="An instance pair to compare, can be repeated",
+)
+@click.option(
+    "--target",
+    "-t",
+    "targets",
+    multiple=True,
+    help="Compare --source to this instance, can be repeated",
+)
+@click.option("--source", "-s", help="The instance to get sets from")
+@click.option(
+    "--format",
+    "report_format",
+    type=click.Choice(REPORT_FORMATS),
+    default="xlsx",
+    show_default=True,
+)
+@click.option(
+    "--output-dir",
+    type=click.Path(file_okay=False),
+    default=".",
+    show_default=True,
+    help="Where the reports are written, one per pair named SOURCE-TARGET",
+)
+@click.option(
+    "--workers",
+    type=click.IntRange(min=0),
+    show_default="one per pair up to the number of CPUs, 0 for a single pair",
+    help="Processes writing reports while the next pairs are compared, "
+    "0 writes them in turn",
+)
+@click.pass_obj
+def batch(connection, pair_values, targets, source, report_format, output_dir, workers):
+    """
+    Compares several instance pairs in one run and writes a report of each
+    pair's install order. The inventories and connections are shared
+    between pairs, and the reports are written by a pool of processes
+    while the next pairs are compared. The instances and connections are
+    those of snset's --registry, --transport and --retries:
+
+    \b
+    snset batch -s nyudev -t nyuqa -t nyutest -t nyutrain
+    snset batch --pair nyudev:nyuqa --pair nyuqa:nyu --format csv
+    """
+    pairs = parse_pairs(pair_values, "--pair")
+    if targets and not source:
+        raise click.UsageError("--target requires --source")
+    pairs += [(source, target) for target in targets]
+    if not pairs:
+        raise click.UsageError("Give the pairs to compare with --pair or -s and -t")
+    if workers is None:
+        # a single report has nothing to overlap with, starting a process
+        # would only add to the run
+        workers = min(len(pairs), os.cpu_count() or 1) if len(pairs) > 1 else 0
+    os.makedirs(output_dir, exist_ok=True)
+    failed = 0
+    with Comparator(
+        connection_settings(connection), max_age=0
+    ) as comparator, ReportWriter(workers, report_format) as writer:
+        for pair_source, pair_target in pairs:
+            click.echo(f"Comparing {pair_source} to {pair_target}")
+            try:
+                records = list(comparator.compare(pair_source, pair_target))
+            except (requests.RequestException, ValueError) as ex:
+                click.echo(f"Could not compare {pair_source} to {pair_target}: {ex}")
+                failed += 1
+                continue
+            if not records:
+                click.echo(f"No sets are missing from {pair_target}")
+                continue
+            writer.submit(
+                os.path.join(output_dir, f"{pair_source}-{pair_target}"), records
+            )
+        click.echo("Waiting for the reports")
+        for path, error in writer.wait():
+            if error:
+                click.echo(f"Could not write {path}: {error}")
+                failed += 1
+            else:
+                click.echo(f"Wrote {path}")
+    if failed:
+        exit(1)
+
+
+@main.group()
+@click.option(
+    "--cache-dir",
+    type=click.Path(exists=True, file_okay=False),
+    envvar="SN_SET_CACHE_DIR",
+    required=True,
+    help="The disk cache directory",
+)
+@click.pass_context
+def cache(ctx, cache_dir):
+    """
+    Inspects and prunes the disk cache shared by snset processes
+    """
+    ctx.obj = DiskCache(cache_dir)
+
+
+@cache.command("stats")
+@click.option(
+    "--json", "as_json", is_flag=True, flag_value=True, help="Print the stats as json"
+)
+@click.option(
+    "--ttl",
+    type=click.FloatRange(min=0),
+    default=DEFAULT_TTL,
+    show_default=True,
+    help="Count the entries older than this many seconds as expired",
+)
+@click.pass_obj
+def cache_stats(disk_cache, as_json, ttl):
+    """
+    Shows the entries, size and age of the disk cache
+    """
+    disk_cache.ttl = ttl
+    stats = disk_cache.stats()
+    click.echo(json.dumps(stats, indent=2) if as_json else format_stats(stats))
+
+
+@cache.command("prune")
+@click.option(
+    "--max-size",
+    type=click.IntRange(min=0),
+    default=DEFAULT_MAX_BYTES // 2**20,
+    show_default=True,
+    help="Evict the oldest entries until the cache holds at most this many MiB",
+)
+@click.option(
+    "--older-than",
+    type=click.FloatRange(min=0),
+    default=DEFAULT_TTL,
+    show_default=True,
+    help="Remove the entries older than this many seconds, 0 keeps them",
+)
+@click.pass_obj
+def cache_prune(disk_cache, max_size, older_than):
+    """
+    Removes expired entries, then the oldest until the cache fits its size
+    """
+    result = disk_cache.prune(max_bytes=max_size * 2**20, older_than=older_than)
     click.echo(
-        f"Begin retrieving update sets from source: {source} and target: {target}"
+        f"Removed {result['removed']} entries ({result['freed_bytes'] / 2**20:.1f} "
+        f"MiB), {result['entries']} entries ({result['bytes'] / 2**20:.1f} MiB) left"
     )
 
-    click.echo("Begin get source sets")
-    source_sets = list(map(lambda x: x.get("name"), get_update_sets(source)))
-    click.echo(f"Retrieved Source sets: {len(source_sets)}")
-    if debug:
-        click.echo("Retrieved update sets\n" + "\n".join(source_sets))
 
-    click.echo("\nBegin get Target sets")
-    target_sets = list(map(lambda x: x.get("name"), get_update_sets(target)))
-    click.echo(f"Retrieved Target sets: {len(target_sets)}")
-    if debug:
-        click.echo("Retrieved update sets\n" + "\n".join(target_sets))
+def restore_options(saved: Dict) -> None:
+    """
+    Puts back the options as they were before a run
+    """
+    options.clear()
+    options.update(saved)
 
-    click.echo("\nCompute set difference")
-    set_diff = get_set_diff(source_sets, target_sets, debug=debug)
-    if debug:
-        click.echo("Set difference: " + "\n".join(set_diff))
 
-    click.echo(f"\nGet install order for {len(set_diff)} update sets")
-    ordered_sets = get_install_order(source, set_diff)
+def use_window(source: str, target: str, since: str, watermark_file: str) -> None:
+    """
+    Sets the window of a --since run: the timestamp given, or the start of
+    the window following the pair's last run
+    """
+    watermarks = options["watermarks"] = WatermarkStore(watermark_file)
+    if since != LAST_RUN:
+        try:
+            options["since"] = parse_since(since)
+        except ValueError as ex:
+            raise click.BadParameter(str(ex), param_hint="--since")
+        return
+    try:
+        options["since"] = watermarks.since(source, target)
+    except ValueError as ex:
+        raise click.UsageError(str(ex))
+    if not options["since"]:
+        click.echo(
+            f"No watermark for {source}:{target} in {watermarks.path}, "
+            "comparing every set"
+        )
+
+
+def save_watermark(source: str, target: str, partial: Dict) -> None:
+    """
+    Records the latest update of the source seen by a --since run, so the
+    next one starts from there
+    """
+    watermarks = options.get("watermarks")
+    if watermarks and partial.get("watermark"):
+        watermarks.save(source, target, partial["watermark"])
+
 
-    # get the elements that weren't in the list of retrieved update sets
-    set_names = (
-        list(map(lambda x: x.get("name"), ordered_sets))
-        if len(ordered_sets) > 0
-        else []
+def parse_pairs(values: Iterable[str], param_hint: str) -> List[Tuple[str, str]]:
+    """
+    Splits SOURCE:TARGET values into (source, target) pairs
+    """
+    pairs = []
+    for value in values:
+        source, sep, target = value.partition(":")
+        if not sep or not source or not target:
+            raise click.BadParameter(
+                f"{value} is not SOURCE:TARGET", param_hint=param_hint
+            )
+        pairs.append((source, target))
+    return pairs
+
+
+def connection_settings(connection: Dict) -> Dict:
+    """
+    The Comparator settings of a long running subcommand, from the
+    --transport and --retries of the group
+    """
+    return dict(
+        transport=connection["transport"],
+        resilience=ResiliencePolicy(retries=connection["retries"], failure_threshold=5),
     )
-    new_sets = get_set_diff(set_diff, set_names)
-
-    if new_sets and len(new_sets) > 0:
-        click.echo("Getting newly created update sets")
-        ordered_sets += get_install_order_new(source, new_sets)
-
-    click.echo("Output to excel")
-    if short:
-        click.echo("Short circuiting")
-        exit(0)
-    if to_excel(ordered_sets, file_name):
-        click.echo("Success!")
-        exit(0)
-    else:
-        click.echo("There was an error writing the spreadsheet")
-        exit(-1)
 
 
-def get_set_diff(left: List[str], right: List[str], debug: bool = False) -> List[str]:
+def use_registry(path: Optional[str]) -> None:
+    """
+    Makes the instances of a registry file the instances of the run
+    """
+    if path:
+        try:
+            options["registry"] = load_registry(path)
+        except ValueError as ex:
+            raise click.UsageError(str(ex))
+
+
+@contextmanager
+def stage(collector: StatsCollector, name: str) -> Iterator[None]:
+    """
+    Runs a named pipeline stage, attributing its requests to the stage in
+    the run stats and tracing it as a span
+    """
+    with collector.stage(name), tracing.span(f"stage {name}", stage=name):
+        yield
+
+
+def resumable(name: str, compute: Callable[[], Any]) -> Any:
+    """
+    Runs a unit of work and saves its result to the checkpoint, or loads the
+    result when the checkpoint being resumed already holds it
+    """
+    checkpoint = options.get("checkpoint")
+    if checkpoint and checkpoint.has(name):
+        click.echo(f"Resuming {name} from the checkpoint")
+        return checkpoint.load(name)
+    result = compute()
+    if checkpoint:
+        checkpoint.save(name, result)
+    return result
+
+
+def run(
+    source,
+    target,
+    file_name,
+    debug,
+    short,
+    collector: StatsCollector,
+    partial: Dict = None,
+    comparator: Optional[Comparator] = None,
+):
+    if partial is None:
+        partial = {}
+    if comparator is None:
+        comparator = Comparator(
+            max_age=0, difference=functools.partial(get_set_diff, debug=debug)
+        )
+    click.echo(
+        f"Begin retrieving update sets from source: {source} and target: {target}"
+    )
+
+    if options.get("prewarm"):
+        with stage(collector, "prewarm"):
+            for instance, error in comparator.prewarm([source, target]).items():
+                if error:
+                    click.echo(f"Could not prewarm {instance}: {error}")
+
+    since = options.get("since")
+    # a --since run, even one without a window yet
+    if options.get("watermarks"):
+        # taken before the fetch, whatever is updated after it is in the
+        # next run's window
+        with stage(collector, "watermark"):
+            partial["watermark"] = resumable(
+                "watermark", lambda: comparator.watermark(source)
+            )
+
+    with stage(collector, "source fetch"):
+        click.echo("Begin get source sets")
+        if since:
+            click.echo(f"Only the sets updated since {since}")
+        source_sets = resumable(
+            "source_sets", lambda: comparator.names(source, since=since)
+        )
+        click.echo(f"Retrieved Source sets: {len(source_sets)}")
+        if debug:
+            click.echo("Retrieved update sets\n" + "\n".join(source_sets))
+
+    with stage(collector, "target fetch"):
+        click.echo("\nBegin get Target sets")
+        # in a window the target's whole inventory isn't needed, only which
+        # of the source sets it has
+        target_sets = resumable(
+            "target_sets",
+            lambda: comparator.target_names(target, source_sets, since=since),
+        )
+        click.echo(f"Retrieved Target sets: {len(target_sets)}")
+        if debug:
+            click.echo("Retrieved update sets\n" + "\n".join(target_sets))
+
+    with stage(collector, "diff"):
+        click.echo("\nCompute set difference")
+        if options.get("content_diff") and source_sets:
+            set_diff = resumable(
+                "diff",
+                lambda: get_content_diff(
+                    comparator, source, target, source_sets, target_sets
+                ),
+            )
+        else:
+            set_diff = resumable(
+                "diff", lambda: comparator.missing(source_sets, target_sets)
+            )
+        if debug:
+            click.echo("Set difference: " + "\n".join(set_diff))
+
+    with stage(collector, "install order"):
+        click.echo(f"\nGet install order for {len(set_diff)} update sets")
+        # filled as the fallback lookups complete, until the whole stage does
+        partial["ordered_sets"] = options["partial_rows"] = []
+        ordered_sets = resumable(
+            "install_order", lambda: comparator.committed_order(source, set_diff)
+        )
+        partial["ordered_sets"] = list(ordered_sets)
+
+    with stage(collector, "new sets"):
+        # the sets that weren't found committed on the source
+        new_sets = comparator.uncommitted(set_diff, ordered_sets)
+        if new_sets:
+            click.echo("Getting newly created update sets")
+            partial["new_sets"] = options["partial_rows"] = []
+            partial["new_sets"] = resumable(
+                "new_sets", lambda: comparator.new_sets(source, new_sets)
+            )
+            ordered_sets += partial["new_sets"]
+        options.pop("partial_rows", None)
+
+    if options.get("waves") and ordered_sets:
+        with stage(collector, "waves"):
+            names = [record.get("name") for record in ordered_sets]
+
+            def compute_waves() -> List[List[str]]:
+                wave_plan = comparator.waves(source, names)
+                click.echo(format_waves(wave_plan))
+                return wave_plan.waves
+
+            ordered_sets = assign_waves(ordered_sets, resumable("waves", compute_waves))
+
+    if options.get("predict_collisions") and ordered_sets:
+        with stage(collector, "collisions"):
+            names = [record.get("name") for record in ordered_sets]
+
+            def compute_collisions() -> Dict[str, int]:
+                report = comparator.collisions(source, target, names)
+                click.echo(format_collisions(report))
+                return report.counts()
+
+            counts = resumable("collisions", compute_collisions)
+            ordered_sets = annotate_collisions(ordered_sets, counts)
+
+    with stage(collector, "export"):
+        click.echo("Output to excel")
+        if not ordered_sets:
+            # the target is up to date, which is no failed export
+            window = f"updated since {since} " if since else ""
+            click.echo(f"No sets {window}are missing from {target}")
+            save_watermark(source, target, partial)
+            exit(0)
+        if short:
+            click.echo("Short circuiting")
+            save_watermark(source, target, partial)
+            exit(0)
+        if to_excel(ordered_sets, file_name):
+            click.echo("Success!")
+            save_watermark(source, target, partial)
+            exit(0)
+        else:
+            click.echo("There was an error writing the spreadsheet")
+            exit(-1)
+
+
+def partial_install_order(partial: Dict) -> List[Dict]:
+    """
+    The install order a stopped run had worked out: the committed sets by
+    commit date, then the new sets by update date, as far as either was
+    fetched
+    """
+    committed = first_per_name([partial.get("ordered_sets")])
+    new = first_per_name([partial.get("new_sets")])
+    committed.sort(key=lambda record: record.get("commit_date") or "")
+    new.sort(key=lambda record: record.get("sys_updated_on") or "")
+    return committed + new
+
+
+def get_content_diff(
+    comparator: Comparator,
+    source: str,
+    target: str,
+    source_sets: List[str],
+    target_sets: List[str],
+) -> List[str]:
+    """
+    The source sets with updates the target doesn't have, by payload
+
+    Parameters:
+    comparator: Comparator - compares the sets
+    source: str - the instance the sets come from
+    target: str - the instance to compare to
+    source_sets: List[str] - every set of the source
+    target_sets: List[str] - every set of the target, to report where the
+        content and name diffs disagree
+
+    returns: List[str] - the sets missing on the target, in source order
+    """
+    diff = comparator.content_diff(source, target, source_sets)
+    name_diff = comparator.missing(source_sets, target_sets)
+    click.echo(format_content_diff(diff, name_diff))
+    return diff.missing_sets()
+
+
+def get_set_diff(
+    left: Iterable[str],
+    right: Iterable[str],
+    debug: bool = False,
+    stable: Optional[bool] = None,
+) -> List[str]:
     """
     Finds all of the elements in the left input that are not present in the right
     returns the difference list. i.e. given two sets A and B, it returns the set A - B
 
     Parameters:
-    left: List[str] - source list of elements
-    right: List[str] - list of elements to compare source against
+    left: Iterable[str] - source list (or iterator) of elements
+    right: Iterable[str] - list of elements to compare source against
+    stable: bool - keep the order of left, defaults to the --stable-order option
 
     returns: List[str] - left - right
     """
-    if not left or not isinstance(left, list):
-        raise ValueError("Left must be a list")
-    if not right or not isinstance(right, list):
-        raise ValueError("Right must be a list")
-    for item in left:
-        if not item or not isinstance(item, str):
-            raise ValueError("The lists must be composed of strings")
-    for item in right:
-        if not item or not isinstance(item, str):
-            raise ValueError("The lists must be composed of strings")
-
+    if stable is None:
+        stable = bool(options.get("stable_order"))
     if debug:
-        click.echo("Left:\n" + "\n".join(set(left)))
-        click.echo("\n\nRight:\n" + "\n".join(set(right)))
-
-    # since we don't care about ordering here, this is orders of magnitude faster
-    # than a list comprehension
-    return list(set(left) - set(right))
+        left, right = list(left), list(right)
+    result = difference(left, right, stable=stable)
+    if debug:
+        click.echo("Left:\n" + "\n".join(dict.fromkeys(left)))
+        click.echo("\n\nRight:\n" + "\n".join(dict.fromkeys(right)))
+    return result
 
 
 def to_excel(update_sets: List[Dict[str, str]], file: str) -> bool:
@@ -133,26 +1122,12 @@ def to_excel(update_sets: List[Dict[str, str]], file: str) -> bool:
     if not update_sets or not isinstance(update_sets, list) or len(update_sets) == 0:
         print("update set list was empty, exiting")
         return False
-    headers = [key for key in update_sets[0].keys()]
-    click.echo(f"headers: {headers}")
+    packed = pack(update_sets)
+    click.echo(f"headers: {list(packed[0])}")
     if not file:
         file = "output"
-    with xlsxwriter.Workbook(f"{file}.xlsx") as workbook:
-        # add worksheet
-        worksheet = workbook.add_worksheet()
-
-        # write headers
-        for idx, header in enumerate(headers):
-            worksheet.write(0, idx, header)
-
-        # write data
-        for idx, update_set in enumerate(update_sets, start=1):
-            for kdix, (k, v) in enumerate(update_set.items()):
-                if isinstance(v, dict):
-                    v = v.get("display_value")
-                worksheet.write(idx, headers.index(k), v)
-
-        return True
+    write_xlsx(f"{file}.xlsx", packed)
+    return True
 
 
 if __name__ == "__main__":
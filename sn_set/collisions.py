@@ -0,0 +1,190 @@
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Mapping, Tuple
+
+from .requests_lib import instance_url, is_invalid_instance
+from .waves import UPDATE_XML_FIELDS, stream_rows, update_xml_params
+
+# records listed per set by format_collisions
+SHOWN_PER_SET = 5
+
+
+@dataclass
+class Collision:
+    """
+    A record a set updates that was updated on the target after the set's
+    update was made, which the target's preview is likely to flag
+    """
+
+    record: str
+    source_updated_on: str
+    target_updated_on: str
+    target_update_set: str
+
+
+class CollisionReport:
+    """
+    The likely collisions of each set, keyed by set name then record
+
+    source_updates: int - sys_update_xml rows read from the source
+    target_updates: int - rows read from the target for the same records
+    records: int - distinct records the sets update
+    """
+
+    def __init__(
+        self,
+        collisions: Dict[str, Dict[str, Collision]],
+        source_updates: int,
+        target_updates: int,
+        records: int,
+    ):
+        self.collisions = collisions
+        self.source_updates = source_updates
+        self.target_updates = target_updates
+        self.records = records
+
+    def counts(self) -> Dict[str, int]:
+        return {name: len(found) for name, found in self.collisions.items()}
+
+
+def record_updates_params(clause: str) -> Dict[str, str]:
+    """
+    The Table API params the updates of some records are queried with
+
+    Parameters:
+    clause: str - selects the records, i.e. "nameINa,b" or "name=a"
+    """
+    return {
+        "sysparm_query": clause,
+        "sysparm_fields": ",".join(UPDATE_XML_FIELDS),
+    }
+
+
+def index_updates(rows: Iterable[Mapping]) -> Tuple[Dict[str, Tuple], int]:
+    """
+    Indexes source updates by the record they update
+
+    returns: Tuple - record -> ((sys_updated_on, set name), ...) with the
+        latest update of each set, and the number of rows read
+    """
+    index: Dict[str, Tuple] = {}
+    count = 0
+    for row in rows:
+        count += 1
+        record, set_name = row.get("name"), row.get("update_set.name")
+        if not record or not set_name:
+            continue
+        updated_on = row.get("sys_updated_on") or ""
+        updates = index.get(record, ())
+        for idx, (earlier, name) in enumerate(updates):
+            if name == set_name:
+                if updated_on > earlier:
+                    updates = updates[:idx] + ((updated_on, name),) + updates[idx + 1 :]
+                break
+        else:
+            updates += ((updated_on, set_name),)
+        index[record] = updates
+    return index, count
+
+
+def join_updates(
+    index: Dict[str, Tuple], target_rows: Iterable[Mapping]
+) -> Tuple[Dict[str, Dict[str, Collision]], int]:
+    """
+    Streams the target's updates of the indexed records past the index. An
+    update made on the target after a set's update of the same record, in
+    another set, is a likely collision for that set
+
+    returns: Tuple - set -> record -> the latest colliding target update,
+        and the number of target rows read
+    """
+    collisions: Dict[str, Dict[str, Collision]] = {}
+    count = 0
+    for row in target_rows:
+        count += 1
+        target_updated_on = row.get("sys_updated_on") or ""
+        target_set = row.get("update_set.name") or ""
+        record = row.get("name")
+        for updated_on, set_name in index.get(record, ()):
+            if target_updated_on <= updated_on or target_set == set_name:
+                continue
+            found = collisions.setdefault(set_name, {})
+            known = found.get(record)
+            if known is None or target_updated_on > known.target_updated_on:
+                found[record] = Collision(
+                    record, updated_on, target_updated_on, target_set
+                )
+    return collisions, count
+
+
+def predict_collisions(
+    source: str, target: str, set_names: List[str]
+) -> CollisionReport:
+    """
+    Predicts which sets will collide when previewed on the target, without
+    previewing them. The updates of the sets are read from the source and
+    indexed by record, then the target's updates of those records are
+    streamed past the index, so only the index is held in memory
+
+    Parameters:
+    source: str - the instance the sets come from
+    target: str - the instance they will be previewed on
+    set_names: List[str] - the sets to check
+
+    returns: CollisionReport - the likely collisions of each set
+    """
+    if is_invalid_instance(source) or is_invalid_instance(target):
+        raise ValueError("Please enter a valid instance name.")
+    for name in set_names:
+        if not name or not isinstance(name, str):
+            raise ValueError("IDs cannot be null or empty")
+
+    source_url = instance_url(source)
+    index, source_updates = index_updates(
+        stream_rows(
+            f"{source_url}/api/now/table/sys_update_xml",
+            set_names,
+            update_xml_params,
+            source_url,
+        )
+    )
+    target_url = instance_url(target)
+    collisions, target_updates = join_updates(
+        index,
+        stream_rows(
+            f"{target_url}/api/now/table/sys_update_xml",
+            list(index),
+            record_updates_params,
+            target_url,
+        ),
+    )
+    return CollisionReport(collisions, source_updates, target_updates, len(index))
+
+
+def annotate_collisions(rows: List[Mapping], counts: Dict[str, int]) -> List[Dict]:
+    """
+    Adds a "predicted_collisions" column to install order rows
+    """
+    return [
+        {**row, "predicted_collisions": counts.get(row.get("name"), 0)} for row in rows
+    ]
+
+
+def format_collisions(report: CollisionReport) -> str:
+    counts = report.counts()
+    lines = [
+        f"{report.source_updates} source updates to {report.records} records, "
+        f"{report.target_updates} target updates of them: "
+        f"{len(counts)} sets likely to collide"
+    ]
+    for name, count in sorted(counts.items(), key=lambda item: -item[1]):
+        lines.append(f"{count:>6}  {name}")
+        found = sorted(report.collisions[name].values(), key=lambda c: c.record)
+        for collision in found[:SHOWN_PER_SET]:
+            lines.append(
+                f"        {collision.record} updated {collision.target_updated_on} "
+                f"in {collision.target_update_set or 'default'}, "
+                f"after {collision.source_updated_on}"
+            )
+        if count > SHOWN_PER_SET:
+            lines.append(f"        (+{count - SHOWN_PER_SET})")
+    return "\n".join(lines)
@@ -0,0 +1,343 @@
+import functools
+import inspect
+import threading
+import time
+from collections import ChainMap
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .collisions import CollisionReport, predict_collisions
+from .content_diff import DEFAULT_BUFFER_ROWS, PAYLOAD_FIELD, ContentDiff, content_diff
+from .diff import difference
+from .requests_lib import (
+    context,
+    get_existing_sets,
+    get_install_order,
+    get_install_order_new,
+    get_latest_update,
+    get_update_sets,
+    options,
+    prewarm,
+)
+from .waves import WavePlan, fetch_updates, plan_waves
+
+# seconds an inventory is reused for before it is fetched again
+DEFAULT_MAX_AGE = 300.0
+# a library caller compares repeatedly, so connections are kept open
+DEFAULT_SETTINGS = {"keep_alive": True}
+
+
+def scoped(method: Callable) -> Callable:
+    """
+    Runs a Comparator method within its settings and clients, see
+    Comparator.scope. A generator method runs within them each time it is
+    resumed, so it can be consumed a step at a time
+    """
+    if inspect.isgeneratorfunction(method):
+
+        @functools.wraps(method)
+        def steps(self, *args, **kwargs):
+            results = method(self, *args, **kwargs)
+            while True:
+                with self.scope():
+                    try:
+                        result = next(results)
+                    except StopIteration:
+                        return
+                yield result
+
+        return steps
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.scope():
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+class Comparator:
+    """
+    Compares the update sets of instances from a long lived process. The
+    inventories and install orders fetched are kept for max_age seconds, so
+    repeated comparisons reuse them and the connections of earlier ones.
+    Results are generators; nothing is printed and nothing exits the process
+
+    The settings are run options of requests_lib (transport, cache,
+    resilience...) that apply to this comparator's requests only, over the
+    process wide options. The clients it builds are its own as well, so
+    comparators with different settings don't share connections
+
+    Parameters:
+    settings: Dict - run options, applied over DEFAULT_SETTINGS
+    max_age: float - seconds results are reused for, 0 until refresh()
+    difference: Callable - left - right of two non-empty lists of names,
+        a stable diff.difference by default
+    """
+
+    def __init__(
+        self,
+        settings: Optional[Dict] = None,
+        max_age: float = DEFAULT_MAX_AGE,
+        clock: Callable[[], float] = time.monotonic,
+        difference: Optional[Callable[[List[str], List[str]], List[str]]] = None,
+    ):
+        self.settings = {**DEFAULT_SETTINGS, **(settings or {})}
+        # base_url -> the client config of each instance, see client_factory
+        self.clients: Dict[str, Dict] = {}
+        self.max_age = max_age
+        self.clock = clock
+        self.difference = difference or stable_difference
+        # (kind, instance, set names) -> (fetched at, records)
+        self._held: Dict[Tuple, Tuple[float, List[Dict]]] = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> "Comparator":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    @contextmanager
+    def scope(self) -> Iterator[None]:
+        """
+        The requests made within the block use this comparator's settings
+        and clients
+        """
+        with options.scope(ChainMap(self.settings, options.default)):
+            with context.scope(self.clients):
+                yield
+
+    @scoped
+    def prewarm(self, instances: List[str]) -> Dict[str, Optional[str]]:
+        """
+        Connects and authenticates to the instances in parallel, see
+        requests_lib.prewarm
+
+        returns: Dict[str, Optional[str]] - the error of each instance, if any
+        """
+        return prewarm(instances)
+
+    @scoped
+    def inventory(
+        self, instance: str, refresh: bool = False, since: Optional[str] = None
+    ) -> Iterator[Dict]:
+        """
+        The complete update sets of an instance, fetched when they are not
+        held or older than max_age
+
+        Parameters:
+        instance: str - the SN Instance Host
+        refresh: bool - fetch them again regardless
+        since: str - only the sets updated at or after this timestamp
+        """
+        args = (instance, since) if since else (instance,)
+        yield from self._fetch(
+            ("inventory", instance, (since,)), lambda: get_update_sets(*args), refresh
+        )
+
+    @scoped
+    def names(self, instance: str, since: Optional[str] = None) -> List[str]:
+        """
+        The names of the complete update sets of an instance
+        """
+        return [record.get("name") for record in self.inventory(instance, since=since)]
+
+    @scoped
+    def existing(self, instance: str, names: Iterable[str]) -> List[str]:
+        """
+        The names among names of the sets complete on an instance, looked up
+        rather than read from its whole inventory
+        """
+        names = list(dict.fromkeys(names))
+        records = self._fetch(
+            ("existing", instance, tuple(names)),
+            lambda: get_existing_sets(instance, names),
+        )
+        return [record.get("name") for record in records]
+
+    @scoped
+    def watermark(self, instance: str) -> Optional[str]:
+        """
+        The latest sys_updated_on of the complete sets of an instance,
+        always asked for rather than held
+        """
+        return get_latest_update(instance)
+
+    @scoped
+    def target_names(
+        self, target: str, source_names: List[str], since: Optional[str] = None
+    ) -> List[str]:
+        """
+        The names the target has to compare the source names against: its
+        whole inventory, or in a --since window only which of the source
+        names it has
+        """
+        if since:
+            return self.existing(target, source_names)
+        return self.names(target)
+
+    def missing(self, source_names: List[str], target_names: List[str]) -> List[str]:
+        """
+        The source names the target names don't include, either side may
+        be empty
+        """
+        if not source_names:
+            return []
+        if not target_names:
+            return list(dict.fromkeys(source_names))
+        return self.difference(source_names, target_names)
+
+    @scoped
+    def diff(
+        self, source: str, target: str, since: Optional[str] = None
+    ) -> Iterator[str]:
+        """
+        The names of the source's sets that the target doesn't have, in
+        source order
+
+        Parameters:
+        since: str - only compare the source sets updated at or after this
+            timestamp, which are then looked up on the target
+        """
+        source_names = self.names(source, since=since)
+        if source_names:
+            target_names = self.target_names(target, source_names, since=since)
+            yield from self.missing(source_names, target_names)
+
+    @scoped
+    def content_diff(
+        self, source: str, target: str, source_sets: Optional[List[str]] = None
+    ) -> ContentDiff:
+        """
+        Compares the sets by the payloads of their updates, see
+        content_diff.content_diff. The field and buffer come from the
+        content_field and content_buffer settings
+
+        Parameters:
+        source_sets: List[str] - the source sets to compare, all by default
+        """
+        return content_diff(
+            source,
+            target,
+            self.names(source) if source_sets is None else source_sets,
+            field=options.get("content_field") or PAYLOAD_FIELD,
+            buffer_rows=options.get("content_buffer") or DEFAULT_BUFFER_ROWS,
+        )
+
+    @scoped
+    def waves(self, source: str, names: List[str]) -> WavePlan:
+        """
+        Groups the sets into install waves by the records their updates
+        touch, see waves.plan_waves
+
+        Parameters:
+        names: List[str] - the sets in install order
+        """
+        return plan_waves(names, fetch_updates(source, names))
+
+    @scoped
+    def collisions(self, source: str, target: str, names: List[str]) -> CollisionReport:
+        """
+        The updates of the sets that would overwrite a newer version of their
+        record on the target, see collisions.predict_collisions
+        """
+        return predict_collisions(source, target, names)
+
+    @scoped
+    def committed_order(self, source: str, names: Iterable[str]) -> List[Dict]:
+        """
+        The committed sets among names, in the order they were committed on
+        the source
+        """
+        names = list(names)
+        if not names:
+            return []
+        return self._fetch(
+            ("order", source, tuple(names)), lambda: get_install_order(source, names)
+        )
+
+    @scoped
+    def new_sets(self, source: str, names: List[str]) -> List[Dict]:
+        """
+        The sets among names that haven't been committed, by creation date
+        """
+        if not names:
+            return []
+        return self._fetch(
+            ("new", source, tuple(names)), lambda: get_install_order_new(source, names)
+        )
+
+    @scoped
+    def install_order(self, source: str, names: Iterable[str]) -> Iterator[Dict]:
+        """
+        The sets among names in the order they must be installed: the
+        committed ones by commit date, then the rest by creation date. The
+        uncommitted sets are only looked up once the committed ones have
+        been consumed
+        """
+        names = list(names)
+        committed = []
+        for record in self.committed_order(source, names):
+            committed.append(record)
+            yield record
+        yield from self.new_sets(source, self.uncommitted(names, committed))
+
+    def uncommitted(self, names: List[str], committed: List[Dict]) -> List[str]:
+        """
+        The names among names that committed_order didn't find
+        """
+        return self.missing(names, [record.get("name") for record in committed])
+
+    @scoped
+    def compare(
+        self, source: str, target: str, since: Optional[str] = None
+    ) -> Iterator[Dict]:
+        """
+        The install order of the sets the target is missing
+        """
+        yield from self.install_order(source, self.diff(source, target, since))
+
+    def refresh(self, instance: Optional[str] = None) -> None:
+        """
+        Forgets the inventories and install orders held for an instance, or
+        for every instance
+        """
+        with self._lock:
+            self._held = {
+                key: held
+                for key, held in self._held.items()
+                if instance is not None and key[1] != instance
+            }
+
+    def close(self) -> None:
+        """
+        Forgets what is held and closes the clients this comparator built
+        """
+        self.refresh()
+        with self._lock:
+            clients = list(self.clients.values())
+            self.clients.clear()
+        for config in clients:
+            client = config.get("client")
+            if client is not None and hasattr(client, "close"):
+                client.close()
+
+    def _fetch(
+        self, key: Tuple, fetch: Callable[[], List[Dict]], refresh: bool = False
+    ) -> List[Dict]:
+        # a copy, so callers can't change what is held
+        with self._lock:
+            held = self._held.get(key)
+        if refresh or held is None or self._expired(held[0]):
+            held = (self.clock(), fetch())
+            with self._lock:
+                self._held[key] = held
+        return list(held[1])
+
+    def _expired(self, fetched_at: float) -> bool:
+        return bool(self.max_age) and self.clock() - fetched_at >= self.max_age
+
+
+def stable_difference(left: List[str], right: List[str]) -> List[str]:
+    return difference(left, right, stable=True)
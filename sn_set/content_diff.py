@@ -0,0 +1,251 @@
+import hashlib
+import heapq
+import os
+import pickle
+import tempfile
+from itertools import groupby, islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .requests_lib import instance_url, is_invalid_instance
+from .waves import stream_rows
+
+# the field fingerprinted by default, the update's xml. An instance that
+# stores a hash of it can be pointed at that field instead
+PAYLOAD_FIELD = "payload"
+# rows sorted in memory before a run is spilled to disk
+DEFAULT_BUFFER_ROWS = 200000
+# rows per block of a run file, a block is read at a time when merging
+RUN_BLOCK_ROWS = 1024
+# payloads are large, so pages are smaller than PAGE_SIZE
+CONTENT_PAGE_SIZE = 1000
+# record names looked up on the target per round of nameIN queries
+LOOKUP_GROUP = 50000
+
+
+def fingerprint(value) -> str:
+    """
+    A short digest of an update's payload
+    """
+    if isinstance(value, dict):
+        value = value.get("value")
+    return hashlib.blake2b((value or "").encode(), digest_size=16).hexdigest()
+
+
+class ExternalSorter:
+    """
+    Sorts more rows than fit in memory: rows are buffered, sorted and spilled
+    to a run file every buffer_rows rows, then the runs are merged
+
+    Parameters:
+    directory: str - where the run files are written
+    buffer_rows: int - the most rows held in memory
+    """
+
+    def __init__(self, directory: str, buffer_rows: int = DEFAULT_BUFFER_ROWS):
+        self.directory = directory
+        self.buffer_rows = buffer_rows
+        self.buffer: List[Tuple] = []
+        self.runs: List[str] = []
+        self.count = 0
+
+    def add(self, row: Tuple) -> None:
+        self.buffer.append(row)
+        self.count += 1
+        if len(self.buffer) >= self.buffer_rows:
+            self._spill()
+
+    def _spill(self) -> None:
+        self.buffer.sort()
+        fd, path = tempfile.mkstemp(dir=self.directory, prefix="run-", suffix=".bin")
+        with os.fdopen(fd, "wb") as f:
+            for start in range(0, len(self.buffer), RUN_BLOCK_ROWS):
+                pickle.dump(self.buffer[start : start + RUN_BLOCK_ROWS], f)
+        self.runs.append(path)
+        self.buffer = []
+
+    def _read(self, path: str) -> Iterator[Tuple]:
+        with open(path, "rb") as f:
+            while True:
+                try:
+                    yield from pickle.load(f)
+                except EOFError:
+                    return
+
+    def sorted(self) -> Iterator[Tuple]:
+        """
+        The rows in order, can be called again to read them again
+        """
+        if not self.runs:
+            self.buffer.sort()
+            return iter(list(self.buffer))
+        if self.buffer:
+            self._spill()
+        return heapq.merge(*(self._read(path) for path in self.runs))
+
+
+class ContentDiff:
+    """
+    Which source sets are missing on the target by content
+
+    sets: Dict[str, Tuple[int, int]] - set name -> (records, records whose
+        payload the target has no update with), in source order
+    source_updates: int - sys_update_xml rows read from the source
+    target_updates: int - rows read from the target for the same records
+    """
+
+    def __init__(
+        self,
+        sets: Dict[str, Tuple[int, int]],
+        source_updates: int,
+        target_updates: int,
+    ):
+        self.sets = sets
+        self.source_updates = source_updates
+        self.target_updates = target_updates
+
+    def missing_sets(self) -> List[str]:
+        """
+        The sets with at least one record not on the target
+        """
+        return [name for name, (_, missing) in self.sets.items() if missing]
+
+    def present_sets(self) -> List[str]:
+        """
+        The sets with every record already on the target
+        """
+        return [name for name, (_, missing) in self.sets.items() if not missing]
+
+
+def content_params(clause: str, field: str) -> Dict[str, str]:
+    return {"sysparm_query": clause, "sysparm_fields": f"name,{field}"}
+
+
+def _rows(
+    instance: str,
+    names: List[str],
+    clause_prefix: str,
+    field: str,
+    extra_fields: str = "",
+) -> Iterator[Dict]:
+    base_url = instance_url(instance)
+
+    def build_params(clause: str) -> Dict[str, str]:
+        params = content_params(f"{clause_prefix}{clause}", field)
+        if extra_fields:
+            params["sysparm_fields"] += f",{extra_fields}"
+        return params
+
+    return stream_rows(
+        f"{base_url}/api/now/table/sys_update_xml",
+        names,
+        build_params,
+        base_url,
+        page_size=CONTENT_PAGE_SIZE,
+    )
+
+
+def distinct_records(rows: Iterable[Tuple]) -> Iterator[str]:
+    return (record for record, _ in groupby(row[0] for row in rows))
+
+
+def merge_join(
+    source: Iterable[Tuple], target: Iterable[Tuple]
+) -> Dict[str, Tuple[int, int]]:
+    """
+    Walks the sorted (record, fingerprint, set) source rows alongside the
+    sorted (record, fingerprint) target rows, counting the records of each
+    set and those the target has no update with the same payload for
+    """
+    tally: Dict[str, List[int]] = {}
+    target = iter(target)
+    current: Optional[Tuple] = next(target, None)
+    for record, digest, set_name in source:
+        key = (record, digest)
+        while current is not None and current < key:
+            current = next(target, None)
+        counts = tally.setdefault(set_name, [0, 0])
+        counts[0] += 1
+        if current != key:
+            counts[1] += 1
+    return {name: (records, missing) for name, (records, missing) in tally.items()}
+
+
+def content_diff(
+    source: str,
+    target: str,
+    set_names: List[str],
+    field: str = PAYLOAD_FIELD,
+    buffer_rows: int = DEFAULT_BUFFER_ROWS,
+    directory: Optional[str] = None,
+) -> ContentDiff:
+    """
+    Compares update sets by what they change rather than by name. The
+    source updates of the sets are fingerprinted and externally sorted by
+    record, the target's updates of the same records likewise, and the two
+    sorted streams are merge joined, so memory is bounded by buffer_rows
+    whatever the number of updates
+
+    Parameters:
+    source: str - the instance the sets come from
+    target: str - the instance to compare to
+    set_names: List[str] - the source sets to compare
+    field: str - the sys_update_xml field to fingerprint
+    buffer_rows: int - rows sorted in memory before spilling to disk
+    directory: str - where to spill, a temporary directory by default
+
+    returns: ContentDiff - per set, how many of its records the target lacks
+    """
+    if is_invalid_instance(source) or is_invalid_instance(target):
+        raise ValueError("Please enter a valid instance name.")
+    for name in set_names:
+        if not name or not isinstance(name, str):
+            raise ValueError("IDs cannot be null or empty")
+
+    with tempfile.TemporaryDirectory(dir=directory, prefix="snset-content-") as tmp:
+        source_rows = ExternalSorter(tmp, buffer_rows)
+        for row in _rows(
+            source, set_names, "update_set.", field, extra_fields="update_set.name"
+        ):
+            if row.get("name") and row.get("update_set.name"):
+                source_rows.add(
+                    (row["name"], fingerprint(row.get(field)), row["update_set.name"])
+                )
+
+        target_rows = ExternalSorter(tmp, buffer_rows)
+        records = distinct_records(source_rows.sorted())
+        while group := list(islice(records, LOOKUP_GROUP)):
+            for row in _rows(target, group, "", field):
+                if row.get("name"):
+                    target_rows.add((row["name"], fingerprint(row.get(field))))
+
+        tally = merge_join(source_rows.sorted(), target_rows.sorted())
+        # a set without updates has nothing the target lacks
+        sets = {name: tally.get(name, (0, 0)) for name in dict.fromkeys(set_names)}
+        return ContentDiff(sets, source_rows.count, target_rows.count)
+
+
+def format_content_diff(diff: ContentDiff, name_diff: Iterable[str] = ()) -> str:
+    """
+    Summarises a content diff, and where it disagrees with the name diff
+    """
+    missing = diff.missing_sets()
+    lines = [
+        f"{diff.source_updates} source updates, {diff.target_updates} target "
+        f"updates of the same records: {len(missing)} of {len(diff.sets)} sets "
+        "have changes the target doesn't"
+    ]
+    name_diff = set(name_diff)
+    if name_diff:
+        renamed = [name for name in diff.present_sets() if name in name_diff]
+        changed = [name for name in missing if name not in name_diff]
+        if renamed:
+            lines.append(
+                f"{len(renamed)} sets missing by name are already on the target: "
+                + ", ".join(renamed)
+            )
+        if changed:
+            lines.append(
+                f"{len(changed)} sets on the target by name have changed: "
+                + ", ".join(changed)
+            )
+    return "\n".join(lines)
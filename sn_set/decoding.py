@@ -0,0 +1,149 @@
+import json
+from typing import Any, Dict, Optional, Sequence, Tuple, Union
+
+from .records import UpdateSetRecord, compact_values, schema_for, to_records
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - exercised when the extra isn't installed
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:  # pragma: no cover - exercised when the extra isn't installed
+    msgspec = None
+
+DECODERS = ["auto", "msgspec", "orjson", "json"]
+
+
+class JsonDecoder:
+    """
+    Decodes Table API responses with the standard library, straight into
+    UpdateSetRecords
+    """
+
+    name = "json"
+
+    def decode_result(
+        self, content: bytes, fields: Optional[Sequence[str]] = None
+    ) -> Any:
+        """
+        Decodes a response body and returns its "result"
+
+        Parameters:
+        content: bytes - the response body
+        fields: Sequence[str] - the sysparm_fields of the query, if any
+        """
+        return json.loads(content, object_pairs_hook=UpdateSetRecord.from_pairs).get(
+            "result"
+        )
+
+
+class OrjsonDecoder(JsonDecoder):
+    """
+    Decodes with orjson, then compacts the rows into UpdateSetRecords
+    """
+
+    name = "orjson"
+
+    def decode_result(
+        self, content: bytes, fields: Optional[Sequence[str]] = None
+    ) -> Any:
+        return to_records(orjson.loads(content).get("result"))
+
+
+class MsgspecDecoder(JsonDecoder):
+    """
+    Decodes with msgspec. Queries that name their fields are decoded into a
+    typed struct for those fields, which is then turned into a record
+    without building a dict first. Like the Table API, it only keeps the
+    fields the query asked for
+    """
+
+    name = "msgspec"
+
+    def __init__(self):
+        self._generic = msgspec.json.Decoder()
+        self._typed: Dict[Tuple[str, ...], Any] = {}
+
+    def _decoder(self, fields: Tuple[str, ...]):
+        if fields not in self._typed:
+            # fields missing from a row stay UNSET and are left out of its record
+            value_type = Union[str, Dict[str, Any], None, msgspec.UnsetType]
+            # dot walked fields (update_set.name) aren't identifiers, the
+            # struct attributes are renamed to them instead
+            names = [f"f{idx}" for idx in range(len(fields))]
+            row = msgspec.defstruct(
+                "Row",
+                [(name, value_type, msgspec.UNSET) for name in names],
+                rename=dict(zip(names, fields)),
+            )
+            envelope = msgspec.defstruct("Envelope", [("result", list[row])])
+            self._typed[fields] = msgspec.json.Decoder(envelope)
+        return self._typed[fields]
+
+    def decode_result(
+        self, content: bytes, fields: Optional[Sequence[str]] = None
+    ) -> Any:
+        if not fields:
+            result = self._generic.decode(content)
+            return to_records(
+                result.get("result") if isinstance(result, dict) else None
+            )
+        fields = tuple(fields)
+        try:
+            rows = self._decoder(fields).decode(content).result
+        except msgspec.ValidationError:
+            # not a list of rows, i.e. an error or aggregate response
+            return self.decode_result(content)
+        schema = schema_for(fields)
+        records = []
+        for row in rows:
+            values = msgspec.structs.astuple(row)
+            if msgspec.UNSET in values:
+                records.append(
+                    UpdateSetRecord.from_pairs(
+                        [
+                            pair
+                            for pair in zip(fields, values)
+                            if pair[1] is not msgspec.UNSET
+                        ]
+                    )
+                )
+            else:
+                records.append(UpdateSetRecord(schema, compact_values(schema, values)))
+        return records
+
+
+_decoders: Dict[str, JsonDecoder] = {}
+
+
+def get_decoder(name: str = "auto") -> JsonDecoder:
+    """
+    The decoder for a name in DECODERS. "auto" picks the fastest installed
+    one, msgspec, then orjson, then the standard library
+
+    raises: ImportError when the named decoder isn't installed
+    """
+    if name == "auto":
+        name = "msgspec" if msgspec else "orjson" if orjson else "json"
+    if name not in _decoders:
+        if name == "msgspec":
+            if msgspec is None:
+                raise ImportError(
+                    "msgspec is not installed, "
+                    "install it with: pip install snset[msgspec]"
+                )
+            _decoders[name] = MsgspecDecoder()
+        elif name == "orjson":
+            if orjson is None:
+                raise ImportError(
+                    "orjson is not installed, "
+                    "install it with: pip install snset[orjson]"
+                )
+            _decoders[name] = OrjsonDecoder()
+        elif name == "json":
+            _decoders[name] = JsonDecoder()
+        else:
+            raise ValueError(f"Unknown json decoder {name}, use one of {DECODERS}")
+    return _decoders[name]
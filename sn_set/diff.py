@@ -0,0 +1,95 @@
+from collections import deque
+from itertools import chain, filterfalse, islice, repeat
+from operator import length_hint
+from typing import Iterable, Iterator, List, Mapping
+
+# names validated and hashed per step, bounds the memory used for the
+# side that is streamed
+CHUNK_SIZE = 8192
+
+
+def _validate(chunk: List[str]) -> None:
+    # set(map(type, ...)) and the "" scan run in C, the per item check only
+    # runs to find out which item is wrong
+    if "" in chunk or not set(map(type, chunk)) <= {str}:
+        for item in chunk:
+            if not item or not isinstance(item, str):
+                raise ValueError("The lists must be composed of strings")
+
+
+def chunks(names: Iterable[str], label: str) -> Iterator[List[str]]:
+    """
+    Streams validated chunks of names
+
+    Parameters:
+    names: Iterable[str] - a list or iterator of names
+    label: str - what the names are, for error messages, i.e. "Left"
+
+    raises: ValueError if names isn't a non-empty iterable of non-empty strings
+    """
+    if names is None or isinstance(names, (str, bytes, Mapping)):
+        raise ValueError(f"{label} must be a list")
+    try:
+        it = iter(names)
+    except TypeError:
+        raise ValueError(f"{label} must be a list") from None
+    empty = True
+    while True:
+        chunk = list(islice(it, CHUNK_SIZE))
+        if not chunk:
+            break
+        empty = False
+        _validate(chunk)
+        yield chunk
+    if empty:
+        raise ValueError(f"{label} must be a list")
+
+
+def difference(
+    left: Iterable[str], right: Iterable[str], stable: bool = False
+) -> List[str]:
+    """
+    Finds the names in left that are not in right, validating both sides in
+    the same pass that hashes them. Only the smaller side (by len or
+    length_hint, right when unknown) is held as a set, the other is streamed
+
+    Parameters:
+    left: Iterable[str] - source names, a list or an iterator
+    right: Iterable[str] - names to compare the source against
+    stable: bool - return the names in the order they first appear in left,
+        otherwise the order is arbitrary
+
+    returns: List[str] - the unique names of left - right
+
+    raises: ValueError if either side is empty or holds anything but
+        non-empty strings
+    """
+    left_size, right_size = length_hint(left), length_hint(right)
+    if left_size and right_size and left_size < right_size:
+        return _stream_right(left, right, stable)
+    return _stream_left(left, right, stable)
+
+
+def _stream_left(left: Iterable[str], right: Iterable[str], stable: bool) -> List[str]:
+    exclude = set()
+    for chunk in chunks(right, "Right"):
+        exclude.update(chunk)
+    found = {} if stable else set()
+    for chunk in chunks(left, "Left"):
+        new = filterfalse(exclude.__contains__, chunk)
+        found.update(dict.fromkeys(new) if stable else new)
+    return list(found)
+
+
+def _stream_right(left: Iterable[str], right: Iterable[str], stable: bool) -> List[str]:
+    names = chain.from_iterable(chunks(left, "Left"))
+    if not stable:
+        remaining = set(names)
+        for chunk in chunks(right, "Right"):
+            remaining.difference_update(chunk)
+        return list(remaining)
+    # a dict keeps the order of left, popping each right name runs in C
+    ordered = dict.fromkeys(names)
+    for chunk in chunks(right, "Right"):
+        deque(map(ordered.pop, chunk, repeat(None)), maxlen=0)
+    return list(ordered)
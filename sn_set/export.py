@@ -0,0 +1,161 @@
+import csv
+import io
+import json
+from typing import Dict, List, Optional, Set, Tuple
+
+BACKENDS = ["table", "auto", "jsonv2", "csv"]
+
+# rows per export request. The processors silently stop at their row limit
+# (glide.json.return_limit, glide.csv.export.limit), 10000 by default, so
+# exports are read in pages well under it
+EXPORT_PAGE_SIZE = 5000
+
+# fields the Table API returns as a reference object, which the processors
+# flatten to a string. Queries selecting one stay on the Table API
+REFERENCE_FIELDS = {
+    "application",
+    "remote_update_set",
+    "sys_scope",
+    "update_set",
+    "update_source",
+}
+# fields whose display value is their value. CSV only exports display values
+# (choice labels, dates in the user's format), so a query without
+# sysparm_display_value must only select these to be exported as CSV
+TEXT_FIELDS = {"description", "name", "sys_created_by", "sys_id", "sys_updated_by"}
+
+# instances (by base url) where the export processors turned out to be disabled,
+# so "auto" doesn't keep trying them for every query
+unavailable_instances: Set[str] = set()
+
+
+def exportable(params: Dict[str, str], export_format: str) -> bool:
+    """
+    Whether the export processor returns the records of a Table API query
+    in the shape the Table API does. Every field must be named, none may be
+    a reference and CSV needs display values or plain text fields
+    """
+    params = params or {}
+    fields = {f for f in (params.get("sysparm_fields") or "").split(",") if f}
+    if not fields or fields & REFERENCE_FIELDS:
+        return False
+    if export_format == "csv":
+        return params.get("sysparm_display_value") == "true" or fields <= TEXT_FIELDS
+    return True
+
+
+def split_order(query: str) -> Tuple[str, List[Tuple[str, bool]]]:
+    """
+    Takes the ORDERBY terms out of an encoded query, pages are ordered by
+    sys_id instead
+
+    returns: Tuple[str, List] - the query and its (field, descending) orders
+    """
+    terms, orders = [], []
+    for term in filter(None, (query or "").split("^")):
+        if term.startswith("ORDERBYDESC"):
+            orders.append((term[len("ORDERBYDESC") :], True))
+        elif term.startswith("ORDERBY"):
+            orders.append((term[len("ORDERBY") :], False))
+        else:
+            terms.append(term)
+    return "^".join(terms), orders
+
+
+def order_records(records: List[Dict], query: str) -> List[Dict]:
+    """
+    Sorts records by the ORDERBY terms of the query they were exported for
+    """
+    for field, descending in reversed(split_order(query)[1]):
+        records.sort(key=lambda record: record.get(field) or "", reverse=descending)
+    return records
+
+
+def export_request(
+    uri: str,
+    params: Dict[str, str],
+    export_format: str = "jsonv2",
+    page_size: int = EXPORT_PAGE_SIZE,
+    after: Optional[str] = None,
+) -> Tuple[str, Dict[str, str]]:
+    """
+    Translates a Table API request into the equivalent export processor
+    request for one page of its records, i.e.
+    /api/now/table/sys_update_set -> /sys_update_set.do?JSONv2. Pages are
+    keyed on sys_id like requests_lib.iter_pages
+
+    Parameters:
+    uri: str - the Table API uri
+    params: Dict - the Table API path params
+    export_format: str - "jsonv2" or "csv"
+    page_size: int - rows per page
+    after: str - the last sys_id of the previous page
+
+    returns: Tuple[str, Dict] - the processor uri and its params
+    """
+    if export_format not in ("jsonv2", "csv"):
+        raise ValueError(f"Unknown export format: {export_format}")
+    prefix, _, table = uri.rstrip("/").rpartition("/api/now/table/")
+    if not prefix:
+        raise ValueError(f"Not a Table API uri: {uri}")
+    export_uri = f"{prefix}/{table}.do"
+
+    params = params or {}
+    export_params: Dict[str, str] = {}
+    if export_format == "jsonv2":
+        export_params["JSONv2"] = ""
+        if params.get("sysparm_display_value") == "true":
+            export_params["displayvalue"] = "true"
+    else:
+        export_params["CSV"] = ""
+    fields = [f for f in (params.get("sysparm_fields") or "").split(",") if f]
+    if fields:
+        if "sys_id" not in fields:
+            fields.append("sys_id")
+        export_params["sysparm_fields"] = ",".join(fields)
+    elif export_format == "csv":
+        export_params["sysparm_default_export_fields"] = "all"
+    query = split_order(params.get("sysparm_query", ""))[0]
+    terms = [query, f"sys_id>{after}" if after else "", "ORDERBYsys_id"]
+    export_params["sysparm_query"] = "^".join(filter(None, terms))
+    export_params["sysparm_record_count"] = str(page_size)
+    return export_uri, export_params
+
+
+def parse_export(
+    content: bytes, export_format: str, params: Dict[str, str] = None
+) -> List[Dict[str, str]]:
+    """
+    Parses the body of a JSONv2 or CSV export into Table API shaped records,
+    keeping only (and in the order of) the fields the query asked for
+
+    Parameters:
+    content: bytes - the raw response body
+    export_format: str - "jsonv2" or "csv"
+    params: Dict - the Table API path params the export was built from,
+        sys_id is kept as well so the next page can be asked for
+
+    returns: List[Dict[str, str]] - the parsed records
+
+    raises: ValueError if the body isn't a valid export, i.e. the
+    processor is disabled and the instance answered with a login page
+    """
+    if export_format == "jsonv2":
+        try:
+            records = json.loads(content).get("records")
+        except (json.JSONDecodeError, UnicodeDecodeError, AttributeError) as ex:
+            raise ValueError("Response was not a JSONv2 export") from ex
+        if records is None:
+            raise ValueError("Response was not a JSONv2 export")
+    else:
+        text = content.decode("utf-8-sig")
+        if text.lstrip().startswith("<"):
+            raise ValueError("Response was not a CSV export")
+        records = list(csv.DictReader(io.StringIO(text)))
+
+    fields = [f for f in ((params or {}).get("sysparm_fields") or "").split(",") if f]
+    if not fields:
+        return records
+    if "sys_id" not in fields:
+        fields.append("sys_id")
+    return [{field: record.get(field, "") for field in fields} for record in records]
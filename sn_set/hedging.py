@@ -0,0 +1,187 @@
+import contextvars
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+import requests
+
+from .stats import percentile
+
+# latencies kept per instance to work out the hedge delay from
+WINDOW = 500
+
+
+class InstanceHedging:
+    """
+    The observed latencies and hedging counts of a single instance
+    """
+
+    def __init__(self):
+        self.latencies: Deque[float] = deque(maxlen=WINDOW)
+        self.requests = 0
+        self.hedged = 0
+        self.wins = 0
+        self.time_saved = 0.0
+
+
+class HedgingPolicy:
+    """
+    Hedges slow GETs: when a response hasn't arrived within the given
+    percentile of the latencies observed for the instance, the same request
+    is sent again and whichever answers first is used. The hedges sent to an
+    instance are capped at max_ratio of its requests
+
+    Parameters:
+    pct: float - the latency percentile after which a request is hedged
+    max_ratio: float - extra requests allowed per instance, i.e. 0.1 for 10%
+    min_samples: int - latencies to observe before hedging an instance
+    min_delay: float - never hedge sooner than this many seconds
+    """
+
+    def __init__(
+        self,
+        pct: float = 95.0,
+        max_ratio: float = 0.1,
+        min_samples: int = 20,
+        min_delay: float = 0.05,
+        max_workers: int = 8,
+        clock: Callable[[], float] = time.perf_counter,
+    ):
+        self.pct = pct
+        self.max_ratio = max_ratio
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.clock = clock
+        self.instances: Dict[str, InstanceHedging] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="snset-hedge"
+        )
+
+    def _instance(self, key: str) -> InstanceHedging:
+        if key not in self.instances:
+            self.instances[key] = InstanceHedging()
+        return self.instances[key]
+
+    def delay(self, key: str) -> Optional[float]:
+        """
+        Seconds to wait for a response from the instance before hedging,
+        None until enough latencies have been observed
+        """
+        with self._lock:
+            latencies = list(self._instance(key).latencies)
+        if len(latencies) < self.min_samples:
+            return None
+        return max(self.min_delay, percentile(latencies, self.pct))
+
+    def _reserve(self, key: str) -> bool:
+        with self._lock:
+            instance = self._instance(key)
+            if instance.hedged + 1 > math.floor(instance.requests * self.max_ratio):
+                return False
+            instance.hedged += 1
+            return True
+
+    def _timed(
+        self, key: str, send: Callable[[], requests.Response], start: float
+    ) -> Tuple[requests.Response, float]:
+        r = send()
+        end = self.clock()
+        with self._lock:
+            self._instance(key).latencies.append(end - start)
+        return r, end
+
+    def send(
+        self, key: str, send: Callable[[], requests.Response]
+    ) -> requests.Response:
+        """
+        Sends an idempotent request, hedging it when it is slow
+
+        Parameters:
+        key: str - the instance the request goes to, i.e. its base url
+        send: Callable - sends the request, called again for the hedge
+
+        returns: requests.Response - the first successful response
+        """
+        with self._lock:
+            self._instance(key).requests += 1
+        delay = self.delay(key)
+        start = self.clock()
+        if delay is None:
+            return self._timed(key, send, start)[0]
+
+        primary = self._submit(self._timed, key, send, start)
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._reserve(key):
+            return primary.result()[0]
+
+        hedge = self._submit(self._timed, key, send, self.clock())
+        pending: List[Future] = [primary, hedge]
+        winner = None
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.remove(future)
+                if winner is None and future.exception() is None:
+                    winner = future
+            if winner is not None:
+                break
+        if winner is None:
+            # both failed, report the original request's error
+            return primary.result()[0]
+        if winner is hedge:
+            hedge_end = hedge.result()[1]
+            with self._lock:
+                self._instance(key).wins += 1
+            primary.add_done_callback(lambda future: self._saved(key, hedge_end))
+        return winner.result()[0]
+
+    def _submit(self, fn: Callable, *args) -> Future:
+        # runs in a copy of the caller's context, so the attempt keeps the
+        # caller's tracing span and stats stage. A context can only be
+        # entered by one thread at a time, each attempt gets its own copy
+        return self._executor.submit(contextvars.copy_context().run, fn, *args)
+
+    def _saved(self, key: str, hedge_end: float) -> None:
+        # the primary request finished (or failed) after the hedge answered
+        with self._lock:
+            self._instance(key).time_saved += max(0.0, self.clock() - hedge_end)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+
+    def summary(self) -> Dict:
+        """
+        The hedge rate and time saved per instance
+        """
+        with self._lock:
+            return {
+                key: {
+                    "requests": instance.requests,
+                    "hedged": instance.hedged,
+                    "hedge_rate": (
+                        round(instance.hedged / instance.requests, 4)
+                        if instance.requests
+                        else 0.0
+                    ),
+                    "hedge_wins": instance.wins,
+                    "time_saved_s": round(instance.time_saved, 4),
+                }
+                for key, instance in self.instances.items()
+            }
+
+    def format_summary(self) -> str:
+        lines = [
+            f"{'hedged instance':<40} {'reqs':>6} {'hedged':>7} "
+            f"{'rate':>7} {'wins':>5} {'saved s':>8}"
+        ]
+        for key, row in self.summary().items():
+            lines.append(
+                f"{key:<40} {row['requests']:>6} {row['hedged']:>7} "
+                f"{row['hedge_rate']:>7.1%} {row['hedge_wins']:>5} "
+                f"{row['time_saved_s']:>8.3f}"
+            )
+        return "\n".join(lines)
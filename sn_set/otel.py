@@ -0,0 +1,57 @@
+from .tracing import Span, TraceHook
+
+try:
+    from opentelemetry import context as otel_context
+    from opentelemetry import trace as otel_trace
+except ImportError:  # pragma: no cover - exercised when the extra isn't installed
+    otel_trace = None
+
+
+class OpenTelemetryHook(TraceHook):
+    """
+    Forwards snset spans to OpenTelemetry, so runs show up in the same
+    trace as the process that called snset. Requires the otel extra:
+    pip install snset[otel]
+
+    Parameters:
+    tracer - optional OpenTelemetry tracer, defaults to the global provider's
+    """
+
+    def __init__(self, tracer=None):
+        if otel_trace is None:
+            raise ImportError(
+                "OpenTelemetry is not installed, "
+                "install it with: pip install snset[otel]"
+            )
+        self.tracer = tracer or otel_trace.get_tracer("sn_set")
+
+    def on_start(self, span: Span) -> None:
+        otel_span = self.tracer.start_span(span.name, attributes=_attributes(span))
+        span.hook_data["otel_span"] = otel_span
+        span.hook_data["otel_token"] = otel_context.attach(
+            otel_trace.set_span_in_context(otel_span)
+        )
+
+    def on_end(self, span: Span) -> None:
+        otel_span = span.hook_data.pop("otel_span", None)
+        if otel_span is None:
+            return
+        for key, value in _attributes(span).items():
+            otel_span.set_attribute(key, value)
+        if span.error:
+            otel_span.set_status(
+                otel_trace.Status(otel_trace.StatusCode.ERROR, span.error)
+            )
+        otel_span.end()
+        otel_context.detach(span.hook_data.pop("otel_token"))
+
+
+def _attributes(span: Span):
+    # OpenTelemetry only accepts primitive attribute values
+    return {
+        f"snset.{key}": (
+            value if isinstance(value, (str, bool, int, float)) else str(value)
+        )
+        for key, value in span.attributes.items()
+        if value is not None
+    }
@@ -0,0 +1,258 @@
+import json
+import math
+from typing import Callable, Dict, List
+from urllib.parse import urlencode
+
+from . import export
+from .records import json_default
+from .requests_lib import (
+    UPDATE_SET_QUERY,
+    chunk_names,
+    get_record_count,
+    install_order_new_params,
+    install_order_params,
+    instance_url,
+    make_request,
+    name_clause,
+    options,
+    update_sets_params,
+)
+
+# the longest url we expect an instance to accept for a single nameIN query
+DEFAULT_URL_LIMIT = 8192
+# records sampled per table to estimate the size of a row
+SAMPLE_SIZE = 20
+
+
+def sample_records(base_url: str, table: str, params: Dict[str, str]) -> List[Dict]:
+    """
+    Retrieves the first few records of a query, to size its rows
+    """
+    uri = f"{base_url}/api/now/table/{table}"
+    params = {**params, "sysparm_limit": str(SAMPLE_SIZE)}
+    return make_request(uri, path_params=params, base_url=base_url) or []
+
+
+def row_bytes(records: List[Dict]) -> int:
+    if not records:
+        return 0
+    return math.ceil(len(json.dumps(records, default=json_default)) / len(records))
+
+
+def lookup_plan(
+    uri: str,
+    count: int,
+    name_length: int,
+    build_params: Callable[[str], Dict[str, str]],
+    url_limit: int,
+) -> Dict:
+    """
+    Plans the requests of a nameIN lookup of `count` names, following the
+    same fallback get_install_order and get_install_order_new take when the
+    single query is too long
+
+    returns: Dict - the requests, the Batch API sub requests and the
+        number of names per query
+    """
+    # placeholder names of the average length, only their size matters
+    names = ["x" * name_length] * count
+    clause = name_clause(names) if names else "nameIN"
+    query_length = len(f"{uri}?{urlencode(build_params(clause))}")
+    if query_length <= url_limit or count <= 1:
+        return {
+            "requests": 1,
+            "sub_requests": 0,
+            "url_length": query_length,
+            "fallback": False,
+            "chunks": [count] if count else [],
+        }
+
+    max_url_length = options.get("max_url_length")
+    chunks = (
+        [len(chunk) for chunk in chunk_names(uri, names, build_params, max_url_length)]
+        if max_url_length
+        else [1] * count
+    )
+    batch_size = options.get("batch_size")
+    requests = math.ceil(len(chunks) / batch_size) if batch_size else len(chunks)
+    return {
+        # the single nameIN query is rejected before the fallback runs
+        "requests": 1 + requests,
+        "sub_requests": len(chunks) if batch_size else 0,
+        "url_length": query_length,
+        "fallback": True,
+        "chunks": chunks,
+    }
+
+
+def fetch_requests(rows: int, params: Dict[str, str]) -> int:
+    """
+    The requests fetching the rows of a query takes with the configured
+    backend: one for the Table API, a page at a time for an export
+    """
+    backend = options.get("backend") or "table"
+    export_format = "jsonv2" if backend == "auto" else backend
+    if backend == "table" or not export.exportable(params, export_format):
+        return 1
+    # the last page is the first one short of a full page
+    return rows // export.EXPORT_PAGE_SIZE + 1
+
+
+def build_plan(source: str, target: str, url_limit: int = DEFAULT_URL_LIMIT) -> Dict:
+    """
+    Estimates the HTTP work of comparing source against target from
+    record counts and a small sample of each query, without downloading
+    the update sets. The difference is estimated as the number of sets the
+    source has over the target, which assumes the target holds a subset of
+    the source's sets
+
+    Parameters:
+    source: str - the instance update sets are copied from
+    target: str - the instance being compared to
+    url_limit: int - the longest url the instances accept
+
+    returns: Dict - the counts the plan was built from and per stage estimates
+    """
+    source_count = get_record_count(source, "sys_update_set", UPDATE_SET_QUERY)
+    target_count = get_record_count(target, "sys_update_set", UPDATE_SET_QUERY)
+    local_count = get_record_count(
+        source, "sys_update_set", f"{UPDATE_SET_QUERY}^installed_fromISEMPTY"
+    )
+    diff = max(source_count - target_count, 0)
+    new_sets = round(diff * local_count / source_count) if source_count else 0
+    committed = diff - new_sets
+
+    base_url = instance_url(source)
+    name_sample = sample_records(base_url, "sys_update_set", update_sets_params())
+    name_length = (
+        math.ceil(sum(len(r.get("name") or "") for r in name_sample) / len(name_sample))
+        if name_sample
+        else 0
+    )
+    set_bytes = row_bytes(name_sample)
+    remote_bytes = row_bytes(
+        sample_records(
+            base_url,
+            "sys_remote_update_set",
+            install_order_params("nameISNOTEMPTY"),
+        )
+    )
+    new_bytes = row_bytes(
+        sample_records(
+            base_url, "sys_update_set", install_order_new_params("nameISNOTEMPTY")
+        )
+    )
+
+    install_order = lookup_plan(
+        f"{base_url}/api/now/table/sys_remote_update_set",
+        diff,
+        name_length,
+        install_order_params,
+        url_limit,
+    )
+    new_lookup = (
+        lookup_plan(
+            f"{base_url}/api/now/table/sys_update_set",
+            new_sets,
+            name_length,
+            install_order_new_params,
+            url_limit,
+        )
+        if new_sets
+        else {"requests": 0, "sub_requests": 0, "fallback": False, "chunks": []}
+    )
+
+    stages = [
+        {
+            "stage": "source fetch",
+            "requests": fetch_requests(source_count, update_sets_params()),
+            "rows": source_count,
+            "bytes": source_count * set_bytes,
+        },
+        {
+            "stage": "target fetch",
+            "requests": fetch_requests(target_count, update_sets_params()),
+            "rows": target_count,
+            "bytes": target_count * set_bytes,
+        },
+        {"stage": "diff", "requests": 0, "rows": 0, "bytes": 0},
+        {
+            "stage": "install order",
+            **install_order,
+            "rows": committed,
+            "bytes": committed * remote_bytes,
+        },
+        {
+            "stage": "new sets",
+            **new_lookup,
+            "rows": new_sets,
+            "bytes": new_sets * new_bytes,
+        },
+        {"stage": "export", "requests": 0, "rows": 0, "bytes": 0},
+    ]
+    return {
+        "source": source,
+        "target": target,
+        "source_url": base_url,
+        "backend": options.get("backend") or "table",
+        "source_sets": source_count,
+        "target_sets": target_count,
+        "estimated_diff": diff,
+        "estimated_new_sets": new_sets,
+        "url_limit": url_limit,
+        "max_url_length": options.get("max_url_length"),
+        "batch_size": options.get("batch_size") or 0,
+        # every request is sent one after the other
+        "concurrency": 1,
+        "stages": stages,
+        "totals": {
+            key: sum(s.get(key, 0) for s in stages)
+            for key in ["requests", "sub_requests", "rows", "bytes"]
+        },
+    }
+
+
+def format_chunks(chunks: List[int]) -> str:
+    if not chunks:
+        return "-"
+    if min(chunks) == max(chunks):
+        return f"{len(chunks)} x {chunks[0]}"
+    return f"{len(chunks)} x {min(chunks)}-{max(chunks)}"
+
+
+def format_plan(plan: Dict) -> str:
+    """
+    Renders a plan as plain text, one line per stage
+    """
+    lines = [
+        f"Plan for {plan['source']} -> {plan['target']} "
+        f"({plan['source_url']}, {plan['backend']} backend)",
+        f"Source sets: {plan['source_sets']}, target sets: {plan['target_sets']}, "
+        f"estimated difference: {plan['estimated_diff']} "
+        f"({plan['estimated_new_sets']} created on {plan['source']})",
+        "",
+        f"{'stage':<16} {'reqs':>6} {'batched':>8} {'rows':>8} "
+        f"{'est bytes':>11}  nameIN chunks (names per query)",
+    ]
+    for row in plan["stages"] + [{"stage": "total", **plan["totals"]}]:
+        chunks = format_chunks(row["chunks"]) if "chunks" in row else ""
+        lines.append(
+            f"{row['stage']:<16} {row['requests']:>6} "
+            f"{row.get('sub_requests', 0):>8} {row['rows']:>8} {row['bytes']:>11}  "
+            f"{chunks}".rstrip()
+        )
+    lines.append("")
+    for row in plan["stages"]:
+        if row.get("fallback"):
+            lines.append(
+                f"{row['stage']}: a single nameIN query would be "
+                f"{row['url_length']} characters, over the {plan['url_limit']} "
+                "limit, so the lookup falls back to "
+                + (
+                    f"nameIN queries of at most {plan['max_url_length']} characters"
+                    if plan["max_url_length"]
+                    else "one request per name (set --max-url-length to chunk)"
+                )
+            )
+    lines.append(f"Expected concurrency: {plan['concurrency']} request at a time")
+    return "\n".join(lines)
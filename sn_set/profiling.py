@@ -0,0 +1,124 @@
+import cProfile
+import io
+import os
+import pstats
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple
+
+# the modules we want called out in the report
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def is_own_code(filename: str) -> bool:
+    return os.path.abspath(filename).startswith(PACKAGE_DIR + os.sep)
+
+
+def hottest_functions(
+    stats: pstats.Stats, sort: str = "tottime", limit: int = 15
+) -> List[Tuple]:
+    """
+    The sn_set functions that took the most time
+
+    Parameters:
+    stats: pstats.Stats - the collected profile
+    sort: str - "tottime" (time in the function itself) or "cumtime"
+    limit: int - maximum number of functions to return
+
+    returns: List[Tuple] - (location, calls, tottime, cumtime) tuples
+    """
+    rows = []
+    for (filename, line, name), (_, calls, tottime, cumtime, _) in stats.stats.items():
+        if is_own_code(filename):
+            location = f"{os.path.relpath(filename, os.path.dirname(PACKAGE_DIR))}"
+            rows.append((f"{location}:{line}({name})", calls, tottime, cumtime))
+    idx = 2 if sort == "tottime" else 3
+    rows.sort(key=lambda row: row[idx], reverse=True)
+    return rows[:limit]
+
+
+def format_report(
+    profiler: Optional[cProfile.Profile],
+    snapshot: Optional[tracemalloc.Snapshot],
+    peak: int,
+    wall: float,
+    limit: int = 15,
+) -> str:
+    lines = [f"snset profile, wall time {wall:.3f}s", ""]
+    if profiler is not None:
+        stats = pstats.Stats(profiler)
+        for sort, title in [
+            ("tottime", "Hottest sn_set functions (own time)"),
+            ("cumtime", "Hottest sn_set functions (cumulative time)"),
+        ]:
+            lines.append(title)
+            lines.append(f"{'calls':>10} {'tottime':>10} {'cumtime':>10}  function")
+            for location, calls, tottime, cumtime in hottest_functions(
+                stats, sort, limit
+            ):
+                lines.append(
+                    f"{calls:>10} {tottime:>10.4f} {cumtime:>10.4f}  {location}"
+                )
+            lines.append("")
+
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(limit)
+        lines.append("All functions (cumulative time)")
+        lines.append(out.getvalue().strip())
+        lines.append("")
+
+    if snapshot is not None:
+        lines.append(f"Peak traced memory: {peak / 1024 / 1024:.2f} MiB")
+        lines.append("")
+        lines.append("Top allocations")
+        for stat in snapshot.statistics("lineno")[:limit]:
+            lines.append(f"  {stat}")
+        own = snapshot.filter_traces([tracemalloc.Filter(True, f"{PACKAGE_DIR}*")])
+        lines.append("")
+        lines.append("Top sn_set allocations")
+        for stat in own.statistics("lineno")[:limit]:
+            lines.append(f"  {stat}")
+    return "\n".join(lines) + "\n"
+
+
+@contextmanager
+def profile_run(
+    output_dir: str = ".",
+    cpu: bool = True,
+    memory: bool = False,
+    prefix: str = "snset",
+    limit: int = 15,
+) -> Iterator[None]:
+    """
+    Profiles the wrapped block and writes {prefix}.pstats (cpu) along with a
+    {prefix}-profile.txt report of the hottest sn_set functions and, when
+    memory is set, the top tracemalloc allocations
+
+    Usage:
+    with profile_run("./profiles", memory=True):
+        run(...)
+    """
+    profiler = cProfile.Profile() if cpu else None
+    if memory:
+        tracemalloc.start(10)
+    start = time.perf_counter()
+    if profiler:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler:
+            profiler.disable()
+        wall = time.perf_counter() - start
+        snapshot, peak = None, 0
+        if memory:
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+        os.makedirs(output_dir, exist_ok=True)
+        if profiler:
+            profiler.dump_stats(os.path.join(output_dir, f"{prefix}.pstats"))
+        with open(os.path.join(output_dir, f"{prefix}-profile.txt"), "w") as f:
+            f.write(format_report(profiler, snapshot, peak, wall, limit))
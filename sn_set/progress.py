@@ -0,0 +1,202 @@
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+try:
+    from rich.console import Console
+    from rich.live import Live
+    from rich.table import Table
+except ImportError:  # pragma: no cover - exercised when the extra isn't installed
+    Live = None
+
+from .stats import StatsCollector
+from .tracing import Span, TraceHook
+
+
+def format_eta(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return "-"
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+class StageProgress:
+    """
+    Progress of a single cli stage, fed by the trace spans of its requests
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.perf_counter()
+        self.ended: Optional[float] = None
+        self.requests = 0
+        self.in_flight = 0
+        self.units_done = 0
+        self.units_total = 0
+
+    @property
+    def elapsed(self) -> float:
+        return (self.ended or time.perf_counter()) - self.started
+
+    @property
+    def eta(self) -> Optional[float]:
+        """
+        Seconds left, extrapolated from the fallback units done so far
+        """
+        if self.ended:
+            return 0.0
+        if not self.units_total or not self.units_done:
+            return None
+        remaining = self.units_total - self.units_done
+        return self.elapsed / self.units_done * remaining
+
+
+class ProgressDisplay(TraceHook):
+    """
+    Shows rows per second, requests in flight, retries and ETA for each
+    stage. Renders a live table on a terminal and falls back to plain lines,
+    at most one every `interval` seconds per stage, when output is redirected
+    or the rich extra isn't installed (pip install snset[rich])
+
+    Parameters:
+    collector: StatsCollector - where the row and retry counts come from
+    live: bool - render a live table rather than plain lines, when rich is
+        installed
+    interval: float - seconds between plain progress lines
+    write: Callable[[str], None] - how plain lines are written
+    """
+
+    def __init__(
+        self,
+        collector: StatsCollector,
+        live: bool = False,
+        interval: float = 10.0,
+        write: Callable[[str], None] = print,
+    ):
+        self.collector = collector
+        self.interval = interval
+        self.write = write
+        self.stages: List[StageProgress] = []
+        self.current: Optional[StageProgress] = None
+        self._last_line = 0.0
+        self._lock = threading.Lock()
+        self._live = (
+            Live(
+                get_renderable=self.render,
+                console=Console(),
+                refresh_per_second=4,
+                transient=False,
+            )
+            if live and Live is not None
+            else None
+        )
+
+    def start(self) -> "ProgressDisplay":
+        if self._live:
+            self._live.start()
+        return self
+
+    def close(self) -> None:
+        if self._live:
+            self._live.stop()
+            self._live = None
+
+    def _stage_totals(self, stage: StageProgress) -> Dict:
+        stage_stat = self.collector.stages.get(stage.name)
+        requests = list(stage_stat.requests) if stage_stat else []
+        rows = sum(r.rows or 0 for r in requests)
+        return {
+            "rows": rows,
+            "rows_per_s": rows / stage.elapsed if stage.elapsed > 0 else 0.0,
+            "retries": sum(r.retries for r in requests),
+        }
+
+    def on_start(self, span: Span) -> None:
+        with self._lock:
+            if span.name.startswith("stage "):
+                self.current = StageProgress(span.attributes.get("stage", span.name))
+                self.stages.append(self.current)
+            elif self.current is None:
+                return
+            elif span.name.startswith("HTTP "):
+                self.current.in_flight += 1
+            elif span.name == "fallback chunk":
+                self.current.units_total = max(
+                    self.current.units_total, span.attributes.get("of", 0)
+                )
+            elif span.name == "fallback batch":
+                self.current.units_total += span.attributes.get("requests", 0)
+
+    def on_end(self, span: Span) -> None:
+        line = None
+        with self._lock:
+            stage = self.current
+            if stage is None:
+                return
+            if span.name.startswith("stage "):
+                stage.ended = time.perf_counter()
+                self.current = None
+                line = self.format_line(stage)
+            elif span.name.startswith("HTTP "):
+                stage.in_flight -= 1
+                stage.requests += 1
+            elif span.name == "fallback chunk":
+                stage.units_done += 1
+            elif span.name == "fallback batch":
+                stage.units_done += span.attributes.get("requests", 0)
+
+            now = time.perf_counter()
+            if line is None and now - self._last_line >= self.interval:
+                line = self.format_line(stage)
+            if line:
+                self._last_line = now
+        if line and not self._live:
+            self.write(line)
+
+    def format_line(self, stage: StageProgress) -> str:
+        totals = self._stage_totals(stage)
+        status = "done" if stage.ended else "running"
+        progress = (
+            f", {stage.units_done}/{stage.units_total} lookups"
+            if stage.units_total
+            else ""
+        )
+        return (
+            f"[{stage.name}] {status} {stage.elapsed:.1f}s, {stage.requests} requests"
+            f"{progress}, {totals['rows']} rows ({totals['rows_per_s']:.1f}/s), "
+            f"{stage.in_flight} in flight, {totals['retries']} retries, "
+            f"ETA {format_eta(stage.eta)}"
+        )
+
+    def render(self) -> "Table":
+        table = Table(title="snset progress", expand=False)
+        for column in [
+            "stage",
+            "status",
+            "elapsed",
+            "requests",
+            "in flight",
+            "rows",
+            "rows/s",
+            "retries",
+            "lookups",
+            "ETA",
+        ]:
+            table.add_column(column, justify="left" if column == "stage" else "right")
+        with self._lock:
+            stages = list(self.stages)
+        for stage in stages:
+            totals = self._stage_totals(stage)
+            table.add_row(
+                stage.name,
+                "done" if stage.ended else "running",
+                f"{stage.elapsed:.1f}s",
+                str(stage.requests),
+                str(stage.in_flight),
+                str(totals["rows"]),
+                f"{totals['rows_per_s']:.1f}",
+                str(totals["retries"]),
+                f"{stage.units_done}/{stage.units_total}" if stage.units_total else "-",
+                format_eta(stage.eta),
+            )
+        return table
@@ -0,0 +1,165 @@
+import sys
+from collections.abc import KeysView, Mapping
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# values up to this long are interned, which shares the many repeated
+# states, types and user names between records
+INTERN_MAX_LENGTH = 40
+# the fields with few distinct values, the only ones interned. Interned
+# strings are never freed, so interning sys_ids, dates or names would grow
+# the memory of a long running process (snset serve) without bound
+SHARED_FIELDS = frozenset(
+    {
+        "action",
+        "category",
+        "collisions",
+        "state",
+        "sys_class_name",
+        "sys_created_by",
+        "sys_updated_by",
+        "table",
+        "type",
+    }
+)
+
+
+class Schema:
+    """
+    The field names shared by every record with the same fields, so each
+    record only has to hold its values
+    """
+
+    __slots__ = ("fields", "index", "shared")
+
+    def __init__(self, fields: Tuple[str, ...]):
+        self.fields = fields
+        self.index = {name: idx for idx, name in enumerate(fields)}
+        self.shared = tuple(name in SHARED_FIELDS for name in fields)
+
+
+_schemas: Dict[Tuple[str, ...], Schema] = {}
+
+
+def schema_for(fields: Tuple[str, ...]) -> Schema:
+    schema = _schemas.get(fields)
+    if schema is None:
+        schema = _schemas[fields] = Schema(tuple(sys.intern(f) for f in fields))
+    return schema
+
+
+def compact_value(value: Any, shared: bool = False) -> Any:
+    if shared and isinstance(value, str) and len(value) <= INTERN_MAX_LENGTH:
+        return sys.intern(value)
+    if isinstance(value, dict):
+        return UpdateSetRecord.from_dict(value)
+    return value
+
+
+def compact_values(schema: Schema, values: Iterable[Any]) -> Tuple:
+    """
+    The values of a row, with those of the SHARED_FIELDS interned
+    """
+    return tuple(map(compact_value, values, schema.shared))
+
+
+class UpdateSetRecord(Mapping):
+    """
+    A read only row of a Table API result, i.e. an update set. Behaves like
+    the dict it was decoded from (and compares equal to it) but only keeps a
+    tuple of values and a reference to the schema shared with the other rows
+
+    Usage:
+    record = UpdateSetRecord.from_dict({"name": "a set", "state": "complete"})
+    record["name"], record.get("state"), dict(record)
+    """
+
+    __slots__ = ("_schema", "_values")
+
+    def __init__(self, schema: Schema, values: Tuple):
+        self._schema = schema
+        self._values = values
+
+    @classmethod
+    def from_pairs(cls, pairs: List[Tuple[str, Any]]) -> "UpdateSetRecord":
+        """
+        Builds a record from decoded json pairs, for use as an
+        object_pairs_hook
+        """
+        keys, values = zip(*pairs) if pairs else ((), ())
+        schema = _schemas.get(keys) or schema_for(keys)
+        return cls(schema, compact_values(schema, values))
+
+    @classmethod
+    def from_dict(cls, row: Dict[str, Any]) -> "UpdateSetRecord":
+        schema = schema_for(tuple(row))
+        return cls(schema, compact_values(schema, row.values()))
+
+    def __getitem__(self, key: str) -> Any:
+        try:
+            return self._values[self._schema.index[key]]
+        except KeyError:
+            raise KeyError(key) from None
+
+    def get(self, key: str, default: Any = None) -> Any:
+        idx = self._schema.index.get(key)
+        return default if idx is None else self._values[idx]
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._schema.index
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._schema.fields)
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def keys(self) -> KeysView:
+        return KeysView(self)
+
+    def items(self):
+        return list(zip(self._schema.fields, self._values))
+
+    def values(self):
+        return self._values
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            key: value.to_dict() if isinstance(value, UpdateSetRecord) else value
+            for key, value in self.items()
+        }
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, UpdateSetRecord) and other._schema is self._schema:
+            return self._values == other._values
+        if isinstance(other, Mapping):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"UpdateSetRecord({self.to_dict()!r})"
+
+    def __reduce__(self):
+        return UpdateSetRecord.from_pairs, (list(self.items()),)
+
+
+def to_records(rows: Optional[Iterable]) -> Optional[List]:
+    """
+    Converts a list of decoded dict rows to records, leaving anything
+    else (i.e. an aggregate result) as it is
+    """
+    if not isinstance(rows, list):
+        return rows
+    return [
+        UpdateSetRecord.from_dict(row) if isinstance(row, dict) else row for row in rows
+    ]
+
+
+def json_default(value: Any) -> Any:
+    """
+    Lets json.dump write records, i.e. json.dumps(rows, default=json_default)
+    """
+    if isinstance(value, UpdateSetRecord):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
@@ -0,0 +1,201 @@
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+DEFAULT_INSTANCE_URL = "https://{instance}.service-now.com"
+# the instances snset knows without a registry file
+DEFAULT_INSTANCES = [
+    "nyu",
+    "nyuqa",
+    "nyutest",
+    "nyudev",
+    "nyutrain",
+    "nyusandbox",
+    "nyudev2",
+    "nyudev3",
+    "nyu2",
+]
+REGISTRY_ENV = "SN_SET_REGISTRY"
+
+
+class RateLimiter:
+    """
+    A token bucket: up to `burst` requests go out at once, after that
+    `rate` per second. acquire() blocks until a request may be sent
+
+    Parameters:
+    rate: float - requests per second
+    burst: int - requests that may be sent back to back
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: int = 1,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = float(self.burst)
+        self.updated = clock()
+        self.waited = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        Takes a token, waiting for one if the bucket is empty
+
+        returns: float - the seconds waited
+        """
+        with self._lock:
+            now = self.clock()
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            # the token is taken now, so concurrent callers queue up behind it
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            self.waited += wait
+        if wait:
+            self.sleep(wait)
+        return wait
+
+
+class InstanceConfig:
+    """
+    How snset connects to an instance
+
+    Parameters:
+    name: str - the instance's name, i.e. nyudev
+    base_url: str - defaults to https://{name}.service-now.com
+    profile: str - the credentials profile, the SN_USER_NAME etc. settings
+        are read with this prefix, i.e. DEV_SN_USER_NAME
+    pool_size: int - connections kept open to the instance, 0 for the default
+    rate_limit: float - requests per second, 0 for no limit
+    burst: int - requests sent back to back before the rate limit applies
+    """
+
+    def __init__(
+        self,
+        name: str,
+        base_url: Optional[str] = None,
+        profile: str = "",
+        pool_size: int = 0,
+        rate_limit: float = 0.0,
+        burst: int = 1,
+    ):
+        if not name or not isinstance(name, str):
+            raise ValueError("Instance name cannot be null or empty")
+        self.name = name
+        base_url = base_url or DEFAULT_INSTANCE_URL.format(instance=name)
+        self.base_url = base_url.rstrip("/")
+        self.profile = profile
+        self.pool_size = int(pool_size)
+        self.rate_limit = float(rate_limit)
+        self.burst = int(burst)
+
+    @classmethod
+    def from_dict(cls, name: str, values: Dict) -> "InstanceConfig":
+        unknown = set(values) - {
+            "base_url",
+            "profile",
+            "pool_size",
+            "rate_limit",
+            "burst",
+        }
+        if unknown:
+            raise ValueError(
+                f"Unknown settings for instance {name}: {', '.join(sorted(unknown))}"
+            )
+        return cls(name, **values)
+
+    def __repr__(self) -> str:
+        return f"InstanceConfig({self.name}, {self.base_url})"
+
+
+class Registry:
+    """
+    The instances snset may connect to, looked up by name or base url
+
+    Parameters:
+    instances: List[InstanceConfig] - the known instances
+    """
+
+    def __init__(self, instances: List[InstanceConfig]):
+        self.instances: Dict[str, InstanceConfig] = {i.name: i for i in instances}
+        self._by_url = {i.base_url: i for i in instances}
+        self._limiters: Dict[str, RateLimiter] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> Optional[InstanceConfig]:
+        return self.instances.get(name)
+
+    def by_url(self, base_url: Optional[str]) -> Optional[InstanceConfig]:
+        return self._by_url.get((base_url or "").rstrip("/"))
+
+    def limiter(self, base_url: Optional[str]) -> Optional[RateLimiter]:
+        """
+        The rate limiter shared by every request to an instance, if it has
+        a rate limit
+        """
+        instance = self.by_url(base_url)
+        if instance is None or not instance.rate_limit:
+            return None
+        with self._lock:
+            if instance.name not in self._limiters:
+                self._limiters[instance.name] = RateLimiter(
+                    instance.rate_limit, instance.burst
+                )
+            return self._limiters[instance.name]
+
+
+def default_registry() -> Registry:
+    return Registry([InstanceConfig(name) for name in DEFAULT_INSTANCES])
+
+
+def read_registry(path: str) -> Registry:
+    """
+    Reads a registry file, a json object of instance names to their
+    settings. Instances not in the file aren't known:
+
+    {
+        "nyudev": {"profile": "dev", "pool_size": 20},
+        "acme": {"base_url": "https://acme.service-now.com", "rate_limit": 5}
+    }
+
+    raises: ValueError when the file isn't a registry
+    """
+    with open(path) as f:
+        try:
+            data = json.load(f)
+        except json.JSONDecodeError as ex:
+            raise ValueError(f"{path} is not valid json: {ex}")
+    if not isinstance(data, dict) or not all(
+        isinstance(values, dict) for values in data.values()
+    ):
+        raise ValueError(f"{path} must map instance names to their settings")
+    return Registry(
+        [InstanceConfig.from_dict(name, values) for name, values in data.items()]
+    )
+
+
+_loaded: Dict[Optional[str], Registry] = {}
+
+
+def load_registry(path: Optional[str] = None) -> Registry:
+    """
+    The registry in path, or in the file named by SN_SET_REGISTRY, or the
+    default instances. Each file is read once
+    """
+    path = path or os.environ.get(REGISTRY_ENV) or None
+    if path not in _loaded:
+        _loaded[path] = read_registry(path) if path else default_registry()
+    return _loaded[path]
@@ -0,0 +1,136 @@
+import csv
+import multiprocessing
+from collections.abc import Mapping
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import xlsxwriter
+
+REPORT_FORMATS = ["xlsx", "csv"]
+
+# the column names, then one tuple of cell values per record. Keys aren't
+# repeated per record, so a report is cheap to send to a worker process
+Packed = Tuple[Tuple[str, ...], List[Tuple]]
+
+
+def cell(value):
+    """
+    The value written for a field, the display value of a reference
+    """
+    if isinstance(value, Mapping):
+        return value.get("display_value")
+    return value
+
+
+def pack(records: List[Dict]) -> Packed:
+    """
+    Turns records into rows. The columns are every key of every record, in
+    the order they are first seen, a record without one leaves its cell empty
+    """
+    headers = tuple(dict.fromkeys(key for record in records for key in record))
+    rows = [tuple(cell(record.get(key)) for key in headers) for record in records]
+    return headers, rows
+
+
+def write_xlsx(path: str, packed: Packed) -> None:
+    headers, rows = packed
+    # rows are written as they come rather than held for the whole sheet
+    with xlsxwriter.Workbook(path, {"constant_memory": True}) as workbook:
+        worksheet = workbook.add_worksheet()
+        worksheet.write_row(0, 0, headers)
+        for idx, row in enumerate(rows, start=1):
+            worksheet.write_row(idx, 0, row)
+
+
+def write_csv(path: str, packed: Packed) -> None:
+    headers, rows = packed
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(headers)
+        writer.writerows(rows)
+
+
+WRITERS = {"xlsx": write_xlsx, "csv": write_csv}
+
+
+def write_report(path: str, report_format: str, packed: Packed) -> Tuple[str, int]:
+    """
+    Writes a packed report, in a worker process or in this one
+
+    returns: Tuple[str, int] - the path written and its number of rows
+    """
+    WRITERS[report_format](path, packed)
+    return path, len(packed[1])
+
+
+class ReportWriter:
+    """
+    Writes reports in a pool of worker processes while the caller goes on
+    fetching. The records are packed before they are sent, so only their
+    values cross to the worker. Without workers, reports are written as
+    they are submitted
+
+    Parameters:
+    workers: int - worker processes, 0 writes in this process
+    report_format: str - xlsx or csv
+    """
+
+    def __init__(self, workers: int = 0, report_format: str = "xlsx"):
+        if report_format not in WRITERS:
+            raise ValueError(f"Unknown report format: {report_format}")
+        self.report_format = report_format
+        # spawned rather than forked, the parent has tracing and progress
+        # threads running whose locks a fork would copy
+        self._pool = (
+            ProcessPoolExecutor(
+                workers, mp_context=multiprocessing.get_context("spawn")
+            )
+            if workers
+            else None
+        )
+        self._futures: List[Tuple[str, Future]] = []
+
+    def __enter__(self) -> "ReportWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def submit(self, file_name: str, records: List[Dict]) -> Future:
+        """
+        Queues the report of records, written to file_name plus the
+        format's extension
+        """
+        path = f"{file_name}.{self.report_format}"
+        packed = pack(records)
+        if self._pool:
+            future = self._pool.submit(write_report, path, self.report_format, packed)
+        else:
+            future = Future()
+            try:
+                future.set_result(write_report(path, self.report_format, packed))
+            except Exception as ex:
+                future.set_exception(ex)
+        self._futures.append((path, future))
+        return future
+
+    def wait(self) -> List[Tuple[str, Optional[str]]]:
+        """
+        Waits for every report submitted so far
+
+        returns: List[Tuple[str, Optional[str]]] - each report's path and
+            the error that stopped it being written, if any
+        """
+        results = []
+        for path, future in self._futures:
+            error = future.exception()
+            results.append(
+                (path, f"{type(error).__name__}: {error}" if error else None)
+            )
+        self._futures = []
+        return results
+
+    def close(self) -> None:
+        if self._pool:
+            self._pool.shutdown(wait=True)
+            self._pool = None
@@ -1,15 +1,117 @@
+import contextvars
+import itertools
+import time
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import quote_plus, urlencode
 
 import requests
 from authlib.integrations.requests_client import OAuth2Session
 from requests.exceptions import HTTPError
 
+from . import batch, export, tracing
+from .batch import BatchError, BatchTransport
+from .cache import DiskCache
+from .cassette import request_key
+from .decoding import get_decoder
+from .records import to_records
+from .registry import DEFAULT_INSTANCE_URL, Registry, load_registry
+from .resilience import FailFast, ResiliencePolicy
 from .settings import Settings
+from .transport import BearerAuth, HttpxClient
+
+
+class Scoped(MutableMapping):
+    """
+    A process wide dict that a block of code can swap for its own, see
+    scope. The swap holds for the calling context and the work it hands to
+    other threads with contextvars.copy_context
+
+    Parameters:
+    name: str - the name of the context variable holding the swapped dict
+    """
+
+    def __init__(self, name: str):
+        self.default: Dict = {}
+        self._scoped: contextvars.ContextVar[Optional[MutableMapping]] = (
+            contextvars.ContextVar(name, default=None)
+        )
+
+    @property
+    def current(self) -> MutableMapping:
+        scoped = self._scoped.get()
+        return self.default if scoped is None else scoped
+
+    @contextmanager
+    def scope(self, mapping: MutableMapping) -> Iterator[MutableMapping]:
+        """
+        Reads and writes go to mapping within the block
+        """
+        token = self._scoped.set(mapping)
+        try:
+            yield mapping
+        finally:
+            self._scoped.reset(token)
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        return self.current.get(key, default)
+
+    def __getitem__(self, key: Any) -> Any:
+        return self.current[key]
+
+    def __setitem__(self, key: Any, value: Any) -> None:
+        self.current[key] = value
+
+    def __delitem__(self, key: Any) -> None:
+        del self.current[key]
+
+    def __iter__(self) -> Iterator:
+        return iter(self.current)
+
+    def __len__(self) -> int:
+        return len(self.current)
+
+    def __repr__(self) -> str:
+        return repr(self.current)
+
 
 # context holder to persist oauth2 tokens through
-# the execution
-context: Dict = {}
+# the execution, a Comparator keeps its own
+context = Scoped("snset_context")
+
+# run wide request options, set by the cli before any requests are made.
+# A Comparator applies its settings over them
+options = Scoped("snset_options")
+
+# timeouts only, used when no policy has been configured
+DEFAULT_POLICY = ResiliencePolicy()
+
+UPDATE_SET_QUERY = "state=complete^ORstate=ignore"
+INSTALL_ORDER_FIELDS = [
+    "name",
+    "state",
+    "update_source",
+    "description",
+    "sys_created_on",
+    "commit_date",
+    "sys_updated_by",
+    "sys_updated_on",
+    "collisions",
+]
+# rows per page when a query is read in pages
+PAGE_SIZE = 10000
+NEW_SET_FIELDS = [
+    "name",
+    "state",
+    "description",
+    "sys_created_on",
+    # "commit_date",
+    "sys_updated_by",
+    "sys_updated_on",
+]
 
 
 def client_factory(*args, **kwargs) -> Tuple:
@@ -20,7 +122,19 @@ def client_factory(*args, **kwargs) -> Tuple:
     if clientConfig := context.get(base_url):
         return clientConfig.get("client"), clientConfig.get("auth")
 
-    settings = Settings()
+    with tracing.span("client_factory", base_url=base_url):
+        return build_client(base_url)
+
+
+def build_client(base_url: str) -> Tuple:
+    """
+    Creates (and authenticates, when using OAuth2) the client for an
+    instance and stores it in the context. The instance's registry entry
+    picks the credentials profile and the size of the connection pool
+    """
+    instance = registry().by_url(base_url)
+    settings = Settings(instance.profile if instance else "")
+    pool_size = instance.pool_size if instance else 0
     if not settings.get_user() or not settings.get_password():
         raise ValueError("Username or Password is empty")
     if settings.get_use_oauth() and (
@@ -37,23 +151,110 @@ def client_factory(*args, **kwargs) -> Tuple:
             client_secret=settings.get_client_secret(),
             scope="useraccount",
         )
-        client.fetch_token(
-            f"{base_url}/oauth_token.do",
-            username=settings.get_user(),
-            password=settings.get_password(),
-        )
+        session = client
+
+        def fetch_token():
+            session.fetch_token(
+                f"{base_url}/oauth_token.do",
+                username=settings.get_user(),
+                password=settings.get_password(),
+                timeout=(options.get("resilience") or DEFAULT_POLICY).timeout(),
+            )
+
+        fetch_token()
+        if options.get("transport") == "httpx":
+            # the token is fetched with requests, the calls go over httpx and
+            # the session is kept to fetch a new token when this one expires
+            client = HttpxClient(
+                auth=BearerAuth(session, fetch_token), **pooled(pool_size)
+            )
+        elif pool_size:
+            mount_pool(client, pool_size)
         clientConfig: Dict = {"client": client}
         context[base_url] = clientConfig
         return client, None
+    elif options.get("transport") == "httpx":
+        client = HttpxClient(
+            auth=(settings.get_user(), settings.get_password()), **pooled(pool_size)
+        )
+        context[base_url] = {"client": client}
+        return client, None
     else:
-        client = requests
+        # a long running process keeps its connections to the instance open
+        client = (
+            requests.Session() if options.get("keep_alive") or pool_size else requests
+        )
+        if pool_size:
+            mount_pool(client, pool_size)
         auth = requests.auth.HTTPBasicAuth(settings.get_user(), settings.get_password())
         clientConfig: Dict = {"client": client, "auth": auth}
         context[base_url] = clientConfig
         return client, auth
 
 
-def get_update_sets(instance_name: str) -> List[Dict[str, str]]:
+def pooled(pool_size: int) -> Dict:
+    return {"max_connections": pool_size} if pool_size else {}
+
+
+def mount_pool(session: requests.Session, pool_size: int) -> None:
+    """
+    Keeps up to pool_size connections to each host open in the session
+    """
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+
+def prewarm(instance_names: List[str]) -> Dict[str, Optional[str]]:
+    """
+    Creates the client of every instance in parallel and sends each a
+    one row query, so DNS, the TLS handshake and authentication (fetching
+    the OAuth2 token) are done before the first real request. A pooled
+    client (keep_alive or a registry pool size) keeps the connection open
+    for the requests that follow
+
+    Parameters:
+    instance_names: List[str] - the instances the run involves, those not
+        in the registry are skipped and left for the fetch to report
+
+    returns: Dict - each instance mapped to None, or why it couldn't be warmed
+    """
+    names = [n for n in dict.fromkeys(instance_names) if not is_invalid_instance(n)]
+
+    def warm(name: str) -> Optional[str]:
+        base_url = instance_url(name)
+        try:
+            with tracing.span("prewarm", base_url=base_url):
+                # sent rather than served from the disk cache, which would
+                # leave the connection cold
+                send_request(
+                    "GET",
+                    f"{base_url}/api/now/table/sys_update_set",
+                    params={"sysparm_fields": "sys_id", "sysparm_limit": "1"},
+                    base_url=base_url,
+                ).raise_for_status()
+        except (requests.RequestException, ValueError) as ex:
+            return f"{type(ex).__name__}: {ex}"
+        return None
+
+    if not names:
+        return {}
+    with ThreadPoolExecutor(
+        max_workers=len(names), thread_name_prefix="snset-prewarm"
+    ) as executor:
+        # each instance is warmed within the caller's options and clients
+        futures = [
+            executor.submit(contextvars.copy_context().run, warm, name)
+            for name in names
+        ]
+        return {name: future.result() for name, future in zip(names, futures)}
+
+
+def get_update_sets(
+    instance_name: str, since: Optional[str] = None
+) -> List[Dict[str, str]]:
     """
     Handles retrieving the list of Complete update sets
     from the specified instance name. Uses basic auth credentials
@@ -61,6 +262,7 @@ def get_update_sets(instance_name: str) -> List[Dict[str, str]]:
 
     Parameters:
     instance_name: str - The SN Instance Host
+    since: str - only the sets updated at or after this timestamp
 
     Returns:
     list: List of update set dicts
@@ -68,13 +270,72 @@ def get_update_sets(instance_name: str) -> List[Dict[str, str]]:
     if is_invalid_instance(instance_name):
         raise ValueError("Please enter a valid instance name")
 
-    uri = f"https://{instance_name}.service-now.com/api/now/table/sys_update_set"
-    base_url: str = f"https://{instance_name}.service-now.com"
+    base_url: str = instance_url(instance_name)
+    uri = f"{base_url}/api/now/table/sys_update_set"
+    return fetch_records(uri, update_sets_params(since), base_url=base_url)
+
+
+def get_existing_sets(instance_name: str, set_ids: List[str]) -> List[Dict[str, str]]:
+    """
+    Looks up which of the named sets are complete on an instance, rather
+    than fetching every set it has
+
+    Parameters:
+    instance_name: str - the SN Instance Host
+    set_ids: List[str] - the update set names to look for
+
+    returns:
+    list: the update sets found, with their name only
+    """
+    if is_invalid_instance(instance_name):
+        raise ValueError("Please enter a valid instance name.")
+
+    if not isinstance(set_ids, List):
+        raise ValueError("set_ids must be a list")
+
+    for name in set_ids:
+        if not name or not isinstance(name, str):
+            raise ValueError("IDs cannot be null or empty")
+
+    if not set_ids:
+        return []
+    base_url: str = instance_url(instance_name)
+    uri = f"{base_url}/api/now/table/sys_update_set"
+    params = existing_sets_params(f"nameIN{','.join(set_ids)}")
+    try:
+        return fetch_records(uri, params, base_url=base_url)
+    except HTTPError as ex:
+        if ex.response.status_code != 400 and ex.response.status_code != 414:
+            raise ex
+        print(
+            "get_existing_sets: Received 400, attempting to split into multiple calls"
+        )
+        params_list = fallback_params(uri, set_ids, existing_sets_params)
+        return first_per_name(fetch_each(uri, params_list, base_url=base_url))
+
+
+def get_latest_update(instance_name: str) -> Optional[str]:
+    """
+    The latest sys_updated_on of the complete update sets of an instance
+
+    Parameters:
+    instance_name: str - the SN Instance Host
+
+    returns: str - the timestamp, None when the instance has no complete sets
+    """
+    if is_invalid_instance(instance_name):
+        raise ValueError("Please enter a valid instance name.")
+
+    base_url: str = instance_url(instance_name)
     params = {
-        "sysparm_query": "state=complete^ORstate=ignore",
-        "sysparm_fields": "name",
+        "sysparm_query": f"{UPDATE_SET_QUERY}^ORDERBYDESCsys_updated_on",
+        "sysparm_fields": "sys_updated_on",
+        "sysparm_limit": "1",
     }
-    return make_request(uri, path_params=params, base_url=base_url)
+    result = make_request(
+        f"{base_url}/api/now/table/sys_update_set", params, base_url=base_url
+    )
+    return result[0].get("sys_updated_on") if result else None
 
 
 def get_install_order(instance_name: str, set_ids: List[str]) -> List[Dict[str, str]]:
@@ -99,31 +360,11 @@ def get_install_order(instance_name: str, set_ids: List[str]) -> List[Dict[str,
         if not name or not isinstance(name, str):
             raise ValueError("IDs cannot be null or empty")
 
-    fields = [
-        "name",
-        "state",
-        "update_source",
-        "description",
-        "sys_created_on",
-        "commit_date",
-        "sys_updated_by",
-        "sys_updated_on",
-        "collisions",
-    ]
-
-    id_list = ",".join(set_ids)
-    base_url: str = f"https://{instance_name}.service-now.com"
-    uri = f"https://{instance_name}.service-now.com/api/now/table/sys_remote_update_set"
-    params = {
-        "sysparm_query": (
-            f"state=committed^nameIN{id_list}"
-            f"^commit_dateISNOTEMPTY^ORDERBYcommit_date"
-        ),
-        "sysparm_fields": ",".join(fields),
-        "sysparm_display_value": "true",
-    }
+    base_url: str = instance_url(instance_name)
+    uri = f"{base_url}/api/now/table/sys_remote_update_set"
+    params = install_order_params(f"nameIN{','.join(set_ids)}")
     try:
-        return make_request(uri, path_params=params, base_url=base_url)
+        return fetch_records(uri, params, base_url=base_url)
     except HTTPError as e:
         if e.response.status_code != 400 and e.response.status_code != 414:
             raise e
@@ -134,20 +375,10 @@ def get_install_order(instance_name: str, set_ids: List[str]) -> List[Dict[str,
                 "get_install_order: Received 400, "
                 "attempting to split into multiple calls"
             )
-            results = []
-            for name in set_ids:
-                params = {
-                    "sysparm_query": (
-                        f"state=committed^name={name}"
-                        f"^commit_dateISNOTEMPTY^ORDERBYcommit_date"
-                    ),
-                    "sysparm_fields": ",".join(fields),
-                    "sysparm_display_value": "true",
-                }
-                results.append(make_request(uri, path_params=params, base_url=base_url))
-
-            results = [elem[0] for elem in results if len(elem) > 0]
-            return order_sets(results)
+            params_list = fallback_params(uri, set_ids, install_order_params)
+            results = fetch_each(uri, params_list, base_url=base_url)
+
+            return order_sets(first_per_name(results))
 
 
 def order_sets(
@@ -185,28 +416,11 @@ def get_install_order_new(
         if not name or not isinstance(name, str):
             raise ValueError("IDs cannot be null or empty")
 
-    fields = [
-        "name",
-        "state",
-        "description",
-        "sys_created_on",
-        # "commit_date",
-        "sys_updated_by",
-        "sys_updated_on",
-    ]
-
-    id_list = ",".join(set_ids)
-    base_url: str = f"https://{instance_name}.service-now.com"
-    uri = f"https://{instance_name}.service-now.com/api/now/table/sys_update_set"
-    params = {
-        "sysparm_query": (
-            f"nameIN{id_list}^installed_fromISEMPTY"
-            "^install_date=NULL^ORDERBYsys_updated_on"
-        ),
-        "sysparm_fields": ",".join(fields),
-    }
+    base_url: str = instance_url(instance_name)
+    uri = f"{base_url}/api/now/table/sys_update_set"
+    params = install_order_new_params(f"nameIN{','.join(set_ids)}")
     try:
-        return make_request(uri, path_params=params, base_url=base_url)
+        return fetch_records(uri, params, base_url=base_url)
     except HTTPError as ex:
         if ex.response.status_code != 400 and ex.response.status_code != 414:
             raise ex
@@ -217,19 +431,209 @@ def get_install_order_new(
                 "get_install_order_new: Received 400, "
                 "attempting to split into multiple calls"
             )
-            results = []
-            for name in set_ids:
-                params = {
-                    "sysparm_query": (
-                        f"name={name}^installed_fromISEMPTY"
-                        "^install_date=NULL^ORDERBYsys_updated_on"
-                    ),
-                    "sysparm_fields": ",".join(fields),
-                }
-                results.append(make_request(uri, path_params=params, base_url=base_url))
+            params_list = fallback_params(uri, set_ids, install_order_new_params)
+            results = fetch_each(uri, params_list, base_url=base_url)
+
+            return order_sets(first_per_name(results), order_by_field="sys_updated_on")
 
-            results = [elem[0] for elem in results if len(elem) > 0]
-            return order_sets(results, order_by_field="sys_updated_on")
+
+def get_record_count(instance_name: str, table: str, query: str = "") -> int:
+    """
+    Counts the records of a table matching an encoded query with the
+    Aggregate API, without retrieving them
+
+    Parameters:
+    instance_name: str - the SN Instance Host
+    table: str - the table to count, i.e. sys_update_set
+    query: str - optional encoded query
+
+    returns: int - the number of matching records
+    """
+    if is_invalid_instance(instance_name):
+        raise ValueError("Please enter a valid instance name.")
+
+    base_url: str = instance_url(instance_name)
+    uri = f"{base_url}/api/now/stats/{table}"
+    params = {"sysparm_count": "true"}
+    if query:
+        params["sysparm_query"] = query
+    result = make_request(uri, path_params=params, base_url=base_url)
+    return int(result["stats"]["count"])
+
+
+def iter_pages(
+    uri: str,
+    params: Dict[str, str],
+    page_size: Optional[int] = None,
+    base_url: str | None = None,
+) -> Iterator[List[Dict]]:
+    """
+    Reads a Table API query a page at a time. Pages are keyed on sys_id
+    (sys_id>last^ORDERBYsys_id) rather than sysparm_offset, so a deep page
+    costs the instance as little as the first and rows inserted meanwhile
+    can't shift a row onto the next page twice
+
+    Parameters:
+    uri: str - the Table API uri, i.e. {base_url}/api/now/table/sys_update_xml
+    params: Dict - the query params, sys_id is added to sysparm_fields
+    page_size: int - rows per request, PAGE_SIZE by default
+
+    returns: Iterator[List[Dict]] - the non-empty pages, in sys_id order
+    """
+    page_size = page_size or PAGE_SIZE
+    params = dict(params)
+    fields = params.get("sysparm_fields")
+    if fields and "sys_id" not in fields.split(","):
+        params["sysparm_fields"] = f"{fields},sys_id"
+    query = params.get("sysparm_query", "")
+    last = None
+    while True:
+        terms = [query, f"sys_id>{last}" if last else "", "ORDERBYsys_id"]
+        page_params = {
+            **params,
+            "sysparm_query": "^".join(filter(None, terms)),
+            "sysparm_limit": str(page_size),
+        }
+        page = make_request(uri, path_params=page_params, base_url=base_url) or []
+        if page:
+            yield page
+        if len(page) < page_size:
+            return
+        last = page[-1]["sys_id"]
+
+
+def update_sets_params(since: Optional[str] = None) -> Dict[str, str]:
+    """
+    The Table API params get_update_sets queries sys_update_set with
+
+    Parameters:
+    since: str - only select the sets updated at or after this timestamp
+    """
+    query = UPDATE_SET_QUERY
+    if since:
+        # ^OR binds tighter than ^, this is (complete or ignore) and updated
+        query += f"^sys_updated_on>={since}"
+    return {
+        "sysparm_query": query,
+        "sysparm_fields": "name",
+    }
+
+
+def existing_sets_params(name_clause: str) -> Dict[str, str]:
+    """
+    The Table API params get_existing_sets queries sys_update_set with
+
+    Parameters:
+    name_clause: str - selects the sets, i.e. "nameINa,b" or "name=a"
+    """
+    return {
+        "sysparm_query": f"{UPDATE_SET_QUERY}^{name_clause}",
+        "sysparm_fields": "name",
+    }
+
+
+def install_order_params(name_clause: str) -> Dict[str, str]:
+    """
+    The Table API params get_install_order queries sys_remote_update_set with
+
+    Parameters:
+    name_clause: str - selects the sets, i.e. "nameINa,b" or "name=a"
+    """
+    return {
+        "sysparm_query": (
+            f"state=committed^{name_clause}"
+            f"^commit_dateISNOTEMPTY^ORDERBYcommit_date"
+        ),
+        "sysparm_fields": ",".join(INSTALL_ORDER_FIELDS),
+        "sysparm_display_value": "true",
+    }
+
+
+def install_order_new_params(name_clause: str) -> Dict[str, str]:
+    """
+    The Table API params get_install_order_new queries sys_update_set with
+
+    Parameters:
+    name_clause: str - selects the sets, i.e. "nameINa,b" or "name=a"
+    """
+    return {
+        "sysparm_query": (
+            f"{name_clause}^installed_fromISEMPTY"
+            "^install_date=NULL^ORDERBYsys_updated_on"
+        ),
+        "sysparm_fields": ",".join(NEW_SET_FIELDS),
+    }
+
+
+def name_clause(names: List[str]) -> str:
+    return f"name={names[0]}" if len(names) == 1 else f"nameIN{','.join(names)}"
+
+
+def chunk_names(
+    uri: str,
+    names: List[str],
+    build_params: Callable[[str], Dict[str, str]],
+    max_url_length: int,
+) -> List[List[str]]:
+    """
+    Splits names into the fewest nameIN queries whose urls fit in
+    max_url_length. A name too long to fit on its own gets its own chunk
+
+    Parameters:
+    uri: str - the Table API uri being queried
+    names: List[str] - the names to select
+    build_params: Callable - builds the query params for a name clause
+    max_url_length: int - the longest url the instance accepts
+
+    returns: List[List[str]] - the names of each query, in order
+    """
+    base = len(f"{uri}?{urlencode(build_params('nameIN'))}")
+    separator = len(quote_plus(","))
+    chunks: List[List[str]] = []
+    chunk: List[str] = []
+    length = base
+    for name in names:
+        size = len(quote_plus(name)) + (separator if chunk else 0)
+        if chunk and length + size > max_url_length:
+            chunks.append(chunk)
+            chunk, length, size = [], base, size - separator
+        chunk.append(name)
+        length += size
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def fallback_params(
+    uri: str, names: List[str], build_params: Callable[[str], Dict[str, str]]
+) -> List[Dict[str, str]]:
+    """
+    The queries a fallback makes when a single nameIN query is too long,
+    one per name, or as few nameIN queries as fit in the configured
+    max_url_length
+    """
+    max_url_length = options.get("max_url_length")
+    chunks = (
+        chunk_names(uri, names, build_params, max_url_length)
+        if max_url_length
+        else [[name] for name in names]
+    )
+    return [build_params(name_clause(chunk)) for chunk in chunks]
+
+
+def first_per_name(results: List[Optional[List[Dict]]]) -> List[Dict]:
+    """
+    Flattens the results of the fallback queries, keeping the first
+    record returned for each name
+    """
+    seen = set()
+    records = []
+    for result in results:
+        for record in result or []:
+            if record.get("name") not in seen:
+                seen.add(record.get("name"))
+                records.append(record)
+    return records
 
 
 def make_request(
@@ -244,35 +648,377 @@ def make_request(
         values to be added to the request
     base_url - optional base_url to include when using OAuth2
     """
-    client, basicAuth = client_factory(base_url=base_url)
+    if options.get("cache"):
+        r = cached_request(uri, path_params, base_url)
+    else:
+        r = send_request("GET", uri, params=path_params, base_url=base_url)
+        r.raise_for_status()
+    fields = (path_params or {}).get("sysparm_fields")
+    decoder = get_decoder(options.get("json_decoder") or "auto")
+    result = decoder.decode_result(r.content, fields.split(",") if fields else None)
+    count_rows(r, result)
+    return result
+
+
+def cached_request(
+    uri: str, path_params: Dict[str, str] = None, base_url: str | None = None
+) -> requests.Response:
+    """
+    Serves a GET from the shared disk cache, sending it (from one process
+    only) when it isn't cached. Only successful responses are stored
+    """
+    cache: DiskCache = options["cache"]
+    stats = options.get("stats")
+    sent: List[requests.Response] = []
+
+    def fill() -> bytes:
+        r = send_request("GET", uri, params=path_params, base_url=base_url)
+        r.raise_for_status()
+        sent.append(r)
+        return r.content
+
+    start = time.perf_counter()
+    with tracing.span("cache", url=uri) as span:
+        # instances see the records their user may read, so entries are kept
+        # per credentials
+        key = request_key("GET", uri, path_params, scope=credentials_of(base_url))
+        content, hit = cache.get_or_fill(key, fill)
+        span.set_attribute("hit", hit)
+    if sent:
+        return sent[0]
+    r = requests.Response()
+    r.status_code = 200
+    r._content = content
+    r.url = uri
+    if stats:
+        r.request_stat = stats.record(
+            "GET", uri, 200, time.perf_counter() - start, len(content), cached=True
+        )
+    return r
+
+
+def credentials_of(base_url: Optional[str]) -> str:
+    """
+    The credentials profile and user the requests to base_url are made with
+    """
+    instance = registry().by_url(base_url)
+    profile = instance.profile if instance else ""
+    return f"{profile}:{Settings(profile).get_user()}"
+
+
+def count_rows(r: Optional[requests.Response], result) -> None:
+    """
+    Adds the number of returned rows to the stats recorded for the response
+    """
+    stat = getattr(r, "request_stat", None)
+    if stat is not None and isinstance(result, list):
+        stat.rows = (stat.rows or 0) + len(result)
+
+
+def send_request(
+    method: str,
+    uri: str,
+    params: Dict[str, str] = None,
+    json: Dict = None,
+    base_url: str | None = None,
+) -> requests.Response:
+    """
+    Sends a single HTTP request to the instance using the client
+    configured for base_url. Every call to the instance goes through here,
+    so this is also where a cassette records or replays the exchange
+
+    Parameters:
+    method: str - the HTTP method, i.e. GET or POST
+    uri: str - The HTTP URI to make the request against
+    params: Dict - query params to add to the request
+    json: Dict - optional json body
+    base_url - optional base_url to include when using OAuth2
 
-    r: requests.Response = (
-        client.get(uri, params=path_params, auth=basicAuth)
-        if basicAuth
-        else client.get(uri, params=path_params)
+    returns: requests.Response - the raw response, status is not checked
+    """
+    cassette = options.get("cassette")
+    stats = options.get("stats")
+    policy: ResiliencePolicy = options.get("resilience") or DEFAULT_POLICY
+    retries = 0
+    with tracing.span(f"HTTP {method}", method=method, url=uri) as span:
+        policy.check_deadline()
+        start = time.perf_counter()
+        if cassette and cassette.replaying:
+            r = cassette.replay(method, uri, params, json)
+        else:
+            client, basicAuth = client_factory(base_url=base_url)
+
+            kwargs: Dict = {"params": params}
+            if json is not None:
+                kwargs["json"] = json
+            if basicAuth:
+                kwargs["auth"] = basicAuth
+            hedging = options.get("hedging") if method == "GET" else None
+            limiter = registry().limiter(base_url)
+
+            def send(timeout):
+                if limiter:
+                    limiter.acquire()
+                if hedging:
+                    attempts = itertools.count()
+
+                    def attempt():
+                        # a hedge is another request to the instance, it
+                        # takes a token of its own
+                        if limiter and next(attempts):
+                            limiter.acquire()
+                        return client.request(method, uri, timeout=timeout, **kwargs)
+
+                    return hedging.send(base_url or uri, attempt)
+                return client.request(method, uri, timeout=timeout, **kwargs)
+
+            start = time.perf_counter()
+            try:
+                r, retries = policy.send(method, base_url or uri, send)
+            except FailFast:
+                raise
+            except requests.RequestException as ex:
+                if stats:
+                    stats.record(method, uri, None, time.perf_counter() - start, 0)
+                raise ex
+            if cassette:
+                cassette.record(
+                    method, uri, params, json, r, time.perf_counter() - start
+                )
+        size = len(r.content or b"")
+        span.set_attribute("status", r.status_code)
+        span.set_attribute("bytes", size)
+        if retries:
+            span.set_attribute("retries", retries)
+        if stats:
+            r.request_stat = stats.record(
+                method,
+                uri,
+                r.status_code,
+                time.perf_counter() - start,
+                size,
+                retries=retries,
+                cached=bool(cassette and cassette.replaying),
+            )
+        return r
+
+
+def make_batch_request(
+    uri: str, params_list: List[Dict[str, str]], base_url: str | None = None
+) -> List[Optional[Dict]]:
+    """
+    Makes one GET request against uri per entry in params_list, packed into
+    as few ServiceNow Batch API calls as the configured limits allow
+
+    Parameters:
+    uri: str - The HTTP URI to make the requests against
+    params_list: List[Dict] - path params for each of the requests
+    base_url - the instance base url the batch endpoint lives on
+
+    returns: List - the "result" of each request, in params_list order
+
+    raises: BatchError listing every sub request that didn't succeed
+    """
+
+    sent: Dict[str, requests.Response] = {}
+
+    def send(payload: Dict) -> Dict:
+        r = send_request(
+            "POST", f"{base_url}{batch.BATCH_PATH}", json=payload, base_url=base_url
+        )
+        r.raise_for_status()
+        sent[payload["batch_request_id"]] = r
+        return r.json()
+
+    transport = BatchTransport(
+        send,
+        max_requests=options.get("batch_size") or batch.DEFAULT_MAX_REQUESTS,
+        max_bytes=options.get("batch_max_bytes") or batch.DEFAULT_MAX_BYTES,
     )
-    r.raise_for_status()
-    return r.json().get("result")
+    for params in params_list:
+        transport.add(uri, params)
+    responses = transport.flush()
+
+    failures = [response for response in responses if not response.ok]
+    if failures:
+        raise BatchError(failures)
+    results = []
+    for response in responses:
+        result = to_records(response.json().get("result"))
+        count_rows(sent.get(response.batch_id), result)
+        results.append(result)
+    return results
+
+
+def fetch_each(
+    uri: str, params_list: List[Dict[str, str]], base_url: str | None = None
+) -> List[Optional[Dict]]:
+    """
+    Makes one request per entry in params_list, used by the fallback
+    paths when a single IN query is too long for the instance. The requests
+    are sent through the Batch API when a batch size has been configured.
+    With a checkpoint, lookups completed by an earlier run aren't repeated.
+    The records of each lookup are added to the partial_rows option as it
+    completes, so a run stopped halfway keeps them
+
+    returns: List - the "result" of each request, in params_list order
+    """
+    checkpoint = options.get("checkpoint")
+    partial_rows = options.get("partial_rows")
+    results: List = [None] * len(params_list)
+    todo = list(range(len(params_list)))
+
+    def keep(idx: int, result) -> None:
+        results[idx] = result
+        if partial_rows is not None and isinstance(result, list):
+            partial_rows.extend(result)
+
+    if checkpoint:
+        todo = []
+        for idx, params in enumerate(params_list):
+            found, result = checkpoint.chunk(uri, params)
+            if found:
+                keep(idx, result)
+            else:
+                todo.append(idx)
+        if len(todo) < len(params_list):
+            print(
+                f"Resuming: {len(params_list) - len(todo)} of {len(params_list)} "
+                "lookups loaded from the checkpoint"
+            )
+
+    if batch_size := options.get("batch_size"):
+        # one Batch API call at a time, so each is checkpointed as it completes
+        for start in range(0, len(todo), batch_size):
+            group = todo[start : start + batch_size]
+            with tracing.span("fallback batch", url=uri, requests=len(group)):
+                fetched = make_batch_request(
+                    uri, [params_list[idx] for idx in group], base_url=base_url
+                )
+            for idx, result in zip(group, fetched):
+                keep(idx, result)
+                if checkpoint:
+                    checkpoint.save_chunk(uri, params_list[idx], result)
+        return results
+
+    for idx in todo:
+        with tracing.span("fallback chunk", url=uri, chunk=idx, of=len(params_list)):
+            keep(idx, fetch_records(uri, params_list[idx], base_url=base_url))
+        if checkpoint:
+            checkpoint.save_chunk(uri, params_list[idx], results[idx])
+    return results
+
+
+def fetch_records(
+    uri: str, params: Dict[str, str], base_url: str | None = None
+) -> List[Dict]:
+    """
+    Retrieves the records of a Table API query using the configured backend.
+    "table" (the default) uses the Table API, "jsonv2" and "csv" use
+    the bulk export processors and "auto" prefers JSONv2, falling back to the
+    Table API for instances where the processor isn't available. Queries
+    the processors can't return in the Table API shape, i.e. ones selecting
+    a reference field, always use the Table API
+
+    Parameters:
+    uri: str - the Table API uri, i.e. {base_url}/api/now/table/sys_update_set
+    params: Dict - the Table API path params for the query
+    base_url - the instance base url
+
+    returns: List[Dict] - the records, in the same shape for every backend
+    """
+    backend = options.get("backend") or "table"
+    export_format = "jsonv2" if backend == "auto" else backend
+    if (
+        backend == "table"
+        or (backend == "auto" and base_url in export.unavailable_instances)
+        or not export.exportable(params, export_format)
+    ):
+        return make_request(uri, path_params=params, base_url=base_url)
+
+    try:
+        return make_export_request(uri, params, export_format, base_url=base_url)
+    except (HTTPError, ValueError) as ex:
+        if backend != "auto":
+            raise ex
+        status_code = getattr(getattr(ex, "response", None), "status_code", None)
+        if status_code in (400, 414):
+            # the query is too long, the caller falls back to smaller requests
+            raise ex
+        print(f"Export processor unavailable on {base_url}, using the Table API")
+        export.unavailable_instances.add(base_url)
+        return make_request(uri, path_params=params, base_url=base_url)
+
+
+def make_export_request(
+    uri: str,
+    params: Dict[str, str],
+    export_format: str = "jsonv2",
+    base_url: str | None = None,
+) -> List[Dict]:
+    """
+    Runs a Table API query through the JSONv2 or CSV export processor, a
+    page at a time, then puts the records back in the query's order
+
+    Parameters:
+    uri: str - the Table API uri the query was built for
+    params: Dict - the Table API path params for the query
+    export_format: str - "jsonv2" or "csv"
+    base_url - the instance base url
+
+    returns: List[Dict] - the records, shaped like the Table API result
+    """
+    page_size = export.EXPORT_PAGE_SIZE
+    keep_sys_id = "sys_id" in (params.get("sysparm_fields") or "").split(",")
+    result: List[Dict] = []
+    last = None
+    while True:
+        export_uri, export_params = export.export_request(
+            uri, params, export_format, page_size=page_size, after=last
+        )
+        r: requests.Response = send_request(
+            "GET", export_uri, params=export_params, base_url=base_url
+        )
+        r.raise_for_status()
+        page = export.parse_export(r.content, export_format, params)
+        count_rows(r, page)
+        result.extend(page)
+        if len(page) < page_size:
+            break
+        last = page[-1]["sys_id"]
+    if not keep_sys_id:
+        for record in result:
+            record.pop("sys_id", None)
+    return to_records(export.order_records(result, params.get("sysparm_query", "")))
+
+
+def registry() -> Registry:
+    """
+    The instances of the run, from --registry, SN_SET_REGISTRY or the defaults
+    """
+    return options.get("registry") or load_registry()
+
+
+def instance_url(instance_name: str) -> str:
+    """
+    Looks up the base url of the given instance name in the registry, i.e.
+    https://nyudev.service-now.com
+    """
+    if template := options.get("instance_url"):
+        return template.format(instance=instance_name)
+    instance = registry().get(instance_name)
+    if instance:
+        return instance.base_url
+    return DEFAULT_INSTANCE_URL.format(instance=instance_name)
 
 
 def is_invalid_instance(instance_name: str) -> bool:
     """
-    TODO later add a method to call out to see if it's a valid instance
-    Checks whether the supplied instance is valid
+    Checks whether the supplied instance is in the registry
 
     parameters:
     instance: str - the instance's unique name, i.e. nyudev
 
-    returns bool - True if it is valid, false otherwise
-    """
-    return (
-        instance_name != "nyu"
-        and instance_name != "nyuqa"
-        and instance_name != "nyutest"
-        and instance_name != "nyudev"
-        and instance_name != "nyutrain"
-        and instance_name != "nyusandbox"
-        and instance_name != "nyudev2"
-        and instance_name != "nyudev3"
-        and instance_name != "nyu2"
-    )
+    returns bool - True if it is invalid, false otherwise
+    """
+    return not isinstance(instance_name, str) or registry().get(instance_name) is None
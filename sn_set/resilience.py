@@ -0,0 +1,263 @@
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, Optional, Tuple
+
+import requests
+
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_READ_TIMEOUT = 120.0
+# responses worth trying again, the instance is busy rather than wrong
+RETRY_STATUSES = {429, 502, 503, 504}
+
+
+class FailFast(requests.RequestException):
+    """
+    Raised instead of sending a request that can't succeed
+    """
+
+
+class DeadlineExceeded(FailFast, requests.Timeout):
+    """
+    The run's deadline passed, no further requests are made
+    """
+
+
+class CircuitOpenError(FailFast, requests.ConnectionError):
+    """
+    The instance failed too many times in a row, requests to it fail fast
+    until the breaker's reset timeout has passed
+    """
+
+
+class Deadline:
+    """
+    A point in time the whole run has to finish by
+
+    Parameters:
+    seconds: float - how long the run may take from now
+    """
+
+    def __init__(self, seconds: float, clock: Callable[[], float] = time.monotonic):
+        self.seconds = seconds
+        self.clock = clock
+        self.expires = clock() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires - self.clock())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def check(self) -> None:
+        if self.expired:
+            raise DeadlineExceeded(f"Deadline of {self.seconds:g}s exceeded")
+
+
+class CircuitBreaker:
+    """
+    Counts consecutive failures against an instance. Once there have been
+    failure_threshold of them the breaker opens and requests fail fast; after
+    reset_timeout seconds a single trial request is let through (half open),
+    closing the breaker again if it succeeds
+
+    Parameters:
+    name: str - what the breaker protects, i.e. the instance base url
+    failure_threshold: int - consecutive failures before opening
+    reset_timeout: float - seconds to stay open before a trial request
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if self.clock() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def before_request(self) -> None:
+        with self._lock:
+            state = self.state
+            if state == "open" or (state == "half-open" and self._trial):
+                raise CircuitOpenError(
+                    f"Circuit open for {self.name} after {self.failures} "
+                    "consecutive failures"
+                )
+            if state == "half-open":
+                self._trial = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+            self._trial = False
+
+
+def retry_after(response: requests.Response) -> Optional[float]:
+    """
+    The wait the instance asked for in a Retry-After header, in seconds
+    """
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class ResiliencePolicy:
+    """
+    How requests to the instances are protected: connect and read timeouts,
+    retries of busy responses, a deadline for the whole run and a circuit
+    breaker per instance
+
+    Parameters:
+    connect_timeout: float - seconds to wait for a connection
+    read_timeout: float - seconds to wait between bytes of the response
+    retries: int - retries of 429/502/503/504 responses and, for GETs,
+        connection errors and timeouts
+    backoff: float - seconds before the first retry, doubled for each one after,
+        unless the instance sent a Retry-After
+    max_retry_wait: float - longest wait before a retry
+    deadline: float - optional seconds the run may take
+    failure_threshold: int - consecutive failures before an instance's breaker
+        opens, 0 disables the breakers
+    reset_timeout: float - seconds a breaker stays open
+    """
+
+    def __init__(
+        self,
+        connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+        read_timeout: float = DEFAULT_READ_TIMEOUT,
+        retries: int = 0,
+        backoff: float = 1.0,
+        max_retry_wait: float = 60.0,
+        deadline: Optional[float] = None,
+        failure_threshold: int = 0,
+        reset_timeout: float = 30.0,
+        sleep: Callable[[float], None] = time.sleep,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_retry_wait = max_retry_wait
+        self.deadline = Deadline(deadline, clock) if deadline else None
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.sleep = sleep
+        self.clock = clock
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, key: str) -> Optional[CircuitBreaker]:
+        if not self.failure_threshold:
+            return None
+        with self._lock:
+            if key not in self.breakers:
+                self.breakers[key] = CircuitBreaker(
+                    key, self.failure_threshold, self.reset_timeout, self.clock
+                )
+            return self.breakers[key]
+
+    def timeout(self) -> Tuple[float, float]:
+        """
+        The (connect, read) timeout for the next request, cut short so a
+        request can't outlive the deadline
+        """
+        if not self.deadline:
+            return self.connect_timeout, self.read_timeout
+        remaining = max(self.deadline.remaining(), 0.001)
+        return min(self.connect_timeout, remaining), min(self.read_timeout, remaining)
+
+    def check_deadline(self) -> None:
+        if self.deadline:
+            self.deadline.check()
+
+    def send(
+        self,
+        method: str,
+        key: str,
+        send: Callable[[Tuple[float, float]], requests.Response],
+    ) -> Tuple[requests.Response, int]:
+        """
+        Sends a request through the policy
+
+        Parameters:
+        method: str - the HTTP method, only GETs are retried after an exception
+        key: str - the instance the request goes to, i.e. its base url
+        send: Callable - sends the request with the given (connect, read) timeout
+
+        returns: Tuple - the final response and the number of retries it took
+
+        raises: DeadlineExceeded, CircuitOpenError or the request's own exception
+        """
+        breaker = self.breaker(key)
+        attempt = 0
+        while True:
+            self.check_deadline()
+            if breaker:
+                breaker.before_request()
+            try:
+                r = send(self.timeout())
+            except requests.RequestException as ex:
+                if breaker:
+                    breaker.record_failure()
+                if self.deadline and self.deadline.expired:
+                    raise DeadlineExceeded(
+                        f"Deadline of {self.deadline.seconds:g}s exceeded"
+                    ) from ex
+                retryable = method.upper() == "GET" and isinstance(
+                    ex, (requests.ConnectionError, requests.Timeout)
+                )
+                wait = self.backoff * 2**attempt
+                if not retryable or attempt >= self.retries:
+                    raise ex
+                if self.deadline and wait >= self.deadline.remaining():
+                    raise ex
+            else:
+                if breaker:
+                    if r.status_code >= 500:
+                        breaker.record_failure()
+                    elif r.status_code != 429:
+                        breaker.record_success()
+                if r.status_code not in RETRY_STATUSES or attempt >= self.retries:
+                    return r, attempt
+                wait = retry_after(r)
+                if wait is None:
+                    wait = self.backoff * 2**attempt
+                if self.deadline and wait >= self.deadline.remaining():
+                    # no time left to try again, the caller gets the response
+                    return r, attempt
+            self.sleep(min(wait, self.max_retry_wait))
+            attempt += 1
@@ -0,0 +1,407 @@
+import json
+import threading
+import time
+from collections import Counter
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+
+from .comparator import Comparator
+from .records import json_default
+from .requests_lib import (
+    UPDATE_SET_QUERY,
+    instance_url,
+    is_invalid_instance,
+    iter_pages,
+)
+from .watermarks import window_start
+
+# the states get_update_sets keeps, see UPDATE_SET_QUERY
+COMPLETE_STATES = {"complete", "ignore"}
+INVENTORY_FIELDS = "sys_id,name,state,sys_updated_on"
+
+
+class Inventory:
+    """
+    The complete update sets of an instance, kept in memory. The first
+    refresh loads them all, later ones only read the sets updated since the
+    watermark (the latest sys_updated_on seen), so sets that were
+    completed, reopened or renamed are picked up. Deleted sets are only
+    noticed by a full refresh
+
+    Parameters:
+    instance: str - the SN Instance Host
+    """
+
+    def __init__(self, instance: str):
+        self.instance = instance
+        # sys_id -> (name, sys_updated_on) of the complete sets
+        self.sets: Dict[str, Tuple[str, str]] = {}
+        self.names: Counter = Counter()
+        self.watermark: Optional[str] = None
+        self.version = 0
+        self.refreshed_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def _query(self, full: bool) -> str:
+        if full or not self.watermark:
+            return UPDATE_SET_QUERY
+        return f"sys_updated_on>={window_start(self.watermark)}"
+
+    def refresh(self, full: bool = False) -> int:
+        """
+        Brings the inventory up to date
+
+        Parameters:
+        full: bool - reload every set instead of those changed since the
+            watermark
+
+        returns: int - the number of sets added, changed or removed
+        """
+        with self._refresh_lock:
+            full = full or self.watermark is None
+            base_url = instance_url(self.instance)
+            params = {
+                "sysparm_query": self._query(full),
+                "sysparm_fields": INVENTORY_FIELDS,
+            }
+            rows = [
+                row
+                for page in iter_pages(
+                    f"{base_url}/api/now/table/sys_update_set",
+                    params,
+                    base_url=base_url,
+                )
+                for row in page
+            ]
+            with self._lock:
+                changed = self._apply(rows, full)
+                if changed:
+                    self.version += 1
+                self.refreshed_at = time.time()
+                self.last_error = None
+            return changed
+
+    def _apply(self, rows: List[Dict], full: bool) -> int:
+        sets = {} if full else dict(self.sets)
+        for row in rows:
+            sys_id = row.get("sys_id")
+            if row.get("state") in COMPLETE_STATES and row.get("name"):
+                sets[sys_id] = (row["name"], row.get("sys_updated_on") or "")
+            else:
+                sets.pop(sys_id, None)
+            updated_on = row.get("sys_updated_on") or ""
+            if updated_on > (self.watermark or ""):
+                self.watermark = updated_on
+        changed = sum(
+            1
+            for key in sets.keys() | self.sets.keys()
+            if sets.get(key) != self.sets.get(key)
+        )
+        self.sets = sets
+        self.names = Counter(name for name, _ in sets.values())
+        return changed
+
+    def snapshot(self, since: Optional[str] = None) -> Tuple[List[str], int]:
+        """
+        The names of the complete sets and the version they are from
+
+        Parameters:
+        since: str - only the sets updated at or after this sys_updated_on
+        """
+        with self._lock:
+            if since:
+                names = list(
+                    dict.fromkeys(
+                        name
+                        for name, updated_on in self.sets.values()
+                        if updated_on >= since
+                    )
+                )
+            else:
+                names = list(self.names)
+            return names, self.version
+
+    def status(self) -> Dict:
+        with self._lock:
+            return {
+                "sets": len(self.sets),
+                "watermark": self.watermark,
+                "version": self.version,
+                "refreshed_at": self.refreshed_at,
+                "last_error": self.last_error,
+            }
+
+
+class PairCache:
+    """
+    The diff and install order of a source and target, recomputed only
+    when either inventory changes
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # held while the install order is fetched, which takes a while, so
+        # diff queries aren't kept waiting
+        self.order_lock = threading.Lock()
+        self.diff_key: Optional[Tuple] = None
+        self.diff: List[str] = []
+        self.order_key: Optional[Tuple] = None
+        self.install_order: List = []
+
+
+class SnsetService:
+    """
+    Keeps the inventories of the instances it is asked about warm and
+    answers diff and install order queries from them
+
+    Parameters:
+    interval: float - seconds between refreshes of every inventory
+    full_every: int - every Nth refresh reloads the inventories in full,
+        to notice deleted sets. 0 never does
+    settings: Dict - the run options of the service's requests, see
+        Comparator
+    """
+
+    def __init__(
+        self,
+        interval: float = 300.0,
+        full_every: int = 12,
+        settings: Optional[Dict] = None,
+    ):
+        self.interval = interval
+        self.full_every = full_every
+        # the install orders are held by the PairCache, as long as the diff
+        # they are of doesn't change
+        self.comparator = Comparator(settings, max_age=0)
+        self.inventories: Dict[str, Inventory] = {}
+        self.pairs: Dict[Tuple[str, str], PairCache] = {}
+        self.refreshes = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def inventory(self, instance: str) -> Inventory:
+        """
+        The inventory of an instance, loaded on first use
+        """
+        return self._load(instance)[0]
+
+    def _load(self, instance: str) -> Tuple[Inventory, Optional[int]]:
+        # the inventory and the sets found if this call loaded it
+        if is_invalid_instance(instance):
+            raise ValueError(f"Invalid instance name {instance}")
+        with self._lock:
+            inventory = self.inventories.get(instance)
+            if inventory is None:
+                inventory = self.inventories[instance] = Inventory(instance)
+        if inventory.refreshed_at is None:
+            with self.comparator.scope():
+                return inventory, inventory.refresh()
+        return inventory, None
+
+    def refresh(self, instance: str, full: bool = False) -> int:
+        """
+        Refreshes the inventory of an instance, an instance not asked about
+        before is only loaded once
+
+        returns: int - the number of sets added, changed or removed
+        """
+        inventory, loaded = self._load(instance)
+        if loaded is not None:
+            return loaded
+        with self.comparator.scope():
+            return inventory.refresh(full=full)
+
+    def _pair(self, source: str, target: str) -> PairCache:
+        with self._lock:
+            return self.pairs.setdefault((source, target), PairCache())
+
+    def diff(self, source: str, target: str, since: Optional[str] = None) -> Dict:
+        """
+        The sets of source that aren't in target
+
+        Parameters:
+        since: str - only the source sets updated at or after this
+            sys_updated_on, i.e. the sets completed since the last poll
+        """
+        source_names, source_version = self.inventory(source).snapshot(since)
+        target_names, target_version = self.inventory(target).snapshot()
+        result = {
+            "source": source,
+            "target": target,
+            "versions": {source: source_version, target: target_version},
+        }
+        if since:
+            # a narrow diff is cheap, only the full diff is cached
+            sets = self.comparator.missing(source_names, target_names)
+            return {**result, "count": len(sets), "sets": sets}
+        key = (source_version, target_version)
+        pair = self._pair(source, target)
+        with pair.lock:
+            if pair.diff_key != key:
+                pair.diff = self.comparator.missing(source_names, target_names)
+                pair.diff_key = key
+            return {**result, "count": len(pair.diff), "sets": pair.diff}
+
+    def install_order(
+        self, source: str, target: str, fields: Optional[List[str]] = None
+    ) -> Dict:
+        """
+        The sets of source missing in target, in install order. Computed
+        from the instance on the first query and whenever the diff changes
+
+        Parameters:
+        fields: List[str] - only return these fields of each set
+        """
+        result = self.diff(source, target)
+        key = (result["versions"][source], result["versions"][target])
+        pair = self._pair(source, target)
+        with pair.order_lock:
+            if pair.order_key != key:
+                # the comparator holds the order of the previous diff
+                self.comparator.refresh(source)
+                pair.install_order = list(
+                    self.comparator.install_order(source, result["sets"])
+                )
+                pair.order_key = key
+            rows = pair.install_order
+        if fields:
+            rows = [{field: row.get(field) for field in fields} for row in rows]
+        return {**result, "install_order": rows}
+
+    def refresh_all(self) -> None:
+        """
+        Refreshes every known inventory, keeping the old data of those that
+        fail
+        """
+        self.refreshes += 1
+        full = bool(self.full_every) and self.refreshes % self.full_every == 0
+        with self._lock:
+            inventories = list(self.inventories.values())
+        for inventory in inventories:
+            try:
+                with self.comparator.scope():
+                    inventory.refresh(full=full)
+            except Exception as ex:
+                # kept for /status, an error must not end the _watch thread
+                inventory.last_error = f"{type(ex).__name__}: {ex}"
+
+    def start(self) -> "SnsetService":
+        self._thread = threading.Thread(
+            target=self._watch, name="snset-refresh", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.refresh_all()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.comparator.close()
+
+    def status(self) -> Dict:
+        with self._lock:
+            inventories = dict(self.inventories)
+        return {
+            "interval": self.interval,
+            "refreshes": self.refreshes,
+            "instances": {name: inv.status() for name, inv in inventories.items()},
+        }
+
+
+def make_handler(service: SnsetService) -> Callable:
+    """
+    The request handler of the local HTTP/JSON endpoint:
+
+    GET /status
+    GET /diff?source=&target=[&since=]
+    GET /install-order?source=&target=[&fields=name,commit_date]
+    POST /refresh[?instance=]
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status: int, payload: Dict) -> None:
+            body = json.dumps(payload, default=json_default).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _handle(self, method: str) -> None:
+            parts = urlsplit(self.path)
+            query = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+            try:
+                status, payload = route(service, method, parts.path, query)
+            except ValueError as ex:
+                status, payload = HTTPStatus.BAD_REQUEST, {"error": str(ex)}
+            except requests.RequestException as ex:
+                status, payload = HTTPStatus.BAD_GATEWAY, {
+                    "error": f"{type(ex).__name__}: {ex}"
+                }
+            except Exception as ex:
+                status, payload = HTTPStatus.INTERNAL_SERVER_ERROR, {
+                    "error": f"{type(ex).__name__}: {ex}"
+                }
+            self._send(status, payload)
+
+        def do_GET(self):
+            self._handle("GET")
+
+        def do_POST(self):
+            self._handle("POST")
+
+    return Handler
+
+
+def route(
+    service: SnsetService, method: str, path: str, query: Dict[str, str]
+) -> Tuple[int, Dict]:
+    """
+    Answers a single request to the endpoint
+
+    returns: Tuple - the HTTP status and the json payload
+    """
+    path = path.rstrip("/")
+    if method == "GET" and path == "/status":
+        return HTTPStatus.OK, service.status()
+    if method == "GET" and path in ("/diff", "/install-order"):
+        source, target = query.get("source"), query.get("target")
+        if not source or not target:
+            raise ValueError("source and target are required")
+        if path == "/diff":
+            return HTTPStatus.OK, service.diff(source, target, since=query.get("since"))
+        fields = [f for f in query.get("fields", "").split(",") if f]
+        return HTTPStatus.OK, service.install_order(source, target, fields=fields)
+    if method == "POST" and path == "/refresh":
+        instance = query.get("instance")
+        if instance:
+            changed = service.refresh(instance, full=query.get("full") == "true")
+            return HTTPStatus.OK, {"instance": instance, "changed": changed}
+        service.refresh_all()
+        return HTTPStatus.OK, service.status()
+    return HTTPStatus.NOT_FOUND, {"error": f"Not found: {method} {path}"}
+
+
+def make_server(
+    service: SnsetService, host: str = "127.0.0.1", port: int = 8765
+) -> ThreadingHTTPServer:
+    """
+    Creates the HTTP server for a service, call serve_forever() on it
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    server.daemon_threads = True
+    return server
@@ -2,17 +2,34 @@ from environs import Env
 
 
 class Settings:
-    def __init__(self):
+    """
+    The credentials snset connects with. With a profile, each setting is
+    read from the profile's prefixed variable first, i.e. DEV_SN_USER_NAME,
+    falling back to the unprefixed one
+
+    Parameters:
+    profile: str - the credentials profile of an instance, see the registry
+    """
+
+    def __init__(self, profile: str = ""):
         env: Env = Env()
         env.read_env()
-        self.user: str = env.str("SN_USER_NAME")
-        self.password: str = env.str("SN_PASSWORD")
-        self.use_oauth: bool = env.bool("SN_SET_USE_OAUTH", False)
+        self.profile = profile.upper()
+        self.user: str = self._read(env.str, "SN_USER_NAME")
+        self.password: str = self._read(env.str, "SN_PASSWORD")
+        self.use_oauth: bool = self._read(env.bool, "SN_SET_USE_OAUTH", False)
         if self.use_oauth:
-            self.client_id: str = env.str("SN_SET_CLIENT_ID")
-            self.client_secret: str = env.str("SN_SET_CLIENT_SECRET")
+            self.client_id: str = self._read(env.str, "SN_SET_CLIENT_ID")
+            self.client_secret: str = self._read(env.str, "SN_SET_CLIENT_SECRET")
             self.grant_type: str = "password"
 
+    def _read(self, parse, name: str, *default):
+        if self.profile:
+            value = parse(f"{self.profile}_{name}", None)
+            if value is not None:
+                return value
+        return parse(name, *default)
+
     def get_user(self) -> str:
         return self.user
 
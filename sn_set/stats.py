@@ -0,0 +1,195 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from typing import Dict, Iterator, List, Optional
+from urllib.parse import urlsplit
+
+# requests made outside of any stage, i.e. when sn_set is used as a library
+DEFAULT_STAGE = "other"
+
+
+@dataclass
+class RequestStat:
+    """
+    What was observed for a single HTTP request
+    """
+
+    stage: str
+    method: str
+    endpoint: str
+    status: Optional[int]
+    latency: float
+    bytes: int
+    rows: Optional[int] = None
+    retries: int = 0
+    cached: bool = False
+
+
+@dataclass
+class StageStat:
+    """
+    Wall time of a single pipeline stage, i.e. "source fetch"
+    """
+
+    name: str
+    started: float
+    wall: float = 0.0
+    requests: List[RequestStat] = field(default_factory=list)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+class StatsCollector:
+    """
+    Collects per request metrics, grouped by the pipeline stage that was
+    running when the request was made
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages: Dict[str, StageStat] = {}
+        # the stage of the calling context, so work handed to another thread
+        # with contextvars.copy_context (a hedged request) keeps its stage.
+        # Threads started without it see the latest stage
+        self._context_stage: ContextVar[Optional[str]] = ContextVar(
+            "snset_stage", default=None
+        )
+        self._latest: str = DEFAULT_STAGE
+        self.started = time.perf_counter()
+
+    @property
+    def current(self) -> str:
+        return self._context_stage.get() or self._latest
+
+    def _stage(self, name: str) -> StageStat:
+        if name not in self.stages:
+            self.stages[name] = StageStat(name, time.perf_counter())
+        return self.stages[name]
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[StageStat]:
+        """
+        Attributes every request made inside the block to the named stage
+        """
+        with self._lock:
+            stage_stat = self._stage(name)
+            previous, self._latest = self._latest, name
+        token = self._context_stage.set(name)
+        start = time.perf_counter()
+        try:
+            yield stage_stat
+        finally:
+            self._context_stage.reset(token)
+            with self._lock:
+                stage_stat.wall += time.perf_counter() - start
+                self._latest = previous
+
+    def record(
+        self,
+        method: str,
+        uri: str,
+        status: Optional[int],
+        latency: float,
+        size: int,
+        rows: Optional[int] = None,
+        retries: int = 0,
+        cached: bool = False,
+    ) -> RequestStat:
+        stat = RequestStat(
+            self.current,
+            method.upper(),
+            urlsplit(uri).path,
+            status,
+            latency,
+            size,
+            rows,
+            retries,
+            cached,
+        )
+        with self._lock:
+            self._stage(stat.stage).requests.append(stat)
+        return stat
+
+    def summary(self) -> Dict:
+        """
+        Aggregates the requests of each stage
+
+        returns: Dict - totals for the run and per stage aggregates
+        """
+        stages = []
+        with self._lock:
+            stage_list = list(self.stages.values())
+        for stage_stat in stage_list:
+            requests = stage_stat.requests
+            latencies = [r.latency for r in requests]
+            stages.append(
+                {
+                    "stage": stage_stat.name,
+                    "wall_s": round(stage_stat.wall, 4),
+                    "requests": len(requests),
+                    "errors": sum(
+                        1 for r in requests if not r.status or r.status >= 400
+                    ),
+                    "request_s": round(sum(latencies), 4),
+                    "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+                    "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+                    "bytes": sum(r.bytes for r in requests),
+                    "rows": sum(r.rows or 0 for r in requests),
+                    "retries": sum(r.retries for r in requests),
+                    "cache_hits": sum(1 for r in requests if r.cached),
+                }
+            )
+        totals = {
+            key: sum(s[key] for s in stages)
+            for key in ["requests", "errors", "bytes", "rows", "retries", "cache_hits"]
+        }
+        totals["wall_s"] = round(time.perf_counter() - self.started, 4)
+        return {"totals": totals, "stages": stages}
+
+    def to_json(self, include_requests: bool = True, extra: Dict = None) -> str:
+        """
+        The summary as json, optionally with every request and extra
+        top level sections, i.e. the hedging summary
+        """
+        payload = self.summary()
+        payload.update(extra or {})
+        if include_requests:
+            with self._lock:
+                payload["requests"] = [
+                    asdict(r) for s in self.stages.values() for r in s.requests
+                ]
+        return json.dumps(payload, indent=2)
+
+    def format_table(self) -> str:
+        """
+        Renders the per stage summary as a plain text table
+        """
+        summary = self.summary()
+        columns = [
+            ("stage", "stage", "<16"),
+            ("wall_s", "wall s", ">8"),
+            ("requests", "reqs", ">6"),
+            ("errors", "errs", ">5"),
+            ("request_s", "req s", ">8"),
+            ("p50_ms", "p50 ms", ">8"),
+            ("p95_ms", "p95 ms", ">8"),
+            ("bytes", "bytes", ">11"),
+            ("rows", "rows", ">8"),
+            ("retries", "retry", ">6"),
+            ("cache_hits", "cache", ">6"),
+        ]
+        lines = [" ".join(f"{title:{fmt}}" for _, title, fmt in columns)]
+        for row in summary["stages"] + [{"stage": "total", **summary["totals"]}]:
+            lines.append(
+                " ".join(f"{row.get(key, '')!s:{fmt}}" for key, _, fmt in columns)
+            )
+        return "\n".join(lines)
@@ -0,0 +1,163 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional
+
+
+class Span:
+    """
+    A timed unit of work, i.e. a single HTTP request or a cli stage
+    """
+
+    __slots__ = (
+        "name",
+        "attributes",
+        "trace_id",
+        "span_id",
+        "parent_id",
+        "start",
+        "end",
+        "error",
+        "hook_data",
+    )
+
+    def __init__(self, name: str, attributes: Dict, parent: Optional["Span"]):
+        self.name = name
+        self.attributes = attributes
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else None
+        self.start = time.time()
+        self.end: Optional[float] = None
+        self.error: Optional[str] = None
+        # somewhere for hooks to keep their own per span state
+        self.hook_data: Dict = {}
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time.time()) - self.start
+
+    def set_attribute(self, key: str, value) -> None:
+        self.attributes[key] = value
+
+    def to_dict(self) -> Dict:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": self.start,
+            "end": self.end,
+            "duration_ms": round(self.duration * 1000, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class _NoopSpan:
+    """
+    Handed out when tracing is disabled, so instrumented code doesn't
+    need to check whether there are any hooks
+    """
+
+    __slots__ = ()
+
+    def set_attribute(self, key: str, value) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class TraceHook:
+    """
+    Base class for trace callbacks, override the callbacks you need
+    """
+
+    def on_start(self, span: Span) -> None:
+        pass
+
+    def on_end(self, span: Span) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+# the registered hooks, tracing is a no-op while this is empty
+hooks: List[TraceHook] = []
+_current: ContextVar[Optional[Span]] = ContextVar("snset_span", default=None)
+
+
+def add_hook(hook: TraceHook) -> TraceHook:
+    hooks.append(hook)
+    return hook
+
+
+def remove_hook(hook: TraceHook) -> None:
+    if hook in hooks:
+        hooks.remove(hook)
+    hook.close()
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Span]:
+    """
+    Traces the wrapped block as a span, nested under the current span
+
+    Usage:
+    with span("http GET", url=uri) as s:
+        ...
+        s.set_attribute("status", 200)
+    """
+    if not hooks:
+        yield NOOP_SPAN
+        return
+    new_span = Span(name, attributes, _current.get())
+    active = list(hooks)
+    for hook in active:
+        hook.on_start(new_span)
+    token = _current.set(new_span)
+    try:
+        yield new_span
+    except BaseException as ex:
+        # a clean exit() from the cli isn't an error
+        if not (isinstance(ex, SystemExit) and not ex.code):
+            new_span.error = f"{type(ex).__name__}: {ex}"
+        raise
+    finally:
+        _current.reset(token)
+        new_span.end = time.time()
+        for hook in active:
+            hook.on_end(new_span)
+
+
+class JsonTraceExporter(TraceHook):
+    """
+    Writes every finished span to a file as a line of json
+
+    Parameters:
+    path: str - the file to write the trace to
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "w")
+
+    def on_end(self, span: Span) -> None:
+        line = json.dumps(span.to_dict(), default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def close(self) -> None:
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
@@ -0,0 +1,161 @@
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover - exercised when the extra isn't installed
+    httpx = None
+
+TRANSPORTS = ["requests", "httpx"]
+
+# streams (or connections, over HTTP/1.1) kept open per instance
+DEFAULT_MAX_CONNECTIONS = 20
+
+
+class BearerAuth(httpx.Auth if httpx is not None else object):
+    """
+    Sends the bearer token of an OAuth2 session with httpx, fetching a new
+    one when it is about to expire or the instance answers 401, so a long
+    lived process (snset serve, snset batch) keeps working past the
+    token's lifetime
+
+    Parameters:
+    session: OAuth2Session - holds the current token
+    fetch_token: Callable - fetches a new token into the session
+    """
+
+    # seconds before its expiry a token is replaced
+    EXPIRY_MARGIN = 30.0
+
+    def __init__(
+        self,
+        session: Any,
+        fetch_token: Callable[[], Any],
+        clock: Callable[[], float] = time.time,
+    ):
+        self.session = session
+        self.fetch_token = fetch_token
+        self.clock = clock
+        self._lock = threading.Lock()
+
+    def auth_flow(self, request):
+        token = self.access_token()
+        request.headers["Authorization"] = f"Bearer {token}"
+        response = yield request
+        if response.status_code == 401:
+            request.headers["Authorization"] = f"Bearer {self.access_token(token)}"
+            yield request
+
+    def access_token(self, rejected: Optional[str] = None) -> str:
+        """
+        The token to send, a new one when it expires soon or is the token
+        the instance rejected. Another thread may have replaced it already
+        """
+        with self._lock:
+            token = self.session.token or {}
+            expires_at = token.get("expires_at")
+            if token.get("access_token") in (None, rejected) or (
+                expires_at and self.clock() >= expires_at - self.EXPIRY_MARGIN
+            ):
+                self.fetch_token()
+                token = self.session.token
+            return token["access_token"]
+
+
+class HttpxClient:
+    """
+    Sends requests to a single instance over an httpx client, so many
+    concurrent Table API calls are multiplexed as HTTP/2 streams over one
+    connection rather than a connection each. Takes the same arguments as
+    requests' `request` and returns requests Responses and exceptions, so
+    the rest of snset can't tell the transports apart
+
+    Parameters:
+    auth: Tuple[str, str] - basic auth credentials, or a BearerAuth
+    headers: Dict - headers sent with every request
+    http2: bool - negotiate HTTP/2, over TLS (or with prior knowledge, when
+        http1 is False)
+    http1: bool - allow HTTP/1.1
+    max_connections: int - the most connections the pool opens
+    client_kwargs - passed to httpx.Client, i.e. a mock transport in tests
+    """
+
+    def __init__(
+        self,
+        auth: Union[None, Tuple[str, str], BearerAuth] = None,
+        headers: Optional[Dict[str, str]] = None,
+        http2: bool = True,
+        http1: bool = True,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+        **client_kwargs,
+    ):
+        if httpx is None:
+            raise ImportError(
+                "httpx is not installed, install it with: pip install snset[httpx]"
+            )
+        self.client = httpx.Client(
+            auth=auth,
+            headers=headers,
+            http2=http2,
+            http1=http1,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+            **client_kwargs,
+        )
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        params: Optional[Dict[str, str]] = None,
+        json: Optional[Dict] = None,
+        timeout: Union[None, float, Tuple[float, float]] = None,
+        auth=None,
+    ) -> requests.Response:
+        if isinstance(timeout, tuple):
+            connect, read = timeout
+            timeout = httpx.Timeout(read, connect=connect)
+        try:
+            r = self.client.request(
+                method, url, params=params, json=json, timeout=timeout
+            )
+        except httpx.HTTPError as ex:
+            raise to_request_exception(ex) from ex
+        return to_response(r)
+
+    def close(self) -> None:
+        self.client.close()
+
+
+def to_response(r) -> requests.Response:
+    """
+    Copies an httpx response into a requests Response
+    """
+    response = requests.Response()
+    response.status_code = r.status_code
+    response.reason = r.reason_phrase
+    response.headers = CaseInsensitiveDict(r.headers.items())
+    response._content = r.content
+    response.encoding = r.encoding or "utf-8"
+    response.url = str(r.url)
+    return response
+
+
+def to_request_exception(ex) -> requests.RequestException:
+    """
+    The requests exception matching an httpx one, so retries and the circuit
+    breaker treat both transports alike
+    """
+    if isinstance(ex, httpx.ConnectTimeout):
+        return requests.ConnectTimeout(str(ex))
+    if isinstance(ex, httpx.TimeoutException):
+        return requests.ReadTimeout(str(ex))
+    if isinstance(ex, (httpx.NetworkError, httpx.RemoteProtocolError)):
+        return requests.ConnectionError(str(ex))
+    return requests.RequestException(str(ex))
@@ -0,0 +1,98 @@
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from .checkpoint import write_json
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+# how far before a watermark a windowed query reads from. Encoded query
+# dates may be compared in the user's time zone rather than UTC, so a day
+# of changes is read again rather than missing any
+WATERMARK_OVERLAP = timedelta(hours=24)
+# --since value reading from the watermark of the last run of the pair
+LAST_RUN = "last-run"
+DEFAULT_WATERMARK_FILE = os.path.join("~", ".snset", "watermarks.json")
+
+
+def parse_since(value: str) -> str:
+    """
+    Normalizes a timestamp to the instance's date format, a date alone is
+    the start of that day
+
+    raises: ValueError when the value isn't a date or timestamp
+    """
+    for fmt in (DATE_FORMAT, "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(value.strip(), fmt).strftime(DATE_FORMAT)
+        except ValueError:
+            continue
+    raise ValueError(
+        f"{value} is not a date (YYYY-MM-DD), a timestamp "
+        f"(YYYY-MM-DD HH:MM:SS) or {LAST_RUN}"
+    )
+
+
+def window_start(watermark: str) -> str:
+    """
+    Where a query windowed from a watermark starts, WATERMARK_OVERLAP before it
+    """
+    since = datetime.strptime(watermark, DATE_FORMAT) - WATERMARK_OVERLAP
+    return since.strftime(DATE_FORMAT)
+
+
+class WatermarkStore:
+    """
+    The latest sys_updated_on of the source sets a run compared, per
+    source and target pair, kept in a json file so the next run can ask
+    for the sets changed since
+
+    Parameters:
+    path: str - the json file, created on the first save
+    """
+
+    def __init__(self, path: str = DEFAULT_WATERMARK_FILE):
+        self.path = os.path.expanduser(path)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(source: str, target: str) -> str:
+        return f"{source}:{target}"
+
+    def _read(self) -> Dict[str, str]:
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except json.JSONDecodeError as ex:
+            raise ValueError(f"{self.path} is not valid json: {ex}")
+        if not isinstance(data, dict):
+            raise ValueError(f"{self.path} must map instance pairs to timestamps")
+        return data
+
+    def get(self, source: str, target: str) -> Optional[str]:
+        return self._read().get(self.key(source, target))
+
+    def save(self, source: str, target: str, watermark: str) -> None:
+        """
+        Records the watermark of a pair, unless it is older than the one
+        already recorded
+        """
+        with self._lock:
+            data = self._read()
+            key = self.key(source, target)
+            if watermark <= data.get(key, ""):
+                return
+            data[key] = watermark
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            write_json(self.path, data)
+
+    def since(self, source: str, target: str) -> Optional[str]:
+        """
+        The start of the window of the pair's next run, None when it has
+        never run with a window
+        """
+        watermark = self.get(source, target)
+        return window_start(watermark) if watermark else None
@@ -0,0 +1,234 @@
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Set,
+    Union,
+)
+
+from .planner import DEFAULT_URL_LIMIT
+from .requests_lib import (
+    PAGE_SIZE,
+    chunk_names,
+    instance_url,
+    is_invalid_instance,
+    iter_pages,
+    name_clause,
+    options,
+)
+
+# sys_update_xml.name identifies the record an update is for, i.e.
+# sys_script_include_<sys_id>, update_set.name the set it belongs to
+UPDATE_XML_FIELDS = ["name", "update_set.name", "sys_updated_on"]
+# the longest sys_id>... clause a page of updates can add to a query
+PAGE_CLAUSE = f"^sys_id>{'0' * 32}^ORDERBYsys_id"
+# set names listed per wave by format_waves
+SHOWN_PER_WAVE = 3
+
+
+def update_xml_params(clause: str) -> Dict[str, str]:
+    """
+    The Table API params the updates of some sets are queried with
+
+    Parameters:
+    clause: str - selects the sets, i.e. "nameINa,b" or "name=a"
+    """
+    return {
+        "sysparm_query": f"update_set.{clause}",
+        "sysparm_fields": ",".join(UPDATE_XML_FIELDS),
+    }
+
+
+def paged_params(params: Dict[str, str]) -> Dict[str, str]:
+    """
+    What a page of a query looks like once iter_pages has added its clause,
+    to size nameIN chunks with
+    """
+    return {
+        **params,
+        "sysparm_fields": f"{params['sysparm_fields']},sys_id",
+        "sysparm_query": params["sysparm_query"] + PAGE_CLAUSE,
+        "sysparm_limit": str(PAGE_SIZE),
+    }
+
+
+def stream_rows(
+    uri: str,
+    names: List[str],
+    build_params: Callable[[str], Dict[str, str]],
+    base_url: str,
+    page_size: Optional[int] = None,
+) -> Iterator[Dict]:
+    """
+    Streams the rows of a query selecting many names, split into as few
+    nameIN queries as fit in the url limit and read a page at a time, so
+    only a page is held in memory
+
+    Parameters:
+    uri: str - the Table API uri
+    names: List[str] - the names to select
+    build_params: Callable - builds the query params for a name clause
+    base_url: str - the instance base url
+    page_size: int - rows per page, PAGE_SIZE by default
+    """
+    max_url_length = options.get("max_url_length") or DEFAULT_URL_LIMIT
+    chunks = chunk_names(
+        uri, names, lambda clause: paged_params(build_params(clause)), max_url_length
+    )
+    return (
+        row
+        for chunk in chunks
+        for page in iter_pages(
+            uri, build_params(name_clause(chunk)), page_size, base_url=base_url
+        )
+        for row in page
+    )
+
+
+def fetch_updates(instance_name: str, set_names: List[str]) -> Iterator[Dict]:
+    """
+    Streams the sys_update_xml rows of the named update sets
+
+    Parameters:
+    instance_name: str - the SN Instance Host the sets were built on
+    set_names: List[str] - the update set names
+
+    returns: Iterator[Dict] - rows with the UPDATE_XML_FIELDS
+    """
+    if is_invalid_instance(instance_name):
+        raise ValueError("Please enter a valid instance name.")
+    for name in set_names:
+        if not name or not isinstance(name, str):
+            raise ValueError("IDs cannot be null or empty")
+
+    base_url: str = instance_url(instance_name)
+    uri = f"{base_url}/api/now/table/sys_update_xml"
+    return stream_rows(uri, set_names, update_xml_params, base_url)
+
+
+class WavePlan:
+    """
+    Update sets grouped into waves: the sets of a wave touch no record in
+    common, so they can be previewed and committed together, once every
+    earlier wave has been committed
+
+    waves: List[List[str]] - the set names of each wave, in install order
+    depends_on: Dict[str, Set[str]] - for each set, the sets it must follow
+    updates: int - sys_update_xml rows read
+    records: int - distinct records updated
+    shared: int - records updated by more than one set
+    """
+
+    def __init__(
+        self,
+        waves: List[List[str]],
+        depends_on: Dict[str, Set[str]],
+        updates: int,
+        records: int,
+        shared: int,
+    ):
+        self.waves = waves
+        self.depends_on = depends_on
+        self.updates = updates
+        self.records = records
+        self.shared = shared
+
+    @property
+    def edges(self) -> int:
+        return sum(len(sets) for sets in self.depends_on.values())
+
+
+def plan_waves(order: Sequence[str], updates: Iterable[Mapping]) -> WavePlan:
+    """
+    Builds the dependency DAG of a list of update sets and layers it into
+    waves. A set depends on another only if both update the same record and
+    the other comes first in the install order; for a record updated by
+    several sets only consecutive sets are linked, which keeps the edges
+    linear in the number of updates. Sets missing from the order are placed
+    after it, by their first update
+
+    Parameters:
+    order: Sequence[str] - the set names in install order
+    updates: Iterable[Mapping] - sys_update_xml rows, i.e. from fetch_updates
+
+    returns: WavePlan - the waves and the dependencies between the sets
+    """
+    position = {name: idx for idx, name in enumerate(dict.fromkeys(order))}
+    # record -> its set name, or a set of names once a second set updates it,
+    # most records are only touched by one set
+    touched: Dict[str, Union[str, Set[str]]] = {}
+    first_update: Dict[str, str] = {}
+    count = 0
+    for row in updates:
+        count += 1
+        record, set_name = row.get("name"), row.get("update_set.name")
+        if not record or not set_name:
+            continue
+        if set_name not in position:
+            updated_on = row.get("sys_updated_on") or ""
+            if set_name not in first_update or updated_on < first_update[set_name]:
+                first_update[set_name] = updated_on
+        sets = touched.get(record)
+        if sets is None:
+            touched[record] = set_name
+        elif isinstance(sets, str):
+            if sets != set_name:
+                touched[record] = {sets, set_name}
+        else:
+            sets.add(set_name)
+
+    for set_name in sorted(first_update, key=lambda n: (first_update[n], n)):
+        position[set_name] = len(position)
+
+    depends_on: Dict[str, Set[str]] = {name: set() for name in position}
+    shared = 0
+    for sets in touched.values():
+        if isinstance(sets, str):
+            continue
+        shared += 1
+        ordered = sorted(sets, key=position.__getitem__)
+        for before, after in zip(ordered, ordered[1:]):
+            depends_on[after].add(before)
+
+    # every edge points forward in the install order, so walking it is a
+    # topological order and each set's wave is one after its latest dependency
+    level: Dict[str, int] = {}
+    waves: List[List[str]] = []
+    for name in position:
+        wave = 1 + max((level[dep] for dep in depends_on[name]), default=-1)
+        level[name] = wave
+        if wave == len(waves):
+            waves.append([])
+        waves[wave].append(name)
+    return WavePlan(waves, depends_on, count, len(touched), shared)
+
+
+def assign_waves(rows: List[Mapping], waves: List[List[str]]) -> List[Dict]:
+    """
+    Adds a "wave" column (1 based) to install order rows and sorts them by
+    it, keeping the install order within a wave
+    """
+    wave_of = {name: idx for idx, wave in enumerate(waves, start=1) for name in wave}
+    return sorted(
+        ({"wave": wave_of.get(row.get("name")), **row} for row in rows),
+        key=lambda row: row["wave"] or len(waves) + 1,
+    )
+
+
+def format_waves(plan: WavePlan) -> str:
+    lines = [
+        f"{plan.updates} updates to {plan.records} records, {plan.shared} "
+        f"updated by more than one set: {plan.edges} dependencies, "
+        f"{len(plan.waves)} waves",
+        f"{'wave':>4} {'sets':>5}  first sets",
+    ]
+    for idx, wave in enumerate(plan.waves, start=1):
+        shown = ", ".join(wave[:SHOWN_PER_WAVE])
+        more = f" (+{len(wave) - SHOWN_PER_WAVE})" if len(wave) > SHOWN_PER_WAVE else ""
+        lines.append(f"{idx:>4} {len(wave):>5}  {shown}{more}")
+    return "\n".join(lines)
@@ -29,3 +29,76 @@ def mock_oauth_env_vars(monkeypatch):
     monkeypatch.setenv("SN_SET_CLIENT_ID", "client_id")
     monkeypatch.setenv("SN_SET_CLIENT_SECRET", "super-secure")
     monkeypatch.setenv("SN_SET_GRANT_TYPE", "invalid")
+
+
+@pytest.fixture(autouse=True)
+def reset_options():
+    from sn_set.requests_lib import options
+
+    options.clear()
+    yield
+    options.clear()
+
+
+@pytest.fixture
+def clean_context():
+    """
+    Drops the clients a test builds, before and after it
+    """
+    from sn_set.requests_lib import context
+
+    context.clear()
+    yield context
+    context.clear()
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def make_response():
+    """
+    Builds a requests.Response without sending anything
+    """
+    import requests
+
+    def make(status_code: int = 200, headers=None, text: str = ""):
+        r = requests.Response()
+        r.status_code = status_code
+        r.headers.update(headers or {})
+        r._content = text.encode()
+        return r
+
+    return make
+
+
+@pytest.fixture
+def make_update():
+    """
+    Builds a sys_update_xml row, an update of record made in set_name
+    """
+
+    def make(record, set_name, updated_on="2021-01-01 00:00:00", **fields):
+        return {
+            "name": record,
+            "update_set.name": set_name,
+            "sys_updated_on": updated_on,
+            **fields,
+        }
+
+    return make
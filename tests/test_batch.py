@@ -0,0 +1,140 @@
+import base64
+import json
+
+import pytest
+
+from sn_set import batch
+from sn_set.batch import BatchError, BatchTransport
+
+
+def encode(body):
+    return base64.b64encode(json.dumps(body).encode()).decode()
+
+
+def test_relative_url():
+    assert (
+        batch.relative_url(
+            "https://nyudev.service-now.com/api/now/table/sys_update_set",
+            {"sysparm_query": "name=a set"},
+        )
+        == "/api/now/table/sys_update_set?sysparm_query=name%3Da+set"
+    )
+    assert batch.relative_url("https://nyudev.service-now.com/api/x") == "/api/x"
+
+
+@pytest.mark.parametrize(
+    "max_requests,max_bytes,expected",
+    [
+        (2, 10_000, [[0, 1], [2, 3], [4]]),
+        (50, 10_000, [[0, 1, 2, 3, 4]]),
+        (50, 300, [[0], [1], [2], [3], [4]]),
+    ],
+)
+def test_pack(max_requests, max_bytes, expected):
+    urls = ["/api/now/table/x?a=b"] * 5
+    assert batch.pack(urls, max_requests, max_bytes) == expected
+
+
+def test_pack_invalid():
+    with pytest.raises(ValueError):
+        batch.pack(["/a"], max_requests=0)
+
+
+def test_batch_transport_flush():
+    sent = []
+
+    def send(payload):
+        sent.append(payload)
+        return {
+            "batch_request_id": payload["batch_request_id"],
+            "serviced_requests": [
+                {
+                    "id": req["id"],
+                    "status_code": 200,
+                    "status_text": "OK",
+                    "body": encode({"result": [{"url": req["url"]}]}),
+                }
+                for req in reversed(payload["rest_requests"])
+            ],
+            "unserviced_requests": [],
+        }
+
+    transport = BatchTransport(send, max_requests=2)
+    for name in ["a", "b", "c"]:
+        transport.add("https://test.com/api/now/table/x", {"name": name})
+    responses = transport.flush()
+
+    assert len(sent) == 2
+    assert [r.json()["result"][0]["url"] for r in responses] == [
+        "/api/now/table/x?name=a",
+        "/api/now/table/x?name=b",
+        "/api/now/table/x?name=c",
+    ]
+    assert all(r.ok for r in responses)
+    assert transport.queue == []
+
+
+def test_batch_transport_failures():
+    def send(payload):
+        return {
+            "serviced_requests": [
+                {"id": "0", "status_code": 200, "body": encode({"result": []})},
+                {"id": "1", "status_code": 400, "status_text": "Bad Request"},
+            ],
+            "unserviced_requests": ["2"],
+        }
+
+    transport = BatchTransport(send)
+    for name in ["a", "b", "c", "d"]:
+        transport.add("https://test.com/api/x", {"name": name})
+    responses = transport.flush()
+
+    assert [r.status_code for r in responses] == [200, 400, 0, 0]
+    assert [r.ok for r in responses] == [True, False, False, False]
+    assert responses[2].status_text == "unserviced"
+    assert responses[3].status_text == "missing"
+
+    error = BatchError([r for r in responses if not r.ok])
+    assert len(error.failures) == 3
+    assert "400 Bad Request /api/x?name=b" in str(error)
+
+
+def test_make_batch_request(requests_mock, mock_env_vars):
+    from sn_set.requests_lib import make_batch_request
+
+    base_url = "https://batch-test.com"
+
+    def callback(request, context):
+        return {
+            "serviced_requests": [
+                {
+                    "id": req["id"],
+                    "status_code": 200,
+                    "body": encode({"result": [{"name": req["id"]}]}),
+                }
+                for req in request.json()["rest_requests"]
+            ]
+        }
+
+    requests_mock.post(f"{base_url}/api/now/v1/batch", json=callback)
+    result = make_batch_request(
+        f"{base_url}/api/now/table/x",
+        [{"name": "a"}, {"name": "b"}],
+        base_url=base_url,
+    )
+    assert result == [[{"name": "0"}], [{"name": "1"}]]
+    assert requests_mock.call_count == 1
+
+
+def test_make_batch_request_failure(requests_mock, mock_env_vars):
+    from sn_set.requests_lib import make_batch_request
+
+    base_url = "https://batch-test.com"
+    requests_mock.post(
+        f"{base_url}/api/now/v1/batch",
+        json={"serviced_requests": [{"id": "0", "status_code": 404}]},
+    )
+    with pytest.raises(BatchError):
+        make_batch_request(
+            f"{base_url}/api/now/table/x", [{"name": "a"}], base_url=base_url
+        )
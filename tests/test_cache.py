@@ -0,0 +1,255 @@
+import json
+import os
+import threading
+
+import pytest
+import requests
+
+from sn_set import cli
+from sn_set.cache import DiskCache, format_stats
+from sn_set.requests_lib import get_update_sets, options, prewarm
+from sn_set.stats import DEFAULT_STAGE, StatsCollector
+
+URL = "https://nyudev.service-now.com/api/now/table/sys_update_set"
+
+
+def age(disk_cache, key, seconds):
+    path = disk_cache._path(key)
+    mtime = os.path.getmtime(path) - seconds
+    os.utime(path, (mtime, mtime))
+
+
+def test_get_put(tmp_path):
+    disk_cache = DiskCache(str(tmp_path), ttl=60)
+
+    assert disk_cache.get("ab12") is None
+    disk_cache.put("ab12", b'{"result": []}')
+
+    assert disk_cache.get("ab12") == b'{"result": []}'
+    assert (tmp_path / "ab" / "ab12.gz").exists()
+    assert not [p for p in tmp_path.rglob(".tmp-*")]
+
+
+def test_get_expired(tmp_path):
+    disk_cache = DiskCache(str(tmp_path), ttl=60)
+    disk_cache.put("ab12", b"body")
+
+    age(disk_cache, "ab12", 61)
+
+    assert disk_cache.get("ab12") is None
+    disk_cache.ttl = 0
+    assert disk_cache.get("ab12") == b"body"
+
+
+def test_get_or_fill(tmp_path):
+    disk_cache = DiskCache(str(tmp_path))
+    calls = []
+
+    def fill():
+        calls.append(1)
+        return b"body"
+
+    assert disk_cache.get_or_fill("ab12", fill) == (b"body", False)
+    assert disk_cache.get_or_fill("ab12", fill) == (b"body", True)
+    assert len(calls) == 1
+    assert (disk_cache.hits, disk_cache.misses) == (1, 1)
+
+
+def test_get_or_fill_error(tmp_path):
+    disk_cache = DiskCache(str(tmp_path))
+
+    def fill():
+        raise requests.HTTPError("500")
+
+    with pytest.raises(requests.HTTPError):
+        disk_cache.get_or_fill("ab12", fill)
+    assert disk_cache.get("ab12") is None
+    assert disk_cache.entries() == []
+
+
+def test_get_or_fill_single_filler(tmp_path):
+    # separate instances, as separate processes would have
+    caches = [DiskCache(str(tmp_path)) for _ in range(6)]
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def fill():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return b"body"
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda c=c: results.append(c.get_or_fill("ab12", fill)))
+        for c in caches
+    ]
+    threads[0].start()
+    started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert sorted(results) == [(b"body", False)] + [(b"body", True)] * 5
+
+
+def test_prune(tmp_path, clock):
+    disk_cache = DiskCache(str(tmp_path), ttl=0, clock=clock)
+    for key in ["aa01", "bb02", "cc03"]:
+        disk_cache.put(key, os.urandom(1000))
+    for seconds, key in [(300, "aa01"), (200, "bb02"), (100, "cc03")]:
+        age(disk_cache, key, seconds)
+    size = disk_cache.entries()[0][2]
+
+    result = disk_cache.prune(max_bytes=2 * size)
+
+    assert result == {
+        "removed": 1,
+        "freed_bytes": size,
+        "entries": 2,
+        "bytes": 2 * size,
+    }
+    assert disk_cache.get("aa01") is None
+
+    clock.now = os.path.getmtime(disk_cache._path("cc03")) + 150
+    result = disk_cache.prune(older_than=200)
+    assert result["removed"] == 1
+    assert [os.path.basename(p) for p, _, _ in disk_cache.entries()] == ["cc03.gz"]
+
+
+def test_prune_keeps_held_lock_files(tmp_path, clock):
+    fcntl = pytest.importorskip("fcntl")
+    disk_cache = DiskCache(str(tmp_path), ttl=0, clock=clock)
+    with disk_cache.locked("aa01"):
+        pass
+    held = disk_cache._path("aa01", ".lock")
+    with disk_cache.locked("bb02"):
+        pass
+    stale = disk_cache._path("bb02", ".lock")
+    clock.now = os.path.getmtime(held) + 7200
+
+    with open(held) as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        disk_cache.prune()
+
+    # the lock of a fill in progress stays, so waiters lock the same file
+    assert os.path.exists(held)
+    assert not os.path.exists(stale)
+
+
+def test_stats(tmp_path):
+    disk_cache = DiskCache(str(tmp_path), ttl=60)
+    disk_cache.put("aa01", b"a")
+    disk_cache.put("bb02", b"b")
+    age(disk_cache, "aa01", 120)
+
+    stats = disk_cache.stats()
+
+    assert stats["entries"] == 2
+    assert stats["expired"] == 1
+    assert stats["oldest_age"] >= 120
+    assert "2 entries" in format_stats(stats)
+    assert "1 expired" in format_stats(stats)
+
+
+def test_make_request_cached(requests_mock, mock_env_vars, clean_context, tmp_path):
+    requests_mock.get(URL, json={"result": [{"name": "a"}]})
+    options["cache"] = DiskCache(str(tmp_path))
+    options["stats"] = StatsCollector()
+
+    first = get_update_sets("nyudev")
+    second = get_update_sets("nyudev")
+
+    assert first == second == [{"name": "a"}]
+    assert requests_mock.call_count == 1
+    requests_stats = options["stats"].stages[DEFAULT_STAGE].requests
+    assert [r.cached for r in requests_stats] == [False, True]
+
+
+def test_prewarm_not_cached(requests_mock, mock_env_vars, clean_context, tmp_path):
+    requests_mock.get(URL, json={"result": [{"sys_id": "1"}]})
+    options["cache"] = DiskCache(str(tmp_path))
+
+    assert prewarm(["nyudev"]) == {"nyudev": None}
+    assert prewarm(["nyudev"]) == {"nyudev": None}
+
+    # every prewarm reaches the instance, and nothing is cached for it
+    assert requests_mock.call_count == 2
+    assert options["cache"].stats()["entries"] == 0
+
+
+def test_make_request_cached_per_user(
+    requests_mock, mock_env_vars, clean_context, monkeypatch, tmp_path
+):
+    requests_mock.get(URL, json={"result": [{"name": "a"}]})
+    options["cache"] = DiskCache(str(tmp_path))
+
+    get_update_sets("nyudev")
+    clean_context.clear()
+    monkeypatch.setenv("SN_USER_NAME", "other")
+    get_update_sets("nyudev")
+    get_update_sets("nyudev")
+
+    # a user with other roles can see other records, it gets its own entry
+    assert requests_mock.call_count == 2
+    assert len(options["cache"].entries()) == 2
+
+
+def test_make_request_error_not_cached(
+    requests_mock, mock_env_vars, clean_context, tmp_path
+):
+    requests_mock.get(
+        URL,
+        [{"status_code": 400}, {"json": {"result": [{"name": "a"}]}}],
+    )
+    options["cache"] = DiskCache(str(tmp_path))
+
+    with pytest.raises(requests.HTTPError):
+        get_update_sets("nyudev")
+    assert get_update_sets("nyudev") == [{"name": "a"}]
+
+    assert requests_mock.call_count == 2
+
+
+def test_cli_cache_stats_and_prune(runner, tmp_path):
+    disk_cache = DiskCache(str(tmp_path))
+    disk_cache.put("aa01", b"a" * 100)
+    disk_cache.put("bb02", b"b" * 100)
+    age(disk_cache, "aa01", 7200)
+
+    result = runner.invoke(
+        cli.main, ["cache", "--cache-dir", str(tmp_path), "stats", "--json"]
+    )
+    assert result.exit_code == 0, result.output
+    assert json.loads(result.output)["entries"] == 2
+
+    result = runner.invoke(
+        cli.main,
+        ["cache", "--cache-dir", str(tmp_path), "prune", "--older-than", "3600"],
+    )
+    assert result.exit_code == 0, result.output
+    assert result.output.startswith("Removed 1 entries")
+    assert disk_cache.get("bb02") == b"b" * 100
+
+
+def test_cli_cache_with_record(runner, tmp_path):
+    result = runner.invoke(
+        cli.main,
+        [
+            "-s",
+            "nyudev",
+            "-t",
+            "nyuqa",
+            "--cache-dir",
+            str(tmp_path / "cache"),
+            "--record",
+            str(tmp_path / "cassette"),
+        ],
+    )
+
+    assert result.exit_code == 2
+    assert "--cache-dir can't be used with --record or --replay" in result.output
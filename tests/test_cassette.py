@@ -0,0 +1,173 @@
+import gzip
+import json
+import os
+from unittest import mock
+
+import pytest
+from requests.exceptions import HTTPError
+
+from sn_set.cassette import Cassette, CassetteMiss, request_key
+from sn_set.requests_lib import get_install_order, make_request, options
+
+BASE_URL = "https://nyudev.service-now.com"
+TEST_URI = f"{BASE_URL}/api/now/table/sys_update_set"
+
+
+def test_request_key_ignores_param_order():
+    assert request_key("get", TEST_URI, {"a": "1", "b": "2"}) == request_key(
+        "GET", TEST_URI, {"b": "2", "a": "1"}
+    )
+    assert request_key("GET", TEST_URI, {"a": "1"}) != request_key(
+        "GET", TEST_URI, {"a": "2"}
+    )
+    assert request_key("POST", TEST_URI, body={"a": 1}) != request_key(
+        "POST", TEST_URI, body={"a": 2}
+    )
+    assert request_key("GET", TEST_URI, scope=":user") != request_key(
+        "GET", TEST_URI, scope=":other"
+    )
+
+
+def test_cassette_invalid_mode(tmp_path):
+    with pytest.raises(ValueError):
+        Cassette(str(tmp_path), mode="rewind")
+
+
+def test_cassette_replay_missing(tmp_path):
+    with pytest.raises(ValueError):
+        Cassette(str(tmp_path / "nothing-here"), mode="replay")
+
+
+def test_record_then_replay(tmp_path, requests_mock, mock_env_vars):
+    params = {"sysparm_query": "state=complete"}
+    requests_mock.get(
+        TEST_URI,
+        [
+            {"json": {"result": [{"name": "first"}]}},
+            {"json": {"result": [{"name": "second"}]}},
+        ],
+    )
+
+    options["cassette"] = Cassette(str(tmp_path), mode="record")
+    assert make_request(TEST_URI, path_params=params, base_url=BASE_URL) == [
+        {"name": "first"}
+    ]
+    assert make_request(TEST_URI, path_params=params, base_url=BASE_URL) == [
+        {"name": "second"}
+    ]
+
+    with open(tmp_path / "index.jsonl") as f:
+        entries = [json.loads(line) for line in f]
+    assert len(entries) == 2
+    assert entries[0]["status"] == 200
+    assert entries[0]["params"] == params
+    with gzip.open(tmp_path / entries[0]["body"]) as f:
+        assert json.load(f) == {"result": [{"name": "first"}]}
+
+    requests_mock.reset_mock()
+    options["cassette"] = Cassette(str(tmp_path), mode="replay")
+    # replay doesn't need credentials or a network
+    with mock.patch("sn_set.requests_lib.client_factory") as mock_client_factory:
+        results = [
+            make_request(TEST_URI, path_params=params, base_url=BASE_URL)
+            for _ in range(3)
+        ]
+        mock_client_factory.assert_not_called()
+    assert requests_mock.call_count == 0
+    # requests are served in the recorded order, the last one repeats
+    assert results == [[{"name": "first"}], [{"name": "second"}], [{"name": "second"}]]
+
+    with pytest.raises(CassetteMiss):
+        make_request(TEST_URI, path_params={"other": "query"}, base_url=BASE_URL)
+
+
+def test_replay_fallback_path(tmp_path, requests_mock, mock_env_vars):
+    uri = f"{BASE_URL}/api/now/table/sys_remote_update_set"
+    commit_dates = {"a": "2021-05-08 18:39:00", "b": "2021-05-01 18:39:00"}
+
+    def callback(request, context):
+        query = request.qs["sysparm_query"][0]
+        if "namein" in query:
+            context.status_code = 414
+            return {}
+        name = query.split("^")[1][len("name=") :]
+        return {"result": [{"name": name, "commit_date": commit_dates[name]}]}
+
+    requests_mock.get(uri, json=callback)
+    options["cassette"] = Cassette(str(tmp_path), mode="record")
+    recorded = get_install_order("nyudev", ["a", "b"])
+
+    requests_mock.reset_mock()
+    options["cassette"] = Cassette(str(tmp_path), mode="replay")
+    assert get_install_order("nyudev", ["a", "b"]) == recorded
+    assert [elem["name"] for elem in recorded] == ["b", "a"]
+    assert requests_mock.call_count == 0
+
+    options["cassette"] = Cassette(str(tmp_path), mode="replay")
+    response = options["cassette"].replay(
+        "GET",
+        uri,
+        {
+            "sysparm_query": (
+                "state=committed^nameINa,b^commit_dateISNOTEMPTY^ORDERBYcommit_date"
+            ),
+            "sysparm_fields": (
+                "name,state,update_source,description,sys_created_on,"
+                "commit_date,sys_updated_by,sys_updated_on,collisions"
+            ),
+            "sysparm_display_value": "true",
+        },
+    )
+    with pytest.raises(HTTPError):
+        response.raise_for_status()
+
+
+def test_replay_simulated_latency(tmp_path, requests_mock, mock_env_vars):
+    requests_mock.get(TEST_URI, json={"result": []})
+    options["cassette"] = Cassette(str(tmp_path), mode="record")
+    make_request(TEST_URI, base_url=BASE_URL)
+
+    cassette = Cassette(str(tmp_path), mode="replay", latency_factor=2.0)
+    elapsed = next(iter(cassette.entries.values()))[0]["elapsed"]
+    with mock.patch("sn_set.cassette.time.sleep") as mock_sleep:
+        cassette.replay("GET", TEST_URI)
+    mock_sleep.assert_called_once_with(elapsed * 2.0)
+
+
+def test_rerecord_replaces_exchanges(tmp_path, requests_mock, mock_env_vars):
+    requests_mock.get(
+        TEST_URI,
+        [
+            {"json": {"result": [{"name": "old"}]}},
+            {"json": {"result": [{"name": "new"}]}},
+        ],
+    )
+    for _ in range(2):
+        options["cassette"] = Cassette(str(tmp_path), mode="record")
+        make_request(TEST_URI, base_url=BASE_URL)
+
+    with open(tmp_path / "index.jsonl") as f:
+        assert len(f.readlines()) == 1
+    options["cassette"] = Cassette(str(tmp_path), mode="replay")
+    with mock.patch("sn_set.requests_lib.client_factory"):
+        assert make_request(TEST_URI, base_url=BASE_URL) == [{"name": "new"}]
+
+
+def test_record_deduplicates_bodies(tmp_path, requests_mock, mock_env_vars):
+    requests_mock.get(TEST_URI, json={"result": []})
+    options["cassette"] = Cassette(str(tmp_path), mode="record")
+    make_request(TEST_URI, base_url=BASE_URL)
+    make_request(TEST_URI, path_params={"a": "b"}, base_url=BASE_URL)
+    assert len(os.listdir(tmp_path / "bodies")) == 1
+
+
+def test_cli_record_and_replay_exclusive(runner, tmp_path):
+    from sn_set import cli
+
+    result = runner.invoke(
+        cli.main,
+        ["-s", "nyudev", "-t", "nyuqa", "--record", str(tmp_path)]
+        + ["--replay", str(tmp_path)],
+    )
+    assert result.exit_code != 0
+    assert "can't be used together" in result.output
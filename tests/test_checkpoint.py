@@ -0,0 +1,151 @@
+import json
+import os
+from unittest import mock
+
+import pytest
+
+from sn_set import cli
+from sn_set.checkpoint import CHUNKS, Checkpoint
+from sn_set.requests_lib import fetch_each, options
+
+RUN = {"source": "nyudev", "target": "nyuqa"}
+
+
+def test_checkpoint_stages(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path), RUN)
+    assert not checkpoint.has("diff")
+    checkpoint.save("diff", ["a set", "b set"])
+    assert checkpoint.has("diff")
+    assert checkpoint.load("diff") == ["a set", "b set"]
+    checkpoint.close()
+
+    assert not [name for name in os.listdir(tmp_path) if name.startswith(".tmp-")]
+    resumed = Checkpoint(str(tmp_path), RUN, resume=True)
+    assert resumed.resumed
+    assert resumed.load("diff") == ["a set", "b set"]
+
+
+def test_checkpoint_cleared_without_resume(tmp_path):
+    Checkpoint(str(tmp_path), RUN).save("diff", ["a set"])
+    (tmp_path / "unrelated.txt").write_text("keep me")
+
+    checkpoint = Checkpoint(str(tmp_path), RUN)
+
+    assert not checkpoint.resumed
+    assert not checkpoint.has("diff")
+    assert (tmp_path / "unrelated.txt").exists()
+
+
+def test_checkpoint_refuses_other_run(tmp_path):
+    Checkpoint(str(tmp_path), RUN).close()
+    with pytest.raises(ValueError):
+        Checkpoint(str(tmp_path), {"source": "nyudev", "target": "nyu"}, resume=True)
+
+
+def test_checkpoint_chunks_survive_torn_write(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path), RUN)
+    checkpoint.save_chunk("mock://x", {"q": "a"}, [{"name": "a"}])
+    checkpoint.close()
+    with open(tmp_path / CHUNKS, "a") as f:
+        f.write('{"key": "abc", "res')
+
+    resumed = Checkpoint(str(tmp_path), RUN, resume=True)
+
+    assert resumed.chunk("mock://x", {"q": "a"}) == (True, [{"name": "a"}])
+    assert resumed.chunk("mock://x", {"q": "b"}) == (False, None)
+
+    # the chunk saved after the torn line survives the next resume
+    resumed.save_chunk("mock://x", {"q": "b"}, [{"name": "b"}])
+    resumed.close()
+    again = Checkpoint(str(tmp_path), RUN, resume=True)
+    assert again.chunk("mock://x", {"q": "a"}) == (True, [{"name": "a"}])
+    assert again.chunk("mock://x", {"q": "b"}) == (True, [{"name": "b"}])
+
+
+@mock.patch("sn_set.requests_lib.fetch_records")
+def test_fetch_each_skips_checkpointed_lookups(mock_fetch_records, tmp_path):
+    checkpoint = options["checkpoint"] = Checkpoint(str(tmp_path), RUN)
+    params_list = [{"q": "a"}, {"q": "b"}, {"q": "c"}]
+    checkpoint.save_chunk("mock://x", {"q": "b"}, [{"name": "b"}])
+    mock_fetch_records.side_effect = lambda uri, params, base_url: [
+        {"name": params["q"]}
+    ]
+
+    results = fetch_each("mock://x", params_list, base_url="mock://")
+
+    assert results == [[{"name": "a"}], [{"name": "b"}], [{"name": "c"}]]
+    assert [c.args[1] for c in mock_fetch_records.call_args_list] == [
+        {"q": "a"},
+        {"q": "c"},
+    ]
+    assert checkpoint.chunk("mock://x", {"q": "c"}) == (True, [{"name": "c"}])
+
+
+@mock.patch("sn_set.requests_lib.make_batch_request")
+def test_fetch_each_checkpoints_each_batch(mock_make_batch_request, tmp_path):
+    options["batch_size"] = 2
+    checkpoint = options["checkpoint"] = Checkpoint(str(tmp_path), RUN)
+    params_list = [{"q": str(idx)} for idx in range(5)]
+    mock_make_batch_request.side_effect = lambda uri, group, base_url: [
+        [{"name": params["q"]}] for params in group
+    ]
+
+    results = fetch_each("mock://x", params_list, base_url="mock://")
+
+    assert [r[0]["name"] for r in results] == ["0", "1", "2", "3", "4"]
+    assert mock_make_batch_request.call_count == 3
+    assert len(checkpoint.chunks) == 5
+
+
+@mock.patch("sn_set.cli.to_excel")
+@mock.patch("sn_set.comparator.get_install_order_new")
+@mock.patch("sn_set.comparator.get_install_order")
+@mock.patch("sn_set.comparator.get_update_sets")
+def test_cli_resume(
+    mock_get_update_sets,
+    mock_get_install_order,
+    mock_new_install_order,
+    mock_to_excel,
+    runner,
+    tmp_path,
+):
+    mock_get_update_sets.side_effect = [
+        [{"name": "a set"}, {"name": "b set"}, {"name": "c set"}],
+        [{"name": "a set"}],
+    ]
+    mock_get_install_order.side_effect = ConnectionError("instance went away")
+    mock_to_excel.return_value = True
+    args = ["-s", "nyudev", "-t", "nyuqa", "--checkpoint-dir", str(tmp_path)]
+
+    result = runner.invoke(cli.main, args)
+    assert result.exit_code != 0
+    with open(tmp_path / "stage-source_sets.json") as f:
+        assert json.load(f) == ["a set", "b set", "c set"]
+
+    mock_get_install_order.side_effect = None
+    mock_get_install_order.return_value = [{"name": "b set"}]
+    mock_new_install_order.return_value = [{"name": "c set"}]
+    result = runner.invoke(cli.main, args + ["--resume"])
+
+    assert result.exit_code == 0
+    assert "Resuming diff from the checkpoint" in result.output
+    assert mock_get_update_sets.call_count == 2
+    mock_to_excel.assert_called_once_with([{"name": "b set"}, {"name": "c set"}], None)
+
+
+@mock.patch("sn_set.comparator.get_update_sets")
+def test_cli_resume_other_diff_mode(mock_get_update_sets, runner, tmp_path):
+    mock_get_update_sets.side_effect = ConnectionError("instance went away")
+    args = ["-s", "nyudev", "-t", "nyuqa", "--checkpoint-dir", str(tmp_path)]
+    runner.invoke(cli.main, args)
+
+    result = runner.invoke(cli.main, args + ["--resume", "--content-diff"])
+
+    assert result.exit_code == 2
+    assert "The checkpoint in" in result.output
+
+
+def test_cli_resume_requires_checkpoint_dir(runner):
+    result = runner.invoke(cli.main, ["-s", "nyudev", "-t", "nyuqa", "--resume"])
+    assert result.exit_code != 0
+    assert "--checkpoint-dir" in result.output
@@ -26,9 +26,9 @@ def test_cli_no_target(runner):
 
 @mock.patch("sn_set.cli.to_excel")
 @mock.patch("sn_set.cli.get_set_diff")
-@mock.patch("sn_set.cli.get_install_order_new")
-@mock.patch("sn_set.cli.get_install_order")
-@mock.patch("sn_set.cli.get_update_sets")
+@mock.patch("sn_set.comparator.get_install_order_new")
+@mock.patch("sn_set.comparator.get_install_order")
+@mock.patch("sn_set.comparator.get_update_sets")
 def test_cli_valid(
     mock_get_update_sets,
     mock_get_install_order,
@@ -58,7 +58,7 @@ def test_cli_valid(
     mock_set_diff.assert_has_calls(
         [
             mock.call(["a set", "b set"], ["a set"], debug=False),
-            mock.call(["b set"], ["b set"]),
+            mock.call(["b set"], ["b set"], debug=False),
         ]
     )
     mock_new_install_order.assert_not_called()
@@ -75,9 +75,9 @@ def test_cli_valid(
 
 @mock.patch("sn_set.cli.to_excel")
 @mock.patch("sn_set.cli.get_set_diff")
-@mock.patch("sn_set.cli.get_install_order_new")
-@mock.patch("sn_set.cli.get_install_order")
-@mock.patch("sn_set.cli.get_update_sets")
+@mock.patch("sn_set.comparator.get_install_order_new")
+@mock.patch("sn_set.comparator.get_install_order")
+@mock.patch("sn_set.comparator.get_update_sets")
 def test_cli_valid_with_new(
     mock_get_update_sets,
     mock_get_install_order,
@@ -113,7 +113,7 @@ def test_cli_valid_with_new(
     mock_set_diff.assert_has_calls(
         [
             mock.call(["a set", "b set", "c set"], ["a set"], debug=False),
-            mock.call(["b set", "c set"], ["b set"]),
+            mock.call(["b set", "c set"], ["b set"], debug=False),
         ]
     )
     # mock_set_diff.assert_any_call(["a set", "b set", "c set"], ["a set"], debug=False)
@@ -131,9 +131,9 @@ def test_cli_valid_with_new(
 
 @mock.patch("sn_set.cli.to_excel")
 @mock.patch("sn_set.cli.get_set_diff")
-@mock.patch("sn_set.cli.get_install_order_new")
-@mock.patch("sn_set.cli.get_install_order")
-@mock.patch("sn_set.cli.get_update_sets")
+@mock.patch("sn_set.comparator.get_install_order_new")
+@mock.patch("sn_set.comparator.get_install_order")
+@mock.patch("sn_set.comparator.get_update_sets")
 def test_cli_valid_with_file(
     mock_get_update_sets,
     mock_get_install_order,
@@ -173,7 +173,7 @@ def test_cli_valid_with_file(
     mock_set_diff.assert_has_calls(
         [
             mock.call(["a set", "b set", "c set"], ["a set"], debug=True),
-            mock.call(["b set", "c set"], ["b set"]),
+            mock.call(["b set", "c set"], ["b set"], debug=True),
         ]
     )
     mock_new_install_order.assert_called_with("nyudev", ["c set"])
@@ -190,9 +190,9 @@ def test_cli_valid_with_file(
 
 @mock.patch("sn_set.cli.to_excel")
 @mock.patch("sn_set.cli.get_set_diff")
-@mock.patch("sn_set.cli.get_install_order_new")
-@mock.patch("sn_set.cli.get_install_order")
-@mock.patch("sn_set.cli.get_update_sets")
+@mock.patch("sn_set.comparator.get_install_order_new")
+@mock.patch("sn_set.comparator.get_install_order")
+@mock.patch("sn_set.comparator.get_update_sets")
 def test_cli_valid_with_failed_excel(
     mock_get_update_sets,
     mock_get_install_order,
@@ -239,6 +239,22 @@ def test_cli_valid_with_failed_excel(
     assert "There was an error writing the spreadsheet" in result.output
 
 
+@mock.patch("sn_set.cli.to_excel")
+@mock.patch("sn_set.comparator.get_install_order")
+@mock.patch("sn_set.comparator.get_update_sets")
+def test_cli_nothing_missing(
+    mock_get_update_sets, mock_get_install_order, mock_to_excel, runner
+):
+    mock_get_update_sets.return_value = [{"name": "a set"}]
+
+    result = runner.invoke(cli.main, ["--source", "nyudev", "--target", "nyuqa"])
+
+    assert result.exit_code == 0, result.output
+    assert "No sets are missing from nyuqa" in result.output
+    mock_get_install_order.assert_not_called()
+    mock_to_excel.assert_not_called()
+
+
 @pytest.mark.parametrize(
     "test_value1,test_value2,expected_value",
     [
@@ -283,9 +299,9 @@ def test_to_excel_invalid(test_value):
 
 
 @mock.patch("sn_set.cli.get_set_diff")
-@mock.patch("sn_set.cli.get_install_order_new")
-@mock.patch("sn_set.cli.get_install_order")
-@mock.patch("sn_set.cli.get_update_sets")
+@mock.patch("sn_set.comparator.get_install_order_new")
+@mock.patch("sn_set.comparator.get_install_order")
+@mock.patch("sn_set.comparator.get_update_sets")
 def test_cli_short_circuit(
     mock_get_update_sets,
     mock_get_install_order,
@@ -315,7 +331,7 @@ def test_cli_short_circuit(
     mock_set_diff.assert_has_calls(
         [
             mock.call(["a set", "b set"], ["a set"], debug=False),
-            mock.call(["b set"], ["b set"]),
+            mock.call(["b set"], ["b set"], debug=False),
         ]
     )
     mock_new_install_order.assert_not_called()
@@ -0,0 +1,175 @@
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from sn_set import cli
+from sn_set.collisions import (
+    Collision,
+    CollisionReport,
+    annotate_collisions,
+    format_collisions,
+    index_updates,
+    join_updates,
+    predict_collisions,
+)
+
+
+@pytest.fixture
+def source(make_update):
+    return [
+        make_update("script_1", "a", "2021-01-01 00:00:00"),
+        make_update("script_1", "a", "2021-01-03 00:00:00"),
+        make_update("script_1", "b", "2021-01-05 00:00:00"),
+        make_update("script_2", "b", "2021-01-05 00:00:00"),
+        make_update("script_3", "c", "2021-01-05 00:00:00"),
+    ]
+
+
+@pytest.fixture
+def target(make_update):
+    return [
+        # after a's latest update of script_1, before b's
+        make_update("script_1", "hotfix", "2021-01-04 00:00:00"),
+        make_update("script_1", "hotfix", "2021-01-02 00:00:00"),
+        # the set itself, already applied to the target once
+        make_update("script_2", "b", "2021-01-06 00:00:00"),
+        make_update("script_3", "other", "2021-01-04 00:00:00"),
+        make_update("script_3", "other", "2021-01-06 00:00:00"),
+        make_update("script_3", "later", "2021-01-07 00:00:00"),
+    ]
+
+
+def test_index_updates_keeps_latest_update_per_set(source):
+    index, count = index_updates(iter(source))
+
+    assert count == 5
+    assert index["script_1"] == (
+        ("2021-01-03 00:00:00", "a"),
+        ("2021-01-05 00:00:00", "b"),
+    )
+    assert set(index) == {"script_1", "script_2", "script_3"}
+
+
+def test_join_updates(source, target):
+    index, _ = index_updates(source)
+
+    collisions, count = join_updates(index, iter(target))
+
+    assert count == 6
+    assert collisions == {
+        "a": {
+            "script_1": Collision(
+                "script_1", "2021-01-03 00:00:00", "2021-01-04 00:00:00", "hotfix"
+            )
+        },
+        "c": {
+            "script_3": Collision(
+                "script_3", "2021-01-05 00:00:00", "2021-01-07 00:00:00", "later"
+            )
+        },
+    }
+
+
+def test_predict_collisions(requests_mock, mock_env_vars, source, target):
+    def table(rows, key):
+        def respond(request, context):
+            params = parse_qs(urlsplit(request.url).query)
+            clause = params["sysparm_query"][0].split("^")[0]
+            if key == "update_set.name":
+                clause = clause[len("update_set.") :]
+            if clause.startswith("nameIN"):
+                names = clause[6:].split(",")
+            else:
+                names = [clause[5:]]
+            return {"result": [row for row in rows if row[key] in names]}
+
+        return respond
+
+    requests_mock.get(
+        "https://nyudev.service-now.com/api/now/table/sys_update_xml",
+        json=table(source, "update_set.name"),
+    )
+    requests_mock.get(
+        "https://nyuqa.service-now.com/api/now/table/sys_update_xml",
+        json=table(target, "name"),
+    )
+
+    report = predict_collisions("nyudev", "nyuqa", ["a", "b", "c"])
+
+    assert report.counts() == {"a": 1, "c": 1}
+    assert (report.source_updates, report.target_updates, report.records) == (
+        5,
+        6,
+        3,
+    )
+    target_query = parse_qs(urlsplit(requests_mock.last_request.url).query)
+    assert target_query["sysparm_query"][0].startswith(
+        "nameINscript_1,script_2,script_3^"
+    )
+
+
+def test_predict_collisions_invalid():
+    with pytest.raises(ValueError):
+        predict_collisions("nyudev", "nyuqa", ["a", None])
+
+
+def test_annotate_and_format():
+    report = CollisionReport(
+        {
+            "a": {
+                f"script_{i}": Collision(f"script_{i}", "1", "2", "") for i in range(7)
+            },
+            "b": {"script_1": Collision("script_1", "1", "3", "hotfix")},
+        },
+        10,
+        8,
+        9,
+    )
+
+    rows = annotate_collisions([{"name": "a"}, {"name": "c"}], report.counts())
+    text = format_collisions(report)
+
+    assert rows == [
+        {"name": "a", "predicted_collisions": 7},
+        {"name": "c", "predicted_collisions": 0},
+    ]
+    assert "2 sets likely to collide" in text
+    assert "script_1 updated 3 in hotfix, after 1" in text
+    assert "script_0 updated 2 in default" in text
+    assert "(+2)" in text
+
+
+@mock.patch("sn_set.cli.to_excel")
+@mock.patch("sn_set.comparator.predict_collisions")
+@mock.patch("sn_set.comparator.get_install_order_new")
+@mock.patch("sn_set.comparator.get_install_order")
+@mock.patch("sn_set.comparator.get_update_sets")
+def test_cli_predict_collisions(
+    mock_get_update_sets,
+    mock_get_install_order,
+    mock_new_install_order,
+    mock_predict,
+    mock_to_excel,
+    runner,
+):
+    mock_get_update_sets.side_effect = [[{"name": "a"}, {"name": "b"}], [{"name": "x"}]]
+    mock_get_install_order.return_value = [
+        {"name": "a", "commit_date": "1"},
+        {"name": "b", "commit_date": "2"},
+    ]
+    mock_predict.return_value = CollisionReport(
+        {"b": {"script_1": Collision("script_1", "1", "2", "hotfix")}}, 3, 1, 2
+    )
+    mock_to_excel.return_value = True
+
+    result = runner.invoke(
+        cli.main,
+        ["-s", "nyudev", "-t", "nyuqa", "--predict-collisions", "--stable-order"],
+    )
+
+    assert result.exit_code == 0, result.output
+    mock_predict.assert_called_once_with("nyudev", "nyuqa", ["a", "b"])
+    assert "1 sets likely to collide" in result.output
+    rows = mock_to_excel.call_args[0][0]
+    assert [row["predicted_collisions"] for row in rows] == [0, 1]
@@ -0,0 +1,179 @@
+from unittest import mock
+
+import requests
+
+from sn_set.comparator import Comparator
+from sn_set.requests_lib import options
+
+SOURCE_SETS = [{"name": "a"}, {"name": "b"}, {"name": "c"}, {"name": "d"}]
+TARGET_SETS = [{"name": "a"}, {"name": "c"}]
+
+
+def fake_update_sets(instance):
+    return {"nyudev": SOURCE_SETS, "nyuqa": TARGET_SETS}[instance]
+
+
+def test_settings():
+    options["retries"] = 2
+    comparator = Comparator({"transport": "httpx"})
+    other = Comparator()
+
+    with comparator.scope():
+        assert options["transport"] == "httpx"
+        assert options["keep_alive"]
+        # the process wide options show through
+        assert options["retries"] == 2
+    with other.scope():
+        assert options.get("transport") is None
+    assert "transport" not in options
+    assert "keep_alive" not in options
+
+
+@mock.patch("sn_set.comparator.get_update_sets")
+def test_inventory_reused(mock_get_update_sets, clock):
+    mock_get_update_sets.side_effect = fake_update_sets
+    comparator = Comparator(max_age=60, clock=clock)
+
+    assert list(comparator.inventory("nyudev")) == SOURCE_SETS
+    assert comparator.names("nyudev") == ["a", "b", "c", "d"]
+    assert mock_get_update_sets.call_count == 1
+
+    clock.now += 60
+    comparator.names("nyudev")
+    assert mock_get_update_sets.call_count == 2
+
+    list(comparator.inventory("nyudev", refresh=True))
+    comparator.refresh("nyudev")
+    comparator.names("nyudev")
+    assert mock_get_update_sets.call_count == 4
+
+
+@mock.patch("sn_set.comparator.get_update_sets")
+def test_diff(mock_get_update_sets):
+    mock_get_update_sets.side_effect = fake_update_sets
+    comparator = Comparator()
+
+    assert list(comparator.diff("nyudev", "nyuqa")) == ["b", "d"]
+    assert list(comparator.diff("nyudev", "nyuqa")) == ["b", "d"]
+    assert mock_get_update_sets.call_count == 2
+
+
+@mock.patch("sn_set.comparator.get_install_order_new")
+@mock.patch("sn_set.comparator.get_install_order")
+@mock.patch("sn_set.comparator.get_update_sets")
+def test_compare(mock_get_update_sets, mock_get_install_order, mock_new_install_order):
+    mock_get_update_sets.side_effect = fake_update_sets
+    mock_get_install_order.return_value = [{"name": "d"}]
+    mock_new_install_order.return_value = [{"name": "b"}]
+    comparator = Comparator()
+
+    results = comparator.compare("nyudev", "nyuqa")
+
+    assert next(results) == {"name": "d"}
+    # the uncommitted sets are looked up once the committed ones are consumed
+    mock_new_install_order.assert_not_called()
+    assert list(results) == [{"name": "b"}]
+    mock_get_install_order.assert_called_once_with("nyudev", ["b", "d"])
+    mock_new_install_order.assert_called_once_with("nyudev", ["b"])
+
+    list(comparator.compare("nyudev", "nyuqa"))
+    assert mock_get_install_order.call_count == 1
+    comparator.refresh()
+    list(comparator.compare("nyudev", "nyuqa"))
+    assert mock_get_install_order.call_count == 2
+
+
+def test_compare_nothing_missing(requests_mock, mock_env_vars, clean_context):
+    inventory = requests_mock.get(
+        "https://nyudev.service-now.com/api/now/table/sys_update_set",
+        json={"result": [{"name": "a"}]},
+    )
+    requests_mock.get(
+        "https://nyuqa.service-now.com/api/now/table/sys_update_set",
+        json={"result": [{"name": "a"}]},
+    )
+    with Comparator() as comparator:
+        assert list(comparator.compare("nyudev", "nyuqa")) == []
+
+    # the two inventories, an empty diff has no install order to ask for
+    assert requests_mock.call_count == 2
+    assert inventory.call_count == 1
+
+
+def test_missing():
+    comparator = Comparator()
+
+    assert comparator.missing([], ["a"]) == []
+    assert comparator.missing(["b", "a", "b"], []) == ["b", "a"]
+    assert comparator.missing(["b", "a", "c"], ["a"]) == ["b", "c"]
+
+
+@mock.patch("sn_set.comparator.get_install_order_new")
+@mock.patch("sn_set.comparator.get_install_order")
+def test_install_order_all_committed(mock_get_install_order, mock_new_install_order):
+    mock_get_install_order.return_value = [{"name": "b"}, {"name": "a"}]
+
+    assert list(Comparator().install_order("nyudev", ["a", "b"])) == [
+        {"name": "b"},
+        {"name": "a"},
+    ]
+    mock_new_install_order.assert_not_called()
+
+
+def test_close(requests_mock, mock_env_vars, clean_context):
+    requests_mock.get(
+        "https://nyudev.service-now.com/api/now/table/sys_update_set",
+        json={"result": [{"name": "a"}]},
+    )
+    comparator = Comparator()
+    other = Comparator()
+    assert comparator.names("nyudev") == ["a"]
+    assert other.names("nyudev") == ["a"]
+    client = comparator.clients["https://nyudev.service-now.com"]["client"]
+    assert isinstance(client, requests.Session)
+    # each comparator builds its own clients, none are left in the context
+    assert other.clients["https://nyudev.service-now.com"]["client"] is not client
+    assert clean_context == {}
+    # a second comparison goes over the same client
+    comparator.refresh()
+    comparator.names("nyudev")
+    assert comparator.clients["https://nyudev.service-now.com"]["client"] is client
+    with mock.patch.object(client, "close") as close:
+        comparator.close()
+
+    close.assert_called_once()
+    assert comparator.clients == {}
+    assert "https://nyudev.service-now.com" in other.clients
+
+
+@mock.patch("sn_set.comparator.get_install_order_new")
+@mock.patch("sn_set.comparator.get_install_order")
+def test_generator_settings(mock_get_install_order, mock_new_install_order):
+    seen = []
+
+    def new_install_order(instance, names):
+        seen.append(options.get("transport"))
+        return [{"name": name} for name in names]
+
+    mock_get_install_order.return_value = [{"name": "a"}]
+    mock_new_install_order.side_effect = new_install_order
+    results = Comparator({"transport": "httpx"}).install_order("nyudev", ["a", "b"])
+
+    assert next(results) == {"name": "a"}
+    # consumed outside the comparator's settings, each step is run within them
+    assert options.get("transport") is None
+    assert list(results) == [{"name": "b"}]
+    assert seen == ["httpx"]
+
+
+def test_prewarm_clients(requests_mock, mock_env_vars, clean_context):
+    requests_mock.get(
+        "https://nyudev.service-now.com/api/now/table/sys_update_set",
+        json={"result": []},
+    )
+    comparator = Comparator()
+
+    assert comparator.prewarm(["nyudev"]) == {"nyudev": None}
+    # the clients built by the prewarm threads are the comparator's
+    assert "https://nyudev.service-now.com" in comparator.clients
+    assert clean_context == {}
@@ -0,0 +1,205 @@
+import random
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from sn_set import cli
+from sn_set.content_diff import (
+    ContentDiff,
+    ExternalSorter,
+    content_diff,
+    fingerprint,
+    format_content_diff,
+    merge_join,
+)
+
+
+def test_external_sorter_spills_and_merges(tmp_path):
+    rows = [(f"record {i:04d}", str(i % 7)) for i in range(1000)]
+    shuffled = rows[:]
+    random.Random(1).shuffle(shuffled)
+    sorter = ExternalSorter(str(tmp_path), buffer_rows=64)
+
+    for row in shuffled:
+        sorter.add(row)
+
+    assert len(sorter.runs) == 15
+    assert len(sorter.buffer) <= 64
+    assert list(sorter.sorted()) == rows
+    # the runs can be read again
+    assert list(sorter.sorted()) == rows
+    assert sorter.count == 1000
+
+
+def test_external_sorter_in_memory(tmp_path):
+    sorter = ExternalSorter(str(tmp_path), buffer_rows=10)
+    for row in [("b", "1"), ("a", "2")]:
+        sorter.add(row)
+
+    assert list(sorter.sorted()) == [("a", "2"), ("b", "1")]
+    assert sorter.runs == []
+
+
+def test_fingerprint():
+    assert fingerprint("<xml/>") == fingerprint({"value": "<xml/>"})
+    assert fingerprint("<xml/>") != fingerprint("<xml2/>")
+    assert fingerprint(None) == fingerprint("")
+    assert len(fingerprint("<xml/>")) == 32
+
+
+def test_merge_join():
+    source = sorted(
+        [
+            ("r1", "x", "a"),
+            ("r2", "y", "a"),
+            ("r2", "y", "b"),
+            ("r3", "z", "b"),
+            ("r4", "w", "c"),
+        ]
+    )
+    target = sorted([("r1", "x"), ("r1", "old"), ("r2", "y"), ("r3", "changed")])
+
+    assert merge_join(source, target) == {"a": (2, 0), "b": (2, 1), "c": (1, 1)}
+
+
+def table(rows, prefix):
+    def respond(request, context):
+        params = parse_qs(urlsplit(request.url).query)
+        clause = params["sysparm_query"][0].split("^")[0][len(prefix) :]
+        names = clause[6:].split(",") if clause.startswith("nameIN") else [clause[5:]]
+        key = "update_set.name" if prefix else "name"
+        fields = params["sysparm_fields"][0].split(",")
+        return {
+            "result": [
+                {field: row.get(field, "") for field in fields}
+                for row in rows
+                if row[key] in names
+            ]
+        }
+
+    return respond
+
+
+def test_content_diff(requests_mock, mock_env_vars, tmp_path, make_update):
+    requests_mock.get(
+        "https://nyudev.service-now.com/api/now/table/sys_update_xml",
+        json=table(
+            [
+                make_update("r1", "renamed", payload="<one/>"),
+                make_update("r2", "changed", payload="<two v='2'/>"),
+                make_update("r3", "new", payload="<three/>"),
+            ],
+            "update_set.",
+        ),
+    )
+    requests_mock.get(
+        "https://nyuqa.service-now.com/api/now/table/sys_update_xml",
+        json=table(
+            [
+                make_update("r1", "original name", payload="<one/>"),
+                make_update("r2", "changed", payload="<two v='1'/>"),
+            ],
+            "",
+        ),
+    )
+
+    diff = content_diff(
+        "nyudev",
+        "nyuqa",
+        ["renamed", "changed", "new", "empty"],
+        buffer_rows=1,
+        directory=str(tmp_path),
+    )
+
+    assert diff.sets == {
+        "renamed": (1, 0),
+        "changed": (1, 1),
+        "new": (1, 1),
+        "empty": (0, 0),
+    }
+    assert diff.missing_sets() == ["changed", "new"]
+    assert diff.present_sets() == ["renamed", "empty"]
+    assert (diff.source_updates, diff.target_updates) == (3, 2)
+    # the spilled runs are removed
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_content_diff_invalid():
+    with pytest.raises(ValueError):
+        content_diff("nyudev", "nyuqa", [""])
+
+
+def test_format_content_diff():
+    diff = ContentDiff({"renamed": (1, 0), "changed": (1, 1), "new": (2, 1)}, 4, 2)
+
+    text = format_content_diff(diff, ["renamed", "new"])
+
+    assert "2 of 3 sets have changes the target doesn't" in text
+    assert "1 sets missing by name are already on the target: renamed" in text
+    assert "1 sets on the target by name have changed: changed" in text
+
+
+@mock.patch("sn_set.cli.to_excel")
+@mock.patch("sn_set.comparator.content_diff")
+@mock.patch("sn_set.comparator.get_install_order_new")
+@mock.patch("sn_set.comparator.get_install_order")
+@mock.patch("sn_set.comparator.get_update_sets")
+def test_cli_content_diff(
+    mock_get_update_sets,
+    mock_get_install_order,
+    mock_new_install_order,
+    mock_content_diff,
+    mock_to_excel,
+    runner,
+):
+    mock_get_update_sets.side_effect = [
+        [{"name": "renamed"}, {"name": "changed"}],
+        [{"name": "changed"}],
+    ]
+    mock_get_install_order.return_value = [{"name": "changed", "commit_date": "1"}]
+    mock_content_diff.return_value = ContentDiff(
+        {"renamed": (1, 0), "changed": (1, 1)}, 2, 2
+    )
+    mock_to_excel.return_value = True
+
+    result = runner.invoke(
+        cli.main,
+        ["-s", "nyudev", "-t", "nyuqa", "--content-diff", "--content-buffer", "10"],
+    )
+
+    assert result.exit_code == 0, result.output
+    mock_content_diff.assert_called_once_with(
+        "nyudev",
+        "nyuqa",
+        ["renamed", "changed"],
+        field="payload",
+        buffer_rows=10,
+    )
+    mock_get_install_order.assert_called_once_with("nyudev", ["changed"])
+    assert "already on the target: renamed" in result.output
+
+
+@mock.patch("sn_set.cli.to_excel")
+@mock.patch("sn_set.comparator.content_diff")
+@mock.patch("sn_set.comparator.get_install_order_new")
+@mock.patch("sn_set.comparator.get_install_order")
+@mock.patch("sn_set.comparator.get_update_sets")
+def test_cli_content_diff_empty_target(
+    mock_get_update_sets,
+    mock_get_install_order,
+    mock_new_install_order,
+    mock_content_diff,
+    mock_to_excel,
+    runner,
+):
+    mock_get_update_sets.side_effect = [[{"name": "new"}], []]
+    mock_get_install_order.return_value = [{"name": "new", "commit_date": "1"}]
+    mock_content_diff.return_value = ContentDiff({"new": (1, 1)}, 1, 0)
+    mock_to_excel.return_value = True
+
+    result = runner.invoke(cli.main, ["-s", "nyudev", "-t", "nyuqa", "--content-diff"])
+
+    assert result.exit_code == 0, result.output
+    assert "1 of 1 sets have changes the target doesn't" in result.output
+    mock_get_install_order.assert_called_once_with("nyudev", ["new"])
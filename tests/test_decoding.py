@@ -0,0 +1,97 @@
+import json
+
+import pytest
+
+from sn_set import decoding
+from sn_set.decoding import get_decoder
+from sn_set.records import UpdateSetRecord
+from sn_set.requests_lib import INSTALL_ORDER_FIELDS, make_request, options
+
+ROWS = [{field: f"{field} {idx}" for field in INSTALL_ORDER_FIELDS} for idx in range(3)]
+ROWS[1]["commit_date"] = {"display_value": "2021-05-08 18:39:00", "value": "x"}
+
+
+def decoders():
+    for name in ["json", "orjson", "msgspec"]:
+        yield pytest.param(
+            name,
+            marks=pytest.mark.skipif(
+                name != "json" and getattr(decoding, name) is None,
+                reason=f"{name} is not installed",
+            ),
+        )
+
+
+@pytest.mark.parametrize("name", decoders())
+def test_decoders_agree(name):
+    decoder = get_decoder(name)
+    content = json.dumps({"result": ROWS}).encode()
+
+    for fields in [None, INSTALL_ORDER_FIELDS]:
+        result = decoder.decode_result(content, fields)
+        assert result == ROWS
+        assert all(isinstance(row, UpdateSetRecord) for row in result)
+        assert result[1]["commit_date"]["display_value"] == "2021-05-08 18:39:00"
+
+
+@pytest.mark.parametrize("name", decoders())
+def test_decoders_non_row_results(name):
+    decoder = get_decoder(name)
+    content = json.dumps({"result": {"stats": {"count": "42"}}}).encode()
+
+    assert decoder.decode_result(content)["stats"]["count"] == "42"
+    assert decoder.decode_result(content, ["name"])["stats"]["count"] == "42"
+    assert decoder.decode_result(b'{"result": []}', ["name"]) == []
+
+
+@pytest.mark.parametrize("name", decoders())
+def test_decoders_reject_invalid_json(name):
+    with pytest.raises(ValueError):
+        get_decoder(name).decode_result(b"<html>not json</html>")
+
+
+def test_get_decoder_without_extras(monkeypatch):
+    monkeypatch.setattr(decoding, "_decoders", {})
+    monkeypatch.setattr(decoding, "msgspec", None)
+    monkeypatch.setattr(decoding, "orjson", None)
+
+    assert get_decoder("auto").name == "json"
+    with pytest.raises(ImportError):
+        get_decoder("orjson")
+    with pytest.raises(ImportError):
+        get_decoder("msgspec")
+    with pytest.raises(ValueError):
+        get_decoder("yaml")
+
+
+@pytest.mark.parametrize("name", decoders())
+def test_make_request_uses_configured_decoder(name, requests_mock, mock_env_vars):
+    options["json_decoder"] = name
+    requests_mock.get("mock://nyudev/api", json={"result": ROWS})
+
+    result = make_request(
+        "mock://nyudev/api",
+        path_params={"sysparm_fields": ",".join(INSTALL_ORDER_FIELDS)},
+        base_url="mock://nyudev",
+    )
+
+    assert result == ROWS
+
+
+@pytest.mark.parametrize("name", decoders())
+def test_decoders_keep_missing_fields_missing(name):
+    content = json.dumps({"result": [{"name": "a set"}]}).encode()
+    (record,) = get_decoder(name).decode_result(content, ["name", "state"])
+    assert record == {"name": "a set"}
+    assert "state" not in record
+
+
+@pytest.mark.parametrize("name", decoders())
+def test_decoders_dot_walked_fields(name):
+    rows = [{"name": "script_1", "update_set.name": "a set"}]
+    content = json.dumps({"result": rows}).encode()
+
+    result = get_decoder(name).decode_result(content, ["name", "update_set.name"])
+
+    assert result == rows
+    assert result[0]["update_set.name"] == "a set"
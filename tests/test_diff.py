@@ -0,0 +1,66 @@
+import pytest
+
+from sn_set import cli, diff
+from sn_set.requests_lib import options
+
+
+@pytest.mark.parametrize(
+    "left,right",
+    [
+        (["c", "a", "b", "a", "d"], ["b"]),
+        (["c", "a", "b", "a", "d"], ["b", "x", "y", "z", "w", "v"]),
+    ],
+)
+def test_difference_both_sides(left, right):
+    # the second case is smaller on the left, so left is the side held as a set
+    assert sorted(diff.difference(left, right)) == ["a", "c", "d"]
+    assert diff.difference(left, right, stable=True) == ["c", "a", "d"]
+
+
+def test_difference_accepts_iterators(monkeypatch):
+    monkeypatch.setattr(diff, "CHUNK_SIZE", 3)
+    left = (f"set {i}" for i in range(10))
+    right = iter(["set 1", "set 4", "set 9", "other"])
+
+    assert diff.difference(left, right, stable=True) == [
+        f"set {i}" for i in (0, 2, 3, 5, 6, 7, 8)
+    ]
+
+
+@pytest.mark.parametrize(
+    "left,right",
+    [
+        ([], ["a"]),
+        (iter([]), ["a"]),
+        (["a"], {"a": 1}),
+        (["a"], 5),
+        (["a", ""], ["b"]),
+        (["a"], ["b", ["c"]]),
+    ],
+)
+def test_difference_invalid(left, right):
+    with pytest.raises(ValueError):
+        diff.difference(left, right)
+
+
+def test_invalid_item_in_a_later_chunk(monkeypatch):
+    monkeypatch.setattr(diff, "CHUNK_SIZE", 2)
+
+    with pytest.raises(ValueError):
+        diff.difference(["a", "b", "c", None], ["b"])
+
+
+def test_get_set_diff_stable_order_option():
+    left = [f"set {i}" for i in range(50, 0, -1)]
+
+    options["stable_order"] = True
+
+    assert cli.get_set_diff(left, ["set 3"]) == [n for n in left if n != "set 3"]
+
+
+def test_get_set_diff_debug(capsys):
+    assert cli.get_set_diff(iter(["a", "b", "a"]), iter(["b"]), debug=True) == ["a"]
+
+    out = capsys.readouterr().out
+    assert "Left:\na\nb\n" in out
+    assert "Right:\nb" in out
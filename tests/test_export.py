@@ -0,0 +1,223 @@
+import json
+
+import pytest
+from requests.exceptions import HTTPError
+
+from sn_set import export
+from sn_set.requests_lib import fetch_records, options
+
+TEST_URI = "https://export-test.com/api/now/table/sys_remote_update_set"
+TEST_PARAMS = {
+    "sysparm_query": "state=committed^nameINa,b^ORDERBYcommit_date",
+    "sysparm_fields": "name,commit_date",
+    "sysparm_display_value": "true",
+}
+
+
+@pytest.fixture(autouse=True)
+def reset_unavailable():
+    export.unavailable_instances.clear()
+    yield
+    export.unavailable_instances.clear()
+
+
+@pytest.mark.parametrize(
+    "export_format,expected_params",
+    [
+        (
+            "jsonv2",
+            {
+                "JSONv2": "",
+                "displayvalue": "true",
+                "sysparm_fields": "name,commit_date,sys_id",
+                "sysparm_query": "state=committed^nameINa,b^ORDERBYsys_id",
+                "sysparm_record_count": "5000",
+            },
+        ),
+        (
+            "csv",
+            {
+                "CSV": "",
+                "sysparm_fields": "name,commit_date,sys_id",
+                "sysparm_query": "state=committed^nameINa,b^ORDERBYsys_id",
+                "sysparm_record_count": "5000",
+            },
+        ),
+    ],
+)
+def test_export_request(export_format, expected_params):
+    uri, params = export.export_request(TEST_URI, TEST_PARAMS, export_format)
+    assert uri == "https://export-test.com/sys_remote_update_set.do"
+    assert params == expected_params
+
+
+def test_export_request_next_page():
+    _, params = export.export_request(
+        TEST_URI, {"sysparm_query": "active=true"}, "csv", page_size=2, after="9"
+    )
+    assert params == {
+        "CSV": "",
+        "sysparm_default_export_fields": "all",
+        "sysparm_query": "active=true^sys_id>9^ORDERBYsys_id",
+        "sysparm_record_count": "2",
+    }
+
+
+@pytest.mark.parametrize(
+    "params,export_format,expected",
+    [
+        (TEST_PARAMS, "jsonv2", True),
+        (TEST_PARAMS, "csv", True),
+        ({"sysparm_fields": "name,update_source"}, "jsonv2", False),
+        ({"sysparm_query": "active=true"}, "jsonv2", False),
+        ({"sysparm_fields": "name,sys_updated_by"}, "csv", True),
+        # CSV would give the state's label rather than its value
+        ({"sysparm_fields": "name,state"}, "csv", False),
+        ({"sysparm_fields": "name,state"}, "jsonv2", True),
+    ],
+)
+def test_exportable(params, export_format, expected):
+    assert export.exportable(params, export_format) is expected
+
+
+def test_order_records():
+    records = [
+        {"name": "a", "commit_date": "2021-05-02"},
+        {"name": "b", "commit_date": "2021-05-01"},
+        {"name": "c", "commit_date": "2021-05-02"},
+    ]
+    query = "state=committed^ORDERBYDESCcommit_date^ORDERBYDESCname"
+    assert [r["name"] for r in export.order_records(records, query)] == [
+        "c",
+        "a",
+        "b",
+    ]
+
+
+def test_export_request_invalid_format():
+    with pytest.raises(ValueError):
+        export.export_request(TEST_URI, TEST_PARAMS, "xml")
+
+
+def test_parse_export_jsonv2():
+    content = json.dumps(
+        {
+            "records": [
+                {"name": "a", "commit_date": "2021-05-08 18:39:00", "sys_id": "1"},
+                {"name": "b", "sys_id": "2"},
+            ]
+        }
+    ).encode()
+    assert export.parse_export(content, "jsonv2", TEST_PARAMS) == [
+        {"name": "a", "commit_date": "2021-05-08 18:39:00", "sys_id": "1"},
+        {"name": "b", "commit_date": "", "sys_id": "2"},
+    ]
+
+
+def test_parse_export_csv():
+    content = b'\xef\xbb\xbf"sys_id","name","commit_date"\r\n"1","a","2021-05-08"\r\n'
+    assert export.parse_export(content, "csv", TEST_PARAMS) == [
+        {"name": "a", "commit_date": "2021-05-08", "sys_id": "1"}
+    ]
+
+
+@pytest.mark.parametrize(
+    "content,export_format",
+    [
+        (b"<html>login</html>", "jsonv2"),
+        (b'{"result": []}', "jsonv2"),
+        (b"<html>login</html>", "csv"),
+    ],
+)
+def test_parse_export_invalid(content, export_format):
+    with pytest.raises(ValueError):
+        export.parse_export(content, export_format, TEST_PARAMS)
+
+
+def test_fetch_records_jsonv2(requests_mock, mock_env_vars):
+    options["backend"] = "jsonv2"
+    requests_mock.get(
+        "https://export-test.com/sys_remote_update_set.do?JSONv2",
+        json={"records": [{"name": "a", "commit_date": "2021", "state": "x"}]},
+    )
+    result = fetch_records(TEST_URI, TEST_PARAMS, base_url="https://export-test.com")
+    assert result == [{"name": "a", "commit_date": "2021"}]
+
+
+def test_fetch_records_export_pages(requests_mock, mock_env_vars, monkeypatch):
+    monkeypatch.setattr(export, "EXPORT_PAGE_SIZE", 2)
+    options["backend"] = "jsonv2"
+    export_mock = requests_mock.get(
+        "https://export-test.com/sys_remote_update_set.do",
+        [
+            {
+                "json": {
+                    "records": [
+                        {"name": "b", "commit_date": "2021-05-03", "sys_id": "1"},
+                        {"name": "a", "commit_date": "2021-05-01", "sys_id": "2"},
+                    ]
+                }
+            },
+            {
+                "json": {
+                    "records": [
+                        {"name": "c", "commit_date": "2021-05-02", "sys_id": "3"}
+                    ]
+                }
+            },
+        ],
+    )
+    result = fetch_records(TEST_URI, TEST_PARAMS, base_url="https://export-test.com")
+
+    # every page is read, then put back in commit_date order
+    assert [r["name"] for r in result] == ["a", "c", "b"]
+    assert "sys_id" not in result[0]
+    assert export_mock.call_count == 2
+    query = export_mock.request_history[1].qs["sysparm_query"][0]
+    assert query == "state=committed^nameina,b^sys_id>2^orderbysys_id"
+
+
+def test_fetch_records_reference_uses_table(requests_mock, mock_env_vars):
+    options["backend"] = "jsonv2"
+    table_mock = requests_mock.get(TEST_URI, json={"result": [{"name": "a"}]})
+    params = {**TEST_PARAMS, "sysparm_fields": "name,update_source"}
+
+    assert fetch_records(TEST_URI, params, base_url="https://export-test.com") == [
+        {"name": "a"}
+    ]
+    assert table_mock.call_count == 1
+
+
+def test_fetch_records_auto_falls_back(requests_mock, mock_env_vars):
+    options["backend"] = "auto"
+    export_mock = requests_mock.get(
+        "https://export-test.com/sys_remote_update_set.do", status_code=403
+    )
+    table_mock = requests_mock.get(TEST_URI, json={"result": [{"name": "a"}]})
+
+    base_url = "https://export-test.com"
+    assert fetch_records(TEST_URI, TEST_PARAMS, base_url=base_url) == [{"name": "a"}]
+    assert fetch_records(TEST_URI, TEST_PARAMS, base_url=base_url) == [{"name": "a"}]
+    # the processor is only tried once per instance
+    assert export_mock.call_count == 1
+    assert table_mock.call_count == 2
+
+
+@pytest.mark.parametrize("status_code", [400, 414])
+def test_fetch_records_auto_long_query(status_code, requests_mock, mock_env_vars):
+    options["backend"] = "auto"
+    requests_mock.get(
+        "https://export-test.com/sys_remote_update_set.do", status_code=status_code
+    )
+    with pytest.raises(HTTPError):
+        fetch_records(TEST_URI, TEST_PARAMS, base_url="https://export-test.com")
+    assert not export.unavailable_instances
+
+
+def test_fetch_records_forced_export_raises(requests_mock, mock_env_vars):
+    options["backend"] = "csv"
+    requests_mock.get(
+        "https://export-test.com/sys_remote_update_set.do", status_code=403
+    )
+    with pytest.raises(HTTPError):
+        fetch_records(TEST_URI, TEST_PARAMS, base_url="https://export-test.com")
@@ -0,0 +1,159 @@
+import threading
+import time
+from unittest import mock
+
+import pytest
+import requests
+
+from sn_set import tracing
+from sn_set.hedging import HedgingPolicy
+from sn_set.registry import InstanceConfig, Registry
+from sn_set.requests_lib import make_request, options
+from sn_set.stats import StatsCollector
+
+
+def warmed_up(policy: HedgingPolicy, key: str = "nyudev", latency: float = 0.01):
+    instance = policy._instance(key)
+    instance.latencies.extend([latency] * policy.min_samples)
+    instance.requests = 100
+    return policy
+
+
+def test_no_hedging_until_enough_samples(make_response):
+    policy = HedgingPolicy(min_samples=3)
+    assert policy.delay("nyudev") is None
+    for _ in range(3):
+        assert policy.send("nyudev", lambda: make_response(text="ok")).text == "ok"
+    assert policy.delay("nyudev") == policy.min_delay
+    assert policy.summary()["nyudev"]["hedged"] == 0
+
+
+def test_hedge_wins_over_slow_request(make_response):
+    policy = warmed_up(HedgingPolicy(min_delay=0.01))
+    release = threading.Event()
+    calls = []
+
+    def send():
+        calls.append(1)
+        if len(calls) == 1:
+            release.wait(5)
+            return make_response(text="slow")
+        return make_response(text="hedge")
+
+    assert policy.send("nyudev", send).text == "hedge"
+    release.set()
+    policy._executor.shutdown(wait=True)
+
+    summary = policy.summary()["nyudev"]
+    assert summary["hedged"] == 1
+    assert summary["hedge_wins"] == 1
+    assert summary["hedge_rate"] == pytest.approx(1 / 101, abs=1e-4)
+    assert summary["time_saved_s"] > 0
+    assert "nyudev" in policy.format_summary()
+
+
+def test_hedge_keeps_the_callers_context(make_response):
+    policy = warmed_up(HedgingPolicy(min_delay=0.01))
+    collector = StatsCollector()
+    release = threading.Event()
+    seen = []
+
+    def send():
+        with tracing.span("attempt") as span:
+            seen.append((span.parent_id, collector.current))
+        if len(seen) == 1:
+            release.wait(5)
+        return make_response(text="ok")
+
+    hook = tracing.add_hook(tracing.TraceHook())
+    try:
+        with collector.stage("install order"), tracing.span("lookup") as lookup:
+            assert policy.send("nyudev", send).text == "ok"
+    finally:
+        tracing.remove_hook(hook)
+    release.set()
+    policy._executor.shutdown(wait=True)
+
+    # the primary and the hedge both ran in the lookup's span and stage
+    assert seen == [(lookup.span_id, "install order")] * 2
+
+
+def test_hedging_capped_per_instance(make_response):
+    policy = warmed_up(HedgingPolicy(max_ratio=0.0, min_delay=0.01))
+    calls = []
+
+    def send():
+        calls.append(1)
+        time.sleep(0.05)
+        return make_response(text="slow")
+
+    assert policy.send("nyudev", send).text == "slow"
+    assert len(calls) == 1
+    assert policy.summary()["nyudev"]["hedged"] == 0
+
+
+def test_hedge_failure_falls_back_to_primary(make_response):
+    policy = warmed_up(HedgingPolicy(min_delay=0.01))
+    calls = []
+
+    def send():
+        calls.append(1)
+        if len(calls) == 1:
+            time.sleep(0.1)
+            return make_response(text="slow")
+        raise requests.ConnectionError("hedge failed")
+
+    assert policy.send("nyudev", send).text == "slow"
+    assert policy.summary()["nyudev"]["hedge_wins"] == 0
+
+
+def test_both_failing_raises_primary_error():
+    policy = warmed_up(HedgingPolicy(min_delay=0.01))
+    calls = []
+
+    def send():
+        calls.append(1)
+        if len(calls) == 1:
+            time.sleep(0.05)
+            raise requests.ReadTimeout("primary")
+        raise requests.ConnectionError("hedge")
+
+    with pytest.raises(requests.ReadTimeout):
+        policy.send("nyudev", send)
+
+
+def test_make_request_hedging(requests_mock, mock_env_vars):
+    options["hedging"] = HedgingPolicy()
+    requests_mock.get("mock://nyudev/api", json={"result": [{"name": "a"}]})
+
+    assert make_request("mock://nyudev/api", base_url="mock://nyudev") == [
+        {"name": "a"}
+    ]
+    assert options["hedging"].summary()["mock://nyudev"]["requests"] == 1
+
+
+def test_hedge_takes_a_rate_limit_token(make_response, clean_context):
+    base_url = "https://acme.example.com"
+    options["registry"] = Registry(
+        [InstanceConfig("acme", base_url=base_url, rate_limit=10)]
+    )
+    options["hedging"] = warmed_up(HedgingPolicy(min_delay=0.01), key=base_url)
+    release = threading.Event()
+    calls = []
+
+    def request(method, uri, **kwargs):
+        calls.append(1)
+        if len(calls) == 1:
+            release.wait(5)
+        return make_response(text='{"result": [{"name": "a"}]}')
+
+    clean_context[base_url] = {"client": mock.Mock(request=request)}
+    limiter = options["registry"].limiter(base_url)
+    with mock.patch.object(limiter, "acquire", return_value=0.0) as acquire:
+        assert make_request(f"{base_url}/api", base_url=base_url) == [{"name": "a"}]
+        release.set()
+        options["hedging"]._executor.shutdown(wait=True)
+
+    # the original request and its hedge
+    assert len(calls) == 2
+    assert acquire.call_count == 2
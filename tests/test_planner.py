@@ -0,0 +1,138 @@
+import json
+from unittest import mock
+
+from sn_set import cli
+from sn_set.planner import build_plan, format_chunks, format_plan, lookup_plan
+from sn_set.requests_lib import install_order_params, options
+
+URI = "https://nyudev.service-now.com/api/now/table/sys_remote_update_set"
+
+
+def test_lookup_plan_single_query():
+    plan = lookup_plan(URI, 10, 30, install_order_params, 8192)
+    assert plan["requests"] == 1
+    assert plan["fallback"] is False
+    assert plan["chunks"] == [10]
+
+
+def test_lookup_plan_per_name_fallback():
+    plan = lookup_plan(URI, 1000, 30, install_order_params, 8192)
+    assert plan["fallback"] is True
+    assert plan["url_length"] > 8192
+    assert plan["requests"] == 1001
+    assert plan["chunks"] == [1] * 1000
+
+
+def test_lookup_plan_chunked_fallback():
+    options["max_url_length"] = 4000
+    plan = lookup_plan(URI, 1000, 30, install_order_params, 8192)
+    assert sum(plan["chunks"]) == 1000
+    assert max(plan["chunks"]) < 1000
+    assert plan["requests"] == 1 + len(plan["chunks"])
+
+
+def test_lookup_plan_batched_fallback():
+    options["batch_size"] = 50
+    plan = lookup_plan(URI, 1000, 30, install_order_params, 8192)
+    assert plan["requests"] == 1 + 20
+    assert plan["sub_requests"] == 1000
+
+
+@mock.patch("sn_set.planner.make_request")
+@mock.patch("sn_set.planner.get_record_count")
+def test_build_plan(mock_count, mock_make_request):
+    mock_count.side_effect = [1000, 600, 250]
+    mock_make_request.return_value = [{"name": "STRY0000001 - a set"}]
+
+    plan = build_plan("nyudev", "nyuqa")
+
+    assert mock_count.call_args_list[0] == mock.call(
+        "nyudev", "sys_update_set", "state=complete^ORstate=ignore"
+    )
+    assert mock_count.call_args_list[1][0][0] == "nyuqa"
+    assert plan["estimated_diff"] == 400
+    assert plan["estimated_new_sets"] == 100
+    stages = {row["stage"]: row for row in plan["stages"]}
+    assert stages["source fetch"]["rows"] == 1000
+    assert stages["install order"]["rows"] == 300
+    assert stages["new sets"]["rows"] == 100
+    assert stages["diff"]["requests"] == 0
+    assert plan["totals"]["requests"] == sum(r["requests"] for r in plan["stages"])
+    assert plan["concurrency"] == 1
+    # only the samples are retrieved, never the full tables
+    for call in mock_make_request.call_args_list:
+        assert call.kwargs["path_params"]["sysparm_limit"] == "20"
+    assert "Expected concurrency: 1" in format_plan(plan)
+
+
+@mock.patch("sn_set.planner.make_request")
+@mock.patch("sn_set.planner.get_record_count")
+def test_build_plan_export_backend(mock_count, mock_make_request):
+    mock_count.side_effect = [12000, 5000, 0]
+    mock_make_request.return_value = [{"name": "STRY0000001 - a set"}]
+    options["backend"] = "jsonv2"
+
+    plan = build_plan("nyudev", "nyuqa")
+
+    stages = {row["stage"]: row for row in plan["stages"]}
+    # exports are read a page of EXPORT_PAGE_SIZE rows at a time
+    assert stages["source fetch"]["requests"] == 3
+    assert stages["target fetch"]["requests"] == 2
+    assert plan["backend"] == "jsonv2"
+    assert "jsonv2 backend" in format_plan(plan)
+
+
+def test_format_chunks():
+    assert format_chunks([]) == "-"
+    assert format_chunks([5]) == "1 x 5"
+    assert format_chunks([7, 7, 3]) == "3 x 3-7"
+
+
+@mock.patch("sn_set.cli.build_plan")
+def test_cli_plan(mock_build_plan, runner):
+    def build_plan(source, target, url_limit):
+        assert options["batch_size"] == 5
+        return {"source": source, "target": target}
+
+    mock_build_plan.side_effect = build_plan
+
+    result = runner.invoke(
+        cli.main, ["plan", "-s", "nyudev", "-t", "nyuqa", "--json", "--batch-size", "5"]
+    )
+
+    assert result.exit_code == 0
+    mock_build_plan.assert_called_once_with("nyudev", "nyuqa", url_limit=8192)
+    assert '"source": "nyudev"' in result.output
+
+
+@mock.patch("sn_set.planner.make_request")
+@mock.patch("sn_set.planner.get_record_count")
+def test_cli_plan_registry_and_backend(mock_count, mock_make_request, runner, tmp_path):
+    mock_count.return_value = 10
+    mock_make_request.return_value = []
+    path = tmp_path / "registry.json"
+    path.write_text(json.dumps({"acme": {"base_url": "https://acme.example.com"}}))
+
+    result = runner.invoke(
+        cli.main,
+        [
+            "--registry",
+            str(path),
+            "--backend",
+            "csv",
+            "plan",
+            "-s",
+            "acme",
+            "-t",
+            "acme",
+        ],
+    )
+
+    assert result.exit_code == 0, result.output
+    assert "(https://acme.example.com, csv backend)" in result.output
+    assert mock_make_request.call_args.kwargs["base_url"] == "https://acme.example.com"
+
+
+def test_cli_plan_requires_instances(runner):
+    result = runner.invoke(cli.main, ["plan", "-s", "nyudev"])
+    assert result.exit_code != 0
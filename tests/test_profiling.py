@@ -0,0 +1,63 @@
+import os
+import pstats
+from unittest import mock
+
+from sn_set import cli
+from sn_set.profiling import profile_run
+
+
+def test_profile_run_cpu(tmp_path):
+    with profile_run(str(tmp_path)):
+        cli.get_set_diff(["a", "b", "c"], ["b"])
+
+    assert os.path.exists(tmp_path / "snset.pstats")
+    stats = pstats.Stats(str(tmp_path / "snset.pstats"))
+    assert any(name == "get_set_diff" for (_, _, name) in stats.stats)
+
+    with open(tmp_path / "snset-profile.txt") as f:
+        report = f.read()
+    assert "Hottest sn_set functions (own time)" in report
+    assert "sn_set/cli.py" in report.replace(os.sep, "/")
+    assert "Top allocations" not in report
+
+
+def test_profile_run_memory_only(tmp_path):
+    with profile_run(str(tmp_path / "out"), cpu=False, memory=True):
+        cli.get_set_diff([f"set {i}" for i in range(1000)], ["set 1"])
+
+    assert not os.path.exists(tmp_path / "out" / "snset.pstats")
+    with open(tmp_path / "out" / "snset-profile.txt") as f:
+        report = f.read()
+    assert "Peak traced memory" in report
+    assert "Top sn_set allocations" in report
+    assert "Hottest sn_set functions" not in report
+
+
+@mock.patch("sn_set.cli.to_excel")
+@mock.patch("sn_set.comparator.get_install_order_new")
+@mock.patch("sn_set.comparator.get_install_order")
+@mock.patch("sn_set.comparator.get_update_sets")
+def test_cli_profile(
+    mock_get_update_sets,
+    mock_get_install_order,
+    mock_new_install_order,
+    mock_to_excel,
+    runner,
+):
+    mock_get_update_sets.side_effect = [[{"name": "a"}, {"name": "b"}], [{"name": "a"}]]
+    mock_get_install_order.return_value = [{"name": "b"}]
+    mock_to_excel.return_value = True
+
+    with runner.isolated_filesystem():
+        result = runner.invoke(
+            cli.main,
+            ["-s", "nyudev", "-t", "nyuqa", "--profile", "--profile-memory"]
+            + ["--profile-dir", "profiles"],
+        )
+        assert os.path.exists(os.path.join("profiles", "snset.pstats"))
+        with open(os.path.join("profiles", "snset-profile.txt")) as f:
+            report = f.read()
+
+    assert result.exit_code == 0
+    assert "run" in report
+    assert "Peak traced memory" in report
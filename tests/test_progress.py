@@ -0,0 +1,100 @@
+from unittest import mock
+
+import pytest
+from requests.exceptions import HTTPError
+
+from sn_set import cli, tracing
+from sn_set.progress import ProgressDisplay, StageProgress, format_eta
+from sn_set.requests_lib import get_install_order
+from sn_set.stats import StatsCollector
+
+
+def test_format_eta():
+    assert format_eta(None) == "-"
+    assert format_eta(0) == "0:00:00"
+    assert format_eta(3725.4) == "1:02:05"
+
+
+def test_stage_progress_eta(monkeypatch):
+    stage = StageProgress("install order")
+    assert stage.eta is None
+    stage.units_total = 10
+    stage.units_done = 2
+    monkeypatch.setattr(stage, "started", stage.started - 4)
+    assert 15.5 < stage.eta < 16.5
+    stage.ended = stage.started + 5
+    assert stage.eta == 0.0
+
+
+@mock.patch("sn_set.requests_lib.make_request")
+def test_progress_plain_lines(mock_make_request):
+    mock_make_request.side_effect = [
+        HTTPError(response=mock.Mock(status_code=414)),
+        [{"name": "a", "commit_date": "2021-05-08 18:39:00"}],
+        [{"name": "b", "commit_date": "2021-05-09 18:39:00"}],
+    ]
+    collector = StatsCollector()
+    lines = []
+    display = tracing.add_hook(
+        ProgressDisplay(collector, live=False, interval=0.0, write=lines.append)
+    )
+    try:
+        with collector.stage("install order"), tracing.span(
+            "stage install order", stage="install order"
+        ):
+            get_install_order("nyudev", ["a", "b"])
+    finally:
+        tracing.remove_hook(display)
+
+    (stage,) = display.stages
+    assert stage.units_total == 2
+    assert stage.units_done == 2
+    assert stage.ended is not None
+    assert lines[-1].startswith("[install order] done")
+    assert "2/2 lookups" in lines[-1]
+    assert "1/2 lookups" in "\n".join(lines)
+
+
+def test_progress_render():
+    pytest.importorskip("rich")
+    collector = StatsCollector()
+    display = ProgressDisplay(collector, live=False)
+    with collector.stage("source fetch"):
+        collector.record("GET", "https://a.com/api", 200, 0.1, 10, rows=5)
+    display.on_start(
+        tracing.Span("stage source fetch", {"stage": "source fetch"}, None)
+    )
+    table = display.render()
+    assert table.row_count == 1
+    assert display._stage_totals(display.stages[0])["rows"] == 5
+
+
+@mock.patch("sn_set.cli.to_excel")
+@mock.patch("sn_set.comparator.get_install_order_new")
+@mock.patch("sn_set.comparator.get_install_order")
+@mock.patch("sn_set.comparator.get_update_sets")
+def test_cli_progress(
+    mock_get_update_sets,
+    mock_get_install_order,
+    mock_new_install_order,
+    mock_to_excel,
+    runner,
+):
+    mock_get_update_sets.side_effect = [
+        [{"name": "a"}, {"name": "b"}],
+        [{"name": "a"}],
+    ] * 2
+    mock_get_install_order.return_value = [{"name": "b"}]
+    mock_to_excel.return_value = True
+
+    result = runner.invoke(cli.main, ["-s", "nyudev", "-t", "nyuqa", "--progress"])
+    assert result.exit_code == 0
+    assert "[source fetch] done" in result.output
+    assert "[export] done" in result.output
+
+    # output isn't a terminal, no progress unless asked for
+    with mock.patch("sn_set.tracing.add_hook") as mock_add_hook:
+        result = runner.invoke(cli.main, ["-s", "nyudev", "-t", "nyuqa"])
+    assert result.exit_code == 0
+    assert "[source fetch] done" not in result.output
+    mock_add_hook.assert_not_called()
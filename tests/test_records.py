@@ -0,0 +1,69 @@
+import json
+import pickle
+from collections.abc import Mapping
+
+import pytest
+
+from sn_set.records import UpdateSetRecord, json_default, to_records
+
+ROW = {
+    "name": "a set",
+    "state": "committed",
+    "commit_date": {"display_value": "2021-05-08 18:39:00", "value": "x"},
+}
+
+
+def test_record_behaves_like_dict():
+    record = UpdateSetRecord.from_dict(ROW)
+
+    assert isinstance(record, Mapping)
+    assert record == ROW
+    assert ROW == record
+    assert record["name"] == "a set"
+    assert record.get("missing") is None
+    assert record.get("missing", "x") == "x"
+    assert "state" in record
+    assert list(record) == ["name", "state", "commit_date"]
+    assert list(record.keys()) == ["name", "state", "commit_date"]
+    assert record.keys() & {"name", "other"} == {"name"}
+    assert record.keys() == ROW.keys()
+    assert len(record) == 3
+    assert len(record.items()) == 3
+    assert dict(record)["state"] == "committed"
+    assert record["commit_date"]["display_value"] == "2021-05-08 18:39:00"
+    assert record.to_dict() == ROW
+    with pytest.raises(KeyError):
+        record["missing"]
+
+
+def test_records_share_schema_and_interned_strings():
+    records = json.loads(
+        json.dumps({"result": [ROW, {**ROW, "name": "b set"}]}),
+        object_pairs_hook=UpdateSetRecord.from_pairs,
+    )["result"]
+
+    assert records[0]._schema is records[1]._schema
+    assert records[0]["state"] is records[1]["state"]
+    # only the low cardinality fields are interned
+    assert records[0]["commit_date"]["display_value"] is not (
+        records[1]["commit_date"]["display_value"]
+    )
+    assert records[0] != records[1]
+    assert records[0] == UpdateSetRecord.from_dict(ROW)
+
+
+def test_records_are_read_only():
+    record = UpdateSetRecord.from_dict(ROW)
+    with pytest.raises(TypeError):
+        record["name"] = "other"
+    with pytest.raises(AttributeError):
+        record.extra = 1
+
+
+def test_record_serialisation():
+    records = to_records([ROW, "not a row"])
+    assert json.loads(json.dumps(records, default=json_default)) == [ROW, "not a row"]
+    assert pickle.loads(pickle.dumps(records[0])) == ROW
+    assert to_records({"stats": {}}) == {"stats": {}}
+    with pytest.raises(TypeError):
+        json_default(object())
@@ -0,0 +1,228 @@
+import json
+from unittest import mock
+
+import pytest
+import requests
+
+from sn_set import cli, registry
+from sn_set.registry import (
+    InstanceConfig,
+    RateLimiter,
+    Registry,
+    load_registry,
+    read_registry,
+)
+from sn_set.requests_lib import (
+    build_client,
+    context,
+    get_update_sets,
+    instance_url,
+    is_invalid_instance,
+    options,
+    prewarm,
+)
+from sn_set.settings import Settings
+
+
+def test_rate_limiter(clock):
+    limiter = RateLimiter(2.0, burst=2, clock=clock, sleep=clock.sleep)
+
+    waits = [limiter.acquire() for _ in range(4)]
+
+    assert waits == [0.0, 0.0, 0.5, 0.5]
+    clock.now += 10
+    # the bucket refills up to the burst only
+    assert [limiter.acquire() for _ in range(3)] == [0.0, 0.0, 0.5]
+    assert limiter.waited == 1.5
+
+
+def test_rate_limiter_invalid():
+    with pytest.raises(ValueError):
+        RateLimiter(0)
+
+
+def test_instance_config():
+    assert InstanceConfig("nyudev").base_url == "https://nyudev.service-now.com"
+    assert (
+        InstanceConfig("acme", base_url="https://acme.example.com/").base_url
+        == "https://acme.example.com"
+    )
+    with pytest.raises(ValueError, match="Unknown settings for instance acme: pool"):
+        InstanceConfig.from_dict("acme", {"pool": 2})
+    with pytest.raises(ValueError):
+        InstanceConfig("")
+
+
+def test_read_registry(tmp_path):
+    path = tmp_path / "instances.json"
+    path.write_text(
+        json.dumps(
+            {
+                "nyudev": {"profile": "dev", "pool_size": 20},
+                "acme": {"base_url": "https://acme.example.com", "rate_limit": 5},
+            }
+        )
+    )
+
+    instances = read_registry(str(path))
+
+    assert list(instances.instances) == ["nyudev", "acme"]
+    assert instances.get("nyudev").profile == "dev"
+    assert instances.by_url("https://acme.example.com/").name == "acme"
+    assert instances.limiter("https://nyudev.service-now.com") is None
+    limiter = instances.limiter("https://acme.example.com")
+    assert limiter.rate == 5.0
+    assert instances.limiter("https://acme.example.com") is limiter
+
+
+@pytest.mark.parametrize("content", ["not json", "[]", '{"nyudev": 1}'])
+def test_read_registry_invalid(tmp_path, content):
+    path = tmp_path / "instances.json"
+    path.write_text(content)
+
+    with pytest.raises(ValueError):
+        read_registry(str(path))
+
+
+def test_load_registry(tmp_path, monkeypatch):
+    monkeypatch.setattr(registry, "_loaded", {})
+    path = tmp_path / "instances.json"
+    path.write_text(json.dumps({"acme": {}}))
+
+    assert "nyudev" in load_registry().instances
+    monkeypatch.setenv("SN_SET_REGISTRY", str(path))
+    loaded = load_registry()
+    assert list(loaded.instances) == ["acme"]
+    assert load_registry() is loaded
+
+
+def test_is_invalid_instance():
+    assert not is_invalid_instance("nyudev")
+    assert is_invalid_instance("acme")
+    assert is_invalid_instance("")
+    assert is_invalid_instance(None)
+
+    options["registry"] = Registry([InstanceConfig("acme")])
+    assert not is_invalid_instance("acme")
+    assert is_invalid_instance("nyudev")
+
+
+def test_instance_url():
+    options["registry"] = Registry(
+        [InstanceConfig("acme", base_url="https://acme.example.com")]
+    )
+    assert instance_url("acme") == "https://acme.example.com"
+
+    options["instance_url"] = "http://127.0.0.1:8000/{instance}"
+    assert instance_url("acme") == "http://127.0.0.1:8000/acme"
+
+
+def test_settings_profile(mock_env_vars, monkeypatch):
+    monkeypatch.setenv("DEV_SN_USER_NAME", "dev user")
+
+    settings = Settings("dev")
+
+    assert settings.get_user() == "dev user"
+    # not set for the profile, the default is used
+    assert settings.get_password() == "password"
+    assert not settings.get_use_oauth()
+
+
+def test_build_client_profile_and_pool(mock_env_vars, monkeypatch):
+    monkeypatch.setenv("DEV_SN_PASSWORD", "dev password")
+    base_url = "https://acme.example.com"
+    options["registry"] = Registry(
+        [InstanceConfig("acme", base_url=base_url, profile="dev", pool_size=4)]
+    )
+    try:
+        client, auth = build_client(base_url)
+    finally:
+        del context[base_url]
+
+    assert isinstance(client, requests.Session)
+    assert (auth.username, auth.password) == ("user", "dev password")
+    assert client.get_adapter(base_url)._pool_maxsize == 4
+
+
+def test_rate_limited_requests(requests_mock, mock_env_vars):
+    base_url = "https://acme.example.com"
+    options["registry"] = Registry(
+        [InstanceConfig("acme", base_url=base_url, rate_limit=10)]
+    )
+    requests_mock.get(f"{base_url}/api/now/table/sys_update_set", json={"result": []})
+    limiter = options["registry"].limiter(base_url)
+    try:
+        with mock.patch.object(limiter, "acquire", return_value=0.0) as acquire:
+            get_update_sets("acme")
+            get_update_sets("acme")
+    finally:
+        context.pop(base_url, None)
+
+    assert acquire.call_count == 2
+
+
+def test_prewarm(requests_mock, mock_env_vars, clean_context):
+    requests_mock.get(
+        "https://nyudev.service-now.com/api/now/table/sys_update_set",
+        json={"result": [{"sys_id": "1"}]},
+    )
+    requests_mock.get(
+        "https://nyuqa.service-now.com/api/now/table/sys_update_set",
+        status_code=401,
+    )
+    result = prewarm(["nyudev", "nyuqa", "nyudev", "acme"])
+
+    assert result["nyudev"] is None
+    assert result["nyuqa"].startswith("HTTPError: 401")
+    assert "acme" not in result
+    query = requests_mock.request_history[0].qs
+    assert query["sysparm_limit"] == ["1"]
+
+
+def test_cli_invalid_registry(runner, tmp_path):
+    path = tmp_path / "instances.json"
+    path.write_text("[]")
+
+    result = runner.invoke(
+        cli.main, ["-s", "nyudev", "-t", "nyuqa", "--registry", str(path)]
+    )
+
+    assert result.exit_code == 2
+    assert "must map instance names to their settings" in result.output
+
+
+@mock.patch("sn_set.cli.to_excel")
+@mock.patch("sn_set.comparator.get_install_order_new")
+@mock.patch("sn_set.comparator.get_install_order")
+@mock.patch("sn_set.comparator.get_update_sets")
+@mock.patch("sn_set.comparator.prewarm")
+def test_cli_prewarm(
+    mock_prewarm,
+    mock_get_update_sets,
+    mock_get_install_order,
+    mock_new_install_order,
+    mock_to_excel,
+    runner,
+    tmp_path,
+):
+    path = tmp_path / "instances.json"
+    path.write_text(json.dumps({"acme": {}, "nyuqa": {}}))
+
+    def prewarm(instances):
+        assert options["keep_alive"]
+        assert list(options["registry"].instances) == ["acme", "nyuqa"]
+        return {"acme": None, "nyuqa": "HTTPError: 401"}
+
+    mock_prewarm.side_effect = prewarm
+    mock_get_update_sets.side_effect = [[{"name": "a"}, {"name": "b"}], [{"name": "a"}]]
+    mock_get_install_order.return_value = [{"name": "b", "commit_date": "1"}]
+    mock_to_excel.return_value = True
+
+    result = runner.invoke(
+        cli.main,
+        ["-s", "acme", "-t", "nyuqa", "--registry", str(path), "--prewarm"],
+    )
+
+    assert result.exit_code == 0, result.output
+    mock_prewarm.assert_called_once_with(["acme", "nyuqa"])
+    assert "Could not prewarm nyuqa: HTTPError: 401" in result.output
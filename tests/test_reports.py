@@ -0,0 +1,191 @@
+import csv
+from unittest import mock
+
+import pytest
+import requests
+
+from sn_set import cli
+from sn_set.reports import ReportWriter, pack
+from sn_set.requests_lib import options
+
+RECORDS = [
+    {"name": "b set", "commit_date": "2021-05-01 00:00:00"},
+    {"name": "c set", "sys_updated_by": {"display_value": "admin", "value": "6"}},
+]
+
+
+def test_pack():
+    headers, rows = pack(RECORDS)
+
+    assert headers == ("name", "commit_date", "sys_updated_by")
+    assert rows == [
+        ("b set", "2021-05-01 00:00:00", None),
+        ("c set", None, "admin"),
+    ]
+
+
+def test_report_writer_inline(tmp_path):
+    with ReportWriter(0, "csv") as writer:
+        future = writer.submit(str(tmp_path / "nyudev-nyuqa"), RECORDS)
+        assert future.done()
+        results = writer.wait()
+
+    assert results == [(str(tmp_path / "nyudev-nyuqa.csv"), None)]
+    with open(tmp_path / "nyudev-nyuqa.csv", newline="") as f:
+        assert list(csv.reader(f)) == [
+            ["name", "commit_date", "sys_updated_by"],
+            ["b set", "2021-05-01 00:00:00", ""],
+            ["c set", "", "admin"],
+        ]
+
+
+def test_report_writer_pool(tmp_path):
+    with ReportWriter(1, "xlsx") as writer:
+        for target in ["nyuqa", "nyutest"]:
+            writer.submit(str(tmp_path / f"nyudev-{target}"), RECORDS)
+        results = writer.wait()
+
+    assert [error for _, error in results] == [None, None]
+    assert (tmp_path / "nyudev-nyuqa.xlsx").exists()
+    assert (tmp_path / "nyudev-nyutest.xlsx").exists()
+
+
+def test_report_writer_error(tmp_path):
+    writer = ReportWriter(0, "csv")
+    writer.submit(str(tmp_path / "missing" / "report"), RECORDS)
+
+    [(path, error)] = writer.wait()
+
+    assert error.startswith("FileNotFoundError")
+    assert writer.wait() == []
+
+
+def test_report_writer_invalid_format():
+    with pytest.raises(ValueError):
+        ReportWriter(0, "pdf")
+
+
+def test_to_excel_keys_missing_from_first(runner):
+    with runner.isolated_filesystem():
+        # the first record doesn't have every column
+        assert cli.to_excel(RECORDS, "output")
+
+
+@mock.patch("sn_set.comparator.get_install_order_new")
+@mock.patch("sn_set.comparator.get_install_order")
+@mock.patch("sn_set.comparator.get_update_sets")
+def test_cli_batch(
+    mock_get_update_sets,
+    mock_get_install_order,
+    mock_new_install_order,
+    runner,
+    tmp_path,
+):
+    inventories = {
+        "nyudev": [{"name": "a set"}, {"name": "b set"}],
+        "nyuqa": [{"name": "a set"}],
+        "nyutest": [{"name": "b set"}],
+    }
+
+    def get_update_sets(instance):
+        if instance == "nyutrain":
+            raise requests.ConnectionError("unreachable")
+        return inventories[instance]
+
+    mock_get_update_sets.side_effect = get_update_sets
+    mock_get_install_order.side_effect = lambda source, names: [
+        {"name": name, "commit_date": "2021-05-01 00:00:00"} for name in names
+    ]
+
+    result = runner.invoke(
+        cli.main,
+        [
+            "batch",
+            "-s",
+            "nyudev",
+            "-t",
+            "nyuqa",
+            "-t",
+            "nyutest",
+            "--pair",
+            "nyudev:nyutrain",
+            "--format",
+            "csv",
+            "--workers",
+            "0",
+            "--output-dir",
+            str(tmp_path),
+        ],
+    )
+
+    assert result.exit_code == 1, result.output
+    assert "Could not compare nyudev to nyutrain: unreachable" in result.output
+    # the source is fetched once for every pair
+    assert [c.args for c in mock_get_update_sets.call_args_list].count(("nyudev",)) == 1
+    with open(tmp_path / "nyudev-nyuqa.csv") as f:
+        assert "b set" in f.read()
+    with open(tmp_path / "nyudev-nyutest.csv") as f:
+        assert "a set" in f.read()
+    mock_new_install_order.assert_not_called()
+
+
+@mock.patch("sn_set.cli.ReportWriter")
+@mock.patch("sn_set.comparator.get_update_sets")
+def test_cli_batch_connection(mock_get_update_sets, mock_report_writer, runner):
+    connections = []
+
+    def get_update_sets(instance):
+        connections.append((options["transport"], options["resilience"].retries))
+        return [{"name": "a set"}]
+
+    mock_get_update_sets.side_effect = get_update_sets
+    mock_report_writer.return_value.__enter__.return_value.wait.return_value = []
+
+    result = runner.invoke(
+        cli.main,
+        ["--transport", "httpx", "--retries", "4", "batch", "-s", "nyudev"]
+        + ["-t", "nyuqa"],
+    )
+
+    assert result.exit_code == 0, result.output
+    # the group's options are those of the subcommand
+    assert connections == [("httpx", 4), ("httpx", 4)]
+
+
+@pytest.mark.parametrize(
+    "args,cpus,workers",
+    [
+        (["-s", "nyudev", "-t", "nyuqa"], 8, 0),
+        (["-s", "nyudev", "-t", "nyuqa", "-t", "nyutest"], 8, 2),
+        (["-s", "nyudev", "-t", "nyuqa", "-t", "nyutest"], 1, 1),
+        (["-s", "nyudev", "-t", "nyuqa", "--workers", "3"], 8, 3),
+    ],
+)
+@mock.patch("sn_set.cli.ReportWriter")
+@mock.patch("sn_set.comparator.get_update_sets")
+def test_cli_batch_workers(
+    mock_get_update_sets, mock_report_writer, runner, args, cpus, workers
+):
+    mock_get_update_sets.return_value = [{"name": "a set"}]
+    mock_report_writer.return_value.__enter__.return_value.wait.return_value = []
+
+    with mock.patch("sn_set.cli.os.cpu_count", return_value=cpus):
+        result = runner.invoke(cli.main, ["batch"] + args)
+
+    assert result.exit_code == 0, result.output
+    mock_report_writer.assert_called_once_with(workers, "xlsx")
+
+
+@pytest.mark.parametrize(
+    "args,message",
+    [
+        ([], "Give the pairs to compare"),
+        (["-t", "nyuqa"], "--target requires --source"),
+        (["--pair", "nyudev"], "nyudev is not SOURCE:TARGET"),
+    ],
+)
+def test_cli_batch_usage(runner, args, message):
+    result = runner.invoke(cli.main, ["batch"] + args)
+
+    assert result.exit_code == 2
+    assert message in result.output
@@ -1,4 +1,5 @@
 from unittest import mock
+from urllib.parse import parse_qs, urlsplit
 
 import pytest
 from requests.exceptions import HTTPError
@@ -468,3 +469,171 @@ def test_get_install_order_new_fields_verification(mock_make_request):
     # Should have core fields
     assert "sys_updated_on" in requested_fields
     assert "name" in requested_fields
+
+
+@mock.patch("sn_set.requests_lib.make_batch_request")
+@mock.patch("sn_set.requests_lib.make_request")
+def test_get_install_order_400_batch(mock_make_request, mock_make_batch_request):
+    from sn_set.requests_lib import get_install_order, options
+
+    options["batch_size"] = 10
+    mock_make_request.side_effect = HTTPError(response=mock.Mock(status_code=414))
+    mock_make_batch_request.return_value = [
+        [{"name": "b", "commit_date": "2021-05-17 15:00:00"}],
+        [],
+        [{"name": "a", "commit_date": "2021-05-08 18:39:00"}],
+    ]
+
+    result = get_install_order("nyudev", ["b", "c", "a"])
+
+    assert [elem["name"] for elem in result] == ["a", "b"]
+    assert mock_make_request.call_count == 1
+    args, kwargs = mock_make_batch_request.call_args
+    assert [p["sysparm_query"].split("^")[1] for p in args[1]] == [
+        "name=b",
+        "name=c",
+        "name=a",
+    ]
+
+
+@mock.patch("sn_set.requests_lib.make_request")
+def test_get_install_order_400_chunked(mock_make_request):
+    from sn_set.requests_lib import get_install_order, options
+
+    options["max_url_length"] = 400
+    names = [f"STRY{idx:07d} - update set {idx}" for idx in range(20)]
+
+    def respond(uri, path_params=None, base_url=None):
+        clause = path_params["sysparm_query"].split("^")[1]
+        if clause.startswith("nameIN") and len(clause) > 300:
+            raise HTTPError(response=mock.Mock(status_code=400))
+        selected = (
+            clause[6:].split(",") if clause.startswith("nameIN") else [clause[5:]]
+        )
+        return [{"name": n, "commit_date": "2021-05-08 18:39:00"} for n in selected]
+
+    mock_make_request.side_effect = respond
+
+    result = get_install_order("nyudev", names)
+
+    queries = [
+        call.kwargs["path_params"]["sysparm_query"].split("^")[1]
+        for call in mock_make_request.call_args_list[1:]
+    ]
+    assert len(queries) < len(names)
+    assert max(len(query[6:].split(",")) for query in queries) > 1
+    assert len(result) == len(names)
+
+
+def test_chunk_names_fit_max_url_length():
+    from urllib.parse import urlencode
+
+    from sn_set.requests_lib import chunk_names, install_order_params, name_clause
+
+    uri = "https://nyudev.service-now.com/api/now/table/sys_remote_update_set"
+    names = [f"STRY{idx:07d} - update set & more {idx}" for idx in range(100)]
+
+    chunks = chunk_names(uri, names, install_order_params, 1000)
+
+    assert [name for chunk in chunks for name in chunk] == names
+    assert len(chunks) > 1
+    for chunk in chunks:
+        params = install_order_params(f"nameIN{','.join(chunk)}")
+        assert len(f"{uri}?{urlencode(params)}") <= 1000
+    assert name_clause(["a"]) == "name=a"
+    assert name_clause(["a", "b"]) == "nameINa,b"
+
+
+def test_chunk_names_oversized_name():
+    from sn_set.requests_lib import chunk_names, install_order_params
+
+    chunks = chunk_names("mock://x", ["a", "b" * 500, "c"], install_order_params, 300)
+    assert chunks == [["a"], ["b" * 500], ["c"]]
+
+
+def test_first_per_name():
+    from sn_set.requests_lib import first_per_name
+
+    results = [
+        [{"name": "a", "n": 1}, {"name": "a", "n": 2}, {"name": "b", "n": 1}],
+        [],
+        None,
+        [{"name": "b", "n": 2}, {"name": "c", "n": 1}],
+    ]
+    assert first_per_name(results) == [
+        {"name": "a", "n": 1},
+        {"name": "b", "n": 1},
+        {"name": "c", "n": 1},
+    ]
+
+
+def test_get_record_count(requests_mock, mock_env_vars):
+    from sn_set.requests_lib import get_record_count
+
+    requests_mock.get(
+        "https://nyudev.service-now.com/api/now/stats/sys_update_set",
+        json={"result": {"stats": {"count": "42"}}},
+    )
+
+    assert get_record_count("nyudev", "sys_update_set", "state=complete") == 42
+    assert requests_mock.last_request.qs == {
+        "sysparm_count": ["true"],
+        "sysparm_query": ["state=complete"],
+    }
+
+
+def test_iter_pages_keyset(requests_mock, mock_env_vars):
+    from sn_set.requests_lib import iter_pages
+
+    uri = "https://nyudev.service-now.com/api/now/table/sys_update_xml"
+    rows = [{"sys_id": f"{i:032x}", "name": f"r{i}"} for i in range(5)]
+
+    def respond(request, context):
+        params = parse_qs(urlsplit(request.url).query)
+        query = params["sysparm_query"][0]
+        after = query.split("sys_id>")[1].split("^")[0] if "sys_id>" in query else ""
+        limit = int(params["sysparm_limit"][0])
+        return {"result": [r for r in rows if r["sys_id"] > after][:limit]}
+
+    requests_mock.get(uri, json=respond)
+
+    base_url = "https://nyudev.service-now.com"
+    params = {"sysparm_query": "a=b", "sysparm_fields": "name"}
+    pages = list(iter_pages(uri, params, 2, base_url=base_url))
+
+    assert [[r["name"] for r in page] for page in pages] == [
+        ["r0", "r1"],
+        ["r2", "r3"],
+        ["r4"],
+    ]
+    queries = [
+        parse_qs(urlsplit(r.url).query)["sysparm_query"][0]
+        for r in requests_mock.request_history
+    ]
+    assert queries == [
+        "a=b^ORDERBYsys_id",
+        f"a=b^sys_id>{1:032x}^ORDERBYsys_id",
+        f"a=b^sys_id>{3:032x}^ORDERBYsys_id",
+    ]
+    assert parse_qs(urlsplit(requests_mock.last_request.url).query)[
+        "sysparm_fields"
+    ] == ["name,sys_id"]
+
+
+def test_iter_pages_stops_on_empty_full_page(requests_mock, mock_env_vars):
+    from sn_set.requests_lib import iter_pages
+
+    uri = "https://nyudev.service-now.com/api/now/table/sys_update_xml"
+    requests_mock.get(
+        uri,
+        [
+            {"json": {"result": [{"sys_id": "1"}, {"sys_id": "2"}]}},
+            {"json": {"result": []}},
+        ],
+    )
+
+    base_url = "https://nyudev.service-now.com"
+    pages = list(iter_pages(uri, {}, 2, base_url=base_url))
+
+    assert pages == [[{"sys_id": "1"}, {"sys_id": "2"}]]
+    assert requests_mock.call_count == 2
@@ -0,0 +1,253 @@
+from unittest import mock
+
+import pytest
+import requests
+
+from sn_set import cli
+from sn_set.requests_lib import make_request, options
+from sn_set.resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    Deadline,
+    DeadlineExceeded,
+    ResiliencePolicy,
+    retry_after,
+)
+from sn_set.stats import StatsCollector
+
+
+def test_deadline(clock):
+    deadline = Deadline(5, clock)
+    assert deadline.remaining() == 5
+    deadline.check()
+    clock.now += 6
+    assert deadline.expired
+    with pytest.raises(DeadlineExceeded):
+        deadline.check()
+
+
+def test_circuit_breaker_opens_and_recovers(clock):
+    breaker = CircuitBreaker(
+        "nyudev", failure_threshold=2, reset_timeout=10, clock=clock
+    )
+    breaker.record_failure()
+    breaker.before_request()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()
+
+    clock.now += 10
+    assert breaker.state == "half-open"
+    breaker.before_request()
+    # only a single trial request is let through
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+def test_circuit_breaker_failed_trial_reopens(clock):
+    breaker = CircuitBreaker(
+        "nyudev", failure_threshold=3, reset_timeout=10, clock=clock
+    )
+    for _ in range(3):
+        breaker.record_failure()
+    clock.now += 10
+    breaker.before_request()
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+
+def test_retry_after(make_response):
+    assert retry_after(make_response(429, {"Retry-After": "7"})) == 7.0
+    assert retry_after(make_response(429)) is None
+    assert retry_after(make_response(429, {"Retry-After": "soon"})) is None
+    assert (
+        retry_after(
+            make_response(429, {"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"})
+        )
+        == 0.0
+    )
+
+
+def test_policy_retries_busy_responses(make_response):
+    sleeps = []
+    policy = ResiliencePolicy(retries=2, backoff=0.5, sleep=sleeps.append)
+    send = mock.Mock(
+        side_effect=[
+            make_response(429, {"Retry-After": "3"}),
+            make_response(503),
+            make_response(200),
+        ]
+    )
+
+    r, retries = policy.send("GET", "nyudev", send)
+
+    assert r.status_code == 200
+    assert retries == 2
+    assert sleeps == [3.0, 1.0]
+    send.assert_called_with((10.0, 120.0))
+
+
+@pytest.mark.parametrize("status_code", [200, 400, 404, 500])
+def test_policy_does_not_retry(status_code, make_response):
+    send = mock.Mock(return_value=make_response(status_code))
+    r, retries = ResiliencePolicy(retries=3, sleep=mock.Mock()).send(
+        "GET", "nyudev", send
+    )
+    assert r.status_code == status_code
+    assert retries == 0
+    assert send.call_count == 1
+
+
+def test_policy_gives_up_after_retries(make_response):
+    send = mock.Mock(return_value=make_response(503))
+    r, retries = ResiliencePolicy(retries=1, sleep=mock.Mock()).send(
+        "GET", "nyudev", send
+    )
+    assert r.status_code == 503
+    assert retries == 1
+
+
+def test_policy_retries_get_connection_errors_only(make_response):
+    policy = ResiliencePolicy(retries=1, sleep=mock.Mock())
+    send = mock.Mock(side_effect=[requests.ConnectionError(), make_response(200)])
+    assert policy.send("GET", "nyudev", send)[1] == 1
+
+    send = mock.Mock(side_effect=requests.ConnectionError())
+    with pytest.raises(requests.ConnectionError):
+        policy.send("POST", "nyudev", send)
+    assert send.call_count == 1
+
+
+def test_policy_circuit_breaker_fails_fast(make_response):
+    policy = ResiliencePolicy(failure_threshold=2)
+    send = mock.Mock(return_value=make_response(500))
+    policy.send("GET", "nyudev", send)
+    policy.send("GET", "nyudev", send)
+
+    with pytest.raises(CircuitOpenError):
+        policy.send("GET", "nyudev", send)
+    assert send.call_count == 2
+    # other instances are unaffected
+    policy.send("GET", "nyuqa", send)
+    assert send.call_count == 3
+
+
+def test_policy_deadline(clock):
+    policy = ResiliencePolicy(deadline=5, clock=clock)
+    assert policy.timeout() == (5, 5)
+    clock.now += 4
+    assert policy.timeout() == (1, 1)
+
+    def timed_out(timeout):
+        clock.now += timeout[1]
+        raise requests.ReadTimeout()
+
+    with pytest.raises(DeadlineExceeded):
+        policy.send("GET", "nyudev", timed_out)
+    send = mock.Mock()
+    with pytest.raises(DeadlineExceeded):
+        policy.send("GET", "nyudev", send)
+    send.assert_not_called()
+
+
+def test_policy_no_retry_past_deadline(clock, make_response):
+    policy = ResiliencePolicy(retries=3, deadline=5, clock=clock, sleep=mock.Mock())
+    send = mock.Mock(return_value=make_response(429, {"Retry-After": "60"}))
+    r, retries = policy.send("GET", "nyudev", send)
+    assert r.status_code == 429
+    assert retries == 0
+
+
+def test_make_request_retries_and_timeouts(requests_mock, mock_env_vars):
+    options["stats"] = StatsCollector()
+    options["resilience"] = ResiliencePolicy(
+        connect_timeout=2, read_timeout=30, retries=1, sleep=mock.Mock()
+    )
+    requests_mock.get(
+        "mock://nyudev/api",
+        [
+            {"status_code": 429, "headers": {"Retry-After": "1"}},
+            {"json": {"result": [{"name": "a"}]}},
+        ],
+    )
+
+    assert make_request("mock://nyudev/api", base_url="mock://nyudev") == [
+        {"name": "a"}
+    ]
+    assert requests_mock.last_request.timeout == (2, 30)
+    (stat,) = options["stats"].stages["other"].requests
+    assert stat.retries == 1
+    assert stat.rows == 1
+
+
+def test_make_request_default_timeout(requests_mock, mock_env_vars):
+    requests_mock.get("mock://nyudev/api", json={"result": []})
+    make_request("mock://nyudev/api", base_url="mock://nyudev")
+    assert requests_mock.last_request.timeout == (10.0, 120.0)
+
+
+@mock.patch("sn_set.cli.to_excel")
+@mock.patch("sn_set.comparator.get_install_order_new")
+@mock.patch("sn_set.comparator.get_install_order")
+@mock.patch("sn_set.comparator.get_update_sets")
+def test_cli_deadline_partial_results(
+    mock_get_update_sets,
+    mock_get_install_order,
+    mock_new_install_order,
+    mock_to_excel,
+    runner,
+):
+    mock_get_update_sets.side_effect = [
+        [{"name": "a set"}, {"name": "b set"}, {"name": "c set"}],
+        [{"name": "a set"}],
+    ]
+    mock_get_install_order.return_value = [{"name": "b set"}]
+
+    def new_install_order(source, names):
+        assert options["resilience"].deadline.seconds == 5
+        raise DeadlineExceeded("Deadline of 5s exceeded")
+
+    mock_new_install_order.side_effect = new_install_order
+    mock_to_excel.return_value = True
+
+    result = runner.invoke(
+        cli.main, ["-s", "nyudev", "-t", "nyuqa", "--deadline", "5", "-f", "out"]
+    )
+
+    assert result.exit_code == cli.PARTIAL_EXIT_CODE
+    assert "Deadline of 5s exceeded during new sets" in result.output
+    mock_to_excel.assert_called_once_with([{"name": "b set"}], "out-partial")
+
+
+@mock.patch("sn_set.cli.to_excel")
+@mock.patch("sn_set.requests_lib.fetch_records")
+@mock.patch("sn_set.comparator.get_update_sets")
+def test_cli_deadline_during_fallback(
+    mock_get_update_sets, mock_fetch_records, mock_to_excel, mock_env_vars, runner
+):
+    mock_get_update_sets.side_effect = [
+        [{"name": "a set"}, {"name": "b set"}, {"name": "c set"}],
+        [{"name": "a set"}],
+    ]
+    too_long = requests.Response()
+    too_long.status_code = 414
+    mock_fetch_records.side_effect = [
+        requests.HTTPError(response=too_long),
+        [{"name": "b set", "commit_date": "2021-05-02 00:00:00"}],
+        DeadlineExceeded("Deadline of 5s exceeded"),
+    ]
+    mock_to_excel.return_value = True
+
+    result = runner.invoke(
+        cli.main, ["-s", "nyudev", "-t", "nyuqa", "--deadline", "5", "-f", "out"]
+    )
+
+    assert result.exit_code == cli.PARTIAL_EXIT_CODE
+    assert "exceeded during install order" in result.output
+    # the lookup that completed before the deadline is kept
+    mock_to_excel.assert_called_once_with(
+        [{"name": "b set", "commit_date": "2021-05-02 00:00:00"}], "out-partial"
+    )
@@ -0,0 +1,342 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+from http import HTTPStatus
+from unittest import mock
+
+import pytest
+import requests
+
+from sn_set import cli
+from sn_set.requests_lib import build_client, context, options
+from sn_set.server import Inventory, SnsetService, make_server, route
+
+
+def update_set(sys_id, name, updated_on, state="complete"):
+    return {
+        "sys_id": sys_id,
+        "name": name,
+        "state": state,
+        "sys_updated_on": updated_on,
+    }
+
+
+class FakeTable:
+    """
+    Answers iter_pages with the rows of each instance, recording the queries
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    def __call__(self, uri, params, page_size=None, base_url=None):
+        self.queries.append((base_url, params["sysparm_query"]))
+        instance = base_url.split("//")[1].split(".")[0]
+        yield list(self.rows.get(instance, []))
+
+
+@pytest.fixture
+def table(monkeypatch):
+    table = FakeTable(
+        {
+            "nyudev": [
+                update_set("1", "a", "2021-05-01 10:00:00"),
+                update_set("2", "b", "2021-05-02 10:00:00"),
+                update_set("3", "c", "2021-05-03 10:00:00"),
+                update_set("4", "wip", "2021-05-04 10:00:00", state="in progress"),
+            ],
+            "nyuqa": [update_set("9", "a", "2021-05-01 12:00:00")],
+        }
+    )
+    monkeypatch.setattr("sn_set.server.iter_pages", table)
+    return table
+
+
+def test_inventory_refresh(table):
+    inventory = Inventory("nyudev")
+
+    assert inventory.refresh() == 3
+    assert inventory.snapshot() == (["a", "b", "c"], 1)
+    assert inventory.watermark == "2021-05-04 10:00:00"
+    assert table.queries[-1][1] == "state=complete^ORstate=ignore"
+
+    # a set reopened, one renamed and one completed since the watermark
+    table.rows["nyudev"] = [
+        update_set("2", "b", "2021-05-05 10:00:00", state="in progress"),
+        update_set("3", "c renamed", "2021-05-05 11:00:00"),
+        update_set("4", "wip", "2021-05-05 12:00:00"),
+    ]
+    assert inventory.refresh() == 3
+    assert table.queries[-1][1] == "sys_updated_on>=2021-05-03 10:00:00"
+    assert inventory.snapshot() == (["a", "c renamed", "wip"], 2)
+    assert inventory.snapshot(since="2021-05-05 00:00:00") == (
+        ["c renamed", "wip"],
+        2,
+    )
+
+    # nothing changed, the version stays
+    assert inventory.refresh() == 0
+    assert inventory.version == 2
+
+
+def test_inventory_full_refresh_drops_deleted(table):
+    inventory = Inventory("nyudev")
+    inventory.refresh()
+    table.rows["nyudev"] = [update_set("1", "a", "2021-05-01 10:00:00")]
+
+    inventory.refresh(full=True)
+
+    assert table.queries[-1][1] == "state=complete^ORstate=ignore"
+    assert inventory.snapshot() == (["a"], 2)
+
+
+def test_service_diff_cached(table, monkeypatch):
+    service = SnsetService()
+    first = service.diff("nyudev", "nyuqa")
+
+    assert first["sets"] == ["b", "c"]
+    assert first["count"] == 2
+    assert first["versions"] == {"nyudev": 1, "nyuqa": 1}
+
+    calls = []
+    monkeypatch.setattr(
+        service.comparator, "difference", lambda *args: calls.append(args) or []
+    )
+    assert service.diff("nyudev", "nyuqa")["sets"] == ["b", "c"]
+    assert calls == []
+    # only the inventories that were asked about are loaded
+    assert len(table.queries) == 2
+
+    service.diff("nyudev", "nyuqa", since="2021-05-03 00:00:00")
+    assert len(calls) == 1
+
+
+def test_service_diff_since(table):
+    service = SnsetService()
+
+    result = service.diff("nyudev", "nyuqa", since="2021-05-02 12:00:00")
+
+    assert result["sets"] == ["c"]
+
+
+def test_service_invalid_instance():
+    with pytest.raises(ValueError):
+        SnsetService().diff("", "nyuqa")
+
+
+def test_service_install_order(table, monkeypatch):
+    calls = []
+
+    def install_order(instance, names):
+        calls.append(("existing", instance, names))
+        return [{"name": "c", "commit_date": "2021-05-03", "sys_id": "3"}]
+
+    def install_order_new(instance, names):
+        calls.append(("new", instance, names))
+        return [{"name": name, "commit_date": None} for name in names]
+
+    monkeypatch.setattr("sn_set.comparator.get_install_order", install_order)
+    monkeypatch.setattr("sn_set.comparator.get_install_order_new", install_order_new)
+    service = SnsetService()
+
+    result = service.install_order("nyudev", "nyuqa", fields=["name"])
+
+    assert result["install_order"] == [{"name": "c"}, {"name": "b"}]
+    assert calls == [("existing", "nyudev", ["b", "c"]), ("new", "nyudev", ["b"])]
+
+    service.install_order("nyudev", "nyuqa")
+    assert len(calls) == 2
+
+    table.rows["nyuqa"].append(update_set("8", "b", "2021-05-06 10:00:00"))
+    service.refresh_all()
+    service.install_order("nyudev", "nyuqa")
+    assert calls[-1] == ("existing", "nyudev", ["c"])
+
+
+def test_refresh_all_keeps_data_on_error(table, monkeypatch):
+    service = SnsetService(full_every=2)
+    service.diff("nyudev", "nyuqa")
+
+    def failing(*args, **kwargs):
+        raise requests.ConnectionError("down")
+        yield
+
+    monkeypatch.setattr("sn_set.server.iter_pages", failing)
+    service.refresh_all()
+
+    status = service.status()["instances"]["nyudev"]
+    assert status["last_error"] == "ConnectionError: down"
+    assert status["sets"] == 3
+    assert service.diff("nyudev", "nyuqa")["sets"] == ["b", "c"]
+
+
+def test_refresh_all_keeps_going_on_unexpected_error(table, monkeypatch):
+    service = SnsetService()
+    service.inventory("nyudev")
+    service.inventory("nyuqa")
+
+    def failing(self, full=False):
+        raise KeyError("sys_id")
+
+    monkeypatch.setattr(Inventory, "refresh", failing)
+    service.refresh_all()
+
+    instances = service.status()["instances"]
+    assert instances["nyudev"]["last_error"] == "KeyError: 'sys_id'"
+    assert instances["nyuqa"]["last_error"] == "KeyError: 'sys_id'"
+
+
+def test_refresh_all_full_every(table):
+    service = SnsetService(full_every=2)
+    service.inventory("nyuqa")
+
+    service.refresh_all()
+    service.refresh_all()
+
+    queries = [query for _, query in table.queries]
+    assert queries == [
+        "state=complete^ORstate=ignore",
+        "sys_updated_on>=2021-04-30 12:00:00",
+        "state=complete^ORstate=ignore",
+    ]
+
+
+def test_route(table):
+    service = SnsetService()
+
+    with pytest.raises(ValueError, match="source and target are required"):
+        route(service, "GET", "/diff/", {"source": "nyudev"})
+
+    status, payload = route(service, "GET", "/nope", {})
+    assert status == HTTPStatus.NOT_FOUND
+
+    status, payload = route(
+        service, "POST", "/refresh", {"instance": "nyudev", "full": "true"}
+    )
+    # the first refresh of an instance is its load, not a second query
+    assert (status, payload) == (HTTPStatus.OK, {"instance": "nyudev", "changed": 3})
+    assert service.status()["instances"]["nyudev"]["sets"] == 3
+    assert len(table.queries) == 1
+
+    status, payload = route(service, "POST", "/refresh", {"instance": "nyudev"})
+    assert (status, payload) == (HTTPStatus.OK, {"instance": "nyudev", "changed": 0})
+    assert len(table.queries) == 2
+
+
+def test_route_invalid_instance():
+    with pytest.raises(ValueError):
+        route(SnsetService(), "GET", "/diff", {"source": "bad name", "target": "x"})
+
+
+def fetch(url, method="GET"):
+    request = urllib.request.Request(url, method=method)
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as ex:
+        return ex.code, json.load(ex)
+
+
+def test_http_endpoint(table):
+    service = SnsetService()
+    server = make_server(service, "127.0.0.1", 0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        status, payload = fetch(f"{base}/diff?source=nyudev&target=nyuqa")
+        assert status == 200
+        assert payload["sets"] == ["b", "c"]
+
+        status, payload = fetch(f"{base}/diff?source=nyudev")
+        assert status == 400
+
+        status, payload = fetch(f"{base}/refresh", method="POST")
+        assert status == 200
+        assert payload["refreshes"] == 1
+        assert set(payload["instances"]) == {"nyudev", "nyuqa"}
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_http_endpoint_upstream_error(monkeypatch):
+    def failing(*args, **kwargs):
+        raise requests.ConnectionError("down")
+        yield
+
+    monkeypatch.setattr("sn_set.server.iter_pages", failing)
+    server = make_server(SnsetService(), "127.0.0.1", 0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        status, payload = fetch(
+            f"http://127.0.0.1:{server.server_address[1]}"
+            "/diff?source=nyudev&target=nyuqa"
+        )
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert status == 502
+    assert payload == {"error": "ConnectionError: down"}
+
+
+def test_http_endpoint_unexpected_error(table, monkeypatch):
+    def failing(*args, **kwargs):
+        raise KeyError("name")
+
+    monkeypatch.setattr("sn_set.server.route", failing)
+    server = make_server(SnsetService(), "127.0.0.1", 0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        status, payload = fetch(f"http://127.0.0.1:{server.server_address[1]}/status")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert status == 500
+    assert payload == {"error": "KeyError: 'name'"}
+
+
+def test_build_client_keep_alive(mock_env_vars):
+    options["keep_alive"] = True
+    base_url = "https://keepalive.service-now.com"
+    try:
+        client, _ = build_client(base_url)
+        assert isinstance(client, requests.Session)
+    finally:
+        del context[base_url]
+
+
+def test_cli_serve_bad_warm(runner):
+    result = runner.invoke(cli.main, ["serve", "--warm", "nyudev"])
+
+    assert result.exit_code == 2
+    assert "nyudev is not SOURCE:TARGET" in result.output
+
+
+def test_cli_serve_connection(runner, monkeypatch):
+    services = []
+
+    def make_service(**kwargs):
+        services.append(SnsetService(**kwargs))
+        return services[-1]
+
+    server = mock.Mock(server_address=("127.0.0.1", 8765))
+    server.serve_forever.side_effect = KeyboardInterrupt
+    monkeypatch.setattr("sn_set.cli.SnsetService", make_service)
+    monkeypatch.setattr("sn_set.cli.make_server", lambda *args: server)
+
+    result = runner.invoke(
+        cli.main, ["--transport", "httpx", "--retries", "4", "serve"]
+    )
+
+    assert result.exit_code == 0, result.output
+    # the group's options are those of the service
+    settings = services[0].comparator.settings
+    assert settings["transport"] == "httpx"
+    assert settings["resilience"].retries == 4
@@ -0,0 +1,110 @@
+import json
+from unittest import mock
+
+from sn_set import cli
+from sn_set.cassette import Cassette
+from sn_set.requests_lib import make_request, options
+from sn_set.stats import StatsCollector, percentile
+
+BASE_URL = "https://nyudev.service-now.com"
+TEST_URI = f"{BASE_URL}/api/now/table/sys_update_set"
+
+
+def test_percentile():
+    assert percentile([], 50) == 0.0
+    assert percentile([3.0, 1.0, 2.0], 50) == 2.0
+    assert percentile([1.0, 2.0, 3.0, 4.0], 100) == 4.0
+
+
+def test_collector_stages():
+    collector = StatsCollector()
+    collector.record("get", "https://a.com/api/x?b=c", 200, 0.5, 10, rows=2)
+    with collector.stage("source fetch"):
+        collector.record("GET", "https://a.com/api/y", 200, 0.1, 100, rows=5)
+        collector.record("GET", "https://a.com/api/y", 404, 0.3, 20, retries=1)
+    with collector.stage("export"):
+        pass
+
+    summary = collector.summary()
+    stages = {s["stage"]: s for s in summary["stages"]}
+    assert stages["other"]["requests"] == 1
+    assert stages["source fetch"]["requests"] == 2
+    assert stages["source fetch"]["errors"] == 1
+    assert stages["source fetch"]["bytes"] == 120
+    assert stages["source fetch"]["rows"] == 5
+    assert stages["source fetch"]["retries"] == 1
+    assert stages["export"]["requests"] == 0
+    assert summary["totals"]["requests"] == 3
+    assert summary["totals"]["bytes"] == 130
+
+    payload = json.loads(collector.to_json())
+    assert payload["requests"][0]["endpoint"] == "/api/x"
+    assert payload["requests"][0]["method"] == "GET"
+
+    table = collector.format_table()
+    assert "source fetch" in table
+    assert table.splitlines()[-1].startswith("total")
+
+
+def test_make_request_records_stats(requests_mock, mock_env_vars):
+    options["stats"] = collector = StatsCollector()
+    requests_mock.get(TEST_URI, json={"result": [{"name": "a"}, {"name": "b"}]})
+
+    with collector.stage("source fetch"):
+        make_request(TEST_URI, base_url=BASE_URL)
+
+    (request,) = collector.stages["source fetch"].requests
+    assert request.status == 200
+    assert request.rows == 2
+    assert request.bytes > 0
+    assert request.endpoint == "/api/now/table/sys_update_set"
+    assert not request.cached
+
+
+def test_replayed_requests_are_cache_hits(tmp_path, requests_mock, mock_env_vars):
+    requests_mock.get(TEST_URI, json={"result": [{"name": "a"}]})
+    options["cassette"] = Cassette(str(tmp_path), mode="record")
+    make_request(TEST_URI, base_url=BASE_URL)
+
+    options["cassette"] = Cassette(str(tmp_path), mode="replay")
+    options["stats"] = collector = StatsCollector()
+    make_request(TEST_URI, base_url=BASE_URL)
+    assert collector.summary()["totals"]["cache_hits"] == 1
+
+
+@mock.patch("sn_set.cli.to_excel")
+@mock.patch("sn_set.comparator.get_install_order_new")
+@mock.patch("sn_set.comparator.get_install_order")
+@mock.patch("sn_set.comparator.get_update_sets")
+def test_cli_stats(
+    mock_get_update_sets,
+    mock_get_install_order,
+    mock_new_install_order,
+    mock_to_excel,
+    runner,
+):
+    mock_get_update_sets.side_effect = [
+        [{"name": "a set"}, {"name": "b set"}],
+        [{"name": "a set"}],
+    ]
+    mock_get_install_order.return_value = [{"name": "b set"}]
+    mock_to_excel.return_value = True
+
+    with runner.isolated_filesystem():
+        result = runner.invoke(
+            cli.main,
+            ["-s", "nyudev", "-t", "nyuqa", "--stats", "--stats-json", "stats.json"],
+        )
+        with open("stats.json") as f:
+            payload = json.load(f)
+
+    assert result.exit_code == 0
+    assert "install order" in result.output
+    assert [s["stage"] for s in payload["stages"]] == [
+        "source fetch",
+        "target fetch",
+        "diff",
+        "install order",
+        "new sets",
+        "export",
+    ]
@@ -0,0 +1,174 @@
+import json
+from unittest import mock
+
+import pytest
+from requests.exceptions import HTTPError
+
+from sn_set import cli, otel, tracing
+from sn_set.requests_lib import get_install_order, make_request
+from sn_set.tracing import JsonTraceExporter, TraceHook
+
+BASE_URL = "https://nyudev.service-now.com"
+
+
+class RecordingHook(TraceHook):
+    def __init__(self):
+        self.started = []
+        self.ended = []
+
+    def on_start(self, span):
+        self.started.append(span)
+
+    def on_end(self, span):
+        self.ended.append(span)
+
+
+@pytest.fixture
+def hook():
+    recording = tracing.add_hook(RecordingHook())
+    yield recording
+    tracing.remove_hook(recording)
+
+
+def test_span_noop_without_hooks():
+    assert tracing.hooks == []
+    with tracing.span("anything", a=1) as span:
+        span.set_attribute("b", 2)
+    assert span is tracing.NOOP_SPAN
+
+
+def test_span_nesting(hook):
+    with tracing.span("outer") as outer:
+        with tracing.span("inner", key="value") as inner:
+            inner.set_attribute("status", 200)
+
+    assert [s.name for s in hook.started] == ["outer", "inner"]
+    assert [s.name for s in hook.ended] == ["inner", "outer"]
+    assert inner.parent_id == outer.span_id
+    assert inner.trace_id == outer.trace_id
+    assert outer.parent_id is None
+    assert inner.attributes == {"key": "value", "status": 200}
+    assert inner.end is not None
+    assert tracing.current_span() is None
+
+
+def test_span_error(hook):
+    with pytest.raises(ValueError):
+        with tracing.span("failing"):
+            raise ValueError("boom")
+    assert hook.ended[0].error == "ValueError: boom"
+
+    with pytest.raises(SystemExit):
+        with tracing.span("exiting"):
+            exit(0)
+    assert hook.ended[1].error is None
+
+
+def test_json_trace_exporter(tmp_path):
+    path = tmp_path / "trace.jsonl"
+    exporter = tracing.add_hook(JsonTraceExporter(str(path)))
+    with tracing.span("outer"):
+        with tracing.span("inner", url="x"):
+            pass
+    tracing.remove_hook(exporter)
+
+    with open(path) as f:
+        spans = [json.loads(line) for line in f]
+    assert [s["name"] for s in spans] == ["inner", "outer"]
+    assert spans[0]["parent_id"] == spans[1]["span_id"]
+    assert spans[0]["attributes"] == {"url": "x"}
+    assert spans[0]["duration_ms"] >= 0
+
+
+def test_request_spans(hook, requests_mock, mock_env_vars):
+    uri = "https://tracing-test.com/api/now/table/sys_update_set"
+    requests_mock.get(uri, json={"result": []})
+    make_request(uri, base_url="https://tracing-test.com")
+
+    names = [s.name for s in hook.ended]
+    assert names == ["client_factory", "HTTP GET"]
+    http_span = hook.ended[1]
+    assert http_span.attributes["status"] == 200
+    assert http_span.attributes["url"] == uri
+
+    from sn_set.requests_lib import context
+
+    del context["https://tracing-test.com"]
+
+
+@mock.patch("sn_set.requests_lib.make_request")
+def test_fallback_chunk_spans(mock_make_request, hook):
+    mock_make_request.side_effect = [
+        HTTPError(response=mock.Mock(status_code=400)),
+        [{"name": "a", "commit_date": "2021-05-08 18:39:00"}],
+        [],
+    ]
+    get_install_order("nyudev", ["a", "b"])
+    chunks = [s for s in hook.ended if s.name == "fallback chunk"]
+    assert [s.attributes["chunk"] for s in chunks] == [0, 1]
+
+
+@mock.patch("sn_set.cli.to_excel")
+@mock.patch("sn_set.comparator.get_install_order_new")
+@mock.patch("sn_set.comparator.get_install_order")
+@mock.patch("sn_set.comparator.get_update_sets")
+def test_cli_trace_file(
+    mock_get_update_sets,
+    mock_get_install_order,
+    mock_new_install_order,
+    mock_to_excel,
+    runner,
+):
+    mock_get_update_sets.side_effect = [[{"name": "a"}, {"name": "b"}], [{"name": "a"}]]
+    mock_get_install_order.return_value = [{"name": "b"}]
+    mock_to_excel.return_value = True
+
+    with runner.isolated_filesystem():
+        result = runner.invoke(
+            cli.main, ["-s", "nyudev", "-t", "nyuqa", "--trace", "trace.jsonl"]
+        )
+        with open("trace.jsonl") as f:
+            spans = [json.loads(line) for line in f]
+
+    assert result.exit_code == 0
+    assert tracing.hooks == []
+    assert [s["name"] for s in spans] == [
+        "stage source fetch",
+        "stage target fetch",
+        "stage diff",
+        "stage install order",
+        "stage new sets",
+        "stage export",
+        "snset",
+    ]
+    assert all(s["error"] is None for s in spans)
+
+
+def test_otel_hook(monkeypatch):
+    mock_trace = mock.Mock()
+    mock_context = mock.Mock()
+    monkeypatch.setattr(otel, "otel_trace", mock_trace)
+    monkeypatch.setattr(otel, "otel_context", mock_context, raising=False)
+    tracer = mock.Mock()
+
+    hook = tracing.add_hook(otel.OpenTelemetryHook(tracer))
+    try:
+        with pytest.raises(ValueError):
+            with tracing.span("HTTP GET", url="x", skipped=None) as span:
+                span.set_attribute("status", 500)
+                raise ValueError("boom")
+    finally:
+        tracing.remove_hook(hook)
+
+    tracer.start_span.assert_called_once_with("HTTP GET", attributes={"snset.url": "x"})
+    otel_span = tracer.start_span.return_value
+    otel_span.set_attribute.assert_any_call("snset.status", 500)
+    otel_span.set_status.assert_called_once()
+    otel_span.end.assert_called_once()
+    mock_context.detach.assert_called_once_with(mock_context.attach.return_value)
+
+
+def test_otel_hook_not_installed(monkeypatch):
+    monkeypatch.setattr(otel, "otel_trace", None)
+    with pytest.raises(ImportError, match="snset\\[otel\\]"):
+        otel.OpenTelemetryHook()
@@ -0,0 +1,187 @@
+import base64
+import json
+
+import pytest
+import requests
+
+from sn_set import transport
+from sn_set.requests_lib import build_client, context, make_request, options
+from sn_set.resilience import ResiliencePolicy
+from sn_set.transport import HttpxClient, to_response
+
+httpx = pytest.importorskip("httpx")
+
+BASE_URL = "https://transport-test.com"
+
+
+def mock_client(handler, **kwargs):
+    return HttpxClient(transport=httpx.MockTransport(handler), **kwargs)
+
+
+def test_request(clean_context):
+    seen = []
+
+    def handler(request):
+        seen.append(request)
+        return httpx.Response(200, json={"result": [{"name": "a"}]})
+
+    client = mock_client(handler, auth=("user", "password"))
+
+    r = client.request(
+        "POST",
+        f"{BASE_URL}/api/now/v1/batch",
+        params={"sysparm_query": "name=a b"},
+        json={"batch_request_id": "1"},
+        timeout=(1.5, 30),
+    )
+
+    assert isinstance(r, requests.Response)
+    assert r.status_code == 200
+    assert r.json() == {"result": [{"name": "a"}]}
+    assert r.headers["content-type"] == "application/json"
+    request = seen[0]
+    assert request.url.params["sysparm_query"] == "name=a b"
+    assert json.loads(request.content) == {"batch_request_id": "1"}
+    credentials = base64.b64encode(b"user:password").decode()
+    assert request.headers["authorization"] == f"Basic {credentials}"
+    assert request.extensions["timeout"] == {
+        "connect": 1.5,
+        "read": 30,
+        "write": 30,
+        "pool": 30,
+    }
+
+
+def test_to_response_raise_for_status():
+    r = to_response(
+        httpx.Response(414, request=httpx.Request("GET", f"{BASE_URL}/api/now/table/x"))
+    )
+
+    with pytest.raises(requests.HTTPError) as ex:
+        r.raise_for_status()
+    assert ex.value.response.status_code == 414
+    assert r.url == f"{BASE_URL}/api/now/table/x"
+
+
+@pytest.mark.parametrize(
+    "error, expected",
+    [
+        (httpx.ConnectTimeout, requests.ConnectTimeout),
+        (httpx.ReadTimeout, requests.ReadTimeout),
+        (httpx.ConnectError, requests.ConnectionError),
+        (httpx.RemoteProtocolError, requests.ConnectionError),
+        (httpx.UnsupportedProtocol, requests.RequestException),
+    ],
+)
+def test_request_errors(error, expected):
+    def handler(request):
+        raise error("failed", request=request)
+
+    with pytest.raises(expected):
+        mock_client(handler).request("GET", f"{BASE_URL}/api/now/table/x")
+
+
+def test_missing_httpx(monkeypatch):
+    monkeypatch.setattr(transport, "httpx", None)
+
+    with pytest.raises(ImportError, match="snset\\[httpx\\]"):
+        HttpxClient()
+
+
+def test_build_client_basic(mock_env_vars, clean_context):
+    options["transport"] = "httpx"
+
+    client, auth = build_client(BASE_URL)
+
+    assert isinstance(client, HttpxClient)
+    assert auth is None
+    assert context[BASE_URL] == {"client": client}
+
+
+def test_build_client_oauth(mock_oauth_env_vars, monkeypatch, clean_context):
+    from authlib.integrations.requests_client import OAuth2Session
+
+    def mock_fetch_token(self, *args, **kwargs):
+        self.token = {"access_token": "abc", "token_type": "Bearer"}
+
+    monkeypatch.setattr(OAuth2Session, "fetch_token", mock_fetch_token)
+    monkeypatch.setenv("SN_SET_GRANT_TYPE", "password")
+    options["transport"] = "httpx"
+
+    client, auth = build_client(BASE_URL)
+
+    assert isinstance(client, HttpxClient)
+    assert auth is None
+    assert isinstance(client.client.auth, transport.BearerAuth)
+    assert client.client.auth.access_token() == "abc"
+
+
+class MockSession:
+    def __init__(self, expires_at=None):
+        self.token = None
+        self.fetched = 0
+        self.expires_at = expires_at
+
+    def fetch_token(self):
+        self.fetched += 1
+        self.token = {
+            "access_token": f"token{self.fetched}",
+            "expires_at": self.expires_at,
+        }
+
+
+def test_bearer_auth_refreshes_on_401():
+    session = MockSession()
+    seen = []
+
+    def handler(request):
+        seen.append(request.headers["authorization"])
+        # the first token has expired on the instance
+        status = 401 if request.headers["authorization"] == "Bearer token1" else 200
+        return httpx.Response(status, json={"result": []})
+
+    client = mock_client(
+        handler, auth=transport.BearerAuth(session, session.fetch_token)
+    )
+
+    assert client.request("GET", f"{BASE_URL}/x").status_code == 200
+    assert client.request("GET", f"{BASE_URL}/x").status_code == 200
+    assert seen == ["Bearer token1", "Bearer token2", "Bearer token2"]
+    assert session.fetched == 2
+
+
+def test_bearer_auth_refreshes_before_expiry():
+    session = MockSession(expires_at=1000)
+    now = [900.0]
+    auth = transport.BearerAuth(session, session.fetch_token, clock=lambda: now[0])
+
+    assert auth.access_token() == "token1"
+    assert auth.access_token() == "token1"
+    now[0] = 980.0
+    assert auth.access_token() == "token2"
+
+
+def test_make_request_retries(clean_context):
+    attempts = []
+
+    def handler(request):
+        attempts.append(request)
+        if len(attempts) == 1:
+            raise httpx.ConnectError("refused", request=request)
+        if len(attempts) == 2:
+            return httpx.Response(503)
+        return httpx.Response(200, json={"result": [{"name": "a"}]})
+
+    context[BASE_URL] = {"client": mock_client(handler)}
+    options["resilience"] = ResiliencePolicy(
+        retries=2, backoff=0, sleep=lambda seconds: None
+    )
+
+    result = make_request(
+        f"{BASE_URL}/api/now/table/sys_update_set",
+        {"sysparm_fields": "name"},
+        base_url=BASE_URL,
+    )
+
+    assert [dict(r) for r in result] == [{"name": "a"}]
+    assert len(attempts) == 3
@@ -0,0 +1,267 @@
+import json
+from unittest import mock
+
+import pytest
+
+from sn_set import cli
+from sn_set.comparator import Comparator
+from sn_set.requests_lib import (
+    context,
+    get_existing_sets,
+    get_latest_update,
+    options,
+    update_sets_params,
+)
+from sn_set.watermarks import WatermarkStore, parse_since, window_start
+
+URL = "https://nyuqa.service-now.com/api/now/table/sys_update_set"
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    [
+        ("2021-05-01", "2021-05-01 00:00:00"),
+        ("2021-05-01 10:30:00", "2021-05-01 10:30:00"),
+        ("2021-05-01T10:30:00", "2021-05-01 10:30:00"),
+    ],
+)
+def test_parse_since(value, expected):
+    assert parse_since(value) == expected
+
+
+@pytest.mark.parametrize("value", ["yesterday", "2021-13-01", ""])
+def test_parse_since_invalid(value):
+    with pytest.raises(ValueError):
+        parse_since(value)
+
+
+def test_window_start():
+    assert window_start("2021-05-02 10:00:00") == "2021-05-01 10:00:00"
+
+
+def test_watermark_store(tmp_path):
+    store = WatermarkStore(str(tmp_path / "state" / "watermarks.json"))
+
+    assert store.get("nyudev", "nyuqa") is None
+    assert store.since("nyudev", "nyuqa") is None
+    store.save("nyudev", "nyuqa", "2021-05-02 10:00:00")
+    # an older watermark doesn't move it back
+    store.save("nyudev", "nyuqa", "2021-05-01 10:00:00")
+    store.save("nyudev", "nyutest", "2021-04-01 10:00:00")
+
+    assert store.get("nyudev", "nyuqa") == "2021-05-02 10:00:00"
+    assert store.since("nyudev", "nyuqa") == "2021-05-01 10:00:00"
+    assert json.loads((tmp_path / "state" / "watermarks.json").read_text()) == {
+        "nyudev:nyuqa": "2021-05-02 10:00:00",
+        "nyudev:nyutest": "2021-04-01 10:00:00",
+    }
+
+
+def test_watermark_store_invalid(tmp_path):
+    path = tmp_path / "watermarks.json"
+    path.write_text("[]")
+
+    with pytest.raises(ValueError):
+        WatermarkStore(str(path)).get("nyudev", "nyuqa")
+
+
+def test_update_sets_params_since():
+    assert update_sets_params("2021-05-01 00:00:00")["sysparm_query"] == (
+        "state=complete^ORstate=ignore^sys_updated_on>=2021-05-01 00:00:00"
+    )
+    assert update_sets_params()["sysparm_query"] == "state=complete^ORstate=ignore"
+
+
+def test_get_existing_sets(requests_mock, mock_env_vars):
+    requests_mock.get(URL, json={"result": [{"name": "a"}]})
+
+    assert get_existing_sets("nyuqa", ["a", "b"]) == [{"name": "a"}]
+    assert get_existing_sets("nyuqa", []) == []
+    assert requests_mock.call_count == 1
+    query = requests_mock.request_history[0].qs["sysparm_query"][0]
+    assert query == "state=complete^orstate=ignore^nameina,b"
+
+
+def test_get_existing_sets_fallback(requests_mock, mock_env_vars):
+    requests_mock.get(
+        URL,
+        [
+            {"status_code": 400},
+            {"json": {"result": [{"name": "a"}]}},
+            {"json": {"result": []}},
+        ],
+    )
+
+    assert get_existing_sets("nyuqa", ["a", "b"]) == [{"name": "a"}]
+    assert requests_mock.call_count == 3
+
+
+def test_get_latest_update(requests_mock, mock_env_vars):
+    requests_mock.get(
+        URL,
+        [
+            {"json": {"result": [{"sys_updated_on": "2021-05-02 10:00:00"}]}},
+            {"json": {"result": []}},
+        ],
+    )
+
+    assert get_latest_update("nyuqa") == "2021-05-02 10:00:00"
+    assert get_latest_update("nyuqa") is None
+    query = requests_mock.request_history[0].qs
+    assert query["sysparm_limit"] == ["1"]
+    assert query["sysparm_query"][0].endswith("orderbydescsys_updated_on")
+
+
+@mock.patch("sn_set.comparator.get_existing_sets")
+@mock.patch("sn_set.comparator.get_update_sets")
+def test_comparator_diff_since(mock_get_update_sets, mock_get_existing_sets):
+    mock_get_update_sets.return_value = [{"name": "a"}, {"name": "b"}]
+    mock_get_existing_sets.return_value = [{"name": "a"}]
+
+    diff = list(Comparator().diff("nyudev", "nyuqa", since="2021-05-01 00:00:00"))
+
+    assert diff == ["b"]
+    mock_get_update_sets.assert_called_once_with("nyudev", "2021-05-01 00:00:00")
+    mock_get_existing_sets.assert_called_once_with("nyuqa", ["a", "b"])
+
+
+@mock.patch("sn_set.cli.to_excel")
+@mock.patch("sn_set.comparator.get_install_order_new")
+@mock.patch("sn_set.comparator.get_install_order")
+@mock.patch("sn_set.comparator.get_existing_sets")
+@mock.patch("sn_set.comparator.get_update_sets")
+@mock.patch("sn_set.comparator.get_latest_update")
+def test_cli_since_last_run(
+    mock_get_latest_update,
+    mock_get_update_sets,
+    mock_get_existing_sets,
+    mock_get_install_order,
+    mock_new_install_order,
+    mock_to_excel,
+    runner,
+    tmp_path,
+):
+    path = tmp_path / "watermarks.json"
+    mock_get_latest_update.side_effect = ["2021-05-02 10:00:00", "2021-05-03 09:00:00"]
+    mock_get_update_sets.side_effect = [
+        [{"name": "a"}, {"name": "b"}],
+        [{"name": "a"}],
+        [{"name": "a"}, {"name": "b"}],
+    ]
+    mock_get_existing_sets.return_value = [{"name": "a"}]
+    mock_get_install_order.return_value = [{"name": "b", "commit_date": "1"}]
+    mock_to_excel.return_value = True
+    args = ["-s", "nyudev", "-t", "nyuqa", "--watermark-file", str(path)]
+
+    result = runner.invoke(cli.main, args + ["--since", "last-run"])
+
+    assert result.exit_code == 0, result.output
+    assert "No watermark for nyudev:nyuqa" in result.output
+    # no window yet, the first run compares every set
+    mock_get_update_sets.assert_has_calls([mock.call("nyudev"), mock.call("nyuqa")])
+    mock_get_existing_sets.assert_not_called()
+    assert json.loads(path.read_text()) == {"nyudev:nyuqa": "2021-05-02 10:00:00"}
+
+    # the window and watermarks of the run don't outlive it
+    assert options == {}
+    context.clear()
+    result = runner.invoke(cli.main, args + ["--changed-after", "last-run"])
+
+    assert result.exit_code == 0, result.output
+    mock_get_update_sets.assert_called_with("nyudev", "2021-05-01 10:00:00")
+    mock_get_existing_sets.assert_called_with("nyuqa", ["a", "b"])
+    assert json.loads(path.read_text()) == {"nyudev:nyuqa": "2021-05-03 09:00:00"}
+
+
+@mock.patch("sn_set.cli.to_excel")
+@mock.patch("sn_set.comparator.get_install_order")
+@mock.patch("sn_set.comparator.get_existing_sets")
+@mock.patch("sn_set.comparator.get_update_sets")
+@mock.patch("sn_set.comparator.get_latest_update")
+def test_cli_since_resume(
+    mock_get_latest_update,
+    mock_get_update_sets,
+    mock_get_existing_sets,
+    mock_get_install_order,
+    mock_to_excel,
+    runner,
+    tmp_path,
+):
+    path = tmp_path / "watermarks.json"
+    mock_get_latest_update.side_effect = ["2021-05-02 10:00:00", "2021-05-03 09:00:00"]
+    mock_get_update_sets.return_value = [{"name": "a"}, {"name": "b"}]
+    mock_get_existing_sets.return_value = [{"name": "a"}]
+    mock_get_install_order.side_effect = ConnectionError("instance went away")
+    mock_to_excel.return_value = True
+    args = ["-s", "nyudev", "-t", "nyuqa", "--since", "2021-05-01"]
+    args += ["--watermark-file", str(path), "--checkpoint-dir", str(tmp_path / "cp")]
+
+    assert runner.invoke(cli.main, args).exit_code != 0
+    mock_get_install_order.side_effect = None
+    mock_get_install_order.return_value = [{"name": "b", "commit_date": "1"}]
+    result = runner.invoke(cli.main, args + ["--resume"])
+
+    assert result.exit_code == 0, result.output
+    assert "Resuming watermark from the checkpoint" in result.output
+    # the resumed run's window ends where the first run's began
+    assert mock_get_latest_update.call_count == 1
+    assert json.loads(path.read_text()) == {"nyudev:nyuqa": "2021-05-02 10:00:00"}
+
+
+@mock.patch("sn_set.cli.to_excel")
+@mock.patch("sn_set.comparator.get_install_order")
+@mock.patch("sn_set.comparator.get_existing_sets")
+@mock.patch("sn_set.comparator.get_update_sets")
+@mock.patch("sn_set.comparator.get_latest_update")
+def test_cli_since_nothing_missing(
+    mock_get_latest_update,
+    mock_get_update_sets,
+    mock_get_existing_sets,
+    mock_get_install_order,
+    mock_to_excel,
+    runner,
+    tmp_path,
+):
+    path = tmp_path / "watermarks.json"
+    mock_get_latest_update.return_value = "2021-05-02 10:00:00"
+    mock_get_update_sets.return_value = [{"name": "a"}]
+    mock_get_existing_sets.return_value = [{"name": "a"}]
+    mock_get_install_order.return_value = []
+
+    result = runner.invoke(
+        cli.main,
+        [
+            "-s",
+            "nyudev",
+            "-t",
+            "nyuqa",
+            "--since",
+            "2021-05-01",
+            "--watermark-file",
+            str(path),
+        ],
+    )
+
+    assert result.exit_code == 0, result.output
+    assert "No sets updated since 2021-05-01 00:00:00 are missing" in result.output
+    mock_to_excel.assert_not_called()
+    assert json.loads(path.read_text()) == {"nyudev:nyuqa": "2021-05-02 10:00:00"}
+
+
+def test_cli_since_invalid(runner, tmp_path):
+    result = runner.invoke(
+        cli.main,
+        [
+            "-s",
+            "nyudev",
+            "-t",
+            "nyuqa",
+            "--since",
+            "yesterday",
+            "--watermark-file",
+            str(tmp_path / "watermarks.json"),
+        ],
+    )
+
+    assert result.exit_code == 2
+    assert "yesterday is not a date" in result.output
@@ -0,0 +1,207 @@
+from unittest import mock
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+import pytest
+
+from sn_set import cli
+from sn_set.requests_lib import PAGE_SIZE, options
+from sn_set.waves import (
+    PAGE_CLAUSE,
+    UPDATE_XML_FIELDS,
+    WavePlan,
+    assign_waves,
+    fetch_updates,
+    format_waves,
+    plan_waves,
+)
+
+
+def test_plan_waves_only_links_sets_sharing_records(make_update):
+    order = ["a", "b", "c", "d", "e"]
+    updates = [
+        make_update("script_1", "a"),
+        make_update("script_1", "c"),
+        make_update("script_2", "b"),
+        make_update("script_3", "c"),
+        make_update("script_3", "d"),
+        make_update("script_4", "e"),
+        make_update("script_4", "e"),
+    ]
+
+    plan = plan_waves(order, updates)
+
+    assert plan.waves == [["a", "b", "e"], ["c"], ["d"]]
+    assert plan.depends_on["c"] == {"a"}
+    assert plan.depends_on["d"] == {"c"}
+    assert plan.edges == 2
+    assert (plan.updates, plan.records, plan.shared) == (7, 4, 2)
+
+
+def test_plan_waves_links_consecutive_sets_per_record(make_update):
+    order = ["a", "b", "c"]
+    updates = [make_update("script_1", name) for name in reversed(order)]
+
+    plan = plan_waves(order, updates)
+
+    # c follows b which follows a, c -> a is implied
+    assert plan.depends_on == {"a": set(), "b": {"a"}, "c": {"b"}}
+    assert plan.waves == [["a"], ["b"], ["c"]]
+
+
+def test_plan_waves_sets_without_order_or_updates(make_update):
+    updates = [
+        make_update("script_1", "a"),
+        make_update("script_1", "late", "2021-03-01 00:00:00"),
+        make_update("script_2", "early", "2021-02-01 00:00:00"),
+        make_update("script_2", "late", "2021-01-15 00:00:00"),
+        {"name": "", "update_set.name": "a"},
+    ]
+
+    plan = plan_waves(["a", "no updates"], updates)
+
+    # "late" was first updated before "early", so it is placed first
+    assert plan.waves == [["a", "no updates"], ["late"], ["early"]]
+    assert plan.depends_on == {
+        "a": set(),
+        "no updates": set(),
+        "late": {"a"},
+        "early": {"late"},
+    }
+
+
+def test_plan_waves_is_linear_in_updates(make_update):
+    order = [f"set {i}" for i in range(300)]
+    updates = [
+        make_update(f"record {i}_{j}", name)
+        for i, name in enumerate(order)
+        for j in range(200)
+    ]
+    updates += [make_update("sys_properties", name) for name in order[::3]]
+
+    plan = plan_waves(order, iter(updates))
+
+    assert len(plan.waves) == 100
+    assert plan.edges == 99
+    assert plan.records == 300 * 200 + 1
+
+
+def test_assign_waves():
+    rows = [{"name": "a"}, {"name": "b"}, {"name": "c"}, {"name": "unknown"}]
+
+    result = assign_waves(rows, [["a", "c"], ["b"]])
+
+    assert result == [
+        {"wave": 1, "name": "a"},
+        {"wave": 1, "name": "c"},
+        {"wave": 2, "name": "b"},
+        {"wave": None, "name": "unknown"},
+    ]
+    assert list(result[0]) == ["wave", "name"]
+
+
+def test_format_waves():
+    plan = WavePlan([["a", "b", "c", "d"], ["e"]], {"e": {"a"}}, 10, 8, 1)
+
+    text = format_waves(plan)
+
+    assert "10 updates to 8 records, 1 updated by more than one set" in text
+    assert "1 dependencies, 2 waves" in text
+    assert "a, b, c (+1)" in text
+
+
+def test_fetch_updates_chunks_and_pages(
+    requests_mock, mock_env_vars, monkeypatch, make_update
+):
+    monkeypatch.setattr("sn_set.requests_lib.PAGE_SIZE", 2)
+    uri = "https://nyudev.service-now.com/api/now/table/sys_update_xml"
+    rows = [
+        {"sys_id": f"{i:032x}", **make_update(f"r{i}", f"set {i % 3}")}
+        for i in range(9)
+    ]
+
+    def respond(request, context):
+        params = parse_qs(urlsplit(request.url).query)
+        query = params["sysparm_query"][0]
+        clause = query.split("^")[0][len("update_set.") :]
+        names = clause[6:].split(",") if clause.startswith("nameIN") else [clause[5:]]
+        after = query.split("sys_id>")[1].split("^")[0] if "sys_id>" in query else ""
+        found = [
+            r for r in rows if r["update_set.name"] in names and r["sys_id"] > after
+        ]
+        return {"result": found[: int(params["sysparm_limit"][0])]}
+
+    requests_mock.get(uri, json=respond)
+    # room for a page of two of the sets
+    two_sets = {
+        "sysparm_query": f"update_set.nameINset 0,set 1{PAGE_CLAUSE}",
+        "sysparm_fields": ",".join(UPDATE_XML_FIELDS + ["sys_id"]),
+        "sysparm_limit": str(PAGE_SIZE),
+    }
+    options["max_url_length"] = len(f"{uri}?{urlencode(two_sets)}")
+
+    result = list(fetch_updates("nyudev", ["set 0", "set 1", "set 2"]))
+
+    assert sorted(r["name"] for r in result) == [f"r{i}" for i in range(9)]
+    queries = [
+        parse_qs(urlsplit(r.url).query)["sysparm_query"][0]
+        for r in requests_mock.request_history
+    ]
+    assert {q.split("^")[0] for q in queries} == {
+        "update_set.nameINset 0,set 1",
+        "update_set.name=set 2",
+    }
+    assert all(
+        len(r.url) <= options["max_url_length"] for r in requests_mock.request_history
+    )
+
+
+def test_fetch_updates_invalid():
+    with pytest.raises(ValueError):
+        fetch_updates("nyudev", ["a", ""])
+
+
+@mock.patch("sn_set.cli.to_excel")
+@mock.patch("sn_set.comparator.fetch_updates")
+@mock.patch("sn_set.comparator.get_install_order_new")
+@mock.patch("sn_set.comparator.get_install_order")
+@mock.patch("sn_set.comparator.get_update_sets")
+def test_cli_waves(
+    mock_get_update_sets,
+    mock_get_install_order,
+    mock_new_install_order,
+    mock_fetch_updates,
+    mock_to_excel,
+    runner,
+    make_update,
+):
+    mock_get_update_sets.side_effect = [
+        [{"name": "a"}, {"name": "b"}, {"name": "c"}],
+        [{"name": "x"}],
+    ]
+    mock_get_install_order.return_value = [
+        {"name": "a", "commit_date": "1"},
+        {"name": "b", "commit_date": "2"},
+        {"name": "c", "commit_date": "3"},
+    ]
+    mock_fetch_updates.return_value = iter(
+        [
+            make_update("script_1", "a"),
+            make_update("script_1", "b"),
+            make_update("script_2", "c"),
+        ]
+    )
+    mock_to_excel.return_value = True
+
+    result = runner.invoke(
+        cli.main, ["-s", "nyudev", "-t", "nyuqa", "--waves", "--stable-order"]
+    )
+
+    assert result.exit_code == 0, result.output
+    mock_fetch_updates.assert_called_once_with("nyudev", ["a", "b", "c"])
+    assert "2 waves" in result.output
+    rows = mock_to_excel.call_args[0][0]
+    assert [(row["wave"], row["name"]) for row in rows] == [
+        (1, "a"),
+        (1, "c"),
+        (2, "b"),
+    ]